@@ -170,6 +170,9 @@ class DownloadImpl:
         
         # RePEX: extend kvconfig with initialdlstatus
         kvconfig['initialdlstatus'] = initialdlstatus
+
+        # hash check checkpoints are stored next to the Download checkpoints
+        kvconfig['hashcheck_checkpoint_dir'] = self.session.get_downloads_pstate_dir()
         
         # Define which file to DL in VOD mode
         live = self.get_def().get_live()
@@ -315,7 +318,11 @@ class DownloadImpl:
                 swarmcache = self.sd.get_swarmcache() or swarmcache
                 
                 (status,stats,logmsgs,proxyservice_proxy_list,proxyservice_doe_list) = self.sd.get_stats(getpeerlist)
-                ds = DownloadState(self,status,self.error,0.0,stats=stats,filepieceranges=self.filepieceranges,logmsgs=logmsgs,proxyservice_proxy_list=proxyservice_proxy_list,proxyservice_doe_list=proxyservice_doe_list,swarmcache=swarmcache)
+                if status in [DLSTATUS_WAITING4HASHCHECK,DLSTATUS_HASHCHECKING]:
+                    hashcheckqueue = self.session.lm.get_hashcheck_queue_state(self.sd)
+                else:
+                    hashcheckqueue = None
+                ds = DownloadState(self,status,self.error,0.0,stats=stats,filepieceranges=self.filepieceranges,logmsgs=logmsgs,proxyservice_proxy_list=proxyservice_proxy_list,proxyservice_doe_list=proxyservice_doe_list,swarmcache=swarmcache,hashcheckqueue=hashcheckqueue)
                 self.progressbeforestop = ds.get_progress()
             
             if sessioncalling:
@@ -328,6 +335,21 @@ class DownloadImpl:
         finally:
             self.dllock.release()
 
+    def network_get_summary(self):
+        """ Returns (status,progress,downrate,uprate,numpeers) without
+        building a DownloadState, to find out if the state changed.
+
+        Called by network thread """
+        self.dllock.acquire()
+        try:
+            if self.error is not None:
+                return (DLSTATUS_STOPPED_ON_ERROR,self.progressbeforestop,0.0,0.0,0)
+            elif self.sd is None or self.sd.get_bt1download() is None:
+                return (DLSTATUS_STOPPED,self.progressbeforestop,0.0,0.0,0)
+            return self.sd.get_summary()
+        finally:
+            self.dllock.release()
+
     def sesscb_get_state_returncallback(self,usercallback,when,newgetpeerlist):
         """ Called by SessionCallbackThread """
         self.dllock.acquire()
@@ -53,6 +53,23 @@ class DownloadRuntimeConfig(DownloadRuntimeConfigBaseImpl):
         finally:
             self.dllock.release()
 
+    def set_max_speed_per_peer(self,direct,speed):
+        self.dllock.acquire()
+        try:
+            if self.sd is not None:
+                set_max_speed_per_peer_lambda = lambda:self.sd is not None and self.sd.set_max_speed_per_peer(direct,speed,None)
+                self.session.lm.rawserver.add_task(set_max_speed_per_peer_lambda,0)
+            DownloadConfigInterface.set_max_speed_per_peer(self,direct,speed)
+        finally:
+            self.dllock.release()
+
+    def get_max_speed_per_peer(self,direct):
+        self.dllock.acquire()
+        try:
+            return DownloadConfigInterface.get_max_speed_per_peer(self,direct)
+        finally:
+            self.dllock.release()
+
     def set_dest_dir(self,path):
         raise OperationNotPossibleAtRuntimeException()
     
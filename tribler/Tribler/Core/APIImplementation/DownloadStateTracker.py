@@ -0,0 +1,81 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Remembers the state of each Download as last reported to a subscriber of
+# Session.set_download_states_changed_callback(), such that on the next poll
+# only the Downloads whose state changed noticeably have to be turned into
+# DownloadStates. The states are kept in flat arrays indexed by a slot per
+# Download instead of in per-Download objects.
+
+from array import array
+
+DEBUG = False
+
+# report a Download when its progress changed by this much
+PROGRESS_THRESHOLD = 0.001
+# or when a rate changed by this fraction of the reported rate
+RATE_THRESHOLD = 0.1
+# and by at least this many bytes/s
+MIN_RATE_THRESHOLD = 1024.0
+
+
+class DownloadStateTracker:
+    """ Called by network thread only """
+
+    def __init__(self):
+        # Download -> slot in the arrays
+        self.slots = {}
+        self.freeslots = []
+        self.status = array('i')
+        self.progress = array('d')
+        self.downrate = array('d')
+        self.uprate = array('d')
+        self.numpeers = array('i')
+
+    def changed(self, d, summary):
+        """ Returns whether summary, a (status,progress,downrate,uprate,numpeers)
+        tuple, differs noticeably from the last one reported for Download d,
+        and if so remembers it as reported. """
+        (status, progress, downrate, uprate, numpeers) = summary
+        slot = self.slots.get(d)
+        if slot is None:
+            slot = self.new_slot(d)
+        elif ( status == self.status[slot]
+               and numpeers == self.numpeers[slot]
+               and abs(progress - self.progress[slot]) < PROGRESS_THRESHOLD
+               and (progress != 1.0 or self.progress[slot] == 1.0)
+               and not self.rate_changed(downrate, self.downrate[slot])
+               and not self.rate_changed(uprate, self.uprate[slot]) ):
+            return False
+
+        self.status[slot] = status
+        self.progress[slot] = progress
+        self.downrate[slot] = downrate
+        self.uprate[slot] = uprate
+        self.numpeers[slot] = numpeers
+        return True
+
+    def rate_changed(self, rate, reported):
+        return abs(rate - reported) >= max(MIN_RATE_THRESHOLD, RATE_THRESHOLD * reported)
+
+    def new_slot(self, d):
+        if self.freeslots:
+            slot = self.freeslots.pop()
+        else:
+            slot = len(self.status)
+            self.status.append(0)
+            self.progress.append(0.0)
+            self.downrate.append(0.0)
+            self.uprate.append(0.0)
+            self.numpeers.append(0)
+        self.slots[d] = slot
+        return slot
+
+    def retain(self, dllist):
+        """ Forget the Downloads that are not in dllist anymore """
+        if len(self.slots) == len(dllist):
+            return
+        current = dict.fromkeys(dllist)
+        for d in self.slots.keys():
+            if d not in current:
+                self.freeslots.append(self.slots.pop(d))
@@ -0,0 +1,171 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Decides when each SingleDownload may check the integrity of its data on
+# disk. Checks of Downloads on different disks run in parallel, checks on the
+# same disk are limited such that the heads do not seek between torrents.
+# Downloads with (almost) nothing to read, such as seeders restarted with
+# valid resume data, start right away instead of waiting behind large checks.
+
+import sys
+import os
+from heapq import heappush, heappop
+from traceback import print_exc
+
+DEBUG = False
+
+# Downloads that need to read less than this many bytes do not wait for a slot
+FAST_HASHCHECK_SIZE = 4 * 1024 * 1024
+
+
+def get_disk(path):
+    """ Returns an identifier of the disk (device, drive) that holds path,
+    which need not exist yet. """
+    path = os.path.abspath(path)
+    if sys.platform == 'win32':
+        # st_dev is always 0 on win32
+        return os.path.splitdrive(path)[0].upper()
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+class HashcheckScheduler:
+    """ Runs the hashchecks of SingleDownloads, at most 'concurrency' at a
+    time and at most 'perdisk' at a time per disk. Waiting Downloads are
+    checked smallest first (in bytes to read) per disk.
+
+    Called by network thread only. """
+
+    def __init__(self, concurrency, perdisk):
+        self.concurrency = max(1, concurrency)
+        self.perdisk = max(1, perdisk)
+        # disk -> heap of (estimate, seqno, sd)
+        self.queues = {}
+        # sd -> (disk, seqno) for the waiting SingleDownloads
+        self.waiting = {}
+        # sd -> disk for the SingleDownloads being checked, None for the fast ones
+        self.checking = {}
+        # disk -> number of SingleDownloads being checked
+        self.checking_per_disk = {}
+        self.numslow = 0
+        self.seqno = 0
+        # sd -> position in the queue of its disk, rebuilt when needed
+        self.positions = None
+
+    def queue(self, sd):
+        """ Schedule a SingleDownload for integrity check of on-disk data """
+        if sd in self.waiting or sd in self.checking:
+            return
+        estimate, disk = self.get_cost(sd)
+        if DEBUG:
+            print >>sys.stderr,"hashcheck: queue",`sd.get_infohash()`,"estimate",estimate,"disk",disk
+        if estimate < FAST_HASHCHECK_SIZE:
+            self.start(sd, None)
+            return
+
+        self.seqno += 1
+        heappush(self.queues.setdefault(disk, []), (estimate, self.seqno, sd))
+        self.waiting[sd] = (disk, self.seqno)
+        self.positions = None
+        self.schedule()
+
+    def hashcheck_done(self, sd, success = True):
+        """ Called when the check of sd completed or failed, or when sd was
+        shut down while waiting or checking. Notifications for SingleDownloads
+        that are not ours (anymore) are ignored. """
+        if DEBUG:
+            print >>sys.stderr,"hashcheck: done",`sd.get_infohash()`,"success",success
+        if sd in self.waiting:
+            # stopped while waiting, its heap entry is skipped later
+            del self.waiting[sd]
+            self.positions = None
+            return
+        if sd not in self.checking:
+            return
+
+        disk = self.checking.pop(sd)
+        if disk is not None:
+            self.numslow -= 1
+            self.checking_per_disk[disk] -= 1
+            if not self.checking_per_disk[disk]:
+                del self.checking_per_disk[disk]
+        if success:
+            sd.hashcheck_done()
+        self.schedule()
+
+    def schedule(self):
+        """ Start checks while there are free slots """
+        while self.numslow < self.concurrency:
+            best = None
+            for disk in self.queues.keys():
+                if self.checking_per_disk.get(disk, 0) >= self.perdisk:
+                    continue
+                head = self.get_head(disk)
+                if head is not None and (best is None or head < best[0]):
+                    best = (head, disk)
+            if best is None:
+                return
+            (estimate, seqno, sd), disk = best
+            heappop(self.queues[disk])
+            del self.waiting[sd]
+            self.positions = None
+            self.start(sd, disk)
+
+    def start(self, sd, disk):
+        if DEBUG:
+            print >>sys.stderr,"hashcheck: start",`sd.get_infohash()`,"disk",disk
+        # Register first, a failing check reports back right away
+        self.checking[sd] = disk
+        if disk is not None:
+            self.numslow += 1
+            self.checking_per_disk[disk] = self.checking_per_disk.get(disk, 0) + 1
+        sd.perform_hashcheck(lambda success = True: self.hashcheck_done(sd, success))
+
+    def get_head(self, disk):
+        """ Returns the first live entry in the queue of disk, or None """
+        queue = self.queues[disk]
+        while queue:
+            estimate, seqno, sd = queue[0]
+            if self.waiting.get(sd) == (disk, seqno):
+                return queue[0]
+            heappop(queue)
+        del self.queues[disk]
+        return None
+
+    def get_cost(self, sd):
+        """ Returns (bytes to read, disk) for sd """
+        dow = sd.get_bt1download()
+        if dow is None:
+            # Failed to start, let perform_hashcheck report it
+            return 0L, None
+        try:
+            return dow.get_hashcheck_estimate(), get_disk(dow.get_dest(0))
+        except:
+            print_exc()
+            return dow.get_datalength(), None
+
+    def get_queue_state(self, sd):
+        """ Returns a dict with the 'position' of sd in the queue of its disk
+        (0 when being checked), the number of Downloads 'waiting' and the
+        number being 'checked', or None if sd is not waiting or checking. """
+        if sd in self.checking:
+            position = 0
+        elif sd in self.waiting:
+            if self.positions is None:
+                self.positions = {}
+                for disk, queue in self.queues.iteritems():
+                    live = [entry for entry in queue if self.waiting.get(entry[2]) == (disk, entry[1])]
+                    live.sort()
+                    for i in xrange(len(live)):
+                        self.positions[live[i][2]] = i + 1
+            position = self.positions[sd]
+        else:
+            return None
+        return {'position': position, 'waiting': len(self.waiting), 'checking': len(self.checking)}
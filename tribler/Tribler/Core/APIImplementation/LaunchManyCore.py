@@ -15,14 +15,18 @@ import traceback
 
 from Tribler.__init__ import LIBRARYNAME
 from Tribler.Core.BitTornado.RawServer import RawServer
+from Tribler.Core.BitTornado.RateLimiter import RateShaper, DOWNLOAD_BURST
 from Tribler.Core.BitTornado.ServerPortHandler import MultiHandler
 from Tribler.Core.BitTornado.BT1.track import Tracker
+from Tribler.Core.BitTornado.BT1.UDPTracker import UDPTracker
 from Tribler.Core.BitTornado.HTTPHandler import HTTPHandler,DummyHTTPHandler
 from Tribler.Core.simpledefs import *
 from Tribler.Core.exceptions import *
 from Tribler.Core.Download import Download
 from Tribler.Core.DownloadConfig import DownloadStartupConfig
 from Tribler.Core.TorrentDef import TorrentDef
+from Tribler.Core.APIImplementation.HashcheckScheduler import HashcheckScheduler
+from Tribler.Core.APIImplementation.DownloadStateTracker import DownloadStateTracker
 from Tribler.Core.NATFirewall.guessip import get_my_wan_ip
 from Tribler.Core.NATFirewall.UPnPThread import UPnPThread
 from Tribler.Core.NATFirewall.UDPPuncture import UDPHandler
@@ -81,13 +85,16 @@ class TriblerLaunchMany(Thread):
         self.yourip_ext_ip = None
         self.udppuncture_handler = None
         self.internaltracker = None
+        self.udptracker = None
 
         # Orig
         self.sessdoneflag = Event()
 
-        # Following two attributes set/get by network thread ONLY
-        self.hashcheck_queue = []
-        self.sdownloadtohashcheck = None
+        # Following attribute set/get by network thread ONLY
+        self.hashcheck_scheduler = HashcheckScheduler(config['hashcheck_concurrency'],config['hashcheck_per_disk'])
+        # Cost of the download states callbacks, set by network thread,
+        # protected by sesslock
+        self.states_poll_stats = {}
 
         # Following 2 attributes set/get by UPnPThread
         self.upnp_thread = None
@@ -102,6 +109,10 @@ class TriblerLaunchMany(Thread):
                                    errorfunc = self.rawserver_nonfatalerrorfunc)
         self.rawserver.add_task(self.rawserver_keepalive,1)
 
+        # Session-wide bandwidth shaping, used by network thread only
+        self.upload_shaper = RateShaper(self.rawserver.add_task,config['global_max_upload_rate'])
+        self.download_shaper = RateShaper(self.rawserver.add_task,config['global_max_download_rate'],DOWNLOAD_BURST)
+
         self.listen_port = self.rawserver.find_and_bind(0,
                     config['minport'], config['maxport'], config['bind'],
                     reuse = True,
@@ -126,6 +137,7 @@ class TriblerLaunchMany(Thread):
             from Tribler.Core.CacheDB.SqliteFriendshipStatsCacheDB import FriendshipStatisticsDBHandler
             from Tribler.Category.Category import Category
             from Tribler.Core.CacheDB.sqlitecachedb import try_register
+            from Tribler.Core.CacheDB.TorrentStore import TorrentStore, STORE_DIRNAME
 
             # 13-04-2010, Andrea: rich metadata (subtitle) db
             from Tribler.Core.CacheDB.MetadataDBHandler import MetadataDBHandler
@@ -148,6 +160,8 @@ class TriblerLaunchMany(Thread):
             self.torrent_db     = TorrentDBHandler.getInstance()
             torrent_collecting_dir = os.path.abspath(config['torrent_collecting_dir'])
             self.torrent_db.register(Category.getInstance(),torrent_collecting_dir)
+            self.torrent_store = TorrentStore.getInstance()
+            self.torrent_store.register(os.path.join(torrent_collecting_dir, STORE_DIRNAME))
             self.mypref_db      = MyPreferenceDBHandler.getInstance()
             self.pref_db        = PreferenceDBHandler.getInstance()
             self.superpeer_db   = SuperPeerDBHandler.getInstance()
@@ -215,7 +229,7 @@ class TriblerLaunchMany(Thread):
 
         # SWIFTPROC
         if config['swiftproc']:
-            self.spm = SwiftProcessMgr(config['swiftpath'],config['swiftcmdlistenport'],config['swiftdlsperproc'],self.session.get_swift_tunnel_listen_port(),self.sesslock)
+            self.spm = SwiftProcessMgr(config['swiftpath'],config['swiftcmdlistenport'],config['swiftdlsperproc'],self.session.get_swift_tunnel_listen_port(),self.sesslock,config['swiftprocpoolsize'],config['swiftprocidletimeout'],self.session.get_swift_working_dir(),self.session.get_torrent_collecting_dir())
         else:
             self.spm = None
 
@@ -298,6 +312,11 @@ class TriblerLaunchMany(Thread):
         if config['internaltracker']:
             self.internaltracker = Tracker(config, self.rawserver)
             self.httphandler = HTTPHandler(self.internaltracker.get, config['tracker_min_time_between_log_flushes'])
+            if config['tracker_udp_port']:
+                try:
+                    self.udptracker = UDPTracker(self.internaltracker, self.rawserver, config['tracker_udp_port'])
+                except socket.error:
+                    print_exc()
         else:
             self.httphandler = DummyHTTPHandler()
         self.multihandler.set_httphandler(self.httphandler)
@@ -607,34 +626,30 @@ class TriblerLaunchMany(Thread):
         """ Schedule a SingleDownload for integrity check of on-disk data
 
         Called by network thread """
-        if hash:
-            self.hashcheck_queue.append(sd)
-            # Check smallest torrents first
-            self.hashcheck_queue.sort(singledownload_size_cmp)
-
-        if not self.sdownloadtohashcheck:
-            self.dequeue_and_start_hashcheck()
-
-    def dequeue_and_start_hashcheck(self):
-        """ Start integriy check for first SingleDownload in queue
-
-        Called by network thread """
-        self.sdownloadtohashcheck = self.hashcheck_queue.pop(0)
-        self.sdownloadtohashcheck.perform_hashcheck(self.hashcheck_done)
+        self.hashcheck_scheduler.queue(sd)
 
-    def hashcheck_done(self,success=True):
-        """ Integrity check for first SingleDownload in queue done
+    def hashcheck_done(self,sd,success=True):
+        """ Integrity check for SingleDownload done, or the SingleDownload
+        was stopped while waiting or checking
 
         Called by network thread """
         if DEBUG:
             print >>sys.stderr,"tlm: hashcheck_done, success",success
-        #Niels, 2012-02-01: sdownloadtohashcheck could be none and throw an error here
-        if success and self.sdownloadtohashcheck:
-            self.sdownloadtohashcheck.hashcheck_done()
-        if self.hashcheck_queue:
-            self.dequeue_and_start_hashcheck()
+        self.hashcheck_scheduler.hashcheck_done(sd,success)
+
+    def get_hashcheck_queue_state(self,sd):
+        """ Called by network thread """
+        return self.hashcheck_scheduler.get_queue_state(sd)
+
+    #
+    # Bandwidth shaping
+    #
+    def set_max_speed(self,direct,speed):
+        """ Called by network thread """
+        if direct == UPLOAD:
+            self.upload_shaper.set_rate(speed)
         else:
-            self.sdownloadtohashcheck = None
+            self.download_shaper.set_rate(speed)
 
     #
     # State retrieval
@@ -646,6 +661,7 @@ class TriblerLaunchMany(Thread):
 
     def network_set_download_states_callback(self,usercallback,getpeerlist):
         """ Called by network thread """
+        starttime = timemod.time()
         self.sesslock.acquire()
         try:
             # Even if the list of Downloads changes in the mean time this is
@@ -661,6 +677,7 @@ class TriblerLaunchMany(Thread):
         for d in dllist:
             ds = d.network_get_state(None,getpeerlist,sessioncalling=True)
             dslist.append(ds)
+        self.record_states_poll('all',timemod.time()-starttime,len(dllist),len(dslist))
 
         # Invoke the usercallback function via a new thread.
         # After the callback is invoked, the return values will be passed to
@@ -673,6 +690,63 @@ class TriblerLaunchMany(Thread):
             # reschedule
             self.set_download_states_callback(usercallback,newgetpeerlist,when=when)
 
+    def set_download_states_changed_callback(self,usercallback,getpeerlist,when=0.0,tracker=None):
+        """ Called by any thread """
+        if tracker is None:
+            tracker = DownloadStateTracker()
+        network_set_download_states_changed_callback_lambda = lambda:self.network_set_download_states_changed_callback(usercallback,getpeerlist,tracker)
+        self.rawserver.add_task(network_set_download_states_changed_callback_lambda,when)
+
+    def network_set_download_states_changed_callback(self,usercallback,getpeerlist,tracker):
+        """ Called by network thread """
+        starttime = timemod.time()
+        self.sesslock.acquire()
+        try:
+            dllist = self.downloads.values()
+        finally:
+            self.sesslock.release()
+
+        dslist = []
+        for d in dllist:
+            try:
+                if tracker.changed(d,d.network_get_summary()):
+                    dslist.append(d.network_get_state(None,getpeerlist,sessioncalling=True))
+            except:
+                print_exc()
+        tracker.retain(dllist)
+        self.record_states_poll('changed',timemod.time()-starttime,len(dllist),len(dslist))
+
+        def sesscb_set_download_states_changed_returncallback(usercallback,when,newgetpeerlist):
+            """ Called by SessionCallbackThread """
+            if when > 0.0:
+                self.set_download_states_changed_callback(usercallback,newgetpeerlist,when=when,tracker=tracker)
+        self.session.uch.perform_getstate_usercallback(usercallback,dslist,sesscb_set_download_states_changed_returncallback)
+
+    def record_states_poll(self,kind,duration,numchecked,numreported):
+        """ Called by network thread """
+        self.sesslock.acquire()
+        try:
+            stats = self.states_poll_stats.get(kind)
+            if stats is None:
+                stats = {'polls':0,'total':0.0,'max':0.0}
+                self.states_poll_stats[kind] = stats
+            stats['polls'] += 1
+            stats['total'] += duration
+            stats['max'] = max(stats['max'],duration)
+            stats['last'] = duration
+            stats['checked'] = numchecked
+            stats['reported'] = numreported
+        finally:
+            self.sesslock.release()
+
+    def get_download_states_poll_stats(self):
+        """ Called by any thread """
+        self.sesslock.acquire()
+        try:
+            return dict([(kind,stats.copy()) for kind,stats in self.states_poll_stats.iteritems()])
+        finally:
+            self.sesslock.release()
+
     #
     # Persistence methods
     #
@@ -854,6 +928,7 @@ class TriblerLaunchMany(Thread):
 
                 db = SQLiteCacheDB.getInstance()
                 db.commit()
+                self.torrent_store.close()
 
             mainlineDHT.deinit()
 
@@ -1169,31 +1244,3 @@ class TriblerLaunchMany(Thread):
                 
         finally:
             self.sesslock.release()
-        
-def singledownload_size_cmp(x,y):
-    """ Method that compares 2 SingleDownload objects based on the size of the
-        content of the BT1Download (if any) contained in them.
-    """
-    if x is None and y is None:
-        return 0
-    elif x is None:
-        return 1
-    elif y is None:
-        return -1
-    else:
-        a = x.get_bt1download()
-        b = y.get_bt1download()
-        if a is None and b is None:
-            return 0
-        elif a is None:
-            return 1
-        elif b is None:
-            return -1
-        else:
-            if a.get_datalength() == b.get_datalength():
-                return 0
-            elif a.get_datalength() < b.get_datalength():
-                return -1
-            else:
-                return 1
-
@@ -122,6 +122,42 @@ class SessionRuntimeConfig(SessionConfigInterface):
         finally:
             self.sesslock.release()
 
+    def set_hashcheck_concurrency(self,value):
+        raise OperationNotPossibleAtRuntimeException()
+
+    def get_hashcheck_concurrency(self):
+        self.sesslock.acquire()
+        try:
+            return SessionConfigInterface.get_hashcheck_concurrency(self)
+        finally:
+            self.sesslock.release()
+
+    def set_hashcheck_per_disk(self,value):
+        raise OperationNotPossibleAtRuntimeException()
+
+    def get_hashcheck_per_disk(self):
+        self.sesslock.acquire()
+        try:
+            return SessionConfigInterface.get_hashcheck_per_disk(self)
+        finally:
+            self.sesslock.release()
+
+    def set_max_speed(self,direct,speed):
+        self.sesslock.acquire()
+        try:
+            SessionConfigInterface.set_max_speed(self,direct,speed)
+            task = lambda:self.lm.set_max_speed(direct,speed)
+            self.lm.rawserver.add_task(task,0)
+        finally:
+            self.sesslock.release()
+
+    def get_max_speed(self,direct):
+        self.sesslock.acquire()
+        try:
+            return SessionConfigInterface.get_max_speed(self,direct)
+        finally:
+            self.sesslock.release()
+
     def set_megacache(self,value):
         raise OperationNotPossibleAtRuntimeException()
 
@@ -435,6 +471,16 @@ class SessionRuntimeConfig(SessionConfigInterface):
     #def get_internal_tracker_url(self):
         """ Implemented in Session.py """
 
+    def set_internal_tracker_udp_port(self,value):
+        raise OperationNotPossibleAtRuntimeException()
+
+    def get_internal_tracker_udp_port(self):
+        self.sesslock.acquire()
+        try:
+            return SessionConfigInterface.get_internal_tracker_udp_port(self)
+        finally:
+            self.sesslock.release()
+
     def set_mainline_dht(self,value):
         raise OperationNotPossibleAtRuntimeException()
 
@@ -988,3 +1034,25 @@ class SessionRuntimeConfig(SessionConfigInterface):
             return SessionConfigInterface.get_swift_downloads_per_process(self)
         finally:
             self.sesslock.release()
+
+
+    def set_swift_process_pool_size(self,value):
+        raise OperationNotPossibleAtRuntimeException()
+    
+    def get_swift_process_pool_size(self):
+        self.sesslock.acquire()
+        try:
+            return SessionConfigInterface.get_swift_process_pool_size(self)
+        finally:
+            self.sesslock.release()
+
+
+    def set_swift_process_idle_timeout(self,value):
+        raise OperationNotPossibleAtRuntimeException()
+    
+    def get_swift_process_idle_timeout(self):
+        self.sesslock.acquire()
+        try:
+            return SessionConfigInterface.get_swift_process_idle_timeout(self)
+        finally:
+            self.sesslock.release()
@@ -168,9 +168,7 @@ class SingleDownload:
         try:
             """ Schedules actually hashcheck on network thread """
             self._getstatsfunc = SPECIAL_VALUE # signal we're hashchecking
-            # Already set, should be same
-            self.lmhashcheckcompletecallback = complete_callback
-            self._hashcheckfunc(self.lmhashcheckcompletecallback)
+            self._hashcheckfunc(complete_callback)
         except Exception,e:
             self.fatalerrorfunc(e)
             
@@ -183,7 +181,10 @@ class SingleDownload:
         if DEBUG:
             print >>sys.stderr,"SingleDownload: hashcheck_done()"
         try:
-            self.dow.startEngine(vodeventfunc = self.lmvodeventcallback)
+            lm = self.dlinstance.session.lm
+            self.dow.startEngine(vodeventfunc = self.lmvodeventcallback,
+                                 upload_shaper = lm.upload_shaper,
+                                 download_shaper = lm.download_shaper)
             self._getstatsfunc = self.dow.startStats() # not possible earlier
             
             # RePEX: don't start the Rerequester in RePEX mode
@@ -210,6 +211,15 @@ class SingleDownload:
         if callback is not None:
             callback(direct,speed)
 
+    def set_max_speed_per_peer(self,direct,speed,callback):
+        if self.dow is not None:
+            if direct == UPLOAD:
+                self.dow.setPeerUploadRate(speed,networkcalling=True)
+            else:
+                self.dow.setPeerDownloadRate(speed,networkcalling=True)
+        if callback is not None:
+            callback(direct,speed)
+
     def set_max_conns_to_initiate(self,nconns,callback):
         if self.dow is not None:
             if DEBUG:
@@ -257,6 +267,22 @@ class SingleDownload:
                 status = None
             return (status,self._getstatsfunc(getpeerlist=getpeerlist),logmsgs,proxyservice_proxy_list,proxyservice_doe_list)
 
+    def get_summary(self):
+        """ Returns (status,progress,downrate,uprate,numpeers), which is much
+        cheaper than get_stats() """
+        if self._getstatsfunc is None:
+            return (DLSTATUS_WAITING4HASHCHECK,0.0,0.0,0.0,0)
+        elif self._getstatsfunc == SPECIAL_VALUE:
+            return (DLSTATUS_HASHCHECKING,self.hashcheckfrac,0.0,0.0,0)
+        (frac,up,down,numpeers) = self.dow.get_summary()
+        if self.repexer is not None:
+            status = DLSTATUS_REPEXING
+        elif frac == 1.0:
+            status = DLSTATUS_SEEDING
+        else:
+            status = DLSTATUS_DOWNLOADING
+        return (status,frac,down,up,numpeers)
+
     def get_infohash(self):
         return self.infohash
 
@@ -294,7 +320,7 @@ class SingleDownload:
         if self._getstatsfunc is None or self._getstatsfunc == SPECIAL_VALUE:
             # Hashchecking or waiting for while being shutdown, signal LaunchMany
             # so it can schedule a new one.
-            self.lmhashcheckcompletecallback(success=False)
+            self.lmhashcheckcompletecallback(self,success=False)
                 
         return resumedata
     
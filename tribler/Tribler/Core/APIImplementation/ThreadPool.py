@@ -1,7 +1,6 @@
 # Written by Jelle Roozenburg, Arno Bakker
 # see LICENSE.txt for license information
 
-import sys
 import time
 from traceback import print_exc
 import threading
@@ -91,9 +90,7 @@ class ThreadPool:
 
         """ Retrieve the next task from the task queue.  For use
         only by ThreadPoolThread objects contained in the pool."""
-        
-        print >> sys.stderr, len(self.__tasks)
-        
+
         self.__taskCond.acquire()
         try:
             while self.__tasks == [] and not self.__isJoining:
@@ -98,18 +98,18 @@ class UserCallbackHandler:
             # Show must go on
             print_exc()
 
-        # Remove checkpoint
+        # Remove checkpoint and the pieces verified by hashchecking
         hexinfohash = binascii.hexlify(infohash)
-        try:
-            basename = hexinfohash+'.pickle'
-            filename = os.path.join(dlpstatedir,basename)
-            if DEBUG:
-                print >>sys.stderr,"Session: sesscb_removestate: removing dlcheckpoint entry",filename
-            if os.access(filename,os.F_OK):
-                os.remove(filename)
-        except:
-            # Show must go on
-            print_exc()
+        for basename in (hexinfohash+'.pickle', hexinfohash+'.hashcheck'):
+            try:
+                filename = os.path.join(dlpstatedir,basename)
+                if DEBUG:
+                    print >>sys.stderr,"Session: sesscb_removestate: removing dlcheckpoint entry",filename
+                if os.access(filename,os.F_OK):
+                    os.remove(filename)
+            except:
+                # Show must go on
+                print_exc()
 
         # Remove downloaded content from disk
         if removecontent:
@@ -109,8 +109,10 @@ class Connection:
         self.connecter = connecter
         self.got_anything = False
         self.next_upload = None
+        self.upload_bucket = None
         self.outqueue = []
         self.partial_message = None
+        self.partial_length = 0
         self.download = None
         self.upload = None
         self.send_choke_queued = False
@@ -332,39 +334,63 @@ class Connection:
                 bhashlist = bencode(hashlist)
                 if hashpiece_msg_id is None:
                     # old Tribler <= 4.5.2 style
-                    self.partial_message = ''.join((
+                    header = ''.join((
                                     tobinary(1+4+4+4+len(bhashlist)+len(piece)), HASHPIECE,
-                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist, piece.tostring() ))
+                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist ))
                 else:
                     # Merkle BEP
-                    self.partial_message = ''.join((
+                    header = ''.join((
                                     tobinary(2+4+4+4+len(bhashlist)+len(piece)), EXTEND, hashpiece_msg_id,
-                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist, piece.tostring() ))
+                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist ))
                     
             else:
-                self.partial_message = ''.join((
+                header = ''.join((
                             tobinary(len(piece) + 9), PIECE, 
-                            tobinary(index), tobinary(begin), piece.tostring()))
+                            tobinary(index), tobinary(begin)))
+            # the message is kept as a list of parts, memory mapped pieces
+            # are written to the socket without copying them
+            self.partial_message = [header]
+            if hasattr(piece, 'getviews'):
+                self.partial_message.extend(piece.getviews())
+            else:
+                self.partial_message.append(piece.tostring())
+            self.partial_length = len(header) + len(piece)
             if DEBUG_NORMAL_MSGS:
                 print >>sys.stderr,'sending chunk: '+str(index)+': '+str(begin)+'-'+str(begin+len(piece))
 
-        if bytes < len(self.partial_message):
-            self.connection.send_message_raw(self.partial_message[:bytes])
-            self.partial_message = self.partial_message[bytes:]
+        if bytes < self.partial_length:
+            parts = self.partial_message
+            left = bytes
+            while left > 0:
+                part = parts[0]
+                if len(part) <= left:
+                    self.connection.send_message_raw(part)
+                    left -= len(part)
+                    del parts[0]
+                else:
+                    self.connection.send_message_raw(buffer(part, 0, left))
+                    parts[0] = buffer(part, left)
+                    left = 0
+            self.partial_length -= bytes
             return bytes
 
-        q = [self.partial_message]
+        q = self.partial_message
+        length = self.partial_length
         self.partial_message = None
+        self.partial_length = 0
         if self.send_choke_queued:
             self.send_choke_queued = False
             self.outqueue.append(tobinary(1)+CHOKE)
             self.upload.choke_sent()
             self.just_unchoked = 0
-        q.extend(self.outqueue)
-        self.outqueue = []
-        q = ''.join(q)
-        self.connection.send_message_raw(q)
-        return len(q)
+        if self.outqueue:
+            s = ''.join(self.outqueue)
+            self.outqueue = []
+            q.append(s)
+            length += len(s)
+        for part in q:
+            self.connection.send_message_raw(part)
+        return length
 
     def get_upload(self):
         return self.upload
@@ -9,6 +9,7 @@ from Tribler.Core.BitTornado.bitfield import Bitfield
 from random import shuffle
 from base64 import b64encode
 from Tribler.Core.BitTornado.clock import clock
+from Tribler.Core.BitTornado.RateLimiter import TokenBucket, RateShaper, UNLIMITED, DOWNLOAD_BURST
 from Tribler.Core.Statistics.Status.Status import get_status_holder
 from Tribler.Core.DecentralizedTracking.repex import REPEX_LISTEN_TIME
 from Tribler.Core.simpledefs import *
@@ -177,6 +178,8 @@ class SingleDownload():
         self.backlog = 2
         self.ip = connection.get_ip()
         self.guard = BadDataGuard(self)
+        # download shaping of this peer, below that of the torrent
+        self.bucket = TokenBucket(downloader.peer_rate, downloader.bucket, DOWNLOAD_BURST)
 
         # boudewijn: VOD needs a download measurement that is not
         # averaged over a 'long' period. downloader.max_rate_period is
@@ -192,7 +195,7 @@ class SingleDownload():
     def _backlog(self, just_unchoked):
         self.backlog = int(min(
             2+int(4*self.measure.get_rate()/self.downloader.chunksize),
-            (2*just_unchoked)+self.downloader.queue_limit() ))
+            (2*just_unchoked)+self.downloader.queue_limit(self) ))
         if self.backlog > 50:
             self.backlog = int(max(50, self.backlog * 0.075))
         return self.backlog
@@ -225,7 +228,7 @@ class SingleDownload():
             return
         lost = {}
         for index, begin, length in self.active_requests:
-            self.downloader.storage.request_lost(index, begin, length)
+            self.downloader.request_lost(self, index, begin, length)
             lost[index] = 1
         lost = lost.keys()
         self.active_requests = []
@@ -302,6 +305,7 @@ class SingleDownload():
         
         self.short_term_measure.update_rate(length)
         self.downloader.measurefunc(length)
+        self.downloader.shaper.update_class_rate(self.downloader.rateclass, length)
         if not self.downloader.storage.piece_came_in(index, begin, hashlist, piece, self.guard):
             self.downloader.piece_flunked(index)
             return False
@@ -430,7 +434,7 @@ class SingleDownload():
                 self.downloader.picker.requested(interest, begin, length)
                 self.active_requests.append((interest, begin, length))
                 self.connection.send_request(interest, begin, length)
-                self.downloader.chunk_requested(length)
+                self.downloader.chunk_requested(length, self)
                 if not self.downloader.storage.do_I_have_requests(interest):
                     loop = False
                     lost_interests.append(interest)
@@ -498,7 +502,7 @@ class SingleDownload():
         self.active_requests.extend(want)
         for piece, begin, length in want:
             self.connection.send_request(piece, begin, length)
-            self.downloader.chunk_requested(length)
+            self.downloader.chunk_requested(length, self)
 
     def got_have(self, index):
 #        print >>sys.stderr,"Downloader: got_have",index
@@ -683,7 +687,8 @@ class SingleDownload():
 class Downloader:
     def __init__(self, infohash, storage, picker, backlog, max_rate_period,
                  numpieces, chunksize, measurefunc, snub_time,
-                 kickbans_ok, kickfunc, banfunc, bt1dl, scheduler = None):
+                 kickbans_ok, kickfunc, banfunc, bt1dl, scheduler = None,
+                 shaper = None):
         self.infohash = infohash
         self.b64_infohash = b64encode(infohash)
         self.storage = storage
@@ -712,8 +717,15 @@ class Downloader:
         self.discarded = 0L
         self.download_rate = 0
 #        self.download_rate = 25000  # 25K/s test rate
-        self.bytes_requested = 0
-        self.last_time = clock()
+        # Requests are limited by a bucket per peer, below the torrent
+        # bucket, below the session bucket of the shaper
+        if shaper is None:
+            # standalone, no session limit
+            shaper = RateShaper(scheduler, 0, DOWNLOAD_BURST)
+        self.shaper = shaper
+        self.bucket = TokenBucket(0, shaper.bucket, DOWNLOAD_BURST)
+        self.rateclass = RATECLASS_BULK
+        self.peer_rate = 0
         self.queued_out = {}
         self.requeueing = False
         self.paused = False
@@ -749,7 +761,19 @@ class Downloader:
 
     def set_download_rate(self, rate):
         self.download_rate = rate * 1000
-        self.bytes_requested = 0
+        self.bucket.set_rate(self.download_rate)
+
+    def set_peer_download_rate(self, rate):
+        """ Sets the download limit per peer in KB/s, 0 is unlimited """
+        self.peer_rate = rate * 1000
+        for d in self.downloads:
+            d.bucket.set_rate(self.peer_rate)
+
+    def set_rateclass(self, rateclass):
+        self.rateclass = rateclass
+
+    def get_rateclass(self):
+        return self.rateclass
 
     # ProxyService_
     #
@@ -760,30 +784,41 @@ class Downloader:
     #
     # _ProxyService
         
-    def queue_limit(self):
-        if not self.download_rate:
+    def queue_limit(self, d = None):
+        """ Returns the number of chunks that may be requested from the peer
+        of SingleDownload d, or from any peer if d is None """
+        if d is None:
+            bucket = self.bucket
+        else:
+            bucket = d.bucket
+        if self.rateclass == RATECLASS_STREAM:
+            # VOD and live are limited by their own limits only, they make
+            # the bulk downloads in the session give way.
+            top = self.shaper.bucket
+        else:
+            top = None
+        tokens = bucket.get_tokens(clock(), top)
+        if tokens >= UNLIMITED:
             return 10e10    # that's a big queue!
-        t = clock()
-        self.bytes_requested -= (t - self.last_time) * self.download_rate
-        self.last_time = t
-        if not self.requeueing and self.queued_out and self.bytes_requested < 0:
+        if not self.requeueing and self.queued_out and tokens > 0:
             self.requeueing = True
             q = self.queued_out.keys()
             shuffle(q)
             self.queued_out = {}
-            for d in q:
-                d._request_more()
+            for queued in q:
+                queued._request_more()
             self.requeueing = False
-        if -self.bytes_requested > 5*self.download_rate:
-            self.bytes_requested = -5*self.download_rate
-        ql = max(int(-self.bytes_requested/self.chunksize), 0)
+        ql = max(int(tokens/self.chunksize), 0)
         # if DEBUG:
-        #     print >> sys.stderr, 'Downloader: download_rate: %s, bytes_requested: %s, chunk: %s -> queue limit: %d' % \
-        #         (self.download_rate, self.bytes_requested, self.chunksize, ql)
+        #     print >> sys.stderr, 'Downloader: download_rate: %s, tokens: %s, chunk: %s -> queue limit: %d' % \
+        #         (self.download_rate, tokens, self.chunksize, ql)
         return ql
 
-    def chunk_requested(self, size):
-        self.bytes_requested += size
+    def chunk_requested(self, size, d = None):
+        if d is None:
+            self.bucket.consume(size)
+        else:
+            d.bucket.consume(size)
 
     external_data_received = chunk_requested
 
@@ -922,6 +957,12 @@ class Downloader:
             return True
         return False
 
+    def request_lost(self, download, index, begin, length):
+        """ The request is no longer outstanding at download, the storage
+        gets it back unless it was also requested from another peer. """
+        if not self.picker.duplicate_lost(download, (index, begin, length)):
+            self.storage.request_lost(index, begin, length)
+
     def too_many_partials(self):
         return len(self.storage.dirty) > (len(self.downloads)/2)
 
@@ -952,7 +993,7 @@ class Downloader:
                     if DEBUG: print >>sys.stderr, "Downloader:cancel_requests: canceling", request, "on", download.ip
                     download.connection.send_cancel(*request)
                     if not self.endgamemode:
-                        self.storage.request_lost(*request)
+                        self.request_lost(download, *request)
             if hit:
                 download.active_requests = [request for request in download.active_requests if not request in requests]
                 # Arno: VOD: all these peers were slow for their individually 
@@ -1001,7 +1042,7 @@ class Downloader:
                     hit = True
                     d.connection.send_cancel(index, nb, nl)
                     if not self.endgamemode:
-                        self.storage.request_lost(index, nb, nl)
+                        self.request_lost(d, index, nb, nl)
             if hit:
                 d.active_requests = [ r for r in d.active_requests
                                       if r[0] not in pieces ]
@@ -1048,8 +1089,9 @@ class Downloader:
             if d.active_requests:
                 assert d.interested and not d.choked
             for request in d.active_requests:
-                assert not request in self.all_requests
-                self.all_requests.append(request)
+                # VOD may have requested a late chunk from two peers
+                if not request in self.all_requests:
+                    self.all_requests.append(request)
         for d in self.downloads:
             d.fix_download_endgame()
         if DEBUG: print >>sys.stderr, "Downloader: start_endgame: we have", len(self.all_requests), "requests remaining"
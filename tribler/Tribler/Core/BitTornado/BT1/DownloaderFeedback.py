@@ -12,7 +12,8 @@ except:
 class DownloaderFeedback:
     def __init__(self, choker, ghttpdl, hhttpdl, add_task, upfunc, downfunc,
             ratemeasure, leftfunc, file_length, finflag, sp, statistics,
-            statusfunc = None, interval = None, infohash = None, voddownload=None):
+            statusfunc = None, interval = None, infohash = None, voddownload=None,
+            shapingfunc = None):
         self.choker = choker
         self.ghttpdl = ghttpdl
         self.hhttpdl = hhttpdl
@@ -29,6 +30,7 @@ class DownloaderFeedback:
         self.spewdata = None
         self.infohash = infohash
         self.voddownload = voddownload
+        self.shapingfunc = shapingfunc
         self.doneprocessing = Event()
         self.doneprocessing.set()
         if statusfunc:
@@ -160,6 +162,8 @@ class DownloaderFeedback:
         else:
             s['spew'] = None
         s['up'] = self.upfunc()
+        if self.shapingfunc is not None:
+            s['shaping'] = self.shapingfunc()
         if self.finflag.isSet():
             s['done'] = self.file_length
             s['down'] = 0.0
@@ -210,6 +214,19 @@ class DownloaderFeedback:
         return s        
 
 
+    def summary(self):
+        """ Cheap subset of gather(), used to find out whether the state of a
+        Download changed: (frac, up, down, number of connections) """
+        up = self.upfunc()
+        if self.finflag.isSet():
+            return 1.0, up, 0.0, len(self.choker.connections)
+        obtained, desired, have = self.leftfunc()
+        if desired > 0:
+            frac = float(obtained)/desired
+        else:
+            frac = 1.0
+        return frac, up, self.downfunc(), len(self.choker.connections)
+
     def display(self, displayfunc):
         if not self.doneprocessing.isSet():
             return
@@ -4,7 +4,6 @@
 
 import sys
 from base64 import b64encode
-from cStringIO import StringIO
 from binascii import b2a_hex
 from socket import error as socketerror
 from urllib import quote
@@ -12,7 +11,7 @@ from struct import unpack
 from time import time
 from traceback import print_exc
 
-from Tribler.Core.BitTornado.BT1.MessageID import protocol_name,option_pattern
+from Tribler.Core.BitTornado.BT1.MessageID import protocol_name,option_pattern,PIECE
 from Tribler.Core.BitTornado.BT1.convert import toint
 from Tribler.Core.Statistics.Status.Status import get_status_holder
 from threading import Lock
@@ -175,7 +174,10 @@ class Connection:
         self.complete = False
         self.keepalive = lambda: None
         self.closed = False
-        self.buffer = StringIO()
+        # Receive buffer for messages that arrive in parts, reused for all
+        # messages on this connection. The first 'buffered' bytes are valid.
+        self.buffer = bytearray()
+        self.buffered = 0
 # overlay        
         self.dns = dns
         self.support_extend_messages = False
@@ -251,8 +253,12 @@ class Connection:
                 print >>sys.stderr,"encoder: Peer supports Merkle hashes"
 # _overlay
 
+    # The read_* functions get the next next_len bytes as a memoryview that is
+    # only valid during the call, and return the (next_len, next_func) to
+    # read the rest of the stream with, or None to close the connection.
+
     def read_header_len(self, s):
-        if ord(s) != len(protocol_name):
+        if ord(s[0]) != len(protocol_name):
             return None
         return len(protocol_name), self.read_header
 
@@ -308,6 +314,7 @@ class Connection:
         if DEBUG:
             print >>sys.stderr,"Encoder.Connection: read_peer_id"
 
+        s = s.tobytes()
         if not self.id:    # remote init or local init without remote peer's id or remote init
             self.id = s
             self.readable_id = make_readable(s)
@@ -351,7 +358,11 @@ class Connection:
         return l, self.read_message
 
     def read_message(self, s):
-        if s != '':
+        if len(s):
+            # PIECE payloads go to the Downloader and StorageWrapper without
+            # copying, the latter copies what it has to keep
+            if s[0] != PIECE:
+                s = s.tobytes()
             self.connecter.got_message(self, s)
         #else:
         #    print >>sys.stderr,"encoder: got keepalive from",s.getpeername()
@@ -420,18 +431,25 @@ class Connection:
 
     def data_came_in(self, connection, s):
         self.Encoder.measurefunc(len(s))
+        view = memoryview(s)
+        pos = 0
+        end = len(s)
         while 1:
             if self.closed:
                 return
-            i = self.next_len - self.buffer.tell()
-            if i > len(s):
-                self.buffer.write(s)
+            i = self.next_len - self.buffered
+            if i > end - pos:
+                self._buffer_data(view[pos:])
                 return
-            self.buffer.write(s[:i])
-            s = s[i:]
-            m = self.buffer.getvalue()
-            self.buffer.reset()
-            self.buffer.truncate()
+            if self.buffered:
+                # complete the message in the receive buffer
+                self._buffer_data(view[pos:pos + i])
+                m = memoryview(self.buffer)[:self.next_len]
+                self.buffered = 0
+            else:
+                # the message is contained in s, no need to copy it
+                m = view[pos:pos + i]
+            pos += i
             try:
                 x = self.next_func(m)
             except:
@@ -447,6 +465,20 @@ class Connection:
                 return
             self.next_len, self.next_func = x
 
+    def _buffer_data(self, data):
+        """ Appends data, a part of the message being read, to the receive
+        buffer """
+        size = self.buffered + len(data)
+        if size > len(self.buffer):
+            # A new buffer instead of resizing, a memoryview on the old one
+            # may still be alive. The buffer grows to the largest message
+            # seen, which is bounded by Encoder.max_len.
+            newbuffer = bytearray(self.next_len)
+            newbuffer[:self.buffered] = self.buffer[:self.buffered]
+            self.buffer = newbuffer
+        self.buffer[self.buffered:size] = data
+        self.buffered = size
+
     def connection_flushed(self, connection):
         if self.complete:
             self.connecter.connection_flushed(self)
@@ -0,0 +1,241 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Hash checking of existing data on worker threads. A reader thread fetches
+# runs of consecutive pieces from Storage with large sequential reads, a pool
+# of threads hashes them (hashlib releases the GIL) and StorageWrapper
+# collects the digests on the network thread.
+#
+# HashCheckpoint remembers, per file, the size and mtime together with the
+# pieces that were found correct, so unchanged files are not checked again
+# after a restart.
+
+import os
+import sys
+from os.path import exists, getsize, getmtime, dirname
+from threading import Thread, Event
+from Queue import Queue, Empty
+from traceback import print_exc
+
+from Tribler.Core.Utilities.Crypto import sha
+from Tribler.Core.BitTornado.bitfield import Bitfield
+from Tribler.Core.BitTornado.bencode import bencode, bdecode
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+DEBUG = False
+
+# bytes requested from Storage per read
+READSIZE = 4 * 1048576
+HASHCHECK_THREADS = 2
+# pieces that may wait for a hashing thread, per thread
+READAHEAD = 4
+
+
+class HashChecker:
+    """
+    Hashes the pieces in CHECK_LIST on a pool of threads. For each piece
+    get_results returns (piece, sha1 of the first LASTLEN bytes, sha1 of the
+    piece), the first digest is used to find an out-of-place last piece.
+    Reading stops when FLAG is set.
+    """
+    def __init__(self, storage, piece_size, total_length, check_list, lastlen,
+                 flag, threads = HASHCHECK_THREADS, readsize = READSIZE):
+        self.storage = storage
+        self.flag = flag
+        self.piece_size = piece_size
+        self.total_length = total_length
+        self.check_list = check_list
+        self.lastlen = lastlen
+        self.readsize = max(readsize, piece_size)
+        self.threads = max(1, threads)
+        self.error = None
+        self.doneflag = Event()
+        self.work = Queue(self.threads * READAHEAD)
+        self.results = Queue()
+
+        self.workers = [Thread(target = self._read, name = "HashCheckReader")]
+        for i in xrange(self.threads):
+            self.workers.append(Thread(target = self._hash, name = "HashCheckHasher-%d" % i))
+        for t in self.workers:
+            t.setDaemon(True)
+            t.start()
+
+    def _piecelen(self, piece):
+        return min(self.piece_size, self.total_length - piece * self.piece_size)
+
+    def _runs(self):
+        """
+        Yields lists of consecutive pieces from check_list of at most
+        readsize bytes.
+        """
+        run = []
+        for piece in self.check_list:
+            if run and (piece != run[-1] + 1 or (len(run) + 1) * self.piece_size > self.readsize):
+                yield run
+                run = []
+            run.append(piece)
+        if run:
+            yield run
+
+    def _read(self):
+        try:
+            try:
+                for run in self._runs():
+                    if self.doneflag.isSet() or self.flag.isSet():
+                        break
+                    begin = run[0] * self.piece_size
+                    length = sum([self._piecelen(piece) for piece in run])
+                    d = self.storage.read(begin, length)
+                    data = d.getarray()
+                    d.release()
+                    offset = 0
+                    for piece in run:
+                        piecelen = self._piecelen(piece)
+                        self.work.put((piece, buffer(data, offset, piecelen)))
+                        offset += piecelen
+            except Exception, e:
+                if DEBUG:
+                    print_exc()
+                self.error = str(e)
+        finally:
+            for i in xrange(self.threads):
+                self.work.put(None)
+
+    def _hash(self):
+        lastlen = self.lastlen
+        while True:
+            job = self.work.get()
+            if job is None:
+                return
+            if self.doneflag.isSet():
+                continue
+            piece, data = job
+            sh = sha(buffer(data, 0, lastlen))
+            sp = sh.digest()
+            sh.update(buffer(data, lastlen))
+            self.results.put((piece, sp, sh.digest()))
+
+    def get_results(self):
+        """
+        Returns the (piece, sp, s) tuples that were hashed since the last
+        call, without blocking.
+        """
+        r = []
+        try:
+            while True:
+                r.append(self.results.get_nowait())
+        except Empty:
+            pass
+        return r
+
+    def stop(self):
+        self.doneflag.set()
+
+
+class HashCheckpoint:
+    """
+    Persists, per file in STORAGE, the (size, mtime, verified pieces)
+    of the last hash check.
+    """
+    def __init__(self, path, storage, piece_size):
+        self.path = path
+        self.storage = storage
+        self.piece_size = piece_size
+
+    def _file_pieces(self, index):
+        """
+        Returns the first piece and the number of pieces that overlap file
+        INDEX, or None for empty files.
+        """
+        r = self.storage.file_ranges[index]
+        if r is None:
+            return None
+        begin, end, offset, file = r
+        first = int(begin // self.piece_size)
+        last = int((end - 1) // self.piece_size)
+        return first, last - first + 1
+
+    def _stat(self, file):
+        if not exists(file):
+            return None
+        return getsize(file), int(getmtime(file))
+
+    def load(self):
+        """
+        Returns the set of pieces that were verified by the previous check and
+        of which no file has changed since.
+        """
+        try:
+            f = open(self.path, 'rb')
+            try:
+                d = bdecode(f.read())
+            finally:
+                f.close()
+            if d['piece length'] != self.piece_size or len(d['files']) != len(self.storage.files):
+                return set()
+            verified = set()
+            changed = set()
+            for index, (size, mtime, bits) in enumerate(d['files']):
+                pieces = self._file_pieces(index)
+                if pieces is None:
+                    continue
+                first, count = pieces
+                file = self.storage.files[index][0]
+                if self._stat(file) != (size, mtime):
+                    changed.update(xrange(first, first + count))
+                    continue
+                bitfield = Bitfield(count, bits)
+                for i in xrange(count):
+                    if bitfield[i]:
+                        verified.add(first + i)
+                    else:
+                        changed.add(first + i)
+            # a piece that spans several files needs all of them unchanged
+            return verified - changed
+        except IOError:
+            return set()
+        except Exception:
+            if DEBUG:
+                print_exc()
+            return set()
+
+    def save(self, verified):
+        """
+        Stores VERIFIED, a container with the pieces that are known to be
+        correct on disk.
+        """
+        files = []
+        for index in xrange(len(self.storage.files)):
+            file = self.storage.files[index][0]
+            pieces = self._file_pieces(index)
+            stat = self._stat(file)
+            if pieces is None or stat is None:
+                files.append([0, 0, ''])
+                continue
+            first, count = pieces
+            bitfield = Bitfield(count)
+            for i in xrange(count):
+                if first + i in verified:
+                    bitfield[i] = True
+            files.append([stat[0], stat[1], bitfield.tostring()])
+
+        try:
+            if not os.path.isdir(dirname(self.path)):
+                os.makedirs(dirname(self.path))
+            f = open(self.path + '.new', 'wb')
+            try:
+                f.write(bencode({'piece length': self.piece_size, 'files': files}))
+            finally:
+                f.close()
+            if exists(self.path):
+                os.remove(self.path)
+            os.rename(self.path + '.new', self.path)
+        except (IOError, OSError):
+            if DEBUG:
+                print >>sys.stderr, "HashCheckpoint: could not save", self.path
+                print_exc()
@@ -3,6 +3,7 @@
 # see LICENSE.txt for license information
 
 from random import randrange, shuffle
+from itertools import islice
 from Tribler.Core.BitTornado.clock import clock
 from Tribler.Core.simpledefs import *
 # ProxyService_
@@ -20,6 +21,10 @@ except:
 
 DEBUG = False
 
+# lists of pieces up to this length are scanned rather than searched through
+# with the bitsets
+SCAN_LENGTH = 32
+
 """
   rarest_first_cutoff = number of downloaded pieces at which to switch from random to rarest first.
   rarest_first_priority_cutoff = number of peers which need to have a piece before other partials
@@ -51,6 +56,11 @@ class PiecePicker:
 
         # pieces we have started to download (in transit)
         self.started = []
+        # the same pieces as a long, and piece:sequence number pairs that
+        # give their order in self.started
+        self.started_bits = 0L
+        self.started_order = {}
+        self.started_count = 0
 
         # !!! the following statistics involve peers, and exclude seeds !!!
 
@@ -124,6 +134,11 @@ class PiecePicker:
                      [self.pos_in_interests[piece]]
 
         holds. Pieces within the same subset are kept shuffled.
+
+        self.level_bits[level] is a long with bit piece set for every piece
+        in self.interests[level], and self.interest_bits the union of all
+        levels. _next intersects these with the pieces a peer has to skip
+        levels that hold nothing for that peer.
         """
 
         self.interests = [[] for x in xrange(self.priority_step)]
@@ -134,6 +149,15 @@ class PiecePicker:
         for i in xrange(self.numpieces):
             self.pos_in_interests[interests[i]] = i
         self.interests.append(interests)
+        self.interest_bits = (1L << self.numpieces) - 1
+        self.level_bits = [0L] * self.priority_step
+        self.level_bits.append(self.interest_bits)
+
+    def _grow_interests(self, level):
+        """ Makes sure interest level 'level' exists. """
+        while len(self.interests) < level+1:
+            self.interests.append([])
+            self.level_bits.append(0L)
 
     def got_piece(self, piece, begin, length):
         """
@@ -147,6 +171,14 @@ class PiecePicker:
         """
         pass
 
+    def duplicate_lost(self, download, request):
+        """
+        Used by the streaming piece picker, which may request a chunk from
+        two peers. Returns True when another download still has the request
+        outstanding, so the storage must not get it back.
+        """
+        return False
+
     def got_have(self, piece, connection = None):
         """ A peer reports to have the given piece. """
 
@@ -173,9 +205,8 @@ class PiecePicker:
             return True
         elif self.priority[piece] == -1:
             return False
-        if numint == len(self.interests) - 1:
-            self.interests.append([])
-        self._shift_over(piece, self.interests[numint], self.interests[numint + 1])
+        self._grow_interests(numint + 1)
+        self._shift_over(piece, numint, numint + 1)
         return False
 
     def lost_have(self, piece):
@@ -196,7 +227,7 @@ class PiecePicker:
             self.level_in_interests[piece] -= 1
         elif self.has[piece] or self.priority[piece] == -1:
             return
-        self._shift_over(piece, self.interests[numint], self.interests[numint - 1])
+        self._shift_over(piece, numint, numint - 1)
 
 
     # Arno: LIVEWRAP
@@ -220,22 +251,11 @@ class PiecePicker:
             p = self.priority[piece]
             level = self.numhaves[piece] + (self.priority_step * p)
             self.level_in_interests[piece] = level
-            while len(self.interests) < level+1:
-                self.interests.append([])
+            self._grow_interests(level)
 
             # insert at a random spot in the list at the current level
-            l2 = self.interests[level]
-            parray = self.pos_in_interests
-            newp = randrange(len(l2)+1)
-            if newp == len(l2):
-                parray[piece] = len(l2)
-                l2.append(piece)
-            else:
-                old = l2[newp]
-                parray[old] = len(l2)
-                l2.append(old)
-                l2[newp] = piece
-                parray[piece] = newp
+            self._add_to_level(piece, level)
+            self.interest_bits |= 1L << piece
 
         # modelled after lost_have
 
@@ -256,7 +276,7 @@ class PiecePicker:
         self.crosscount2[0] += 1
         numint = self.level_in_interests[piece]
         self.level_in_interests[piece] = 0
-        self._shift_over(piece, self.interests[numint], self.interests[0])
+        self._shift_over(piece, numint, 0)
 
     def set_downloader(self,dl):
         self.downloader = dl
@@ -268,10 +288,12 @@ class PiecePicker:
     #
     # _ProxyService
 
-    def _shift_over(self, piece, l1, l2):
-        """ Moves 'piece' from interests list l1 to l2. """
+    def _shift_over(self, piece, level1, level2):
+        """ Moves 'piece' from interest level level1 to level2. """
 
         assert self.superseed or (not self.has[piece] and self.priority[piece] >= 0)
+        l1 = self.interests[level1]
+        l2 = self.interests[level2]
         parray = self.pos_in_interests
 
         # remove piece from l1
@@ -282,6 +304,12 @@ class PiecePicker:
         parray[q] = p
         del l1[-1]
 
+        if level1 != level2:
+            mask = 1L << piece
+            level_bits = self.level_bits
+            level_bits[level1] ^= mask
+            level_bits[level2] |= mask
+
         # add piece to a random place in l2
         newp = randrange(len(l2)+1)
         if newp == len(l2):
@@ -294,6 +322,34 @@ class PiecePicker:
             l2[newp] = piece
             parray[piece] = newp
 
+    def _remove_from_level(self, piece, level):
+        """ Removes 'piece' from interest level 'level'. """
+        l1 = self.interests[level]
+        parray = self.pos_in_interests
+        p = parray[piece]
+        assert l1[p] == piece
+        q = l1[-1]
+        l1[p] = q
+        parray[q] = p
+        del l1[-1]
+        self.level_bits[level] ^= 1L << piece
+
+    def _add_to_level(self, piece, level):
+        """ Adds 'piece' to a random place in interest level 'level'. """
+        l2 = self.interests[level]
+        parray = self.pos_in_interests
+        self.level_bits[level] |= 1L << piece
+        newp = randrange(len(l2)+1)
+        if newp == len(l2):
+            parray[piece] = len(l2)
+            l2.append(piece)
+        else:
+            old = l2[newp]
+            parray[old] = len(l2)
+            l2.append(old)
+            l2[newp] = piece
+            parray[piece] = newp
+
     def got_seed(self):
         self.seeds_connected += 1
         self.cutoff = max(self.rarest_first_priority_cutoff-self.seeds_connected, 0)
@@ -308,6 +364,7 @@ class PiecePicker:
             self.level_in_interests = [i-1 for i in self.level_in_interests]
             if self.interests:
                 del self.interests[0]
+                self.interest_bits &= ~self.level_bits.pop(0)
         del self.crosscount[0]
         if not self.done:
             del self.crosscount2[0]
@@ -320,23 +377,30 @@ class PiecePicker:
     # and LENGTH parameter
     def requested(self, piece, begin=None, length=None):
         """ Given piece has been requested or a partial of it is on disk. """
-        if piece not in self.started:
-            self.started.append(piece)
+        if piece not in self.started_order:
+            self._add_started(piece)
+
+    def _add_started(self, piece):
+        self.started.append(piece)
+        self.started_bits |= 1L << piece
+        self.started_order[piece] = self.started_count
+        self.started_count += 1
+
+    def _remove_started(self, piece):
+        """ Removes 'piece' from self.started, returns whether it was in
+        there. """
+        if piece not in self.started_order:
+            return False
+        self.started.remove(piece)
+        self.started_bits ^= 1L << piece
+        del self.started_order[piece]
+        return True
 
     def _remove_from_interests(self, piece, keep_partial = False):
-        l = self.interests[self.level_in_interests[piece]]
-        p = self.pos_in_interests[piece]
-        assert l[p] == piece
-        q = l[-1]
-        l[p] = q
-        self.pos_in_interests[q] = p
-        del l[-1]
-        try:
-            self.started.remove(piece)
-            if keep_partial:
-                self.removed_partials[piece] = 1
-        except ValueError:
-            pass
+        self._remove_from_level(piece, self.level_in_interests[piece])
+        self.interest_bits ^= 1L << piece
+        if self._remove_started(piece) and keep_partial:
+            self.removed_partials[piece] = 1
 
     def complete(self, piece):
         """ Succesfully received the given piece. """
@@ -383,9 +447,17 @@ class PiecePicker:
         # interest level of best piece
         bestnum = 2 ** 30
 
+        bits = self._have_bits(haves)
+        if bits is None or len(self.started) <= SCAN_LENGTH:
+            started = self.started
+        else:
+            # only the started pieces that the peer has, in started order
+            started = self._bits_to_pieces(self.started_bits & bits)
+            started.sort(key = self.started_order.__getitem__)
+
         # select piece we started to download with best interest index.
-        for i in self.started:
-            if haves[i] and wantfunc(i):
+        for i in started:
+            if (started is not self.started or haves[i]) and wantfunc(i):
                 if self.level_in_interests[i] < bestnum:
                     best = i
                     bestnum = self.level_in_interests[i]
@@ -396,7 +468,10 @@ class PiecePicker:
             if complete_first or (cutoff and len(self.interests) > self.cutoff):
                 return best
 
-        if haves.complete():
+        if bits is not None and not bits & self.interest_bits:
+            # peer has nothing we are interested in
+            r = []
+        elif haves.complete():
             # peer has all pieces - look for any more interesting piece
             r = [ (0, min(bestnum, len(self.interests))) ]
         elif cutoff and len(self.interests) > self.cutoff:
@@ -410,14 +485,74 @@ class PiecePicker:
         # r is an interest-range
         for lo, hi in r:
             for i in xrange(lo, hi):
-                for j in self.interests[i]:
-                    if haves[j] and wantfunc(j):
-                        return j
+                j = self._pick_from_level(i, haves, bits, wantfunc)
+                if j is not None:
+                    return j
 
         if best is not None:
             return best
         return None
 
+    def _have_bits(self, haves):
+        """ Returns the pieces in 'haves' as a long, or None when every
+        piece has to be checked with haves[piece] instead. """
+        if haves.complete():
+            return None
+        try:
+            return haves.tolong()
+        except AttributeError:
+            return None
+
+    def _bits_to_pieces(self, bits):
+        """ Returns the list of pieces that are set in long 'bits'. """
+        pieces = []
+        # a few pieces are taken off the top one by one, which is cheaper
+        # than converting a large long to a string
+        for i in xrange(SCAN_LENGTH):
+            if not bits:
+                return pieces
+            top = bits.bit_length() - 1
+            pieces.append(top)
+            bits ^= 1L << top
+        s = bin(bits)
+        top = len(s) - 1
+        c = s.find('1', 2)
+        while c != -1:
+            pieces.append(top - c)
+            c = s.find('1', c + 1)
+        return pieces
+
+    def _pick_from_level(self, level, haves, bits, wantfunc):
+        """ Returns the first piece in self.interests[level] that is in
+        'haves' and accepted by 'wantfunc', or None.
+
+        @param bits: the pieces in 'haves' as returned by _have_bits
+        """
+        l = self.interests[level]
+        if not l:
+            return None
+        if bits is None or len(l) <= SCAN_LENGTH:
+            for j in l:
+                if haves[j] and wantfunc(j):
+                    return j
+            return None
+
+        candidates = self.level_bits[level] & bits
+        if not candidates:
+            return None
+        # scanning the head of the level is cheap when the peer has many of
+        # its pieces, otherwise try the candidates in the order of the level
+        for j in islice(l, SCAN_LENGTH):
+            if haves[j] and wantfunc(j):
+                return j
+        pos = self.pos_in_interests
+        pieces = [(pos[j], j) for j in self._bits_to_pieces(candidates) if pos[j] >= SCAN_LENGTH]
+        pieces.sort()
+        for p, j in pieces:
+            if wantfunc(j):
+                return j
+        return None
+
     def next(self, haves, wantfunc, sdownload, complete_first = False, slowpieces= [], willrequest = True, connection = None):
         """ Return the next piece number to be downloaded
         
@@ -493,10 +628,7 @@ class PiecePicker:
         l.append(piece)
         for i in range(pos, len(l)):
             self.pos_in_interests[l[i]] = i
-        try:
-            self.started.remove(piece)
-        except:
-            pass
+        self._remove_started(piece)
 
     def set_priority(self, piece, p):
         """ Define the priority with which a piece needs to be downloaded.
@@ -523,23 +655,13 @@ class PiecePicker:
             self.level_in_interests[piece] = level
             if self.has[piece]:
                 return True
-            while len(self.interests) < level+1:
-                self.interests.append([])
-            l2 = self.interests[level]
-            parray = self.pos_in_interests
-            newp = randrange(len(l2)+1)
-            if newp == len(l2):
-                parray[piece] = len(l2)
-                l2.append(piece)
-            else:
-                old = l2[newp]
-                parray[old] = len(l2)
-                l2.append(old)
-                l2[newp] = piece
-                parray[piece] = newp
+            self._grow_interests(level)
+            self._add_to_level(piece, level)
+            self.interest_bits |= 1L << piece
             if self.removed_partials.has_key(piece):
                 del self.removed_partials[piece]
-                self.started.append(piece)
+                if piece not in self.started_order:
+                    self._add_started(piece)
             # now go to downloader and try requesting more
             return True
         numint = self.level_in_interests[piece]
@@ -547,9 +669,8 @@ class PiecePicker:
         self.level_in_interests[piece] = newint
         if self.has[piece]:
             return False
-        while len(self.interests) < newint+1:
-            self.interests.append([])
-        self._shift_over(piece, self.interests[numint], self.interests[newint])
+        self._grow_interests(newint)
+        self._shift_over(piece, numint, newint)
         return False
 
     def is_blocked(self, piece):
@@ -586,10 +707,8 @@ class PiecePicker:
                 if not connection.download.have[piece]:
                     seedint = self.level_in_interests[piece]
                     self.level_in_interests[piece] += 1  # tweak it up one, so you don't duplicate effort
-                    if seedint == len(self.interests) - 1:
-                        self.interests.append([])
-                    self._shift_over(piece, 
-                                self.interests[seedint], self.interests[seedint + 1])
+                    self._grow_interests(seedint + 1)
+                    self._shift_over(piece, seedint, seedint + 1)
                     self.seed_got_haves[piece] = 0       # reset this
                     self.seed_connections[connection] = piece
                     connection.upload.seed_have_list.append(piece)
@@ -622,6 +741,8 @@ class PiecePicker:
             self.interests.append([])
             self.level_in_interests = [self.priority_step] * self.numpieces
             self.pos_in_interests = [0] * self.numpieces # Incorrect, but shouldn't matter
+            self.level_bits = [0L] * len(self.interests)
+            self.interest_bits = 0L
         else:
             self._init_interests()    
 
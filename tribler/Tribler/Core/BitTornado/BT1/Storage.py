@@ -2,6 +2,7 @@
 # see LICENSE.txt for license information
 
 from Tribler.Core.BitTornado.piecebuffer import BufferPool
+from array import array
 from threading import Lock
 from time import strftime, localtime
 import os
@@ -13,6 +14,10 @@ except ImportError:
     fsync = lambda x: None
 from bisect import bisect
 import sys
+try:
+    import mmap
+except ImportError:
+    mmap = None
     
 try:
     True
@@ -37,6 +42,49 @@ def getmtime(path):
 def dummy_status(fractionDone = None, activity = None):
     pass
 
+class MappedBuffer:
+    """
+    Read-only view on memory mapped file data, returned by Storage.read_mapped.
+    Offers the PieceBuffer interface, slicing returns a MappedBuffer on the
+    same memory instead of a copy.
+    """
+    def __init__(self, views):
+        # buffer objects on the mappings, one per file
+        self.views = views
+        self.length = sum([len(v) for v in views])
+
+    def __len__(self):
+        return self.length
+
+    def __getslice__(self, a, b):
+        if b > self.length:
+            b = self.length
+        if b < 0:
+            b += self.length
+        views = []
+        pos = 0
+        for v in self.views:
+            end = pos + len(v)
+            if end > a and pos < b:
+                start = max(a - pos, 0)
+                views.append(buffer(v, start, min(b, end) - pos - start))
+            pos = end
+        return MappedBuffer(views)
+
+    def getviews(self):
+        return self.views
+
+    def tostring(self):
+        return ''.join([str(v) for v in self.views])
+
+    def getarray(self):
+        return array('c', self.tostring())
+
+    def release(self):
+        # the mapping is unmapped once no view refers to it anymore
+        self.views = []
+        self.length = 0
+
 class Storage:
     def __init__(self, files, piece_length, doneflag, config, 
                  disabled_files = None):
@@ -56,6 +104,9 @@ class Storage:
         self.tops = {}
         self.sizes = {}
         self.mtimes = {}
+        # {file: mmap}, mappings exist only for files with an open read handle
+        self.mmaps = {}
+        self.use_mmap = config.get('use_mmap', mmap is not None and os.name != 'nt')
         if config.get('lock_files', True):
             self.lock_file, self.unlock_file = self._lock_file, self._unlock_file
         else:
@@ -202,6 +253,9 @@ class Storage:
     def _close(self, file):
         f = self.handles[file]
         del self.handles[file]
+        if self.mmaps.has_key(file):
+            # not closed explicitly, MappedBuffers handed out may still use it
+            del self.mmaps[file]
         if self.whandles.has_key(file):
             del self.whandles[file]
             f.flush()
@@ -318,6 +372,48 @@ class Storage:
                 self.lock.release()
         return r
 
+    def _get_mapping(self, file):
+        # also moves the file to the end of the handle LRU
+        h = self._get_file_handle(file, False)
+        if self.whandles.has_key(file):
+            # written data may still be in the file object buffer
+            return None
+        m = self.mmaps.get(file)
+        if m is None:
+            if os.fstat(h.fileno()).st_size == 0:
+                return None
+            m = mmap.mmap(h.fileno(), 0, access = mmap.ACCESS_READ)
+            self.mmaps[file] = m
+        return m
+
+    def read_mapped(self, pos, amount):
+        """
+        Returns a MappedBuffer with AMOUNT bytes at POS without copying them,
+        or None when the data can not be memory mapped, e.g. because a file
+        is open for writing. Use read() in that case.
+        """
+        if not self.use_mmap:
+            return None
+        views = []
+        self.lock.acquire()
+        try:
+            try:
+                for file, begin, end in self._intervals(pos, amount):
+                    m = self._get_mapping(file)
+                    if m is None or end > len(m):
+                        return None
+                    views.append(buffer(m, begin, end - begin))
+            except (IOError, OSError, EnvironmentError, ValueError), e:
+                if DEBUG:
+                    print >>sys.stderr, 'Storage: read_mapped failed', str(e)
+                return None
+        finally:
+            self.lock.release()
+        r = MappedBuffer(views)
+        if len(r) != amount:
+            return None
+        return r
+
     def write(self, pos, s):
         if DEBUG:
             print >>sys.stderr, 'writing ', len(s), 'bytes at', pos
@@ -366,6 +462,7 @@ class Storage:
                 pass
         self.handles = {}
         self.whandles = {}
+        self.mmaps = {}
         self.handlebuffer = None
 
 
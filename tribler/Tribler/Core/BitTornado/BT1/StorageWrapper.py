@@ -14,6 +14,8 @@ from Tribler.Core.Utilities.Crypto import sha
 from Tribler.Core.BitTornado.bitfield import Bitfield
 from Tribler.Core.BitTornado.clock import clock
 from Tribler.Core.BitTornado.bencode import bencode
+from Tribler.Core.BitTornado.BT1.HashCheck import HashChecker, HashCheckpoint, HASHCHECK_THREADS
+from Tribler.Core.BitTornado.BT1.Storage import MappedBuffer
 
 try:
     True
@@ -25,6 +27,10 @@ from bisect import insort
 DEBUG = False
 
 STATS_INTERVAL = 0.2
+# seconds between polls for hash check results when none were ready
+HASHCHECK_POLL_INTERVAL = 0.05
+# seconds between hash check checkpoint saves
+CHECKPOINT_INTERVAL = 30
 RARE_RAWSERVER_TASKID = -481  # This must be a rawserver task ID that is never valid.
 
 
@@ -77,7 +83,8 @@ class StorageWrapper:
             data_flunked = lambda x: None, 
             piece_from_live_source_func = lambda i,d: None, 
             backfunc = None, 
-            config = {}, unpauseflag = fakeflag(True)):
+            config = {}, unpauseflag = fakeflag(True),
+            checkpoint = None):
         
         if DEBUG: 
             print >>sys.stderr, "StorageWrapper: __init__: wrapped around", storage.files
@@ -142,6 +149,16 @@ class StorageWrapper:
         self.write_buf_list = []
         # Arno, 2010-04-23: STBSPEED: the piece that were correct on disk at start
         self.pieces_on_disk_at_startup = []
+        # pieces are hashed on threads, results are collected by hashcheckfunc
+        self.hashchecker = None
+        self.check_pos = 0
+        self.hashcheck_threads = config.get('hashcheck_threads', HASHCHECK_THREADS)
+        if checkpoint is None:
+            self.hashcheck_checkpoint = None
+        else:
+            self.hashcheck_checkpoint = HashCheckpoint(checkpoint, storage, self.piece_size)
+        # delay before the next initialize step, set by steps that are waiting
+        self.initialize_delay = 0
 
         # Merkle:
         self.merkle_torrent = (root_hash is not None)
@@ -193,6 +210,9 @@ class StorageWrapper:
                     self.unpauseflag.wait()
                     if self.flag.isSet():
                         return False
+                    if self.initialize_delay:
+                        time.sleep(self.initialize_delay)
+                        self.initialize_delay = 0
                     x = next()
 
         self.statusfunc(fractionDone = 0)
@@ -289,7 +309,8 @@ class StorageWrapper:
                 diff = et - st
                 print >>sys.stderr,"StorageWrapper: _initialize: task took",diff
 
-        self.backfunc(self._initialize)
+        self.backfunc(self._initialize, self.initialize_delay)
+        self.initialize_delay = 0
 
 
     def init_hashcheck(self):
@@ -367,8 +388,40 @@ class StorageWrapper:
         if DEBUG:
             print "StorageWrapper: init_hashcheck: checking",self.check_list
             print "StorageWrapper: init_hashcheck: return self.check_total > 0 is ",(self.check_total > 0)
+        if self.check_total > 0:
+            self._start_hashcheck()
         return self.check_total > 0
 
+    def _start_hashcheck(self):
+        # position in check_list of the next piece to process
+        self.check_pos = 0
+        # piece:(sp, s) pairs for hashed pieces that are not processed yet
+        self.check_results = {}
+        # pieces found correct and in place
+        self.check_verified = []
+        self.check_saved = clock()
+        if not self.check_hashes:
+            return
+
+        if self.hashcheck_checkpoint is not None and self.hashes_unpickled:
+            # unchanged pieces that were correct during the previous check
+            verified = self.hashcheck_checkpoint.load()
+            for i in self.check_list:
+                if i in verified:
+                    self.check_results[i] = (None, self.hashes[i])
+            if DEBUG:
+                print >>sys.stderr,"StorageWrapper: init_hashcheck:",len(self.check_results),"pieces verified by checkpoint"
+
+        todo = [i for i in self.check_list if not self.check_results.has_key(i)]
+        if todo:
+            self.hashchecker = HashChecker(self.storage, self.piece_size, self.total_length,
+                                           todo, self.lastlen, self.flag, self.hashcheck_threads)
+
+    def _stop_hashcheck(self):
+        if self.hashchecker is not None:
+            self.hashchecker.stop()
+            self.hashchecker = None
+
 
     def set_nohashcheck(self):
         if DEBUG:
@@ -376,6 +429,7 @@ class StorageWrapper:
         self.places = {}
         self.check_targets = {}
         self.check_list = []
+        self.check_pos = 0
         self.check_total = len(self.check_list)
         self.check_numchecked = 0.0
         self.lastlen = self._piecelen(len(self.hashes) - 1)
@@ -395,6 +449,15 @@ class StorageWrapper:
         
         return self.pieces_on_disk_at_startup
 
+    def get_hashcheck_estimate(self):
+        """ Returns the number of bytes on disk that initialize() will have to
+        read, i.e. existing data that is not covered by the resume data.
+        Must be called before initialize().
+        """
+        if self.live_streaming or not self.hashes or self.amount_left == 0:
+            return 0L
+        return max(0L, self.storage.get_length_initial_content() - len(self.places) * self.piece_size)
+
 
     def _markgot(self, piece, pos):
         if DEBUG:
@@ -415,79 +478,111 @@ class StorageWrapper:
             if self.live_streaming:
                 return None
             if self.flag.isSet():
+                self._stop_hashcheck()
                 return None
-            if not self.check_list:
+            if self.check_pos >= len(self.check_list):
+                self._stop_hashcheck()
                 return None
 
-            i = self.check_list.pop(0)
-            if not self.check_hashes:
-                self._markgot(i, i)
-            else:
-                d1 = self.read_raw(i, 0, self.lastlen)
-                if d1 is None:
-                    return None
-                sh = sha(d1[:])
-                d1.release()
-                sp = sh.digest()
-                d2 = self.read_raw(i, self.lastlen, self._piecelen(i)-self.lastlen)
-                if d2 is None:
+            error = None
+            if self.hashchecker is not None:
+                error = self.hashchecker.error
+                for i, sp, s in self.hashchecker.get_results():
+                    self.check_results[i] = (sp, s)
+
+            processed = 0
+            while self.check_pos < len(self.check_list):
+                i = self.check_list[self.check_pos]
+                if self.check_hashes:
+                    if not self.check_results.has_key(i):
+                        break
+                    sp, s = self.check_results.pop(i)
+                    self._hashcheck_piece(i, sp, s)
+                else:
+                    self._markgot(i, i)
+                self.check_pos += 1
+                self.numchecked += 1
+                processed += 1
+
+                if self.amount_left == 0:
+                    self._stop_hashcheck()
+                    self._save_hashcheck()
+                    if not self.hashes_unpickled:
+                        # Merkle: The moment of truth. Are we an initial seeder?
+                        self.merkletree = MerkleTree(self.piece_size,self.total_length,None,self.initial_hashes)
+                        if self.merkletree.compare_root_hashes(self.root_hash):
+                            if DEBUG:
+                                print "StorageWrapper: Merkle torrent, initial seeder!"
+                            self.hashes = self.initial_hashes
+                        else:
+                            # Bad luck
+                            if DEBUG:
+                                print "StorageWrapper: Merkle torrent, NOT a seeder!"
+                            self.failed('download corrupted, hash tree does not compute; please delete and restart')
+                            return 1
+                    self.finished()
+                    return (self.numchecked / self.check_total)
+
+            if self.check_pos >= len(self.check_list):
+                self._stop_hashcheck()
+                self._save_hashcheck()
+            elif not processed:
+                if error is not None:
+                    self._stop_hashcheck()
+                    self.failed('IO Error: ' + error)
                     return None
-                sh.update(d2[:])
-                d2.release()
-                s = sh.digest()
+                # the threads are still reading and hashing
+                self.initialize_delay = HASHCHECK_POLL_INTERVAL
+            elif self.check_saved + CHECKPOINT_INTERVAL < clock():
+                self._save_hashcheck()
 
-
-                if DEBUG:
-                    if s != self.hashes[i]:
-                        print >>sys.stderr,"StorageWrapper: hashcheckfunc: piece corrupt",i
-
-                # Merkle: If we didn't read the hashes from persistent storage then
-                # we can't check anything. Exception is the case where we are the
-                # initial seeder. In that case we first calculate all hashes, 
-                # and then compute the hash tree. If the root hash equals the
-                # root hash in the .torrent we're a seeder. Otherwise, we are
-                # client with messed up data and no (local) way of checking it.
-                #
-                if not self.hashes_unpickled:
-                    if DEBUG:
-                        print "StorageWrapper: Merkle torrent, saving calculated hash",i
-                    self.initial_hashes[i] = s
-                    self._markgot(i, i)
-                elif s == self.hashes[i]:
-                    self._markgot(i, i)
-                elif (self.check_targets.get(s)
-                       and self._piecelen(i) == self._piecelen(self.check_targets[s][-1])):
-                    self._markgot(self.check_targets[s].pop(), i)
-                    self.out_of_place += 1
-                elif (not self.have[-1] and sp == self.hashes[-1]
-                       and (i == len(self.hashes) - 1
-                            or not self._waspre(len(self.hashes) - 1))):
-                    self._markgot(len(self.hashes) - 1, i)
-                    self.out_of_place += 1
-                else:
-                    self.places[i] = i
-            self.numchecked += 1
-            if self.amount_left == 0:
-                if not self.hashes_unpickled:
-                    # Merkle: The moment of truth. Are we an initial seeder?
-                    self.merkletree = MerkleTree(self.piece_size,self.total_length,None,self.initial_hashes)
-                    if self.merkletree.compare_root_hashes(self.root_hash):
-                        if DEBUG:
-                            print "StorageWrapper: Merkle torrent, initial seeder!"
-                        self.hashes = self.initial_hashes
-                    else:
-                        # Bad luck
-                        if DEBUG:
-                            print "StorageWrapper: Merkle torrent, NOT a seeder!"
-                        self.failed('download corrupted, hash tree does not compute; please delete and restart')
-                        return 1
-                self.finished()
-                
             return (self.numchecked / self.check_total)
 
         except Exception, e:
             print_exc()
+            self._stop_hashcheck()
             self.failed('download corrupted: '+str(e)+'; please delete and restart')
+
+    def _hashcheck_piece(self, i, sp, s):
+        """
+        Process piece I that hashes to S, where SP is the hash of its first
+        lastlen bytes, or None when it is known that S is correct.
+        """
+        if DEBUG:
+            if s != self.hashes[i]:
+                print >>sys.stderr,"StorageWrapper: hashcheckfunc: piece corrupt",i
+
+        # Merkle: If we didn't read the hashes from persistent storage then
+        # we can't check anything. Exception is the case where we are the
+        # initial seeder. In that case we first calculate all hashes, 
+        # and then compute the hash tree. If the root hash equals the
+        # root hash in the .torrent we're a seeder. Otherwise, we are
+        # client with messed up data and no (local) way of checking it.
+        #
+        if not self.hashes_unpickled:
+            if DEBUG:
+                print "StorageWrapper: Merkle torrent, saving calculated hash",i
+            self.initial_hashes[i] = s
+            self._markgot(i, i)
+        elif s == self.hashes[i]:
+            self._markgot(i, i)
+            self.check_verified.append(i)
+        elif (self.check_targets.get(s)
+               and self._piecelen(i) == self._piecelen(self.check_targets[s][-1])):
+            self._markgot(self.check_targets[s].pop(), i)
+            self.out_of_place += 1
+        elif (not self.have[-1] and sp == self.hashes[-1]
+               and (i == len(self.hashes) - 1
+                    or not self._waspre(len(self.hashes) - 1))):
+            self._markgot(len(self.hashes) - 1, i)
+            self.out_of_place += 1
+        else:
+            self.places[i] = i
+
+    def _save_hashcheck(self):
+        self.check_saved = clock()
+        if self.hashcheck_checkpoint is not None and self.hashes_unpickled and self.check_hashes:
+            self.hashcheck_checkpoint.save(set(self.check_verified))
     
 
     def init_movedata(self):
@@ -744,6 +839,10 @@ class StorageWrapper:
     def _write_to_buffer(self, piece, start, data):
         if not self.write_buf_max:
             return self.write_raw(self.places[piece], start, data)
+        if isinstance(data, memoryview):
+            # a view on a connection's receive buffer, only valid until the
+            # next message comes in
+            data = data.tobytes()
         self.write_buf_size += len(data)
         while self.write_buf_size > self.write_buf_max:
             old = self.write_buf_list.pop(0)
@@ -1008,17 +1107,17 @@ class StorageWrapper:
                 del self.stat_new[index]
 
 
-    def get_piece(self, index, begin, length):
+    def get_piece(self, index, begin, length, mapped = False):
         # Merkle: Get (sub)piece from disk and its associated hashes
-        # do_get_piece() returns PieceBuffer
-        pb = self.do_get_piece(index,begin,length)
+        # do_get_piece() returns PieceBuffer, or MappedBuffer when MAPPED
+        pb = self.do_get_piece(index,begin,length,mapped)
         if self.merkle_torrent and pb is not None and begin == 0:
             hashlist = self.merkletree.get_hashes_for_piece(index)
         else:
             hashlist = []
         return [pb,hashlist]
 
-    def do_get_piece(self, index, begin, length):
+    def do_get_piece(self, index, begin, length, mapped = False):
         if not self.have[index]:
             return None
         data = None
@@ -1037,22 +1136,28 @@ class StorageWrapper:
                 return None
             length = self._piecelen(index)-begin
             if begin == 0:
-                return self.read_raw(self.places[index], 0, length)
+                return self.read_raw(self.places[index], 0, length, mapped = mapped)
         elif begin + length > self._piecelen(index):
             return None
         if data is not None:
             s = data[begin:begin+length]
             data.release()
             return s
-        data = self.read_raw(self.places[index], begin, length)
+        data = self.read_raw(self.places[index], begin, length, mapped = mapped)
         if data is None:
             return None
+        if isinstance(data, MappedBuffer):
+            return data
         s = data.getarray()
         data.release()
         return s
 
-    def read_raw(self, piece, begin, length, flush_first = False):
+    def read_raw(self, piece, begin, length, flush_first = False, mapped = False):
         try:
+            if mapped and not flush_first and not self.live_streaming:
+                data = self.storage.read_mapped(self.piece_size * piece + begin, length)
+                if data is not None:
+                    return data
             return self.storage.read(self.piece_size * piece + begin, 
                                                      length, flush_first)
         except IOError, e:
@@ -0,0 +1,159 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# UDP tracker protocol (BEP 15) on top of the state of the HTTP Tracker in
+# track.py. An announce is one request and one response datagram instead of a
+# TCP connection and an HTTP exchange, so the tracker only has to unpack a
+# few integers and return the compact peer list it already caches.
+#
+# Connection ids are not stored: they are a keyed hash of the address of the
+# client and the current minute, and are accepted during two minutes.
+
+import sys
+import os
+import socket
+from struct import pack, unpack, unpack_from
+from time import time
+from types import StringType
+from traceback import print_exc
+
+from Tribler.Core.simpledefs import *
+from Tribler.Core.BitTornado.bencode import bdecode
+from Tribler.Core.Utilities.Crypto import sha
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+DEBUG = False
+
+PROTOCOL_ID = 0x41727101980
+ACTION_CONNECT = 0
+ACTION_ANNOUNCE = 1
+ACTION_SCRAPE = 2
+ACTION_ERROR = 3
+
+CONNECTION_ID_PERIOD = 60
+# scrape responses for more infohashes do not fit in a datagram
+MAX_SCRAPE_INFOHASHES = 74
+
+EVENTS = {0: None, 1: 'completed', 2: 'started', 3: 'stopped'}
+
+
+class UDPTracker:
+    def __init__(self, tracker, rawserver, port, host = ''):
+        self.tracker = tracker
+        self.rawserver = rawserver
+        self.secret = os.urandom(20)
+        self.socket = rawserver.create_udpsocket(port, host)
+        rawserver.start_listening_udp(self.socket, self)
+
+    def shutdown(self):
+        self.rawserver.stop_listening_udp(self.socket)
+        self.socket.close()
+
+    def get_port(self):
+        return self.socket.getsockname()[1]
+
+    def connection_id(self, address, period):
+        return unpack('!q', sha('%s%d%s:%d' % (self.secret, period, address[0], address[1])).digest()[:8])[0]
+
+    def valid_connection_id(self, connection_id, address):
+        period = int(time() / CONNECTION_ID_PERIOD)
+        return ( connection_id == self.connection_id(address, period)
+                 or connection_id == self.connection_id(address, period-1) )
+
+    def data_came_in(self, packets):
+        for address, data in packets:
+            if len(data) < 16:
+                continue
+            connection_id, action, transaction_id = unpack_from('!qii', data)
+            try:
+                if action == ACTION_CONNECT:
+                    if connection_id == PROTOCOL_ID:
+                        period = int(time() / CONNECTION_ID_PERIOD)
+                        self.send(pack('!iiq', ACTION_CONNECT, transaction_id, self.connection_id(address, period)), address)
+                    continue
+                if not self.valid_connection_id(connection_id, address):
+                    if DEBUG:
+                        print >>sys.stderr,"udptracker: Invalid connection id from",address
+                    self.send_error(transaction_id, 'invalid connection id', address)
+                    continue
+                ip = address[0]
+                if ( (self.tracker.allowed_IPs and not self.tracker.allowed_IPs.includes(ip))
+                     or (self.tracker.banned_IPs and self.tracker.banned_IPs.includes(ip)) ):
+                    self.send_error(transaction_id, 'your IP is not allowed on this tracker', address)
+                elif action == ACTION_ANNOUNCE:
+                    self.announce(data, transaction_id, address)
+                elif action == ACTION_SCRAPE:
+                    self.scrape(data, transaction_id, address)
+            except ValueError, e:
+                self.send_error(transaction_id, 'you sent me garbage - ' + str(e), address)
+            except:
+                print_exc()
+
+    def announce(self, data, transaction_id, address):
+        if len(data) < 98:
+            raise ValueError, 'announce too short'
+        ( infohash, peerid, downloaded, left, uploaded, event, ip, key,
+          numwant, port ) = unpack_from('!20s20sqqqiIIiH', data, 16)
+        if not EVENTS.has_key(event):
+            raise ValueError, 'invalid event'
+        event = EVENTS[event]
+
+        # the parameters of the equivalent HTTP announce
+        paramslist = { 'info_hash': [infohash],
+                       'peer_id': [peerid],
+                       'port': [str(port)],
+                       'left': [str(left)],
+                       'uploaded': [str(uploaded)],
+                       'downloaded': [str(downloaded)],
+                       'key': ['%08x' % key] }
+        if ip:
+            paramslist['ip'] = [socket.inet_ntoa(pack('!I', ip))]
+        if numwant >= 0:
+            paramslist['numwant'] = [str(numwant)]
+
+        tracker = self.tracker
+        notallowed = tracker.check_allowed(infohash, paramslist)
+        if notallowed:
+            self.send_error(transaction_id, bdecode(notallowed[3])['failure reason'], address)
+            return
+        rsize = tracker.add_data(infohash, event, address[0], paramslist)
+        if tracker.is_aggregator:      # don't return peer data here
+            rsize = 0
+        peers = tracker.peerlist(infohash, event == 'stopped', None, not left, 2, rsize)
+        compact = peers.get('peers')
+        if type(compact) != StringType:
+            compact = ''
+        self.send(pack('!iiiii', ACTION_ANNOUNCE, transaction_id, peers['interval'],
+                       peers['incomplete'], peers['complete']) + compact, address)
+
+    def scrape(self, data, transaction_id, address):
+        tracker = self.tracker
+        if tracker.config['tracker_scrape_allowed'] not in [ITRACKSCRAPE_ALLOW_SPECIFIC,ITRACKSCRAPE_ALLOW_FULL]:
+            self.send_error(transaction_id, 'specific scrape function is not available with this tracker.', address)
+            return
+        response = [pack('!ii', ACTION_SCRAPE, transaction_id)]
+        for i in xrange(16, min(len(data), 16+20*MAX_SCRAPE_INFOHASHES) - 19, 20):
+            infohash = data[i:i+20]
+            if ( tracker.downloads.has_key(infohash)
+                 and (tracker.allowed is None or tracker.allowed.has_key(infohash)) ):
+                f = tracker.scrapedata(infohash, False)
+                response.append(pack('!iii', f['complete'], f['downloaded'], f['incomplete']))
+            else:
+                response.append(pack('!iii', 0, 0, 0))
+        self.send(''.join(response), address)
+
+    def send_error(self, transaction_id, message, address):
+        self.send(pack('!ii', ACTION_ERROR, transaction_id) + message, address)
+
+    def send(self, data, address):
+        try:
+            self.socket.sendto(data, address)
+        except socket.error:
+            # the send buffer is full, the client will retry
+            if DEBUG:
+                print_exc()
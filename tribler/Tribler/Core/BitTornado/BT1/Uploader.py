@@ -107,7 +107,7 @@ class Upload:
                     self.piecebuf.release()
                 self.piecedl = index
                 # Merkle
-                [ self.piecebuf, self.hashlist ] = self.storage.get_piece(index, 0, -1)
+                [ self.piecebuf, self.hashlist ] = self.storage.get_piece(index, 0, -1, mapped = True)
             try:
                 piece = self.piecebuf[begin:begin+length]
                 assert len(piece) == length
@@ -122,7 +122,7 @@ class Upload:
             if self.piecebuf:
                 self.piecebuf.release()
                 self.piecedl = None
-            [piece, hashlist] = self.storage.get_piece(index, begin, length)
+            [piece, hashlist] = self.storage.get_piece(index, begin, length, mapped = True)
             if piece is None:
                 self.connection.close()
                 return None
@@ -4,14 +4,15 @@ import sys, os
 import signal
 import re
 import pickle
-from threading import Event, Thread
+from threading import Event, Thread, Lock
+from collections import deque
 from urllib import quote, unquote
 from urlparse import urlparse
 from os.path import exists
 from cStringIO import StringIO
 from traceback import print_exc
 from time import time, gmtime, strftime, localtime
-from random import shuffle, seed
+from random import shuffle, seed, randrange
 from types import StringType, IntType, LongType, DictType
 from binascii import b2a_hex
 
@@ -23,6 +24,7 @@ from Tribler.Core.BitTornado.parsedir import parsedir
 from NatCheck import NatCheck
 from T2T import T2TList
 from Filter import Filter
+from UDPTracker import UDPTracker
 from Tribler.Core.BitTornado.subnetparse import IP_List, ipv6_to_ipv4, to_ipv4, is_valid_ip, is_ipv4
 from Tribler.Core.BitTornado.iprangeparse import IP_List as IP_Range_List
 from Tribler.Core.BitTornado.torrentlistparse import parsetorrentlist
@@ -41,6 +43,13 @@ except:
 
 DEBUG=False
 
+# seconds between runs of expire_downloaders
+EXPIRE_INTERVAL = 1
+# peers expired per run, more runs follow right away when needed
+EXPIRE_BATCH = 500
+# peers copied per network thread task when taking a snapshot of the state
+SNAPSHOT_BATCH = 2000
+
 from Tribler.Core.defaults import trackerdefaults
 
 defaults = []
@@ -172,7 +181,8 @@ class Tracker:
             except:
                 print "**warning** specified favicon file -- %s -- does not exist." % favicon
         self.rawserver = rawserver
-        self.cached = {}    # format: infohash: [[time1, l1, s1], [time2, l2, s2], [time3, l3, s3]]
+        self.cached = {}    # format: infohash: [[time1, l1, s1], [time2, l2, s2], compactcache]
+                            # (see compactpeers for the latter)
         self.cached_t = {}  # format: infohash: [time, cache]
         self.times = {}
         self.state = {}
@@ -226,10 +236,20 @@ class Tracker:
                     ip = gip
                 self.natcheckOK(infohash,x,ip,y['port'],y['left'])
             
+        # (time, infohash, peerid) for every announce, oldest first. Entries
+        # of peers that announced again since are skipped.
+        self.expire_queue = deque()
+        # infohash:1 for torrents that may have no peers left
+        self.emptied = {}
+        # give restored peers a full timeout to announce again
+        now = clock()
         for x in self.downloads.keys():
             self.times[x] = {}
             for y in self.downloads[x].keys():
-                self.times[x][y] = 0
+                self.times[x][y] = now
+                self.expire_queue.append((now, x, y))
+            if not self.downloads[x]:
+                self.emptied[x] = 1
 
         self.trackerid = createPeerID('-T-')
         seed(self.trackerid)
@@ -237,10 +257,14 @@ class Tracker:
         self.reannounce_interval = config['tracker_reannounce_interval']
         self.save_dfile_interval = config['tracker_save_dfile_interval']
         self.show_names = config['tracker_show_names']
-        rawserver.add_task(self.save_state, self.save_dfile_interval)
-        self.prevtime = clock()
+        # [peers copied so far, infohashes to go] while taking a snapshot
+        self.snapshot = None
+        self.save_lock = Lock()
+        self.save_generation = 0
+        self.saved_generation = 0
+        rawserver.add_task(self.snapshot_state, self.save_dfile_interval)
         self.timeout_downloaders_interval = config['tracker_timeout_downloaders_interval']
-        rawserver.add_task(self.expire_downloaders, self.timeout_downloaders_interval)
+        rawserver.add_task(self.expire_downloaders, EXPIRE_INTERVAL)
         self.logfile = None
         self.log = None
         if (config['tracker_logfile']) and (config['tracker_logfile'] != '-'):
@@ -570,8 +594,11 @@ class Tracker:
 
 
     def add_data(self, infohash, event, ip, paramslist):
+        if not self.downloads.has_key(infohash):
+            # removed by expire_downloaders when no peer gets added
+            self.emptied[infohash] = 1
         peers = self.downloads.setdefault(infohash, {})
-        ts = self.times.setdefault(infohash, {})
+        self.times.setdefault(infohash, {})
         self.completed.setdefault(infohash, 0)
         self.seedcount.setdefault(infohash, 0)
 
@@ -617,7 +644,7 @@ class Tracker:
                     self.delete_peer(infohash,myid)
         
         elif not peer:
-            ts[myid] = clock()
+            self.touch(infohash, myid)
             peer = {'ip': ip, 'port': port, 'left': left}
             if mykey:
                 peer['key'] = mykey
@@ -642,7 +669,7 @@ class Tracker:
             if not auth:
                 return rsize    # return w/o changing stats
 
-            ts[myid] = clock()
+            self.touch(infohash, myid)
             if not left and peer['left']:
                 self.completed[infohash] += 1
                 self.seedcount[infohash] += 1
@@ -687,6 +714,83 @@ class Tracker:
         return rsize
 
 
+    def touch(self, infohash, peerid):
+        t = clock()
+        self.times[infohash][peerid] = t
+        self.expire_queue.append((t, infohash, peerid))
+
+
+    def harvest_t2t(self, infohash, return_type):
+        """ Returns the peers from other trackers (if enabled) that are not
+        known here, in the three return types. They are added to the cached
+        peer lists of the other return types. """
+        vv = [[],[],[]]
+        harvest = self.t2tlist.harvest(infohash)   # empty if disabled
+        if not harvest:
+            return vv
+        peers = self.downloads[infohash]
+        for key, ip, port in harvest:
+            if not peers.has_key(key):
+                vv[0].append({'ip': ip, 'port': port, 'peer id': key})
+                vv[1].append({'ip': ip, 'port': port})
+                vv[2].append(compact_peer_info(ip, port))
+        cached = self.cached.setdefault(infohash,[None,None,None])
+        for rr in xrange(2):
+            if rr != return_type:
+                try:
+                    cached[rr][1].extend(vv[rr])
+                except:
+                    pass
+        if return_type != 2 and cached[2]:
+            cached[2][1] += ''.join(vv[2])
+        return vv
+
+
+    def compactpeers(self, infohash, is_seed, rsize, l_get_size):
+        """ Returns rsize peers (or all of them) in compact format.
+
+        The compact strings of the leechers and of the seeds are joined
+        into one string each. Requests get consecutive runs of those,
+        wrapping around, so the strings are only rebuilt when all peers were
+        handed out or after tracker_min_time_between_cache_refreshes. """
+        cached = self.cached.setdefault(infohash,[None,None,None])
+        cache = cached[2]   # [time, leechers, offset, seeds, offset, number handed out]
+        if ( not cache 
+             or cache[5] >= (len(cache[1])+len(cache[3]))/6
+             or cache[0]+self.config['tracker_min_time_between_cache_refreshes'] < self.cachetime ):
+            bc = self.becache[infohash]
+            leechers = ''.join(bc[2][0].values()+self.harvest_t2t(infohash, 2)[2])
+            seeds = ''.join(bc[2][1].values())
+            # dicts are not ordered, a random start is enough
+            cache = [ self.cachetime, 
+                      leechers, randrange(max(len(leechers)/6,1))*6,
+                      seeds, randrange(max(len(seeds)/6,1))*6, 0 ]
+            cached[2] = cache
+
+        len_l = len(cache[1])/6
+        len_s = len(cache[3])/6
+        if is_seed:
+            s_get_size = 0
+        else:
+            s_get_size = min(len_s, rsize-min(len_l, l_get_size))
+        l_get_size = min(len_l, rsize-s_get_size)
+        leechers, cache[2] = self._take_run(cache[1], cache[2], l_get_size)
+        seeds, cache[4] = self._take_run(cache[3], cache[4], s_get_size)
+        cache[5] += l_get_size+s_get_size
+        return leechers+seeds
+
+
+    def _take_run(self, packed, offset, count):
+        n = count*6
+        if n >= len(packed):
+            return packed, offset
+        end = offset+n
+        if end <= len(packed):
+            return packed[offset:end], end % len(packed)
+        end -= len(packed)
+        return packed[offset:]+packed[:end], end
+
+
     def peerlist(self, infohash, stopped, tracker, is_seed, return_type, rsize):
         data = {}    # return data
         seeds = self.seedcount[infohash]
@@ -726,6 +830,9 @@ class Tracker:
             data['peers'] = []
             return data
         l_get_size = int(float(rsize)*(len_l)/(len_l+len_s))
+        if return_type == 2:
+            data['peers'] = self.compactpeers(infohash, is_seed, rsize, l_get_size)
+            return data
         cache = self.cached.setdefault(infohash,[None,None,None])[return_type]
         if cache and ( not cache[1]
                        or (is_seed and len(cache[1]) < rsize)
@@ -733,25 +840,13 @@ class Tracker:
                        or cache[0]+self.config['tracker_min_time_between_cache_refreshes'] < self.cachetime ):
             cache = None
         if not cache:
-            peers = self.downloads[infohash]
-            vv = [[],[],[]]
-            for key, ip, port in self.t2tlist.harvest(infohash):   # empty if disabled
-                if not peers.has_key(key):
-                    vv[0].append({'ip': ip, 'port': port, 'peer id': key})
-                    vv[1].append({'ip': ip, 'port': port})
-                    vv[2].append(compact_peer_info(ip, port))
+            vv = self.harvest_t2t(infohash, return_type)
             cache = [ self.cachetime,
                       bc[return_type][0].values()+vv[return_type],
                       bc[return_type][1].values() ]
             shuffle(cache[1])
             shuffle(cache[2])
             self.cached[infohash][return_type] = cache
-            for rr in xrange(len(self.cached[infohash])):
-                if rr != return_type:
-                    try:
-                        self.cached[infohash][rr][1].extend(vv[rr])
-                    except:
-                        pass
         if len(cache[1]) < l_get_size:
             peerdata = cache[1]
             if not is_seed:
@@ -768,8 +863,6 @@ class Tracker:
             if rsize:
                 peerdata.extend(cache[1][-rsize:])
                 del cache[1][-rsize:]
-        if return_type == 2:
-            peerdata = ''.join(peerdata)
         data['peers'] = peerdata
         return data
 
@@ -957,13 +1050,82 @@ class Tracker:
                 pass
 
     def save_state(self):
-        self.rawserver.add_task(self.save_state, self.save_dfile_interval)
-        h = open(self.dfile, 'wb')
-        if self.config['tracker_dfile_format'] == ITRACKDBFORMAT_BENCODE:
-            h.write(bencode(self.state))
-        else:
-            pickle.dump(self.state,h,-1)
-        h.close()
+        """ Writes the state to dfile right away, e.g. at shutdown """
+        self.save_generation += 1
+        self.write_state(self.state, self.save_generation)
+
+
+    def snapshot_state(self):
+        """ Periodically saves the state without blocking the network
+        thread: the peers are copied a few thousand at a time, the copy is
+        then encoded and written by a separate thread. """
+        self.rawserver.add_task(self.snapshot_state, self.save_dfile_interval)
+        if self.snapshot is None:
+            # [copied peers, infohashes to go, infohash, its peerids to go]
+            self.snapshot = [{}, self.downloads.keys(), None, []]
+            self.snapshot_step()
+
+
+    def snapshot_step(self):
+        peers, infohashes, infohash, peerids = self.snapshot
+        n = 0
+        while n < SNAPSHOT_BATCH:
+            n += 1
+            if peerids:
+                peerid = peerids.pop()
+                peer = self.downloads.get(infohash, {}).get(peerid)
+                if peer is not None:
+                    peers[infohash][peerid] = peer.copy()
+            elif infohashes:
+                infohash = infohashes.pop()
+                peerids = self.downloads.get(infohash, {}).keys()
+                peers[infohash] = {}
+            else:
+                break
+        if peerids or infohashes:
+            self.snapshot[2:] = [infohash, peerids]
+            self.rawserver.add_task(self.snapshot_step, 0)
+            return
+        self.snapshot = None
+
+        state = {}
+        for key, value in self.state.iteritems():
+            if key == 'peers':
+                state[key] = peers
+            elif type(value) == DictType:
+                state[key] = value.copy()
+            else:
+                state[key] = value
+        self.save_generation += 1
+        t = Thread(target = self.write_state, args = (state, self.save_generation), name = "TrackerSaveState")
+        t.setDaemon(True)
+        t.start()
+
+
+    def write_state(self, state, generation):
+        try:
+            # the pure Python encoders let the network thread run meanwhile
+            if self.config['tracker_dfile_format'] == ITRACKDBFORMAT_BENCODE:
+                data = bencode(state)
+            else:
+                data = pickle.dumps(state,-1)
+            self.save_lock.acquire()
+            try:
+                if generation < self.saved_generation:
+                    # a newer state was written meanwhile
+                    return
+                tmpfile = self.dfile+'.new'
+                h = open(tmpfile, 'wb')
+                h.write(data)
+                h.close()
+                if sys.platform == 'win32' and exists(self.dfile):
+                    os.remove(self.dfile)
+                os.rename(tmpfile, self.dfile)
+                self.saved_generation = generation
+            finally:
+                self.save_lock.release()
+        except:
+            print_exc()
 
 
     def parse_allowed(self,source=None):
@@ -1041,21 +1203,40 @@ class Tracker:
                 del x[y][peerid]
         del self.times[infohash][peerid]
         del dls[peerid]
+        if not dls:
+            self.emptied[infohash] = 1
 
     def expire_downloaders(self):
-        for x in self.times.keys():
-            for myid, t in self.times[x].items():
-                if t < self.prevtime:
-                    self.delete_peer(x,myid)
-        self.prevtime = clock()
-        if (self.keep_dead != 1):
-            for key, value in self.downloads.items():
-                if len(value) == 0 and (
-                        self.allowed is None or not self.allowed.has_key(key) ):
-                    del self.times[key]
-                    del self.downloads[key]
-                    del self.seedcount[key]
-        self.rawserver.add_task(self.expire_downloaders, self.timeout_downloaders_interval)
+        """ Removes the peers that did not announce for
+        timeout_downloaders_interval seconds, oldest first. At most
+        EXPIRE_BATCH peers are removed per call, the next call follows right
+        away when more of them expired. """
+        oldest = clock()-self.timeout_downloaders_interval
+        q = self.expire_queue
+        n = 0
+        while q and q[0][0] < oldest and n < EXPIRE_BATCH:
+            t, infohash, peerid = q.popleft()
+            n += 1
+            if self.times.get(infohash, {}).get(peerid) == t:
+                self.delete_peer(infohash, peerid)
+
+        if self.emptied:
+            if self.keep_dead != 1:
+                for key in self.emptied.keys():
+                    if ( not self.downloads.get(key, True) and 
+                         (self.allowed is None or not self.allowed.has_key(key)) ):
+                        self.times.pop(key, None)
+                        del self.downloads[key]
+                        self.seedcount.pop(key, None)
+                        self.becache.pop(key, None)
+                        self.cached.pop(key, None)
+                        self.cached_t.pop(key, None)
+            self.emptied = {}
+
+        if q and q[0][0] < oldest:
+            self.rawserver.add_task(self.expire_downloaders, 0)
+        else:
+            self.rawserver.add_task(self.expire_downloaders, EXPIRE_INTERVAL)
 
 
 def track(args):
@@ -1073,6 +1254,8 @@ def track(args):
     t = Tracker(config, r)
     r.bind(config['minport'], config['bind'],
            reuse = True, ipv6_socket_style = config['ipv6_binds_v4'])
+    if config['tracker_udp_port']:
+        UDPTracker(t, r, config['tracker_udp_port'])
     r.listen_forever(HTTPHandler(t.get, config['min_time_between_log_flushes']))
     t.save_state()
     print '# Shutting down: ' + isotime()
@@ -5,8 +5,11 @@
 from clock import clock
 from CurrentRateMeasure import Measure
 from math import sqrt
+from collections import deque
 import sys
 
+from Tribler.Core.simpledefs import RATECLASS_STREAM, RATECLASS_BULK
+
 try:
     True
 except:
@@ -34,16 +37,169 @@ UP_DELAY_NEXT = 2
 SLOTS_STARTING = 6
 SLOTS_FACTOR = 1.66/1000
 
+# Seconds worth of tokens a limited bucket can save up while idle
+UPLOAD_BURST = 1.0
+DOWNLOAD_BURST = 5.0
+# Seconds worth of tokens a limited bucket can owe
+MAX_DEBT = 3.0
+# Tokens available when no bucket on the way to the root is limited
+UNLIMITED = MAX_RATE * 1000
+# Never wait longer than this for tokens, rates may change meanwhile
+MAX_DELAY = 5.0
+
+RATECLASSES = [RATECLASS_STREAM, RATECLASS_BULK]
+
+
+class TokenBucket:
+    """ Bucket that fills with 'rate' tokens (bytes) per second, up to 'burst'
+    seconds worth; a rate of 0 means unlimited. Buckets form a tree
+    (session -> torrent -> peer): transferring through a bucket takes tokens
+    from it and from all its ancestors. """
+
+    def __init__(self, rate = 0, parent = None, burst = UPLOAD_BURST):
+        self.rate = rate
+        self.parent = parent
+        self.burst = burst
+        self.tokens = 0.0
+        self.lasttime = clock()
+
+    def set_rate(self, rate):
+        """ Sets the rate in bytes/s, 0 is unlimited """
+        self.rate = rate
+        self.tokens = 0.0
+        self.lasttime = clock()
+
+    def _refill(self, t):
+        self.tokens = min(self.tokens + (t - self.lasttime) * self.rate, self.rate * self.burst)
+        self.lasttime = t
+
+    def get_tokens(self, t, top = None):
+        """ Returns the number of bytes that may be transferred now: the
+        fewest tokens of this bucket and its ancestors below top. """
+        tokens = UNLIMITED
+        bucket = self
+        while bucket is not top:
+            if bucket.rate:
+                bucket._refill(t)
+                if bucket.tokens < tokens:
+                    tokens = bucket.tokens
+            bucket = bucket.parent
+        return tokens
+
+    def get_delay(self, t):
+        """ Returns the time until this bucket (ancestors not included) has
+        tokens again, 0.0 if it has tokens now """
+        if not self.rate:
+            return 0.0
+        self._refill(t)
+        if self.tokens >= 0:
+            return 0.0
+        # wait for a whole token, rounding could leave us just short
+        return (1.0 - self.tokens) / self.rate
+
+    def consume(self, bytes):
+        bucket = self
+        while bucket is not None:
+            if bucket.rate:
+                bucket.tokens = max(bucket.tokens - bytes, -bucket.rate * MAX_DEBT)
+            bucket = bucket.parent
+
+
+class RateShaper:
+    """ Root of the token bucket hierarchy for one direction, shared by all
+    torrents of a Session: holds the session bucket and measures the rate of
+    each rate class. For uploads it also decides which torrent sends next,
+    serving the RateLimiters that have connections ready round robin, those
+    of RATECLASS_STREAM before those of RATECLASS_BULK. Picking the next
+    connection to send to takes constant time. """
+
+    def __init__(self, sched, rate = 0, burst = UPLOAD_BURST):
+        self.sched = sched
+        self.bucket = TokenBucket(rate * 1000, None, burst)
+        self.measures = [Measure(MAX_RATE_PERIOD) for rateclass in RATECLASSES]
+        self.queues = [deque() for rateclass in RATECLASSES]
+        self.sending = False
+        self.scheduled = False
+
+    def set_rate(self, rate):
+        """ Sets the session rate in KB/s, 0 is unlimited """
+        if DEBUG:
+            print >>sys.stderr, "RateShaper: set_rate", rate
+        self.bucket.set_rate(rate * 1000)
+        if not self.scheduled:
+            self.try_send()
+
+    def get_rate(self):
+        return self.bucket.rate / 1000
+
+    def update_class_rate(self, rateclass, bytes):
+        self.measures[rateclass].update_rate(bytes)
+
+    def get_class_rates(self):
+        """ Returns the current rate of each rate class in bytes/s """
+        return [measure.get_rate() for measure in self.measures]
+
+    def activate(self, limiter):
+        """ Called by a RateLimiter that has connections ready to send """
+        self.queues[limiter.rateclass].append(limiter)
+        if not (self.sending or self.scheduled):
+            self.try_send()
+
+    def _wakeup(self):
+        self.scheduled = False
+        self.try_send()
+
+    def try_send(self):
+        if DEBUG: print >>sys.stderr, "RateShaper: try_send"
+        self.sending = True
+        try:
+            t = clock()
+            while True:
+                for queue in self.queues:
+                    if queue:
+                        break
+                else:
+                    return
+                delay = self.bucket.get_delay(t)
+                if delay:
+                    # 01/04/10 Boudewijn: because we use a -very- small value
+                    # to indicate a 0bps rate, don't wait until the tokens
+                    # are in, the rate may be raised meanwhile.
+                    self.scheduled = True
+                    self.sched(self._wakeup, min(MAX_DELAY, delay))
+                    return
+                limiter = queue.popleft()
+                if limiter.send(t):
+                    self.queues[limiter.rateclass].append(limiter)
+        finally:
+            self.sending = False
+
+
 class RateLimiter:
-    def __init__(self, sched, unitsize, slotsfunc = lambda x: None):
+    """ Upload shaping of a torrent: the torrent bucket, below the session
+    bucket of its RateShaper, and a bucket per peer below it. Connections
+    that have data to send are queued with queue(), and given bandwidth when
+    the RateShaper picks this torrent. """
+
+    def __init__(self, sched, unitsize, slotsfunc = lambda x: None, shaper = None):
         self.sched = sched
-        self.last = None
         self.unitsize = unitsize
         self.slotsfunc = slotsfunc
         self.measure = Measure(MAX_RATE_PERIOD)
         self.autoadjust = False
         self.upload_rate = MAX_RATE * 1000
         self.slots = SLOTS_STARTING    # garbage if not automatic
+        if shaper is None:
+            # standalone, no session limit
+            shaper = RateShaper(sched)
+        self.shaper = shaper
+        self.bucket = TokenBucket(0, shaper.bucket)
+        self.rateclass = RATECLASS_BULK
+        self.peer_rate = 0
+        # connections ready to send
+        self.ready = deque()
+        # whether queued at the RateShaper or waiting for torrent tokens
+        self.active = False
 
     def set_upload_rate(self, rate):
         if DEBUG: 
@@ -64,73 +220,90 @@ class RateLimiter:
         if not rate:
             rate = MAX_RATE
         self.upload_rate = rate * 1000
-        self.lasttime = clock()
-        self.bytes_sent = 0
+        self._update_bucket()
+
+    def _update_bucket(self):
+        if self.upload_rate >= MAX_RATE * 1000:
+            self.bucket.set_rate(0)
+        else:
+            self.bucket.set_rate(self.upload_rate)
+
+    def set_peer_upload_rate(self, rate):
+        """ Sets the upload limit per peer in KB/s, 0 is unlimited """
+        self.peer_rate = rate * 1000
+
+    def set_rateclass(self, rateclass):
+        self.rateclass = rateclass
+
+    def get_rateclass(self):
+        return self.rateclass
 
     def queue(self, conn):
         if DEBUG: print >>sys.stderr, "RateLimiter: queue", conn
         assert conn.next_upload is None
-        if self.last is None:
-            self.last = conn
-            conn.next_upload = conn
-            self.try_send(True)
-        else:
-            conn.next_upload = self.last.next_upload
-            self.last.next_upload = conn
-            self.last = conn
-
-    def try_send(self, check_time = False):
-        if DEBUG: print >>sys.stderr, "RateLimiter: try_send"
-        t = clock()
-        self.bytes_sent -= (t - self.lasttime) * self.upload_rate
-        #print >> sys.stderr, 'try_send: bytes_sent: %s' % self.bytes_sent
-        self.lasttime = t
-        if check_time and (self.upload_rate < MAX_RATE * 1000):
-            #do not set self.bytes_sent to 0 if we are unlimited...
-            self.bytes_sent = max(self.bytes_sent, 0)
-            
-        cur = self.last.next_upload
-        while self.bytes_sent <= 0:
-            #we would like to send up to self.bytes_sent data to someone
+        # next_upload is set while conn is queued or waits for peer tokens
+        conn.next_upload = self
+        if conn.upload_bucket is None:
+            conn.upload_bucket = TokenBucket(self.peer_rate, self.bucket)
+        self.ready.append(conn)
+        if not self.active:
+            self.active = True
+            self.shaper.activate(self)
+
+    def send(self, t):
+        """ Called by the RateShaper to send one unit to the next connection.
+        Returns whether there are more connections ready. """
+        delay = self.bucket.get_delay(t)
+        if delay:
+            self.sched(self._torrent_tokens_available, min(MAX_DELAY, delay))
+            return False
+
+        while self.ready:
+            conn = self.ready.popleft()
+            bucket = conn.upload_bucket
+            if bucket.rate != self.peer_rate:
+                bucket.set_rate(self.peer_rate)
+            delay = bucket.get_delay(t)
+            if delay:
+                self.sched(lambda conn = conn: self._peer_tokens_available(conn), min(MAX_DELAY, delay))
+                continue
+
+            #we would like to send up to the number of tokens available
             #why not try to send this at once?
-            #bytes = cur.send_partial(self.unitsize)
-            
-            remaining_bytes = max(self.unitsize, int(1 - self.bytes_sent))
-            bytes = cur.send_partial(remaining_bytes)
-            
-            self.bytes_sent += bytes
+            bytes = conn.send_partial(max(self.unitsize, int(bucket.get_tokens(t))))
+            bucket.consume(bytes)
             self.measure.update_rate(bytes)
-            if bytes == 0 or cur.backlogged():
-                if self.last is cur:
-                    self.last = None
-                    cur.next_upload = None
-                    break
-                else:
-                    self.last.next_upload = cur.next_upload
-                    cur.next_upload = None
-                    cur = self.last.next_upload
+            self.shaper.update_class_rate(self.rateclass, bytes)
+            if bytes == 0 or conn.backlogged():
+                conn.next_upload = None
+            elif conn.upload.buffer:
+                # this connection still has a buffer, stay with it
+                self.ready.appendleft(conn)
             else:
-                #does this connection still have a buffer?
-                if not cur.upload.buffer:
-                    self.last = cur
-                    cur = cur.next_upload #switch to the next one
-                else:
-                    pass
+                self.ready.append(conn)
+            break
+
+        if not self.ready:
+            self.active = False
+        return self.active
+
+    def _torrent_tokens_available(self):
+        if self.ready:
+            self.shaper.activate(self)
         else:
-            # 01/04/10 Boudewijn: because we use a -very- small value
-            # to indicate a 0bps rate, we will schedule the call to be
-            # made in a very long time.  This results in no upload for
-            # a very long time.
-            #
-            # the try_send method has protection again calling to
-            # soon, so we can simply schedule the call to be made
-            # sooner.
-            delay = min(5.0, self.bytes_sent / self.upload_rate)
-            self.sched(self.try_send, delay)
+            self.active = False
+
+    def _peer_tokens_available(self, conn):
+        if conn.next_upload is not self:
+            return
+        self.ready.append(conn)
+        if not self.active:
+            self.active = True
+            self.shaper.activate(self)
 
     def adjust_sent(self, bytes):
         # if DEBUG: print >>sys.stderr, "RateLimiter: adjust_sent", bytes
-        self.bytes_sent = min(self.bytes_sent+bytes, self.upload_rate*3)
+        self.bucket.consume(bytes)
         self.measure.update_rate(bytes)
 
 
@@ -158,8 +331,7 @@ class RateLimiter:
             self.slotsfunc(self.slots)
             if DEBUG:
                 print >>sys.stderr, 'RateLimiter: adjust down to '+str(self.upload_rate)
-            self.lasttime = clock()
-            self.bytes_sent = 0
+            self._update_bucket()
             self.autoadjustup = UP_DELAY_FIRST
         else:   # not flooded
             if self.upload_rate == MAX_RATE:
@@ -172,6 +344,5 @@ class RateLimiter:
             self.slotsfunc(self.slots)
             if DEBUG:
                 print >>sys.stderr, 'RateLimiter: adjust up to '+str(self.upload_rate)
-            self.lasttime = clock()
-            self.bytes_sent = 0
+            self._update_bucket()
             self.autoadjustup = UP_DELAY_NEXT
@@ -1,7 +1,8 @@
 # Written by Bram Cohen and Pawel Garbacki
 # see LICENSE.txt for license information
 
-from bisect import insort
+from heapq import heappush, heappop
+from itertools import count
 from SocketHandler import SocketHandler
 import socket
 from cStringIO import StringIO
@@ -49,7 +50,7 @@ READSIZE = 100000
 class RawServer:
     def __init__(self, doneflag, timeout_check_interval, timeout, noisy = True,
                  ipv6_enable = True, failfunc = lambda x: None, errorfunc = None,
-                 sockethandler = None, excflag = Event()):
+                 sockethandler = None, excflag = Event(), poll_backend = None):
         self.timeout_check_interval = timeout_check_interval
         self.timeout = timeout
         self.servers = {}
@@ -60,7 +61,11 @@ class RawServer:
         self.failfunc = failfunc
         self.errorfunc = errorfunc
         self.exccount = 0
+        # heap of [when, seq, func, id] entries, func is None when cancelled
         self.funcs = []
+        # {id: {seq: entry}} to cancel tasks without scanning the heap
+        self.funcs_by_id = {}
+        self.task_counter = count()
         self.externally_added = []
         self.finished = Event()
         self.tasks_to_kill = []
@@ -68,7 +73,7 @@ class RawServer:
         self.lock = RLock()        
 
         if sockethandler is None:
-            sockethandler = SocketHandler(timeout, ipv6_enable, READSIZE)
+            sockethandler = SocketHandler(timeout, ipv6_enable, READSIZE, poll_backend)
         self.sockethandler = sockethandler
 
         self.thread_ident = None
@@ -82,7 +87,32 @@ class RawServer:
     def _add_task(self, func, delay, id = None):
         if delay < 0:
             delay = 0
-        insort(self.funcs, (clock() + delay, func, id))
+        # seq keeps tasks with the same deadline in FIFO order
+        entry = [clock() + delay, self.task_counter.next(), func, id]
+        heappush(self.funcs, entry)
+        if id is not None:
+            self.funcs_by_id.setdefault(id, {})[entry[1]] = entry
+
+    def _pop_task(self):
+        """
+        Removes the first task from the heap and returns its (func, id),
+        func is None when the task was cancelled
+        """
+        garbage1, seq, func, id = heappop(self.funcs)
+        if func is not None and id is not None:
+            entries = self.funcs_by_id[id]
+            del entries[seq]
+            if not entries:
+                del self.funcs_by_id[id]
+        return func, id
+
+    def _next_task_time(self):
+        # drop cancelled tasks so they do not shorten the poll timeout
+        while self.funcs and self.funcs[0][2] is None:
+            heappop(self.funcs)
+        if self.funcs:
+            return self.funcs[0][0]
+        return None
 
     def add_task(self, func, delay = 0, id = None):
         #if DEBUG:
@@ -124,10 +154,11 @@ class RawServer:
 
     def pop_external(self):
         self.lock.acquire()
-        while self.externally_added:
-            (a, b, c) = self.externally_added.pop(0)
-            self._add_task(a, b, c)
+        externally_added = self.externally_added
+        self.externally_added = []
         self.lock.release()
+        for (a, b, c) in externally_added:
+            self._add_task(a, b, c)
 
     def listen_forever(self, handler):
         if DEBUG:
@@ -140,8 +171,9 @@ class RawServer:
                 try:
                     self.pop_external()
                     self._kill_tasks()
-                    if self.funcs:
-                        period = self.funcs[0][0] + 0.001 - clock()
+                    next_time = self._next_task_time()
+                    if next_time is not None:
+                        period = next_time + 0.001 - clock()
                     else:
                         period = 2 ** 30
                     if period < 0:
@@ -160,9 +192,10 @@ class RawServer:
                     
                     
                     while self.funcs and self.funcs[0][0] <= clock() and not self.doneflag.isSet():
-                        garbage1, func, id = self.funcs.pop(0)
-                        if id in self.tasks_to_kill:
-                            pass
+                        func, id = self._pop_task()
+                        if func is None:
+                            # cancelled through kill_tasks
+                            continue
                         try:
 #                            print func.func_name
                             if DEBUG:
@@ -242,12 +275,13 @@ class RawServer:
 
     def _kill_tasks(self):
         if self.tasks_to_kill:
-            new_funcs = []
-            for (t, func, id) in self.funcs:
-                if id not in self.tasks_to_kill:
-                    new_funcs.append((t, func, id))
-            self.funcs = new_funcs
+            tasks_to_kill = self.tasks_to_kill
             self.tasks_to_kill = []
+            for id in tasks_to_kill:
+                # mark the entries, they are dropped when they reach the
+                # top of the heap
+                for entry in self.funcs_by_id.pop(id, {}).itervalues():
+                    entry[2] = None
 
     def kill_tasks(self, id):
         self.tasks_to_kill.append(id)
@@ -284,3 +318,6 @@ class RawServer:
             print >>sys.stderr,"rawudp: stop_listen:",serversocket
         self.sockethandler.stop_listening_udp(serversocket)
 
+    def get_udp_stats(self,serversocket):
+        return self.sockethandler.get_udp_stats(serversocket)
+
@@ -9,11 +9,16 @@ try:
 except ImportError:
     from selectpoll import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
     timemult = 1
+try:
+    from epollpoll import poll as epoll
+except ImportError:
+    epoll = None
 from time import sleep
 from clock import clock
 import sys
 from random import shuffle, randrange
 from traceback import print_exc
+from udpbatch import BatchReader
 
 try:
     True
@@ -30,6 +35,19 @@ if sys.platform == 'win32':
 else:
     SOCKET_BLOCK_ERRORCODE=errno.EWOULDBLOCK
 
+def create_poll(backend = None):
+    """
+    Returns a (poll, timemult) tuple for the requested backend. backend
+    is 'epoll', 'poll' or None, the latter selects epoll when the platform
+    has it and falls back to poll (or selectpoll on win32) otherwise.
+    """
+    if backend not in (None, 'epoll', 'poll'):
+        raise ValueError('unknown poll backend ' + repr(backend))
+    if backend != 'poll' and epoll is not None:
+        # epollpoll.poll takes milliseconds, like select.poll
+        return epoll(), 1000
+    return poll(), timemult
+
 class InterruptSocketHandler:
     @staticmethod
     def data_came_in(interrupt_socket, data):
@@ -76,6 +94,10 @@ class UdpSocket:
     def __init__(self, socket, handler):
         self.socket = socket
         self.handler = handler
+        self.reader = BatchReader(socket)
+        # number of datagrams received and the system calls it took
+        self.packets = 0
+        self.syscalls = 0
 
 class SingleSocket:
     """ 
@@ -197,7 +219,7 @@ class SingleSocket:
                         break
                     self.skipped = 0
                     if amount != len(buf):
-                        self.buffer[0] = buf[amount:]
+                        self.buffer[0] = buffer(buf, amount)
                         break
                     del self.buffer[0]
             except socket.error, e:
@@ -226,11 +248,11 @@ class SingleSocket:
 
 
 class SocketHandler:
-    def __init__(self, timeout, ipv6_enable, readsize = 100000):
+    def __init__(self, timeout, ipv6_enable, readsize = 100000, poll_backend = None):
         self.timeout = timeout
         self.ipv6_enable = ipv6_enable
         self.readsize = readsize
-        self.poll = poll()
+        self.poll, self.timemult = create_poll(poll_backend)
         # {socket: SingleSocket}
         self.single_sockets = {}
         self.dead_from_write = []
@@ -294,6 +316,12 @@ class SocketHandler:
                 self.poll.register(server, POLLIN)
             except socket.error, e:
                 for server in self.servers.values():
+                    # epoll skips registering a fd again with the same
+                    # mask, so the poll must not keep the closed servers
+                    try:
+                        self.poll.unregister(server)
+                    except KeyError:
+                        pass
                     try:
                         server.close()
                     except:
@@ -501,21 +529,10 @@ class SocketHandler:
             if s:
                 packets = []
                 try:
-                    try:
-                        while True:
-                            (data, addr) = s.socket.recvfrom(65535)
-                            if not data:
-                                if DEBUG:
-                                    print >> sys.stderr, "SocketHandler: UDP no-data", addr
-                                break
-                            else:
-                                if DEBUG:
-                                    print >> sys.stderr,"SocketHandler: Got UDP data",addr,"len",len(data)
-                                packets.append((addr, data))
-
-                    except socket.error, e:
-                        if DEBUG:
-                            print >> sys.stderr,"SocketHandler: UDP Socket error",str(e)
+                    s.syscalls += s.reader.read(packets)
+                    s.packets += len(packets)
+                    if DEBUG:
+                        print >> sys.stderr,"SocketHandler: Got",len(packets),"UDP packets"
 
                 finally:
                     s.handler.data_came_in(packets)
@@ -577,7 +594,7 @@ class SocketHandler:
         s.handler.connection_lost(s)
 
     def do_poll(self, t):
-        r = self.poll.poll(t*timemult)
+        r = self.poll.poll(t*self.timemult)
         if r is None:
             connects = len(self.single_sockets)
             to_close = int(connects*0.05)+1 # close 5% of sockets
@@ -628,6 +645,11 @@ class SocketHandler:
         self.poll.unregister(serversocket)
         del self.udp_sockets[serversocket.fileno()]
 
+    def get_udp_stats(self,serversocket):
+        """ Returns (packets, syscalls) received on a listening UDP socket """
+        s = self.udp_sockets[serversocket.fileno()]
+        return s.packets, s.syscalls
+
     #
     # Interface for the InterruptSocket
     #
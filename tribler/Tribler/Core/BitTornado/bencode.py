@@ -1,7 +1,7 @@
 # Written by Petru Paler, Uoti Urpala, Ross Cohen and John Hoffman
 # see LICENSE.txt for license information
 
-from types import IntType, LongType, StringType, ListType, TupleType, DictType
+from types import IntType, LongType, StringType, ListType, TupleType, DictType, BufferType
 try:
     from types import BooleanType
 except ImportError:
@@ -45,26 +45,65 @@ def decode_unicode(x, f):
     s, f = decode_string(x, f+1)
     return (s.decode('UTF-8'), f)
 
+# Strings are by far the most common items, so lists and dicts decode them
+# inline instead of via decode_func
+DIGITS = dict.fromkeys('0123456789')
+
 def decode_list(x, f):
     r, f = [], f+1
-    while x[f] != 'e':
-        v, f = decode_func[x[f]](x, f)
-        r.append(v)
-    return (r, f + 1)
+    append = r.append
+    while 1:
+        c = x[f]
+        if c in DIGITS:
+            colon = x.index(':', f)
+            try:
+                n = int(x[f:colon])
+            except (OverflowError, ValueError):
+                n = long(x[f:colon])
+            if c == '0' and colon != f+1:
+                raise ValueError
+            colon += 1
+            f = colon+n
+            append(x[colon:f])
+        elif c == 'e':
+            return (r, f + 1)
+        else:
+            v, f = decode_func[c](x, f)
+            append(v)
 
 def decode_dict(x, f):
     r, f = {}, f+1
-    lastkey = None
-    while x[f] != 'e':
-        k, f = decode_string(x, f)
+    while 1:
+        c = x[f]
+        if c == 'e':
+            return (r, f + 1)
         # Arno, 2008-09-12: uTorrent 1.8 violates the bencoding spec, its keys
         # in an EXTEND handshake message are not sorted. Be liberal in what we 
-        # receive:
-        ##if lastkey >= k:
-        ##    raise ValueError
-        lastkey = k
-        r[k], f = decode_func[x[f]](x, f)
-    return (r, f + 1)
+        # receive, so no check on the order of the keys.
+        colon = x.index(':', f)
+        try:
+            n = int(x[f:colon])
+        except (OverflowError, ValueError):
+            n = long(x[f:colon])
+        if c == '0' and colon != f+1:
+            raise ValueError
+        colon += 1
+        f = colon+n
+        k = x[colon:f]
+        c = x[f]
+        if c in DIGITS:
+            colon = x.index(':', f)
+            try:
+                n = int(x[f:colon])
+            except (OverflowError, ValueError):
+                n = long(x[f:colon])
+            if c == '0' and colon != f+1:
+                raise ValueError
+            colon += 1
+            f = colon+n
+            r[k] = x[colon:f]
+        else:
+            r[k], f = decode_func[c](x, f)
 
 decode_func = {}
 decode_func['l'] = decode_list
@@ -82,7 +121,17 @@ decode_func['8'] = decode_string
 decode_func['9'] = decode_string
 #decode_func['u'] = decode_unicode
   
-def bdecode(x, sloppy = 0):
+def bdecode(x, sloppy = 0, minbuffer = None):
+    """ Decodes x. With minbuffer, strings of at least minbuffer bytes (such
+    as 'pieces') are returned as read-only buffer objects on x instead of 
+    copies. """
+    if minbuffer is not None:
+        decoder = BDecoder(minbuffer)
+        decoder.feed(x)
+        r = decoder.get()
+        if r is None or (not sloppy and decoder.get_buffered()):
+            raise ValueError, "bad bencoded data"
+        return r
     try:
         r, l = decode_func[x[0]](x, 0)
 #    except (IndexError, KeyError):
@@ -94,6 +143,160 @@ def bdecode(x, sloppy = 0):
         raise ValueError, "bad bencoded data"
     return r
 
+# a longer length or integer than this is bad data rather than incomplete
+MAX_NUMBER_LENGTH = 32
+
+class BDecoder:
+    """ Decodes a stream of bencoded values that arrives in pieces, e.g. from
+    a socket. The lists and dicts decoded so far are kept between calls, so
+    every byte is parsed once, however the data is split.
+    
+    Strings of at least minbuffer bytes are returned as read-only buffer
+    objects on the received data instead of copies. """
+
+    def __init__(self, minbuffer = None):
+        self.minbuffer = minbuffer
+        self.data = ''
+        self.pos = 0
+        self.chunks = []
+        self.numchunked = 0
+        # no use decoding again before we have this many bytes after pos
+        self.needed = 1
+        # lists and dicts being decoded, and the keys they are values of
+        self.stack = []
+        self.keys = []
+        # key of the dict on top of the stack that awaits its value
+        self.key = None
+
+    def feed(self, data):
+        """ Add received data, a string or an object supporting the buffer
+        interface """
+        if type(data) != StringType:
+            if hasattr(data, 'tobytes'):
+                data = data.tobytes()
+            else:
+                data = str(data)
+        self.chunks.append(data)
+        self.numchunked += len(data)
+
+    def get_buffered(self):
+        """ Returns the number of bytes received but not decoded yet """
+        return len(self.data) - self.pos + self.numchunked
+
+    def get(self):
+        """ Returns the next complete value, or None when more data is needed.
+        Raises ValueError on bad data, after which the decoder is useless. """
+        if len(self.data) - self.pos + self.numchunked < self.needed:
+            return None
+        if self.chunks:
+            if self.pos < len(self.data):
+                self.chunks.insert(0, self.data[self.pos:])
+            self.data = ''.join(self.chunks)
+            self.pos = 0
+            self.chunks = []
+            self.numchunked = 0
+        try:
+            return self._decode()
+        except (IndexError, KeyError, ValueError):
+            if DEBUG:
+                print_exc()
+            raise ValueError, "bad bencoded data"
+
+    def _decode(self):
+        x = self.data
+        f = self.pos
+        stack = self.stack
+        keys = self.keys
+        key = self.key
+        minbuffer = self.minbuffer
+        if stack:
+            top = stack[-1]
+            indict = type(top) == DictType
+        else:
+            top = None
+            indict = False
+        while 1:
+            if f >= len(x):
+                needed = f + 1
+                break
+            c = x[f]
+            if c in DIGITS:
+                colon = x.find(':', f)
+                if colon == -1:
+                    if len(x) - f > MAX_NUMBER_LENGTH:
+                        raise ValueError
+                    needed = len(x) + 1
+                    break
+                try:
+                    n = int(x[f:colon])
+                except (OverflowError, ValueError):
+                    n = long(x[f:colon])
+                if c == '0' and colon != f+1:
+                    raise ValueError
+                colon += 1
+                if colon + n > len(x):
+                    needed = colon + n
+                    break
+                f = colon + n
+                if minbuffer is not None and n >= minbuffer and not (indict and key is None):
+                    v = buffer(x, colon, n)
+                else:
+                    v = x[colon:f]
+            elif c == 'e':
+                if top is None or key is not None:
+                    raise ValueError
+                v = stack.pop()
+                key = keys.pop()
+                if stack:
+                    top = stack[-1]
+                    indict = type(top) == DictType
+                else:
+                    top = None
+                    indict = False
+                f += 1
+            elif indict and key is None:
+                # keys must be strings
+                raise ValueError
+            elif c == 'i':
+                if x.find('e', f) == -1:
+                    if len(x) - f > MAX_NUMBER_LENGTH:
+                        raise ValueError
+                    needed = len(x) + 1
+                    break
+                v, f = decode_int(x, f)
+            elif c == 'l' or c == 'd':
+                if c == 'l':
+                    top = []
+                else:
+                    top = {}
+                indict = c == 'd'
+                stack.append(top)
+                keys.append(key)
+                key = None
+                f += 1
+                continue
+            else:
+                raise ValueError
+
+            if top is None:
+                self.pos = f
+                self.key = None
+                self.needed = 1
+                return v
+            if not indict:
+                top.append(v)
+            elif key is None:
+                key = v
+            else:
+                top[key] = v
+                key = None
+
+        # Incomplete, continue from the start of the current item
+        self.pos = f
+        self.key = key
+        self.needed = needed - f
+        return None
+
 def test_bdecode():
     try:
         bdecode('0:0:')
@@ -236,6 +439,29 @@ def test_bdecode():
     except ValueError:
         pass
 
+def test_bdecoder():
+    d = BDecoder(minbuffer = 4)
+    assert d.get() is None
+    for c in 'd3:agei25e4:eyes4:bluee':
+        assert d.get() is None
+        d.feed(c)
+    r = d.get()
+    assert r['age'] == 25 and str(r['eyes']) == 'blue'
+    assert d.get() is None
+    d.feed('li1e3:abc')
+    assert d.get() is None
+    d.feed('ei2e')
+    assert d.get() == [1, 'abc']
+    assert d.get() == 2
+    assert d.get_buffered() == 0
+    d.feed('i-0e')
+    try:
+        d.get()
+        assert 0
+    except ValueError:
+        pass
+    assert bencode(bdecode('d6:pieces8:abcdefghe', minbuffer = 4)) == 'd6:pieces8:abcdefghe'
+
 bencached_marker = []
 
 class Bencached:
@@ -258,6 +484,9 @@ def encode_bool(x, r):
 def encode_string(x, r):    
     r.extend((str(len(x)), ':', x))
 
+def encode_buffer(x, r):
+    r.extend((str(len(x)), ':', str(x)))
+
 def encode_unicode(x, r):
     #r.append('u')
     encode_string(x.encode('UTF-8'), r)
@@ -291,6 +520,7 @@ encode_func[BencachedType] = encode_bencached
 encode_func[IntType] = encode_int
 encode_func[LongType] = encode_int
 encode_func[StringType] = encode_string
+encode_func[BufferType] = encode_buffer
 encode_func[ListType] = encode_list
 encode_func[TupleType] = encode_list
 encode_func[DictType] = encode_dict
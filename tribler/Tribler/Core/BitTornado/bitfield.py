@@ -2,6 +2,7 @@
 # see LICENSE.txt for license information
 
 import sys
+from string import maketrans
 
 try:
     True
@@ -30,6 +31,9 @@ for i in xrange(256):
     lookup_table.append(x)
     reverse_lookup_table[x] = chr(i)
 
+# maps false and true items, as bytes, to binary digits
+binary_digits_table = maketrans('\x00\x01', '01')
+
 
 class Bitfield:
     def __init__(self, length = None, bitstring = None, copyfrom = None, fromarray = None, calcactiveranges=False):
@@ -41,6 +45,8 @@ class Bitfield:
         """
         
         self.activeranges = []
+        # long with bit i set when item i is true, see tolong()
+        self.bits = None
         
         if copyfrom is not None:
             self.length = copyfrom.length
@@ -107,6 +113,8 @@ class Bitfield:
 
     def __setitem__(self, index, val):
         val = bool(val)
+        if self.bits is not None and val != self.array[index]:
+            self.bits ^= 1L << index
         self.numfalse += self.array[index]-val
         self.array[index] = val
 
@@ -125,6 +133,20 @@ class Bitfield:
             r += t[tuple(booleans[-s:] + ([0] * (8-s)))]
         return ''.join(r)
 
+    def tolong(self):
+        """
+        Returns the bitfield as a long in which bit i is set when item i is
+        true, to intersect bitfields quickly. Once asked for, the long is
+        kept up to date by __setitem__.
+        """
+        if self.bits is None:
+            s = str(bytearray(self.array[:self.length]))[::-1].translate(binary_digits_table)
+            if s:
+                self.bits = long(s, 2)
+            else:
+                self.bits = 0L
+        return self.bits
+
     def complete(self):
         return not self.numfalse
 
@@ -224,3 +246,7 @@ def test_bitfield():
     assert len(x) == 8
     assert x.numfalse == 5
     assert x.tostring() == chr(0xC4)
+    assert x.tolong() == 0x23
+    x[1] = 0
+    x[7] = 1
+    assert x.tolong() == 0xA1
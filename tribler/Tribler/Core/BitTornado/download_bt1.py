@@ -94,6 +94,7 @@ class BT1Download:
         self.downloader = None
         self.storagewrapper = None
         self.fileselector = None
+        self.feedback = None
         self.super_seeding_active = False
         self.filedatflag = Event()
         self.spewflag = Event()
@@ -252,7 +253,14 @@ class BT1Download:
         return self.files[index][0]
 
     def get_datalength(self):
-        return self.datalength 
+        return self.datalength
+
+    def get_hashcheck_estimate(self):
+        """ Bytes of existing data the hashcheck will read, call after
+        initFiles() """
+        if self.storagewrapper is None:
+            return 0L
+        return self.storagewrapper.get_hashcheck_estimate()
 
     def _finished(self):
         self.finflag.set()
@@ -327,12 +335,16 @@ class BT1Download:
             root_hash = self.info['root hash']
         else:
             root_hash = None
+        if self.config.get('hashcheck_checkpoint_dir'):
+            checkpoint = os.path.join(self.config['hashcheck_checkpoint_dir'], self.infohash.encode("HEX") + ".hashcheck")
+        else:
+            checkpoint = None
         self.storagewrapper = StorageWrapper(self.videoinfo, self.storage, self.config['download_slice_size'],
             self.pieces, self.info['piece length'], root_hash, 
             self._finished, self._failed,
             statusfunc, self.doneflag, self.config['check_hashes'],
             self._data_flunked, self._piece_from_live_source, self.rawserver.add_task,
-            self.config, self.unpauseflag)
+            self.config, self.unpauseflag, checkpoint)
             
         if self.selector_enabled:
             self.fileselector = FileSelector(self.files, self.info['piece length'],
@@ -398,7 +410,10 @@ class BT1Download:
     def _reqmorefunc(self, pieces):
         self.downloader.requeue_piece_download(pieces)
 
-    def startEngine(self, ratelimiter = None, vodeventfunc = None):
+    def startEngine(self, ratelimiter = None, vodeventfunc = None, 
+                    upload_shaper = None, download_shaper = None):
+        """ upload_shaper and download_shaper are the RateShapers that
+        implement the Session-wide limits """
         
         if DEBUG:
             print >>sys.stderr,"BT1Download: startEngine",`self.info['name']`
@@ -427,8 +442,9 @@ class BT1Download:
         else:
             self.ratelimiter = RateLimiter(self.rawserver.add_task, 
                                            self.config['upload_unit_size'], 
-                                           self.setConns)
+                                           self.setConns, upload_shaper)
             self.ratelimiter.set_upload_rate(self.config['max_upload_rate'])
+            self.ratelimiter.set_peer_upload_rate(self.config['max_upload_rate_per_peer'])
         
         self.ratemeasure = RateMeasure()
         self.ratemeasure_datarejected = self.ratemeasure.data_rejected
@@ -437,8 +453,10 @@ class BT1Download:
             self.config['request_backlog'], self.config['max_rate_period'], 
             self.len_pieces, self.config['download_slice_size'], 
             self._received_data, self.config['snub_time'], self.config['auto_kick'], 
-            self._kick_peer, self._ban_peer, bt1dl = self, scheduler = self.rawserver.add_task)
+            self._kick_peer, self._ban_peer, bt1dl = self, scheduler = self.rawserver.add_task,
+            shaper = download_shaper)
         self.downloader.set_download_rate(self.config['max_download_rate'])
+        self.downloader.set_peer_download_rate(self.config['max_download_rate_per_peer'])
 
         self.picker.set_downloader(self.downloader)
         
@@ -541,6 +559,11 @@ class BT1Download:
             self.videosourcetransporter.start()
         elif DEBUG:
             print >>sys.stderr,"BT1Download: startEngine: Not a VideoSource"
+
+        # VOD and live go before bulk transfers
+        if self.voddownload is not None or self.info.has_key('live'):
+            self.ratelimiter.set_rateclass(RATECLASS_STREAM)
+            self.downloader.set_rateclass(RATECLASS_STREAM)
             
         if not self.doneflag.isSet():
             self.started = True
@@ -629,9 +652,22 @@ class BT1Download:
             self.upmeasure.get_rate, self.downmeasure.get_rate, 
             self.ratemeasure, self.storagewrapper.get_stats, 
             self.datalength, self.finflag, self.spewflag, self.statistics, 
-            infohash = self.infohash,voddownload=self.voddownload)
+            infohash = self.infohash,voddownload=self.voddownload,
+            shapingfunc = self.get_shaping_stats)
+        self.feedback = d
         return d.gather
 
+    def get_shaping_stats(self):
+        """ Returns the rate class of this download and the current rates of
+        all rate classes in the Session, in bytes/s per direction """
+        return {'rateclass': self.downloader.get_rateclass(),
+                'classrates': {UPLOAD: self.ratelimiter.shaper.get_class_rates(),
+                               DOWNLOAD: self.downloader.shaper.get_class_rates()}}
+
+    def get_summary(self):
+        """ (frac, up, down, number of connections), after startStats() """
+        return self.feedback.summary()
+
 
     def getPortHandler(self):
         return self.encoder
@@ -675,6 +711,18 @@ class BT1Download:
         except AttributeError:
             pass
 
+    def setPeerUploadRate(self, rate, networkcalling=False):
+        try:
+            def s(self = self, rate = rate):
+                self.config['max_upload_rate_per_peer'] = rate
+                self.ratelimiter.set_peer_upload_rate(rate)
+            if networkcalling:
+                s()
+            else:
+                self.rawserver.add_task(s)
+        except AttributeError:
+            pass
+
     def setConns(self, conns, conns2 = None,networkcalling=False):
         if not conns2:
             conns2 = conns
@@ -703,6 +751,18 @@ class BT1Download:
         except AttributeError:
             pass
 
+    def setPeerDownloadRate(self, rate, networkcalling=False):
+        try:
+            def s(self = self, rate = rate):
+                self.config['max_download_rate_per_peer'] = rate
+                self.downloader.set_peer_download_rate(rate)
+            if networkcalling:
+                s()
+            else:
+                self.rawserver.add_task(s)
+        except AttributeError:
+            pass
+
     def startConnection(self, ip, port, id):
         self.encoder._start_connection((ip, port), id)
       
@@ -0,0 +1,82 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# poll class on top of Linux epoll. It mimics the select.poll interface
+# (register/unregister/poll with a millisecond timeout) so SocketHandler can
+# use it as a drop-in replacement. Unlike select.poll the kernel keeps the
+# interest set, so each poll() costs O(ready sockets) instead of O(sockets).
+
+import errno
+from select import epoll, EPOLLIN, EPOLLOUT, EPOLLERR, EPOLLHUP
+from types import IntType
+
+# Linux uses the same bit values for the poll and epoll event masks
+POLLIN = EPOLLIN
+POLLOUT = EPOLLOUT
+POLLERR = EPOLLERR
+POLLHUP = EPOLLHUP
+
+DEBUG = False
+
+# epoll_wait takes an int number of milliseconds
+MAXTIMEOUT = 2 ** 30
+
+class poll:
+    def __init__(self, sizehint = -1):
+        self.epoll = epoll(sizehint)
+        # {fileno: eventmask}
+        self.masks = {}
+
+    def register(self, f, t = POLLIN | POLLOUT):
+        if type(f) != IntType:
+            f = f.fileno()
+        current = self.masks.get(f)
+        if current == t:
+            # SingleSocket.try_write re-registers on every write, avoid
+            # an epoll_ctl syscall when nothing changes
+            return
+        if current is None:
+            try:
+                self.epoll.register(f, t)
+            except IOError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                self.epoll.modify(f, t)
+        else:
+            try:
+                self.epoll.modify(f, t)
+            except IOError, e:
+                # the fd was closed without being unregistered and its
+                # number has since been reused
+                if e.errno != errno.ENOENT:
+                    raise
+                self.epoll.register(f, t)
+        self.masks[f] = t
+
+    def unregister(self, f):
+        if type(f) != IntType:
+            f = f.fileno()
+        # select.poll raises KeyError for unknown fds
+        del self.masks[f]
+        try:
+            self.epoll.unregister(f)
+        except IOError, e:
+            if e.errno not in (errno.ENOENT, errno.EBADF):
+                raise
+
+    def poll(self, timeout = None):
+        # timeout is in milliseconds, like select.poll
+        if timeout is None or timeout < 0:
+            timeout = -1
+        else:
+            timeout = min(timeout, MAXTIMEOUT) / 1000.0
+        try:
+            return self.epoll.poll(timeout)
+        except IOError, e:
+            if e.errno == errno.EINTR:
+                return []
+            raise
+
+    def close(self):
+        self.masks = {}
+        self.epoll.close()
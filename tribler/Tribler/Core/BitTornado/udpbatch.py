@@ -0,0 +1,258 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Batched UDP socket I/O. On Linux recvmmsg(2) and sendmmsg(2) move many
+# datagrams per system call, elsewhere (or when libc lacks them) we fall back
+# to one recvfrom/sendto per datagram. Only AF_INET sockets are batched.
+#
+# BatchReader.read and BatchWriter.write report the number of system calls
+# they made, so callers can keep syscalls/packet statistics.
+
+import sys
+import socket
+import errno
+from struct import pack
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+DEBUG = False
+
+# datagrams moved per recvmmsg/sendmmsg call
+BATCHSIZE = 32
+MAXDATAGRAM = 65535
+# bytes in a struct sockaddr_in
+SOCKADDR_IN_SIZE = 16
+
+if sys.platform == 'win32':
+    SOCKET_BLOCK_ERRORCODE = 10035    # WSAEWOULDBLOCK
+else:
+    SOCKET_BLOCK_ERRORCODE = errno.EWOULDBLOCK
+
+MSG_DONTWAIT = 0x40
+MSG_TRUNC = 0x20
+
+_libc = None
+if sys.platform.startswith('linux'):
+    try:
+        import ctypes
+        from ctypes.util import find_library
+
+        class iovec(ctypes.Structure):
+            _fields_ = [("iov_base", ctypes.c_void_p),
+                        ("iov_len", ctypes.c_size_t)]
+
+        class msghdr(ctypes.Structure):
+            _fields_ = [("msg_name", ctypes.c_void_p),
+                        ("msg_namelen", ctypes.c_uint),
+                        ("msg_iov", ctypes.POINTER(iovec)),
+                        ("msg_iovlen", ctypes.c_size_t),
+                        ("msg_control", ctypes.c_void_p),
+                        ("msg_controllen", ctypes.c_size_t),
+                        ("msg_flags", ctypes.c_int)]
+
+        class mmsghdr(ctypes.Structure):
+            _fields_ = [("msg_hdr", msghdr),
+                        ("msg_len", ctypes.c_uint)]
+
+        _libc = ctypes.CDLL(find_library("c"), use_errno=True)
+        _recvmmsg = _libc.recvmmsg
+        _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        _recvmmsg.restype = ctypes.c_int
+        _sendmmsg = _libc.sendmmsg
+        _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        _sendmmsg.restype = ctypes.c_int
+    except (ImportError, OSError, AttributeError, TypeError):
+        # no ctypes, no libc, or a libc without recvmmsg/sendmmsg
+        _libc = None
+
+def batching_available(sock = None):
+    if _libc is None:
+        return False
+    if sock is not None and sock.family != socket.AF_INET:
+        return False
+    return True
+
+
+class BatchReader:
+    """
+    Reads all pending datagrams from a non-blocking UDP socket.
+    """
+    def __init__(self, sock, batchsize = BATCHSIZE, bufsize = MAXDATAGRAM):
+        self.socket = sock
+        self.batchsize = batchsize
+        self.bufsize = bufsize
+        if batching_available(sock):
+            self.read = self._read_mmsg
+            self.buffers = [ctypes.create_string_buffer(bufsize) for _ in xrange(batchsize)]
+            self.names = [ctypes.create_string_buffer(SOCKADDR_IN_SIZE) for _ in xrange(batchsize)]
+            self.iovecs = (iovec * batchsize)()
+            self.msgs = (mmsghdr * batchsize)()
+            for i in xrange(batchsize):
+                self.iovecs[i].iov_base = ctypes.addressof(self.buffers[i])
+                self.iovecs[i].iov_len = bufsize
+                hdr = self.msgs[i].msg_hdr
+                hdr.msg_name = ctypes.addressof(self.names[i])
+                hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+                hdr.msg_iovlen = 1
+        else:
+            self.read = self._read_recvfrom
+
+    def _read_recvfrom(self, packets):
+        """
+        Appends (address, data) tuples to PACKETS until the socket would
+        block. Returns the number of system calls made.
+        """
+        recvfrom = self.socket.recvfrom
+        bufsize = self.bufsize
+        syscalls = 0
+        try:
+            while True:
+                syscalls += 1
+                (data, addr) = recvfrom(bufsize)
+                if not data:
+                    if DEBUG:
+                        print >> sys.stderr, "udpbatch: UDP no-data", addr
+                    break
+                packets.append((addr, data))
+        except socket.error, e:
+            if DEBUG:
+                print >> sys.stderr, "udpbatch: recvfrom error", str(e)
+        return syscalls
+
+    def _read_mmsg(self, packets):
+        fileno = self.socket.fileno()
+        batchsize = self.batchsize
+        msgs = self.msgs
+        names = self.names
+        buffers = self.buffers
+        string_at = ctypes.string_at
+        inet_ntoa = socket.inet_ntoa
+        syscalls = 0
+        while True:
+            for i in xrange(batchsize):
+                msgs[i].msg_hdr.msg_namelen = SOCKADDR_IN_SIZE
+            syscalls += 1
+            count = _recvmmsg(fileno, msgs, batchsize, MSG_DONTWAIT, None)
+            if count <= 0:
+                if DEBUG and count < 0:
+                    print >> sys.stderr, "udpbatch: recvmmsg error", errno.errorcode.get(ctypes.get_errno())
+                break
+            for i in xrange(count):
+                msg = msgs[i]
+                if msg.msg_hdr.msg_flags & MSG_TRUNC:
+                    if DEBUG:
+                        print >> sys.stderr, "udpbatch: dropping truncated datagram"
+                    continue
+                # sockaddr_in: family (2 bytes), port (2 bytes, network order), address (4 bytes)
+                name = names[i].raw
+                addr = (inet_ntoa(name[4:8]), (ord(name[2]) << 8) | ord(name[3]))
+                packets.append((addr, string_at(buffers[i], msg.msg_len)))
+            if count < batchsize:
+                # the socket is drained, skip the recvmmsg that would return EAGAIN
+                break
+        return syscalls
+
+
+class BatchWriter:
+    """
+    Sends (data, address) tuples over a non-blocking UDP socket.
+    """
+    def __init__(self, sock, batchsize = BATCHSIZE):
+        self.socket = sock
+        self.batchsize = batchsize
+        # {address: sockaddr_in buffer}
+        self.names = {}
+        if batching_available(sock):
+            self.write = self._write_mmsg
+            self.iovecs = (iovec * batchsize)()
+            self.msgs = (mmsghdr * batchsize)()
+            for i in xrange(batchsize):
+                hdr = self.msgs[i].msg_hdr
+                hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+                hdr.msg_iovlen = 1
+                hdr.msg_namelen = SOCKADDR_IN_SIZE
+        else:
+            self.write = self._write_sendto
+
+    def _write_sendto(self, packets, start = 0, stop = None):
+        """
+        Sends PACKETS[START:STOP] in order and returns (sent, syscalls),
+        where SENT is the number of packets that went out. Raises
+        socket.error when the first packet could not be sent, the caller
+        decides to retry later (SOCKET_BLOCK_ERRORCODE) or to drop it.
+        """
+        if stop is None:
+            stop = len(packets)
+        sendto = self.socket.sendto
+        sent = 0
+        try:
+            for i in xrange(start, stop):
+                data, addr = packets[i]
+                sendto(data, addr)
+                sent += 1
+        except socket.error:
+            if sent == 0:
+                raise
+            # the failed sendto also counts
+            return sent, sent + 1
+        return sent, sent
+
+    def _get_name(self, addr):
+        name = self.names.get(addr)
+        if name is None:
+            if len(self.names) > 4096:
+                self.names.clear()
+            name = ctypes.create_string_buffer(pack("=H", socket.AF_INET) + pack("!H", addr[1]) + socket.inet_aton(socket.gethostbyname(addr[0])), SOCKADDR_IN_SIZE)
+            self.names[addr] = name
+        return name
+
+    def _write_mmsg(self, packets, start = 0, stop = None):
+        if stop is None:
+            stop = len(packets)
+        fileno = self.socket.fileno()
+        msgs = self.msgs
+        iovecs = self.iovecs
+        batchsize = self.batchsize
+        get_name = self._get_name
+        sent = 0
+        syscalls = 0
+        total = stop - start
+        while sent < total:
+            count = min(batchsize, total - sent)
+            unresolved = False
+            # the iovecs point into these strings, keep them alive
+            keepalive = []
+            for i in xrange(count):
+                data, addr = packets[start + sent + i]
+                try:
+                    name = get_name(addr)
+                except socket.error:
+                    # like a failed send: raise only for the first packet,
+                    # otherwise send the packets before it and stop
+                    if sent == 0 and i == 0:
+                        raise
+                    count = i
+                    unresolved = True
+                    break
+                buf = ctypes.c_char_p(data)
+                keepalive.append(buf)
+                iovecs[i].iov_base = ctypes.cast(buf, ctypes.c_void_p)
+                iovecs[i].iov_len = len(data)
+                msgs[i].msg_hdr.msg_name = ctypes.addressof(name)
+            if count == 0:
+                break
+            syscalls += 1
+            result = _sendmmsg(fileno, msgs, count, MSG_DONTWAIT)
+            if result < 0:
+                if sent == 0:
+                    e = ctypes.get_errno()
+                    raise socket.error(e, errno.errorcode.get(e, str(e)))
+                break
+            sent += result
+            if result < count or unresolved:
+                break
+        return sent, syscalls
@@ -5,7 +5,7 @@
 # for any function you add to database. 
 # Please reuse the functions in sqlitecachedb as much as possible
 
-from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, bin2str, str2bin, NULL, SQLiteNoCacheDB
+from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, bin2str, str2bin, NULL, SQLiteNoCacheDB, allowReaderThread
 from copy import deepcopy,copy
 from traceback import print_exc, print_stack
 from time import time
@@ -24,11 +24,12 @@ import re
 from sets import Set
 from struct import unpack_from
 
-from maxflow import Network
+from reputation import ReputationEngine
 from math import atan, pi
 
 from Tribler.Core.BitTornado.bencode import bencode, bdecode
 from Notifier import Notifier
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 from Tribler.Core.simpledefs import *
 from Tribler.Core.BuddyCast.moderationcast_util import *
 from Tribler.Core.Overlay.permid import sign_data, verify_data, permid_for_user
@@ -1675,6 +1676,7 @@ class TorrentDBHandler(BasicDBHandler):
         if torrent_id is not None:
             torrent_dir = self.getTorrentDir()
             torrent_name = self.getOne('torrent_file_name', torrent_id=torrent_id)
+            TorrentStore.getInstance().delete(infohash)
             src = os.path.join(torrent_dir, torrent_name)
             if not os.path.exists(src):    # already removed
                 return True
@@ -1843,6 +1845,7 @@ class TorrentDBHandler(BasicDBHandler):
               
         return torrent
 
+    @allowReaderThread
     def getNumberTorrents(self, category_name = 'all', library = False):
         table = 'CollectedTorrent'
         value = 'count(torrent_id)'
@@ -1995,6 +1998,7 @@ class TorrentDBHandler(BasicDBHandler):
         res_list = self._db.getAll('Torrent', value_name, where = where, limit=rankList_size, order_by=order_by)
         return [a[0] for a in res_list]
 
+    @allowReaderThread
     def getNumberCollectedTorrents(self): 
         #return self._db.size('CollectedTorrent')
         return self._db.getOne('CollectedTorrent', 'count(torrent_id)')
@@ -2068,16 +2072,21 @@ class TorrentDBHandler(BasicDBHandler):
         #self._db.executemany(sql_insert, torrent_id_infohashes, commit=True)
         
         torrent_dir = self.getTorrentDir()
+        torrent_store = TorrentStore.getInstance()
         deleted = 0 # deleted any file?
         for torrent_file_name, torrent_id, infohash, relevance, weight in res_list:
+            erased = torrent_store.delete(str2bin(infohash))
+            # torrents in the store may also have been extracted to this path
             torrent_path = os.path.join(torrent_dir, torrent_file_name)
             try:
                 os.remove(torrent_path)
                 print >> sys.stderr, "Erase torrent:", os.path.basename(torrent_path)
-                deleted += 1
+                erased = True
             except Exception, msg:
                 #print >> sys.stderr, "Error in erase torrent", Exception, msg
                 pass
+            if erased:
+                deleted += 1
         
         self.notifier.notify(NTFY_TORRENTS, NTFY_DELETE, str2bin(infohash)) # refresh gui
         
@@ -2900,7 +2909,7 @@ class BarterCastDBHandler(BasicDBHandler):
         self.peer_db = PeerDBHandler.getInstance()
         
         # create the maxflow network
-        self.network = Network({})
+        self.network = ReputationEngine()
         self.update_network()
                    
         if DEBUG:
@@ -3101,6 +3110,7 @@ class BarterCastDBHandler(BasicDBHandler):
         item['peer_id_to'] = peer_id2    
             
         self._db.insert(self.table_name, commit=commit, **item)
+        self._update_network(peer_id1, peer_id2, item.get('uploaded'), item.get('downloaded'))
 
     def updateItem(self, (permid_from, permid_to), key, value, commit=True):
         
@@ -3123,6 +3133,7 @@ class BarterCastDBHandler(BasicDBHandler):
             where = "peer_id_from=%s and peer_id_to=%s" % (peer_id1, peer_id2)
             item = {key: value}
             self._db.update(self.table_name, where = where, commit=commit, **item)            
+            self._update_network(peer_id1, peer_id2, item.get('uploaded'), item.get('downloaded'))
 
     def incrementItem(self, (permid_from, permid_to), key, value, commit=True):
         if DEBUG:
@@ -3154,6 +3165,7 @@ class BarterCastDBHandler(BasicDBHandler):
 
             item = {key: new_value}
             self._db.update(self.table_name, where = where, commit=commit, **item)            
+            self._update_network(peer_id1, peer_id2, item.get('uploaded'), item.get('downloaded'))
             return new_value
 
         return None
@@ -3192,6 +3204,7 @@ class BarterCastDBHandler(BasicDBHandler):
             where = "peer_id_from=%s and peer_id_to=%s" % (peer_id1, peer_id2)
             item = {'uploaded': ul, 'downloaded':dl, 'last_seen':int(time())}
             self._db.update(self.table_name, where = where, commit=commit, **item)            
+            self._update_network(peer_id1, peer_id2, ul, dl)
 
     def getPeerIDPairs(self):
         keys = self.getAll(('peer_id_from','peer_id_to'))
@@ -3336,10 +3349,20 @@ class BarterCastDBHandler(BasicDBHandler):
         
     ################################
     def update_network(self):
+        """ Load all records into the maxflow network once, the methods
+        that write records keep it up to date from then on """
+        sql = "SELECT peer_id_from, peer_id_to, uploaded, downloaded FROM BarterCast"
+        for peer_id_from, peer_id_to, uploaded, downloaded in self._db.fetchall(sql):
+            self._update_network(peer_id_from, peer_id_to, uploaded, downloaded)
 
-        #Niels: This seems useless, removing...
-        #keys = self.getPeerIDPairs() #getItemList()
-        pass
+        if DEBUG:
+            print >> sys.stderr, "bartercastdb: network of", self.network.get_num_peers(), "peers,", self.network.get_num_edges(), "edges"
+
+    def _update_network(self, peer_id_from, peer_id_to, uploaded, downloaded):
+        # transfers with non-tribler peers are not part of the network
+        if peer_id_from == -1 or peer_id_to == -1:
+            return
+        self.network.update(peer_id_from, peer_id_to, uploaded, downloaded)
 
     ################################
     def getMyReputation(self, alpha = ALPHA):
@@ -3347,6 +3370,16 @@ class BarterCastDBHandler(BasicDBHandler):
         rep = atan((self.total_up - self.total_down) * alpha)/(0.5 * pi)
         return rep   
 
+    def getReputation(self, permid, alpha = ALPHA):
+        return self.getReputations([permid], alpha)[0]
+
+    def getReputations(self, permids, alpha = ALPHA):
+        """ Returns the reputations of the peers as seen by me, from the
+        maxflow over paths of at most MAXFLOW_DISTANCE hops, in one pass
+        over the network """
+        peer_ids = [self.getPeerID(permid) for permid in permids]
+        return self.network.get_reputations(self.my_peerid, peer_ids, alpha)
+
 
 class VoteCastDBHandler(BasicDBHandler):
     
@@ -4324,6 +4357,7 @@ class ChannelCastDBHandler(object):
         
         return self.__fixTorrents(keys, results)
     
+    @allowReaderThread
     def getRecentReceivedTorrentsFromChannelId(self, channel_id, keys, limit = None):
         sql = "SELECT " + ", ".join(keys) +" FROM Torrent, ChannelTorrents WHERE Torrent.torrent_id = ChannelTorrents.torrent_id AND channel_id = ? ORDER BY inserted DESC"
         if limit:
@@ -4331,24 +4365,28 @@ class ChannelCastDBHandler(object):
         results = self._db.fetchall(sql, (channel_id,))
         return self.__fixTorrents(keys, results)
     
+    @allowReaderThread
     def getRecentModificationsFromChannelId(self, channel_id, keys, limit = None):
         sql = "SELECT " + ", ".join(keys) +" FROM ChannelMetaData LEFT JOIN MetaDataTorrent ON ChannelMetaData.id = MetaDataTorrent.metadata_id LEFT JOIN Moderations ON Moderations.cause = ChannelMetaData.dispersy_id WHERE ChannelMetaData.channel_id = ? ORDER BY -Moderations.time_stamp ASC, ChannelMetaData.inserted DESC"
         if limit:
             sql += " LIMIT %d"%limit
         return self._db.fetchall(sql, (channel_id,))
     
+    @allowReaderThread
     def getRecentModerationsFromChannel(self, channel_id, keys, limit = None):
         sql = "SELECT " + ", ".join(keys) +" FROM Moderations, MetaDataTorrent, ChannelMetaData WHERE Moderations.cause = ChannelMetaData.dispersy_id AND ChannelMetaData.id = MetaDataTorrent.metadata_id AND Moderations.channel_id = ? ORDER BY Moderations.inserted DESC"
         if limit:
             sql += " LIMIT %d"%limit
         return self._db.fetchall(sql, (channel_id,))
 
+    @allowReaderThread
     def getRecentMarkingsFromChannel(self, channel_id, keys, limit = None):
         sql = "SELECT " + ", ".join(keys) +" FROM TorrentMarkings, ChannelTorrents WHERE TorrentMarkings.channeltorrent_id = ChannelTorrents.id AND ChannelTorrents.channel_id = ? ORDER BY TorrentMarkings.time_stamp DESC"
         if limit:
             sql += " LIMIT %d"%limit
         return self._db.fetchall(sql, (channel_id,))
     
+    @allowReaderThread
     def getMostPopularTorrentsFromChannel(self, channel_id, isDispersy, keys, limit = None):
         if isDispersy:
             sql = "SELECT " + ", ".join(keys) +", count(Preference.torrent_id) FROM Torrent, ChannelTorrents, Preference WHERE Torrent.torrent_id = ChannelTorrents.torrent_id AND Preference.torrent_id = Torrent.torrent_id AND channel_id = ? GROUP BY Preference.torrent_id ORDER BY count(Preference.torrent_id) DESC"
@@ -4476,12 +4514,14 @@ class ChannelCastDBHandler(object):
         sql = "SELECT " + ", ".join(keys) +", count(DISTINCT ChannelTorrents.id) FROM Playlists LEFT JOIN PlaylistTorrents ON Playlists.id = PlaylistTorrents.playlist_id LEFT JOIN ChannelTorrents ON PlaylistTorrents.channeltorrent_id = ChannelTorrents.id WHERE Playlists.id = ? GROUP BY Playlists.id"
         return self._db.fetchone(sql, (playlist_id,))
             
+    @allowReaderThread
     def getCommentsFromChannelId(self, channel_id, keys, limit = None):
         sql = "SELECT " + ", ".join(keys) + " FROM Comments LEFT JOIN Peer ON Comments.peer_id = Peer.peer_id LEFT JOIN CommentPlaylist ON Comments.id = CommentPlaylist.comment_id LEFT JOIN CommentTorrent ON Comments.id = CommentTorrent.comment_id WHERE channel_id = ? ORDER BY time_stamp DESC"
         if limit:
             sql += " LIMIT %d"%limit
         return self._db.fetchall(sql, (channel_id, ))
 
+    @allowReaderThread
     def getCommentsFromPlayListId(self, playlist_id, keys, limit = None):
         playlistKeys = keys[:]
         if 'CommentTorrent.channeltorrent_id' in playlistKeys:
@@ -4510,6 +4550,7 @@ class ChannelCastDBHandler(object):
         data = [item for _, item in data]
         return data 
     
+    @allowReaderThread
     def getCommentsFromChannelTorrentId(self, channeltorrent_id, keys, limit = None):
         sql = "SELECT " + ", ".join(keys) + " FROM Comments, CommentTorrent LEFT JOIN Peer ON Comments.peer_id = Peer.peer_id WHERE Comments.id = CommentTorrent.comment_id AND channeltorrent_id = ? ORDER BY time_stamp DESC"
         if limit:
@@ -4517,6 +4558,7 @@ class ChannelCastDBHandler(object):
         
         return self._db.fetchall(sql, (channeltorrent_id, ))
         
+    @allowReaderThread
     def searchChannelsTorrent(self, keywords, limitChannels = None, limitTorrents = None, dispersyOnly = False):
         # search channels based on keywords
         keywords = split_into_keywords(keywords)
@@ -0,0 +1,498 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Packed store for collected .torrent files. Instead of one file per torrent
+# in the torrent collecting dir, torrents are appended as records to segment
+# files of up to SEGMENT_SIZE bytes, and found through an in-memory index on
+# infohash. The index is saved to a snapshot on close and after compaction;
+# records appended after the snapshot are recovered from the segments, and
+# without a snapshot the whole index is rebuilt from them.
+#
+# Deleting a torrent appends a tombstone record. Segments that consist mostly
+# of deleted records are compacted by a background thread, which copies the
+# live records to the segment being appended to and removes the old segment.
+# Reads come from read-only mmaps of the segments.
+
+import sys
+import os
+import mmap
+import heapq
+import random
+import struct
+from zlib import crc32
+from time import time
+from threading import RLock, Thread
+from traceback import print_exc
+
+from Tribler.Core.Utilities.Crypto import sha
+from Tribler.Core.BitTornado.bencode import bencode, bdecode
+from Tribler.Core.Utilities.utilities import get_collected_torrent_filename
+
+DEBUG = False
+
+# subdirectory of the torrent collecting dir
+STORE_DIRNAME = 'torrentstore'
+SEGMENT_SIZE = 64 * 2 ** 20
+# compact a segment when at least this fraction of it is deleted records
+COMPACT_RATIO = 0.5
+
+RECORD_MAGIC = 'TR'
+RECORD_PUT = 0
+RECORD_DELETE = 1
+# magic, type, crc32 of the data, infohash, time, length of the data
+RECORD_HEADER = struct.Struct('>2sBI20sII')
+
+INDEX_FILENAME = 'index'
+INDEX_MAGIC = 'TRIX'
+INDEX_VERSION = 1
+# magic, version, number of segments, number of entries
+INDEX_HEADER = struct.Struct('>4sIII')
+# segment number, length, deleted bytes
+INDEX_SEGMENT = struct.Struct('>III')
+# infohash, segment number, offset, length of the data, time
+INDEX_ENTRY = struct.Struct('>20sIIII')
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.dat'
+
+
+class TorrentStore:
+    """ Called by any thread """
+
+    __single = None
+
+    def __init__(self):
+        if TorrentStore.__single:
+            raise RuntimeError, "TorrentStore is singleton"
+        TorrentStore.__single = self
+        self.lock = RLock()
+        self.storedir = None
+        # infohash -> (segment, offset, length, time)
+        self.entries = {}
+        # segment -> [length, deleted bytes]
+        self.segments = {}
+        self.maps = {}
+        self.appendsegment = None
+        self.appendfile = None
+        self.compacting = False
+        self.migrating = None
+
+    def getInstance(*args, **kw):
+        if TorrentStore.__single is None:
+            TorrentStore(*args, **kw)
+        return TorrentStore.__single
+    getInstance = staticmethod(getInstance)
+
+    def register(self, storedir):
+        self.lock.acquire()
+        try:
+            if not os.path.isdir(storedir):
+                os.makedirs(storedir)
+            self.storedir = storedir
+
+            ondisk = self.list_segments()
+            if not self.load_index(ondisk):
+                if DEBUG:
+                    print >> sys.stderr, "torrentstore: rebuilding index of", len(ondisk), "segments"
+                self.entries = {}
+                self.segments = {}
+            for segment in ondisk:
+                if segment in self.segments:
+                    self.scan_segment(segment, self.segments[segment][0])
+                else:
+                    self.segments[segment] = [0, 0]
+                    self.scan_segment(segment, 0)
+
+            if ondisk:
+                self.open_segment(ondisk[-1])
+            else:
+                self.open_segment(0)
+            if DEBUG:
+                print >> sys.stderr, "torrentstore: opened", storedir, len(self.entries), "torrents in", len(self.segments), "segments"
+        finally:
+            self.lock.release()
+        self.check_compaction()
+
+    def is_registered(self):
+        return self.storedir is not None
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.storedir is None:
+                return
+            self.save_index()
+            for m in self.maps.itervalues():
+                m.close()
+            self.maps = {}
+            self.appendfile.close()
+            self.appendfile = None
+            self.storedir = None
+        finally:
+            self.lock.release()
+
+    #
+    # Torrents
+    #
+    def put(self, infohash, metadata, mtime = None):
+        """ Store the bencoded torrent metadata under infohash, replacing any
+        previous version. """
+        if mtime is None:
+            mtime = time()
+        self.lock.acquire()
+        try:
+            (segment, offset) = self.append_record(RECORD_PUT, infohash, int(mtime), metadata)
+            self.apply_put(infohash, (segment, offset, len(metadata), int(mtime)))
+        finally:
+            self.lock.release()
+
+    def get(self, infohash):
+        """ Returns the bencoded torrent metadata, or None """
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(infohash)
+            if entry is None:
+                return None
+            (segment, offset, length, mtime) = entry
+            start = offset + RECORD_HEADER.size
+            return self.get_map(segment, start + length)[start:start + length]
+        finally:
+            self.lock.release()
+
+    def has(self, infohash):
+        return infohash in self.entries
+
+    def get_length(self, infohash):
+        entry = self.entries.get(infohash)
+        if entry is None:
+            return None
+        return entry[2]
+
+    def delete(self, infohash):
+        """ Returns whether the torrent was in the store """
+        self.lock.acquire()
+        try:
+            if infohash not in self.entries:
+                return False
+            self.append_record(RECORD_DELETE, infohash, int(time()), '')
+            self.apply_delete(infohash)
+            self.segments[self.appendsegment][1] += RECORD_HEADER.size
+        finally:
+            self.lock.release()
+        self.check_compaction()
+        return True
+
+    def read(self, infohash, filename):
+        """ Returns the bencoded torrent metadata from the store or, for a
+        torrent that is not in it (e.g. not migrated yet), from filename.
+        Returns None when neither has the torrent. """
+        metadata = self.get(infohash)
+        if metadata is None and os.path.isfile(filename):
+            f = open(filename, 'rb')
+            try:
+                metadata = f.read()
+            finally:
+                f.close()
+        return metadata
+
+    def extract(self, infohash, filename):
+        """ Write the torrent to filename, for code that needs a .torrent
+        file. Returns whether the torrent was in the store. """
+        metadata = self.get(infohash)
+        if metadata is None:
+            return False
+        f = open(filename, 'wb')
+        try:
+            f.write(metadata)
+        finally:
+            f.close()
+        return True
+
+    def get_num_torrents(self):
+        return len(self.entries)
+
+    def get_recent(self, num):
+        """ Returns the infohashes of the num most recently stored torrents """
+        self.lock.acquire()
+        try:
+            recent = heapq.nlargest(num, self.entries.iteritems(), key = lambda item: item[1][3])
+        finally:
+            self.lock.release()
+        return [infohash for infohash, entry in recent]
+
+    def get_random(self, num, exclude = ()):
+        """ Returns the infohashes of num random torrents not in exclude """
+        self.lock.acquire()
+        try:
+            infohashes = self.entries.keys()
+        finally:
+            self.lock.release()
+        exclude = set(exclude)
+        infohashes = [infohash for infohash in infohashes if infohash not in exclude]
+        return random.sample(infohashes, min(num, len(infohashes)))
+
+    def get_stats(self):
+        """ Returns the number of torrents and segments, the size of the
+        segments and the number of bytes in deleted records """
+        self.lock.acquire()
+        try:
+            size = sum([length for length, dead in self.segments.itervalues()])
+            dead = sum([dead for length, dead in self.segments.itervalues()])
+            return (len(self.entries), len(self.segments), size, dead)
+        finally:
+            self.lock.release()
+
+    def migrate(self, torrent_dir, maxfiles = None):
+        """ Move the collected .torrent files in torrent_dir, as written by
+        MetadataHandler before there was a store, into the store. Moves at
+        most maxfiles files per call and returns the number left. """
+        if self.migrating is None:
+            self.migrating = [filename for filename in os.listdir(torrent_dir) if filename.endswith('.torrent')]
+        if maxfiles is None:
+            maxfiles = len(self.migrating)
+
+        while self.migrating and maxfiles > 0:
+            maxfiles -= 1
+            filename = self.migrating.pop()
+            path = os.path.join(torrent_dir, filename)
+            try:
+                f = open(path, 'rb')
+                try:
+                    metadata = f.read()
+                finally:
+                    f.close()
+                infohash = sha(bencode(bdecode(metadata)['info'])).digest()
+            except:
+                if DEBUG:
+                    print_exc()
+                continue
+            # readable names are used for the torrents of own downloads
+            if filename != get_collected_torrent_filename(infohash):
+                continue
+            try:
+                self.put(infohash, metadata, mtime = os.path.getmtime(path))
+                os.remove(path)
+            except:
+                print_exc()
+        return len(self.migrating)
+
+    #
+    # Records and segments
+    #
+    def segment_path(self, segment):
+        return os.path.join(self.storedir, "%s%06d%s" % (SEGMENT_PREFIX, segment, SEGMENT_SUFFIX))
+
+    def list_segments(self):
+        segments = []
+        for filename in os.listdir(self.storedir):
+            if filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    pass
+        segments.sort()
+        return segments
+
+    def open_segment(self, segment):
+        if self.appendfile is not None:
+            self.appendfile.close()
+        self.appendfile = open(self.segment_path(segment), 'ab')
+        self.appendsegment = segment
+        if segment not in self.segments:
+            self.segments[segment] = [0, 0]
+
+    def get_map(self, segment, end):
+        m = self.maps.get(segment)
+        if m is None or len(m) < end:
+            if m is not None:
+                m.close()
+            f = open(self.segment_path(segment), 'rb')
+            try:
+                m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            finally:
+                f.close()
+            self.maps[segment] = m
+        return m
+
+    def append_record(self, type, infohash, mtime, data):
+        """ Returns the (segment, offset) of the new record. Called with the
+        lock held. """
+        size = RECORD_HEADER.size + len(data)
+        if self.segments[self.appendsegment][0] > 0 and self.segments[self.appendsegment][0] + size > SEGMENT_SIZE:
+            self.open_segment(self.appendsegment + 1)
+        segment = self.appendsegment
+        offset = self.segments[segment][0]
+        self.appendfile.write(RECORD_HEADER.pack(RECORD_MAGIC, type, crc32(data) & 0xffffffff, infohash, mtime, len(data)))
+        self.appendfile.write(data)
+        self.appendfile.flush()
+        self.segments[segment][0] += size
+        return (segment, offset)
+
+    def apply_put(self, infohash, entry):
+        self.apply_delete(infohash)
+        self.entries[infohash] = entry
+
+    def apply_delete(self, infohash):
+        old = self.entries.pop(infohash, None)
+        if old is not None:
+            self.segments[old[0]][1] += RECORD_HEADER.size + old[2]
+
+    def scan_segment(self, segment, offset):
+        """ Apply the records in segment from offset on to the index. A
+        record that was not written completely ends the segment. """
+        f = open(self.segment_path(segment), 'r+b')
+        try:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    break
+                if len(header) == RECORD_HEADER.size:
+                    (magic, type, crc, infohash, mtime, length) = RECORD_HEADER.unpack(header)
+                    data = f.read(length)
+                    if magic == RECORD_MAGIC and len(data) == length and crc32(data) & 0xffffffff == crc:
+                        if type == RECORD_PUT:
+                            self.apply_put(infohash, (segment, offset, length, mtime))
+                        else:
+                            self.apply_delete(infohash)
+                            self.segments[segment][1] += RECORD_HEADER.size + length
+                        offset += RECORD_HEADER.size + length
+                        continue
+                print >> sys.stderr, "torrentstore: truncating damaged segment", segment, "at", offset
+                f.truncate(offset)
+                break
+        finally:
+            f.close()
+        self.segments[segment][0] = offset
+
+    def load_index(self, ondisk):
+        """ Returns whether the snapshot of the index could be loaded and
+        fits the segments on disk """
+        try:
+            f = open(os.path.join(self.storedir, INDEX_FILENAME), 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            return False
+        try:
+            (magic, version, numsegments, numentries) = INDEX_HEADER.unpack_from(data, 0)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                return False
+            pos = INDEX_HEADER.size
+            for i in xrange(numsegments):
+                (segment, length, dead) = INDEX_SEGMENT.unpack_from(data, pos)
+                pos += INDEX_SEGMENT.size
+                # compacted away or shortened after the snapshot was saved
+                if segment not in ondisk or os.path.getsize(self.segment_path(segment)) < length:
+                    return False
+                self.segments[segment] = [length, dead]
+            for i in xrange(numentries):
+                (infohash, segment, offset, length, mtime) = INDEX_ENTRY.unpack_from(data, pos)
+                pos += INDEX_ENTRY.size
+                self.entries[infohash] = (segment, offset, length, mtime)
+        except struct.error:
+            return False
+        return True
+
+    def save_index(self):
+        """ Called with the lock held """
+        parts = [INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self.segments), len(self.entries))]
+        for segment, (length, dead) in self.segments.iteritems():
+            parts.append(INDEX_SEGMENT.pack(segment, length, dead))
+        for infohash, (segment, offset, length, mtime) in self.entries.iteritems():
+            parts.append(INDEX_ENTRY.pack(infohash, segment, offset, length, mtime))
+
+        filename = os.path.join(self.storedir, INDEX_FILENAME)
+        f = open(filename + '.new', 'wb')
+        try:
+            f.write(''.join(parts))
+        finally:
+            f.close()
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(filename + '.new', filename)
+
+    #
+    # Compaction
+    #
+    def get_compaction_candidate(self):
+        for segment, (length, dead) in self.segments.iteritems():
+            if segment != self.appendsegment and dead >= length * COMPACT_RATIO:
+                return segment
+        return None
+
+    def check_compaction(self):
+        self.lock.acquire()
+        try:
+            if self.compacting or self.storedir is None or self.get_compaction_candidate() is None:
+                return
+            self.compacting = True
+        finally:
+            self.lock.release()
+        t = Thread(target = self.compact, name = "TorrentStoreCompaction")
+        t.setDaemon(True)
+        t.start()
+
+    def compact(self):
+        try:
+            while True:
+                self.lock.acquire()
+                try:
+                    if self.storedir is None:
+                        return
+                    segment = self.get_compaction_candidate()
+                    if segment is None:
+                        self.save_index()
+                        return
+                finally:
+                    self.lock.release()
+                self.compact_segment(segment)
+        finally:
+            self.compacting = False
+
+    def compact_segment(self, segment):
+        """ Copy the live records of segment to the segment being appended
+        to, and remove it. Tombstones are copied too, as the torrents they
+        delete may still be in older segments. """
+        if DEBUG:
+            print >> sys.stderr, "torrentstore: compacting segment", segment, self.segments[segment]
+        oldest = segment == min(self.segments)
+        offset = 0
+        while True:
+            self.lock.acquire()
+            try:
+                if self.storedir is None:
+                    return
+                if offset >= self.segments[segment][0]:
+                    break
+                m = self.get_map(segment, self.segments[segment][0])
+                (magic, type, crc, infohash, mtime, length) = RECORD_HEADER.unpack_from(m, offset)
+                entry = self.entries.get(infohash)
+                if type == RECORD_PUT and entry is not None and entry[0] == segment and entry[1] == offset:
+                    start = offset + RECORD_HEADER.size
+                    data = m[start:start + length]
+                    (newsegment, newoffset) = self.append_record(RECORD_PUT, infohash, mtime, data)
+                    self.apply_put(infohash, (newsegment, newoffset, length, mtime))
+                elif type == RECORD_DELETE and entry is None and not oldest:
+                    self.append_record(RECORD_DELETE, infohash, mtime, '')
+                    self.segments[self.appendsegment][1] += RECORD_HEADER.size
+                offset += RECORD_HEADER.size + length
+            finally:
+                self.lock.release()
+
+        self.lock.acquire()
+        try:
+            m = self.maps.pop(segment, None)
+            if m is not None:
+                m.close()
+            del self.segments[segment]
+            # Remove the segment before the index no longer lists it. After a
+            # crash in between, the old index lists a segment that is gone
+            # and the index is rebuilt, whereas a segment that is not in the
+            # index would be scanned again, after the newer copies.
+            os.remove(self.segment_path(segment))
+            self.save_index()
+        finally:
+            self.lock.release()
@@ -0,0 +1,154 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# BarterCast reputations from the graph of reported transfers. The reputation
+# of peer j as seen by peer i is
+#
+#     R_i(j) = arctan((f(j, i) - f(i, j)) * alpha) / (pi / 2)
+#
+# where f(a, b) is the maximal flow from a to b over paths of at most two
+# hops, and the capacity of edge (a, b) is the amount a uploaded to b. The
+# paths a->b and a->k->b for the different k have no edges in common, so the
+# two-hop bounded flow is c(a, b) + sum over k of min(c(a, k), c(k, b)), which
+# needs no augmenting paths.
+#
+# Peers are numbered as nodes of the graph, and the adjacency of a node is
+# kept both ways, as {node: capacity} dicts indexed by node number, so that
+# a reported transfer updates two entries and the flows from or to one peer
+# for all other peers are summed in a single pass over its neighbourhood.
+
+from math import atan, pi
+from threading import Lock
+
+DEBUG = False
+
+
+def reputation(flow_to, flow_from, alpha):
+    return atan((flow_to - flow_from) * alpha)/(0.5 * pi)
+
+
+class ReputationEngine:
+    """ Called by any thread """
+
+    def __init__(self):
+        self.lock = Lock()
+        # peer id <-> node
+        self.nodes = {}
+        self.peer_ids = []
+        # node -> {node: capacity}
+        self.succ = []
+        self.pred = []
+        # (node from, node to) -> [uploaded, downloaded] as reported in the
+        # record of that pair
+        self.reports = {}
+
+    def get_node(self, peer_id):
+        """ Called with the lock held """
+        node = self.nodes.get(peer_id)
+        if node is None:
+            node = len(self.peer_ids)
+            self.nodes[peer_id] = node
+            self.peer_ids.append(peer_id)
+            self.succ.append({})
+            self.pred.append({})
+        return node
+
+    def get_num_peers(self):
+        return len(self.peer_ids)
+
+    def get_num_edges(self):
+        self.lock.acquire()
+        try:
+            return sum([len(succ) for succ in self.succ])
+        finally:
+            self.lock.release()
+
+    def update(self, peer_id_from, peer_id_to, uploaded = None, downloaded = None):
+        """ Apply the record of the transfers between two peers, as stored in
+        the BarterCast table. The record of (a, b) and that of (b, a) may
+        both exist, the largest report of a transfer counts. A value of None
+        leaves that part of the record unchanged. """
+        if peer_id_from == peer_id_to:
+            return
+        self.lock.acquire()
+        try:
+            a = self.get_node(peer_id_from)
+            b = self.get_node(peer_id_to)
+            report = self.reports.setdefault((a, b), [0, 0])
+            if uploaded is not None:
+                report[0] = uploaded
+            if downloaded is not None:
+                report[1] = downloaded
+            reverse = self.reports.get((b, a), (0, 0))
+            self.set_capacity(a, b, max(report[0], reverse[1]))
+            self.set_capacity(b, a, max(report[1], reverse[0]))
+        finally:
+            self.lock.release()
+
+    def set_capacity(self, a, b, capacity):
+        """ Called with the lock held """
+        if capacity > 0:
+            self.succ[a][b] = capacity
+            self.pred[b][a] = capacity
+        elif b in self.succ[a]:
+            del self.succ[a][b]
+            del self.pred[b][a]
+
+    def maxflow(self, source, sink):
+        """ Returns the two-hop bounded maximal flow from peer id source to
+        peer id sink """
+        self.lock.acquire()
+        try:
+            s = self.nodes.get(source)
+            t = self.nodes.get(sink)
+            if s is None or t is None or s == t:
+                return 0
+            succ = self.succ[s]
+            pred = self.pred[t]
+            flow = succ.get(t, 0)
+            if len(succ) <= len(pred):
+                for k, capacity in succ.iteritems():
+                    if k in pred:
+                        flow += min(capacity, pred[k])
+            else:
+                for k, capacity in pred.iteritems():
+                    if k in succ:
+                        flow += min(succ[k], capacity)
+            return flow
+        finally:
+            self.lock.release()
+
+    def get_flows(self, peer_id):
+        """ Returns two dicts of peer id -> the two-hop bounded maximal flow
+        from that peer to peer_id, and from peer_id to that peer, for all
+        peers with a nonzero flow. """
+        self.lock.acquire()
+        try:
+            i = self.nodes.get(peer_id)
+            if i is None:
+                return {}, {}
+            flows_to = self.sum_flows(i, self.pred)
+            flows_from = self.sum_flows(i, self.succ)
+            peer_ids = self.peer_ids
+        finally:
+            self.lock.release()
+        return (dict([(peer_ids[j], flow) for j, flow in flows_to.iteritems()]),
+                dict([(peer_ids[j], flow) for j, flow in flows_from.iteritems()]))
+
+    def sum_flows(self, i, adjacency):
+        """ Returns node -> flow to i over pred, or from i over succ, summing
+        the direct edge and the two-hop paths of every node. Called with the
+        lock held. """
+        flows = {}
+        get = flows.get
+        for k, capacity in adjacency[i].iteritems():
+            flows[k] = get(k, 0) + capacity
+            for j, capacity2 in adjacency[k].iteritems():
+                if j != i:
+                    flows[j] = get(j, 0) + min(capacity, capacity2)
+        return flows
+
+    def get_reputations(self, peer_id, peer_ids, alpha):
+        """ Returns the reputations of peer_ids as seen by peer_id, in order """
+        flows_to, flows_from = self.get_flows(peer_id)
+        return [reputation(flows_to.get(j, 0), flows_from.get(j, 0), alpha) for j in peer_ids]
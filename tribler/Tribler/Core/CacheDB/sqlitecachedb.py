@@ -15,8 +15,9 @@ from Tribler.Core.Utilities.unicode import dunno2unicode
 # ONLY USE APSW >= 3.5.9-r1
 import apsw
 from Tribler.Core.Utilities.utilities import get_collected_torrent_filename
-from threading import currentThread, Event, RLock, Lock
+from threading import currentThread, Event, RLock, Lock, local
 import inspect
+from Tribler.Core.CacheDB.sqlitereaderpool import SQLiteReaderPool, QueryStats
 from Tribler.Core.Swift.SwiftDef import SwiftDef
 
 #support_version = (3,5,9)
@@ -211,6 +212,8 @@ class SQLiteCacheDBBase:
         self.category_table = None
         self.src_table = None
         self.applied_pragma_sync_norm = False
+        # whether the database is in WAL mode, a requirement for SQLiteReaderPool
+        self.wal_enabled = False
         
     def __del__(self):
         self.close()
@@ -239,6 +242,8 @@ class SQLiteCacheDBBase:
             self.class_variables = safe_dict({'db_path':None,'busytimeout':None})
             self.cursor_table = safe_dict()
             self.cache_transaction_table = safe_dict()
+            self.applied_pragma_sync_norm = False
+            self.wal_enabled = False
             
             
     # --------- static functions --------
@@ -294,6 +299,17 @@ class SQLiteCacheDBBase:
             self.applied_pragma_sync_norm = True 
             cur.execute("PRAGMA synchronous = NORMAL;")
             cur.execute("PRAGMA cache_size = 10000;")
+
+            # In WAL mode readers and the writer do not block each other,
+            # which allows reading on other connections while the DB thread
+            # has a transaction open. Requires SQLite >= 3.7.0, the mode is
+            # stored in the database file.
+            if dbfile_path.lower() != ':memory:':
+                try:
+                    mode = list(cur.execute("PRAGMA journal_mode = WAL;"))
+                    self.wal_enabled = bool(mode) and str(mode[0][0]).lower() == 'wal'
+                except Exception, msg:
+                    print >> sys.stderr, "cachedb: could not enable WAL mode:", msg
             
         return cur
     
@@ -1697,6 +1713,8 @@ ALTER TABLE Peer ADD COLUMN services integer DEFAULT 0;
             from Tribler.Utilities.TimedTaskQueue import TimedTaskQueue
             from Tribler.Core.Search.SearchManager import split_into_keywords
             from Tribler.Core.TorrentDef import TorrentDef
+            from Tribler.Core.CacheDB.TorrentStore import TorrentStore
+            from Tribler.Core.BitTornado.bencode import bdecode
             
             # Create an empty file to mark the process of upgradation.
             # In case this process is terminated before completion of upgradation,
@@ -1891,8 +1909,9 @@ ALTER TABLE Peer ADD COLUMN services integer DEFAULT 0;
                                         _, tail = os.path.split(torrent_file_name)
                                         torrent_file_name = os.path.join(torrent_dir, tail)
                                     
-                                    if os.path.isfile(torrent_file_name):    
-                                        torrentdef = TorrentDef.load(torrent_file_name)
+                                    metadata = TorrentStore.getInstance().read(infohash, torrent_file_name)
+                                    if metadata is not None:
+                                        torrentdef = TorrentDef.load_from_dict(bdecode(metadata))
                                         
                                         files = torrentdef.get_files_as_unicode_with_length()
                                         to_be_inserted.append((infohash, timestamp, torrentdef.get_name_as_unicode(), tuple(files), torrentdef.get_trackers_as_single_tuple()))
@@ -1963,10 +1982,11 @@ ALTER TABLE Peer ADD COLUMN services integer DEFAULT 0;
                             torrent_filename = get_collected_torrent_filename(str2bin(infohash))
                             torrent_filename = os.path.join(torrent_dir, torrent_filename)
                         
-                        if not os.path.isfile(torrent_filename):
+                        metadata = TorrentStore.getInstance().read(str2bin(infohash), torrent_filename)
+                        if metadata is None:
                             raise RuntimeError(".torrent file not found. Use fallback.")
                     
-                        torrentdef = TorrentDef.load(torrent_filename)
+                        torrentdef = TorrentDef.load_from_dict(bdecode(metadata))
                         
                         #Making sure that swarmname does not include extension for single file torrents
                         swarmname = torrentdef.get_name_as_unicode()
@@ -2068,6 +2088,7 @@ ALTER TABLE Peer ADD COLUMN services integer DEFAULT 0;
             
             from Tribler.Utilities.TimedTaskQueue import TimedTaskQueue
             from Tribler.Core.RemoteTorrentHandler import RemoteTorrentHandler
+            from Tribler.Core.CacheDB.TorrentStore import TorrentStore
             
             # ensure the temp-file is created, if it is not already
             try:
@@ -2095,6 +2116,7 @@ ALTER TABLE Peer ADD COLUMN services integer DEFAULT 0;
                         return
                     
                     torrent_dir = session.get_torrent_collecting_dir()
+                    to_hash = []
                     for infohash, torrent_filename in records:
                         if not os.path.isfile(torrent_filename):
                             torrent_filename = os.path.join(torrent_dir, torrent_filename)
@@ -2105,10 +2127,20 @@ ALTER TABLE Peer ADD COLUMN services integer DEFAULT 0;
                             torrent_filename = get_collected_torrent_filename(str2bin(infohash))
                             torrent_filename = os.path.join(torrent_dir, torrent_filename)
                         
+                            #.torrent not on disk, swift needs a file to hash
+                            TorrentStore.getInstance().extract(str2bin(infohash), torrent_filename)
+                        
                         if not os.path.isfile(torrent_filename):
                             not_found.append((infohash, ))
                         else:
-                            sdef, swiftpath = rth._write_to_collected(torrent_filename)
+                            to_hash.append((infohash, torrent_filename))
+                    
+                    #calculate the root-hashes of the batch at once
+                    collected = rth._write_batch_to_collected([filename for _, filename in to_hash])
+                    for (infohash, torrent_filename), (sdef, swiftpath) in zip(to_hash, collected):
+                        if sdef is None:
+                            not_found.append((infohash, ))
+                        else:
                             found.append((bin2str(sdef.get_roothash()), swiftpath, infohash))
                             
                             os.remove(torrent_filename)
@@ -2145,6 +2177,11 @@ _shouldCommit = False
 _callback = None
 _callback_lock = RLock()
 
+# time calls from other threads wait for the DB thread versus execute on it
+_dbthread_stats = QueryStats()
+# per thread, the number of allowReaderThread functions being called
+_reader_allowed = local()
+
 def try_register(db, callback = None):
     global _callback, _callback_lock
     
@@ -2198,10 +2235,13 @@ def forceAndReturnDBThread(func):
             event = Event()
             
             result = [None]
+            queued = time()
             def dispersy_thread():
+                started = time()
                 try:
                     result[0] = func(*args, **kwargs)
                 finally:
+                    _dbthread_stats.add(started - queued, time() - started)
                     event.set()
             
             dispersy_thread.__name__ = func.__name__
@@ -2237,6 +2277,24 @@ def forceDBThread(func):
     invoke_func.__name__ = func.__name__
     return invoke_func
 
+def allowReaderThread(func):
+    """
+    Lets the fetchone, fetchall, getOne and getAll calls made while FUNC runs
+    on a thread other than the DB thread use the read-only connections of
+    the reader pool. Only for methods that do not write, and that can do
+    without writes that the DB thread did not commit yet.
+    """
+    def invoke_func(*args,**kwargs):
+        depth = getattr(_reader_allowed, 'depth', 0)
+        _reader_allowed.depth = depth + 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _reader_allowed.depth = depth
+            
+    invoke_func.__name__ = func.__name__
+    return invoke_func
+
 class SQLiteNoCacheDB(SQLiteCacheDBV5):
     __single = None
     DEBUG = False
@@ -2261,6 +2319,9 @@ class SQLiteNoCacheDB(SQLiteCacheDBV5):
         if self.__single != None:
             raise RuntimeError, "SQLiteCacheDB is singleton"
         SQLiteCacheDBBase.__init__(self, *args, **kargs)
+        # SQLiteReaderPool, created on first use, or False when it can not be
+        # used
+        self.reader_pool = None
         
         if __debug__:
             if self.__counter > 0:
@@ -2337,12 +2398,62 @@ class SQLiteNoCacheDB(SQLiteCacheDBV5):
         if DEPRECATION_DEBUG and vacuum:
             raise DeprecationWarning('Please do not use clean_db with vacuum')
         
-    @forceAndReturnDBThread
+    def close(self, clean=False):
+        if self.reader_pool:
+            self.reader_pool.stop()
+        self.reader_pool = None
+        SQLiteCacheDBV5.close(self, clean)
+
+    def getReaderPool(self):
+        """
+        Returns the reader pool when the calling method allows it, see
+        allowReaderThread, or None when the DB thread has to be used.
+        """
+        if not getattr(_reader_allowed, 'depth', 0) or not self.wal_enabled or currentThread().getName() == 'Dispersy':
+            return None
+        
+        if self.reader_pool is None:
+            self.lock.acquire()
+            try:
+                if self.reader_pool is None:
+                    try:
+                        self.reader_pool = SQLiteReaderPool(self.class_variables['db_path'], self.class_variables['busytimeout'])
+                    except:
+                        print_exc()
+                        print >> sys.stderr, "cachedb: reader pool not available, reading on the DB thread"
+                        self.reader_pool = False
+            finally:
+                self.lock.release()
+        return self.reader_pool or None
+    
+    def getQueryStats(self):
+        """
+        Returns the wait and execution times of queries handed to the DB
+        thread and of those served by the reader pool.
+        """
+        stats = {'dbthread': _dbthread_stats.get()}
+        if self.reader_pool:
+            stats['readers'] = self.reader_pool.get_stats()
+        return stats
+    
     def fetchone(self, sql, args=None):
+        pool = self.getReaderPool()
+        if pool:
+            return pool.fetchone(sql, args)
+        return self._fetchone(sql, args)
+    
+    def fetchall(self, sql, args=None, retry=0):
+        pool = self.getReaderPool()
+        if pool:
+            return pool.fetchall(sql, args)
+        return self._fetchall(sql, args, retry)
+    
+    @forceAndReturnDBThread
+    def _fetchone(self, sql, args=None):
         return SQLiteCacheDBV5.fetchone(self, sql, args)
     
     @forceAndReturnDBThread
-    def fetchall(self, sql, args=None, retry=0):
+    def _fetchall(self, sql, args=None, retry=0):
         return SQLiteCacheDBV5.fetchall(self, sql, args, retry)
                 
     @forceAndReturnDBThread
@@ -0,0 +1,167 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Read-only SQLite connections on worker threads. With the database in WAL
+# mode readers do not block the writer, nor the other way around, so queries
+# that only read can be served here instead of waiting for the DB thread.
+# Readers only see committed data: the DB thread keeps a transaction open
+# until commitNow, hence only queries that can do without the latest writes
+# should use the pool (see allowReaderThread in sqlitecachedb).
+
+import sys
+from time import time
+from threading import Thread, Event, Lock
+from Queue import Queue
+from traceback import print_stack
+
+import apsw
+
+DEBUG = False
+
+READER_THREADS = 2
+# seconds a caller waits for its query, like forceAndReturnDBThread
+READER_TIMEOUT = 15
+
+class QueryStats:
+    """
+    Keeps the time queries spent waiting in a queue and executing.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.count = 0
+        self.wait = 0.0
+        self.execute = 0.0
+        self.max_wait = 0.0
+        self.max_execute = 0.0
+
+    def add(self, wait, execute):
+        self.lock.acquire()
+        try:
+            self.count += 1
+            self.wait += wait
+            self.execute += execute
+            self.max_wait = max(self.max_wait, wait)
+            self.max_execute = max(self.max_execute, execute)
+        finally:
+            self.lock.release()
+
+    def get(self):
+        self.lock.acquire()
+        try:
+            return {'count': self.count,
+                    'wait': self.wait,
+                    'execute': self.execute,
+                    'max_wait': self.max_wait,
+                    'max_execute': self.max_execute}
+        finally:
+            self.lock.release()
+
+
+class ReadJob:
+    def __init__(self, sql, args):
+        self.sql = sql
+        self.args = args
+        self.queued = time()
+        self.rows = None
+        self.error = None
+        self.event = Event()
+
+
+class SQLiteReaderPool:
+    def __init__(self, db_path, busytimeout, readers = READER_THREADS):
+        self.db_path = db_path
+        self.busytimeout = busytimeout
+        self.queue = Queue()
+        self.stats = QueryStats()
+        self.threads = []
+
+        # older APSW versions require a connection to be used by the thread
+        # that opened it, each reader opens its own and reports back
+        ready = []
+        for i in xrange(readers):
+            event = Event()
+            status = [event, None]
+            t = Thread(target = self._run, args = (status,), name = "SQLiteReader-%d" % i)
+            t.setDaemon(True)
+            t.start()
+            self.threads.append(t)
+            ready.append(status)
+        for event, error in ready:
+            event.wait()
+        errors = [status[1] for status in ready if status[1] is not None]
+        if errors:
+            self.stop()
+            raise errors[0]
+
+    def _run(self, status):
+        try:
+            con = apsw.Connection(self.db_path, flags = apsw.SQLITE_OPEN_READONLY)
+            con.setbusytimeout(self.busytimeout)
+            cur = con.cursor()
+        except Exception, e:
+            status[1] = e
+            status[0].set()
+            return
+        status[0].set()
+
+        try:
+            while True:
+                job = self.queue.get()
+                if job is None:
+                    break
+
+                started = time()
+                try:
+                    if job.args is None:
+                        job.rows = list(cur.execute(job.sql))
+                    else:
+                        job.rows = list(cur.execute(job.sql, job.args))
+                except Exception, e:
+                    job.error = e
+                self.stats.add(started - job.queued, time() - started)
+                job.event.set()
+        finally:
+            cur.close()
+            con.close()
+
+    def fetchall(self, sql, args = None):
+        """
+        Returns the rows of query SQL, executed on one of the reader threads.
+        Exceptions raised by the query are raised here.
+        """
+        job = ReadJob(sql, args)
+        self.queue.put(job)
+        if not job.event.wait(READER_TIMEOUT) and not job.event.isSet():
+            print_stack()
+            print >> sys.stderr, "GOT TIMEOUT ON SQLiteReaderPool", sql
+            return []
+
+        if job.error is not None:
+            if DEBUG:
+                print >> sys.stderr, "SQLiteReaderPool: error", job.error, "in", sql, job.args
+            raise job.error
+        return job.rows
+
+    def fetchone(self, sql, args = None):
+        """
+        Like SQLiteCacheDBBase.fetchone: returns the single value of the
+        first row, the first row when it has several values, or None.
+        """
+        rows = self.fetchall(sql, args)
+        if not rows:
+            return None
+        row = rows[0]
+        if len(row) > 1:
+            return row
+        return row[0]
+
+    def get_stats(self):
+        stats = self.stats.get()
+        stats['threads'] = len(self.threads)
+        stats['queued'] = self.queue.qsize()
+        return stats
+
+    def stop(self):
+        for t in self.threads:
+            self.queue.put(None)
+        self.threads = []
@@ -10,8 +10,13 @@ results.
 The obvious example is when Tribler does a lookup to gather information about
 an infohash, and a few seconds later the user clicks 'download', thus calling
 pymdht.get_peers() again.\
+
+Cached lookups are kept in a dictionary by info_hash, and in a queue in the
+order they were created so expired ones can be removed from its front.
 """
 
+from collections import deque
+
 import ptime as time
 
 CACHING_NODE = ('0.0.0.0', 0)
@@ -26,24 +31,45 @@ class CachedLookup(object):
     def add_peers(self, peers):
         for peer in peers:
             self.peers.add(peer)
-    
+
 
 class Cache(object):
 
     def __init__(self, validity_time):
         self.validity_time = validity_time
-        self.cached_lookups = []
+        self.cached_lookups = {}
+        self._queue = deque()
 
     def put_cached_lookup(self, cached_lookup):
         # first remove expired chached lookups
-        for i in range(len(self.cached_lookups)):
-            if time.time() > (self.cached_lookups[i].start_ts +
-                              self.validity_time):
-                del self.cached_lookups[i]
-        self.cached_lookups.append(cached_lookup)
-        
+        self._remove_expired()
+        self.cached_lookups[cached_lookup.info_hash] = cached_lookup
+        self._queue.append(cached_lookup)
+
     def get_cached_lookup(self, info_hash):
-        for cached_lookup in self.cached_lookups:
-            if cached_lookup.info_hash == info_hash:
-                if time.time() < cached_lookup.start_ts + self.validity_time:
-                    return cached_lookup.peers, CACHING_NODE
+        cached_lookup = self.cached_lookups.get(info_hash)
+        if cached_lookup and \
+                time.time() < cached_lookup.start_ts + self.validity_time:
+            return cached_lookup.peers, CACHING_NODE
+
+    def add_peers(self, info_hash, peers):
+        """
+        Add peers to the valid cached lookup for info_hash, creating one if
+        needed.
+
+        """
+        cached_lookup = self.cached_lookups.get(info_hash)
+        if not cached_lookup or \
+                time.time() >= cached_lookup.start_ts + self.validity_time:
+            cached_lookup = CachedLookup(info_hash)
+            self.put_cached_lookup(cached_lookup)
+        cached_lookup.add_peers(peers)
+
+    def _remove_expired(self):
+        oldest_valid_ts = time.time() - self.validity_time
+        while self._queue and self._queue[0].start_ts < oldest_valid_ts:
+            cached_lookup = self._queue.popleft()
+            # it may have been replaced by a newer one
+            if self.cached_lookups.get(
+                cached_lookup.info_hash) is cached_lookup:
+                del self.cached_lookups[cached_lookup.info_hash]
@@ -20,6 +20,7 @@ import ptime as time
 import datetime
 import os
 import cPickle
+from collections import deque
 
 import logging, logging_conf
 
@@ -31,6 +32,7 @@ from querier import Querier
 from message import QUERY, RESPONSE, ERROR
 from node import Node
 import responder
+import cache
 #import pkgutil
 
 #from profilestats import profile
@@ -43,7 +45,40 @@ STATE_FILENAME = 'pymdht.state'
 #TIMEOUT_DELAY = 2
 
 CACHE_VALID_PERIOD = 5 * 60 # 5 minutes
-MAX_PENDING_LOOKUPS = 5
+MAX_PENDING_LOOKUPS = 5000 # When exceeded, the oldest one is given up
+MAX_RUNNING_LOOKUPS = 64
+# Lookups are started while less than this many queries per second were sent
+# (on average, with bursts up to the same number)
+MAX_QUERIES_PER_SECOND = 200
+# Nodes that responded to a lookup are remembered (by the first byte of their
+# id) to bootstrap later lookups for nearby targets
+NEARBY_NODES_PER_PREFIX = 8
+STATS_PERIOD = 60 # lookups/sec is measured over the last minute
+
+
+class _ScheduledLookup(object):
+
+    '''
+    A get_peers lookup that was requested one or more times. The peers found
+    by the lookup are passed on to all requesters.
+    '''
+
+    def __init__(self, info_hash, bt_port):
+        self.info_hash = info_hash
+        self.bt_port = bt_port
+        self.request_ts = time.time()
+        self.start_ts = None
+        # (lookup_id, callback_f) of each requester
+        self.callbacks = []
+
+    def add_callback(self, lookup_id, callback_f):
+        if callback_f and callable(callback_f):
+            self.callbacks.append((lookup_id, callback_f))
+
+    def callback_f(self, _, peers, node_):
+        # each requester gets its own lookup_id
+        for lookup_id, callback_f in self.callbacks:
+            callback_f(lookup_id, peers, node_)
 
 class Controller:
 
@@ -86,8 +121,23 @@ class Controller:
         self._next_maintenance_ts = current_ts
         self._next_timeout_ts = current_ts
         self._next_main_loop_call_ts = current_ts
-        self._pending_lookups = []
-        self._cached_lookups = []
+        # _ScheduledLookup objects waiting to be started
+        self._pending_lookups = deque()
+        # info_hash -> _ScheduledLookup, pending or running
+        self._scheduled_lookups = {}
+        # lookup_obj -> _ScheduledLookup
+        self._running_lookups = {}
+        self._cache = cache.Cache(CACHE_VALID_PERIOD)
+        # first byte of node id -> nodes that responded to a lookup
+        self._nearby_nodes = {}
+        self._query_budget = MAX_QUERIES_PER_SECOND
+        self._query_budget_ts = current_ts
+        # lookup statistics
+        self._num_lookups = 0
+        self._num_coalesced_lookups = 0
+        self._num_cached_lookups = 0
+        self._total_lookup_time = 0.0
+        self._lookup_done_tss = deque()
                 
     def on_stop(self):
         self._experimental_m.on_stop()
@@ -103,67 +153,170 @@ class Controller:
         This method is designed to be used as minitwisted's external handler.
 
         """
-        if len(self._pending_lookups) >= MAX_PENDING_LOOKUPS:
-            del self._pending_lookups[0]
         datagrams_to_send = []
         logger.debug('get_peers %d %r' % (bt_port, info_hash))
         if use_cache:
             peers = self._get_cached_peers(info_hash)
             if peers and callback_f and callable(callback_f):
+                self._num_cached_lookups += 1
                 callback_f(lookup_id, peers, None)
                 callback_f(lookup_id, None, None)
                 return datagrams_to_send
-        self._pending_lookups.append(self._lookup_m.get_peers(lookup_id,
-                                                              info_hash,
-                                                              callback_f,
-                                                              bt_port))
+        scheduled = self._scheduled_lookups.get(info_hash)
+        if scheduled and bt_port in (0, scheduled.bt_port):
+            # Join the lookup for this info_hash. Give the peers found so
+            # far (if any) right away.
+            self._num_coalesced_lookups += 1
+            scheduled.add_callback(lookup_id, callback_f)
+            peers = self._get_cached_peers(info_hash)
+            if peers and callback_f and callable(callback_f):
+                callback_f(lookup_id, peers, None)
+            return datagrams_to_send
+        if len(self._pending_lookups) >= MAX_PENDING_LOOKUPS:
+            # Give up the oldest one
+            self._lookup_done(self._pending_lookups.popleft(), None)
+        scheduled = _ScheduledLookup(info_hash, bt_port)
+        scheduled.add_callback(lookup_id, callback_f)
+        self._scheduled_lookups[info_hash] = scheduled
+        self._pending_lookups.append(scheduled)
         queries_to_send =  self._try_do_lookup()
         datagrams_to_send = self._register_queries(queries_to_send)
         return datagrams_to_send
+
+    def get_lookup_stats(self):
+        """
+        Return a dictionary with the number of pending, running and
+        completed lookups, the number of lookups completed per second (over
+        the last STATS_PERIOD seconds) and their mean latency in seconds,
+        from the get_peers call to the end of the lookup.
+
+        """
+        oldest_ts = time.time() - STATS_PERIOD
+        while self._lookup_done_tss and self._lookup_done_tss[0] < oldest_ts:
+            self._lookup_done_tss.popleft()
+        mean_latency = 0.0
+        if self._num_lookups:
+            mean_latency = self._total_lookup_time / self._num_lookups
+        return {'pending': len(self._pending_lookups),
+                'running': len(self._running_lookups),
+                'completed': self._num_lookups,
+                'coalesced': self._num_coalesced_lookups,
+                'cached': self._num_cached_lookups,
+                'pending_queries': self._querier.num_pending_queries(),
+                'lookups_per_sec': len(self._lookup_done_tss) / float(
+                    STATS_PERIOD),
+                'mean_latency': mean_latency}
     
     def _get_cached_peers(self, info_hash):
-        oldest_valid_ts = time.time() - CACHE_VALID_PERIOD
-        for ts, cached_info_hash, peers in self._cached_lookups:
-            if ts > oldest_valid_ts and info_hash == cached_info_hash:
-                return peers
+        cached = self._cache.get_cached_lookup(info_hash)
+        if cached:
+            return list(cached[0])
 
     def _add_cache_peers(self, info_hash, peers):
-        oldest_valid_ts = time.time() - CACHE_VALID_PERIOD
-        while self._cached_lookups and self._cached_lookups[0][0] < oldest_valid_ts:
-            # clean up old entries
-            del self._cached_lookups[0]
-        if self._cached_lookups and self._cached_lookups[-1][1] == info_hash:
-            self._cached_lookups[-1][2].extend(peers)
-        else:
-            self._cached_lookups.append((time.time(), info_hash, peers))
+        self._cache.add_peers(info_hash, peers)
+
+    def _add_nearby_node(self, node_):
+        if not node_.id:
+            return
+        nodes = self._nearby_nodes.setdefault(node_.id.bin_id[0], deque())
+        if node_ not in nodes:
+            nodes.append(node_)
+            if len(nodes) > NEARBY_NODES_PER_PREFIX:
+                nodes.popleft()
+
+    def _remove_nearby_node(self, node_):
+        if not node_.id:
+            return
+        nodes = self._nearby_nodes.get(node_.id.bin_id[0])
+        if nodes and node_ in nodes:
+            nodes.remove(node_)
+
+    def _get_query_budget(self):
+        current_ts = time.time()
+        self._query_budget = min(MAX_QUERIES_PER_SECOND,
+                                 self._query_budget + MAX_QUERIES_PER_SECOND *
+                                 (current_ts - self._query_budget_ts))
+        self._query_budget_ts = current_ts
+        return self._query_budget
 
     def _try_do_lookup(self):
         queries_to_send = []
-        if self._pending_lookups:
-            lookup_obj = self._pending_lookups[0]
-        else:
-            return queries_to_send
-        distance = lookup_obj.info_hash.distance(self._my_id)
-        bootstrap_rnodes = self._routing_m.get_closest_rnodes(distance.log,
-                                                              0,
-                                                              True)
-        #TODO: get the full bucket
-        if bootstrap_rnodes:
-            del self._pending_lookups[0]
+        while self._pending_lookups and \
+                len(self._running_lookups) < MAX_RUNNING_LOOKUPS:
+            # _register_queries() takes queries_to_send from the budget
+            budget = self._get_query_budget() - len(queries_to_send)
+            if budget <= 0:
+                # Wait until queries can be sent again
+                next_lookup_attempt_ts = time.time() + \
+                    (1 - budget) / MAX_QUERIES_PER_SECOND
+                self._next_main_loop_call_ts = min(
+                    self._next_main_loop_call_ts, next_lookup_attempt_ts)
+                break
+            scheduled = self._pending_lookups[0]
+            distance = scheduled.info_hash.distance(self._my_id)
+            bootstrap_rnodes = self._routing_m.get_closest_rnodes(
+                distance.log, 0, True)
+            #TODO: get the full bucket
+            if not bootstrap_rnodes:
+                next_lookup_attempt_ts = time.time() + .2
+                self._next_main_loop_call_ts = min(
+                    self._next_main_loop_call_ts, next_lookup_attempt_ts)
+                break
+            self._pending_lookups.popleft()
+            # Nodes close to the target that responded to earlier lookups
+            nearby_nodes = self._nearby_nodes.get(
+                scheduled.info_hash.bin_id[0], ())
+            bootstrap_rnodes = list(nearby_nodes) + [
+                rnode for rnode in bootstrap_rnodes
+                if rnode not in nearby_nodes]
+            lookup_id = None
+            if scheduled.callbacks:
+                lookup_id = scheduled.callbacks[0][0]
+            lookup_obj = self._lookup_m.get_peers(lookup_id,
+                                                  scheduled.info_hash,
+                                                  scheduled.callback_f,
+                                                  scheduled.bt_port)
+            scheduled.start_ts = time.time()
+            self._running_lookups[lookup_obj] = scheduled
             # look if I'm tracking this info_hash
-            peers = self._tracker.get(lookup_obj.info_hash)
-            callback_f = lookup_obj.callback_f
+            peers = self._tracker.get(scheduled.info_hash)
             if peers:
-                self._add_cache_peers(lookup_obj.info_hash, peers)
-                if callback_f and callable(callback_f):
-                    callback_f(lookup_obj.lookup_id, peers, None)
+                self._add_cache_peers(scheduled.info_hash, peers)
+                scheduled.callback_f(lookup_id, peers, None)
             # do the lookup
-            queries_to_send = lookup_obj.start(bootstrap_rnodes)
-        else:
-            next_lookup_attempt_ts = time.time() + .2
-            self._next_main_loop_call_ts = min(self._next_main_loop_call_ts,
-                                               next_lookup_attempt_ts)
+            lookup_queries = lookup_obj.start(bootstrap_rnodes)
+            if lookup_queries:
+                queries_to_send.extend(lookup_queries)
+            else:
+                # nobody to ask
+                self._lookup_done(scheduled, lookup_obj)
+                scheduled.callback_f(lookup_id, None, None)
         return queries_to_send
+
+    def _lookup_done(self, scheduled, lookup_obj):
+        '''
+        Bookkeeping of a lookup that completed (lookup_obj) or was given up
+        before starting (lookup_obj is None).
+        '''
+        if lookup_obj is None:
+            # Tell the requesters there is nothing to wait for
+            scheduled.callback_f(None, None, None)
+        elif self._running_lookups.pop(lookup_obj, None) is None:
+            # Not a get_peers lookup, or already done
+            return
+        if self._scheduled_lookups.get(scheduled.info_hash) is scheduled:
+            del self._scheduled_lookups[scheduled.info_hash]
+        current_ts = time.time()
+        self._num_lookups += 1
+        self._total_lookup_time += current_ts - scheduled.request_ts
+        self._lookup_done_tss.append(current_ts)
+        # A pending lookup may be started now
+        self._next_main_loop_call_ts = current_ts
+
+    def _on_lookup_done(self, lookup_obj):
+        scheduled = self._running_lookups.get(lookup_obj)
+        if scheduled:
+            self._lookup_done(scheduled, lookup_obj)
     
     def print_routing_table_stats(self):
         self._routing_m.print_stats()
@@ -295,11 +448,13 @@ class Controller:
                 lookup_obj = related_query.lookup_obj
                 lookup_id = lookup_obj.lookup_id
                 callback_f = lookup_obj.callback_f
+                self._add_nearby_node(msg.src_node)
                 if peers:
                     self._add_cache_peers(lookup_obj.info_hash, peers)
                     if callback_f and callable(callback_f):
                         callback_f(lookup_id, peers, msg.src_node)
                 if lookup_done:
+                    self._on_lookup_done(lookup_obj)
                     if callback_f and callable(callback_f):
                         callback_f(lookup_id, None, msg.src_node)
                     queries_to_send = self._announce(
@@ -353,6 +508,8 @@ class Controller:
                     datagrams = self._announce(related_query.lookup_obj)
                     datagrams_to_send.extend(datagrams)
                 callback_f = related_query.lookup_obj.callback_f
+                if lookup_done:
+                    self._on_lookup_done(related_query.lookup_obj)
                 if callback_f and callable(callback_f):
                     lookup_id = related_query.lookup_obj.lookup_id
                     if lookup_done:
@@ -390,7 +547,9 @@ class Controller:
              ) = related_query.lookup_obj.on_timeout(related_query.dst_node)
             queries_to_send.extend(lookup_queries_to_send)
             callback_f = related_query.lookup_obj.callback_f
+            self._remove_nearby_node(related_query.dst_node)
             if lookup_done:
+                self._on_lookup_done(related_query.lookup_obj)
                 # Size estimation
                 if size_estimation:
                     line = '%d %d\n' % (
@@ -427,6 +586,7 @@ class Controller:
             return []
         timeout_call_ts, datagrams_to_send = self._querier.register_queries(
             queries_to_send)
+        self._query_budget -= len(queries_to_send)
         self._next_main_loop_call_ts = min(self._next_main_loop_call_ts,
                                            timeout_call_ts)
         return datagrams_to_send
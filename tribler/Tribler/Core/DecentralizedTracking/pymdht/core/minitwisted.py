@@ -132,17 +132,16 @@ class ThreadedReactor(threading.Thread):
     def run_one_step(self):
         """Main loop activated by calling self.start()"""
 
-        # Deal with call_asap requests
+        # Deal with call_asap requests (all of them, many lookups may be
+        # requested at once)
         #TODO: retry for 5 seconds if no msgs_to_send (inside controller?)
-        call_asap_tuple = None
         self._lock.acquire()
         try:
-            if self._call_asap_queue:
-                call_asap_tuple = self._call_asap_queue.pop(0)
+            call_asap_queue = self._call_asap_queue
+            self._call_asap_queue = []
         finally:
             self._lock.release()
-        if call_asap_tuple:
-            callback_f, args, kwds = call_asap_tuple
+        for callback_f, args, kwds in call_asap_queue:
             datagrams_to_send = callback_f(*args, **kwds)
             for datagram in datagrams_to_send:
                 self._sendto(datagram)
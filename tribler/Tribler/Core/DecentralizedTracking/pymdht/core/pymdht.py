@@ -99,6 +99,11 @@ class Pymdht:
                                callback_f, bt_port,
                                use_cache)
 
+    def get_lookup_stats(self):
+        """ Return a dictionary with lookup statistics, see
+        controller.Controller.get_lookup_stats. """
+        return self.controller.get_lookup_stats()
+
     def print_routing_table_stats(self):
         self.controller.print_routing_table_stats()
 
@@ -18,6 +18,7 @@ with.
 
 """
 import sys
+from collections import deque
 
 import logging
 
@@ -39,7 +40,9 @@ class Querier(object):
     def __init__(self):#, my_id):
 #        self.my_id = my_id
         self._pending = {}
-        self._timeouts = []
+        # All queries (of all lookups) share TIMEOUT_DELAY, thus they time
+        # out in the order they were registered
+        self._timeouts = deque()
         self._tid = [0, 0]
 
     def _next_tid(self):
@@ -74,6 +77,9 @@ class Querier(object):
                     query.dst_node.addr))
         return timeout_ts, datagrams
 
+    def num_pending_queries(self):
+        return len(self._timeouts)
+
     def get_related_query(self, response_msg):
         """
         Return the message.OutgoingQueryBase object related to the
@@ -109,7 +115,7 @@ class Querier(object):
             if current_ts < timeout_ts:
                 next_timeout_ts = timeout_ts
                 break
-            self._timeouts = self._timeouts[1:]
+            self._timeouts.popleft()
             addr_query_list = self._pending[query.dst_node.addr]
             assert query == addr_query_list.pop(0)
             if not addr_query_list:
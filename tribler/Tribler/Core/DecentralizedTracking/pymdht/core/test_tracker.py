@@ -0,0 +1,84 @@
+# Copyright (C) 2009-2011 Raul Jimenez, Flutra Osmani
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+import ptime as time
+import tracker
+
+
+class TestTracker(object):
+
+    def setup(self):
+        # a clock that only moves when told to
+        self.now = 1000.0
+        self._time = time.time
+        time.time = lambda: self.now
+        self.t = tracker.Tracker(validity_period=10,
+                                 max_peers_per_key=8,
+                                 max_stored_peers=4)
+
+    def teardown(self):
+        time.time = self._time
+
+    def _check_counters(self):
+        num_peers = sum([len(peer_seq) for peer_seq, seq_peers in
+                         self.t._tracker_dict.itervalues()])
+        assert self.t.num_keys == len(self.t._tracker_dict)
+        assert self.t.num_peers == num_peers
+
+    def test_put_get(self):
+        self.t.put('k', 'p1')
+        self.now += 1
+        self.t.put('k', 'p2')
+        assert self.t.get('k') == ['p1', 'p2']
+        assert self.t.get('other') == []
+        self._check_counters()
+
+    def test_reannounce(self):
+        self.t.put('k', 'p1')
+        self.now += 1
+        self.t.put('k', 'p2')
+        self.now += 1
+        self.t.put('k', 'p1')
+        assert self.t.get('k') == ['p2', 'p1']
+        assert self.t.num_peers == 2
+        self._check_counters()
+
+    def test_reannounce_same_timestamp(self):
+        self.t.put('k', 'p1')
+        self.t.put('k', 'p1')
+        self.t.put('k', 'p2')
+        self.t.put('k', 'p1')
+        assert self.t.get('k') == ['p2', 'p1']
+        assert self.t.num_peers == 2
+        self._check_counters()
+
+    def test_reannounce_same_timestamp_after_eviction(self):
+        for peer in ('p1', 'p2', 'p3', 'p4', 'p5'):
+            self.t.put('k', peer)
+        # p1 was evicted, its entry is still in the list
+        assert self.t.get('k') == ['p2', 'p3', 'p4', 'p5']
+        self.t.put('k', 'p1')
+        assert self.t.get('k') == ['p3', 'p4', 'p5', 'p1']
+        self._check_counters()
+
+    def test_expire(self):
+        self.t.put('k1', 'p1')
+        self.now += 6
+        self.t.put('k2', 'p2')
+        self.now += 6
+        assert self.t.get('k1') == []
+        assert self.t.get('k2') == ['p2']
+        assert self.t.num_keys == 1
+        self._check_counters()
+        self.now += 6
+        assert self.t.get('k2') == []
+        assert self.t.num_keys == 0
+        assert self.t.num_peers == 0
+
+    def test_trim_key(self):
+        self.t.max_stored_peers = 100
+        for i in xrange(9):
+            self.t.put('k', i)
+        assert self.t.get('k') == range(3, 9)
+        self._check_counters()
@@ -2,62 +2,136 @@
 # Released under GNU LGPL 2.1
 # See LICENSE.txt for more information
 
+from collections import deque
+
 import ptime as time
 
 VALIDITY_PERIOD = 30 * 60 #30 minutes
-CLEANUP_COUNTER = 100
 
 MAX_PEERS = 50 # Avoids way too long get_peers respoonses (longer than UDP
+MAX_PEERS_PER_KEY = 1000 # When exceeded, the oldest quarter is dropped
+MAX_STORED_PEERS = 500000 # When exceeded, the oldest announcements are dropped
 
 #TODO: avoid tracking several ports from the same IP address!
 
 class Tracker(object):
 
+    '''
+    Every put gets a sequence number. Each key maps to a {peer: seq} dict,
+    used to find duplicates, and a list of (seq, peer) tuples in put order.
+    Every put is also appended to a queue in time order. Expired (and, when
+    the tracker is full, least recently announced) peers are removed from
+    the front of the queue, so the cost of cleaning up is spread over the
+    puts.
+
+    Entries for peers that announced again or were removed stay in the lists
+    and the queue. They are skipped because their sequence number no longer
+    matches the dict. (Timestamps can't be used for that, announcements may
+    get the same one.) A list is rebuilt when they outnumber the stored
+    peers, the queue drops them when they reach its front.
+    '''
+
     def __init__(self, validity_period=VALIDITY_PERIOD,
-                 cleanup_counter=CLEANUP_COUNTER):
+                 max_peers_per_key=MAX_PEERS_PER_KEY,
+                 max_stored_peers=MAX_STORED_PEERS):
+        # k -> ({peer: seq}, [(seq, peer)])
         self._tracker_dict = {}
+        # (ts, seq, k, peer) tuples, oldest first
+        self._queue = deque()
+        self._seq = 0
         self.validity_period = validity_period
-        self.cleanup_counter = cleanup_counter
-        self._put_counter = 0
+        self.max_peers_per_key = max_peers_per_key
+        self.max_stored_peers = max_stored_peers
         self.num_keys = 0
         self.num_peers = 0
-        
+
     def put(self, k, peer):
-        #Clean up every n puts
-        self._put_counter += 1
-        if self._put_counter == self.cleanup_counter:
-            self._put_counter = 0
-            for k_ in self._tracker_dict.keys():
-                ts_peers = self._tracker_dict[k_]
-                self._cleanup_key(k_)
-                if not ts_peers: #empty list. Delete key
-                    del self._tracker_dict[k_]
-                    self.num_keys -= 1
-        
-        ts_peers = self._tracker_dict.setdefault(k,[])
-        if not ts_peers:
+        now = time.time()
+        self._expire(now)
+
+        entry = self._tracker_dict.get(k)
+        if entry is None:
+            entry = self._tracker_dict[k] = ({}, [])
             self.num_keys += 1
-        else:
-            # let's see whether the peer is already there
-            for i in range(len(ts_peers)):
-                if ts_peers[i][1] == peer:
-                    self.num_peers -= 1
-                    del ts_peers[i]
-                    break
-        ts_peers.append((time.time(), peer))
-        self.num_peers += 1
+        peer_seq, seq_peers = entry
+        if peer not in peer_seq:
+            self.num_peers += 1
+        self._seq += 1
+        seq = self._seq
+        peer_seq[peer] = seq
+        seq_peers.append((seq, peer))
+        self._queue.append((now, seq, k, peer))
+
+        if len(peer_seq) > self.max_peers_per_key:
+            self._trim_key(k)
+        elif len(seq_peers) > 2 * len(peer_seq) + MAX_PEERS:
+            self._compact_key(entry)
+        # the queue may also hold an entry for every announcement that was
+        # repeated, bound it too
+        while (self.num_peers > self.max_stored_peers or
+               len(self._queue) > 2 * self.max_stored_peers):
+            self._pop_oldest()
 
     def get(self, k):
-        ts_peers = self._tracker_dict.get(k, [])
-        self._cleanup_key(k)
-        return [ts_peer[1] for ts_peer in ts_peers[-MAX_PEERS:]]
+        self._expire(time.time())
+        entry = self._tracker_dict.get(k)
+        if entry is None:
+            return []
+        peer_seq, seq_peers = entry
+        # the most recent ones
+        peers = []
+        for i in xrange(len(seq_peers) - 1, -1, -1):
+            seq, peer = seq_peers[i]
+            if peer_seq.get(peer) == seq:
+                peers.append(peer)
+                if len(peers) == MAX_PEERS:
+                    break
+        peers.reverse()
+        return peers
+
+    def _is_stored(self, seq, k, peer):
+        entry = self._tracker_dict.get(k)
+        return entry is not None and entry[0].get(peer) == seq
+
+    def _remove(self, k, peer):
+        entry = self._tracker_dict[k]
+        peer_seq = entry[0]
+        del peer_seq[peer]
+        self.num_peers -= 1
+        if not peer_seq: #empty dict. Delete key
+            del self._tracker_dict[k]
+            self.num_keys -= 1
+        elif len(entry[1]) > 2 * len(peer_seq) + MAX_PEERS:
+            self._compact_key(entry)
+
+    def _compact_key(self, entry):
+        peer_seq, seq_peers = entry
+        seq_peers[:] = [(seq, peer) for seq, peer in seq_peers
+                        if peer_seq.get(peer) == seq]
+
+    def _pop_oldest(self):
+        ts, seq, k, peer = self._queue.popleft()
+        if self._is_stored(seq, k, peer):
+            self._remove(k, peer)
+
+    def _expire(self, now):
+        oldest_valid_ts = now - self.validity_period
+        queue = self._queue
+        while queue and queue[0][0] < oldest_valid_ts:
+            self._pop_oldest()
 
-    def _cleanup_key(self, k):
+    def _trim_key(self, k):
         '''
-        Clean up the list as side effect.
+        Drop the oldest quarter of the peers of key k, which happens at most
+        once every max_peers_per_key/4 puts on that key.
         '''
-        ts_peers = self._tracker_dict.get(k, None)
-        oldest_valid_ts = time.time() - self.validity_period
-        while ts_peers and  ts_peers[0][0] < oldest_valid_ts:
-            del ts_peers[0]
-            self.num_peers -= 1
+        peer_seq, seq_peers = self._tracker_dict[k]
+        keep = self.max_peers_per_key - self.max_peers_per_key / 4
+        i = 0
+        while len(peer_seq) > keep:
+            seq, peer = seq_peers[i]
+            if peer_seq.get(peer) == seq:
+                del peer_seq[peer]
+                self.num_peers -= 1
+            i += 1
+        del seq_peers[:i]
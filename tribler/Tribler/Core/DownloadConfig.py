@@ -317,6 +317,25 @@ class DownloadConfigInterface:
         else:
             return self.dlconfig['max_download_rate']
 
+    def set_max_speed_per_peer(self,direct,speed):
+        """ Sets the maximum upload or download speed to or from each peer
+        of this Download.
+        @param direct The direction (UPLOAD/DOWNLOAD) 
+        @param speed The speed in KB/s, 0 for unlimited.
+        """
+        if direct == UPLOAD:
+            self.dlconfig['max_upload_rate_per_peer'] = speed
+        else:
+            self.dlconfig['max_download_rate_per_peer'] = speed
+
+    def get_max_speed_per_peer(self,direct):
+        """ Returns the configured maximum speed per peer.
+        Returns the speed in KB/s. """
+        if direct == UPLOAD:
+            return self.dlconfig['max_upload_rate_per_peer']
+        else:
+            return self.dlconfig['max_download_rate_per_peer']
+
     def set_max_conns_to_initiate(self,nconns):
         """ Sets the maximum number of connections to initiate for this 
         Download.
@@ -23,7 +23,7 @@ class DownloadState(Serializable):
     
     cf. libtorrent torrent_status
     """
-    def __init__(self,download,status,error,progress,stats=None,filepieceranges=None,logmsgs=None,proxyservice_proxy_list=[],proxyservice_doe_list=[],peerid=None,videoinfo=None,swarmcache=None):
+    def __init__(self,download,status,error,progress,stats=None,filepieceranges=None,logmsgs=None,proxyservice_proxy_list=[],proxyservice_doe_list=[],peerid=None,videoinfo=None,swarmcache=None,hashcheckqueue=None):
         """ Internal constructor.
         @param download The Download this state belongs too.
         @param status The status of the Download (DLSTATUS_*)
@@ -33,6 +33,8 @@ class DownloadState(Serializable):
         The get_pieces_complete() returns only completeness information about 
         this range. This is used for playing a video in a multi-torrent file.
         @param logmsgs A list of messages from the BT engine which may be of 
+        @param hashcheckqueue The place of the Download in the hashcheck queue,
+        see get_hashcheck_queue().
         """
         # Raynor Vliegendhart, TODO: documentation of DownloadState seems incomplete?
         # RePEX: @param swarmcache The latest SwarmCache known by Download. This
@@ -47,6 +49,7 @@ class DownloadState(Serializable):
         self.proxyservice_proxy_list = proxyservice_proxy_list
         self.proxyservice_doe_list = proxyservice_doe_list
         self.seedingstats = None #SeedingManager will update downloadstate with seedings stats (version, total_up, total_down, time_seeding)
+        self.hashcheckqueue = hashcheckqueue
         
         # RePEX: stored swarmcache from Download and store current time
         if swarmcache is not None:
@@ -159,6 +162,16 @@ class DownloadState(Serializable):
         @return DLSTATUS_* """
         return self.status
 
+    def get_hashcheck_queue(self):
+        """ Returns the progress of the Download through the hashcheck queue
+        when its status is DLSTATUS_WAITING4HASHCHECK or DLSTATUS_HASHCHECKING.
+        Hashchecks of Downloads on different disks run in parallel.
+        @return A dict with keys 'position' (place in the queue of the disk
+        holding the Download, 1 is next, 0 is being checked), 'waiting' and
+        'checking' (number of Downloads waiting and being checked), or None.
+        """
+        return self.hashcheckqueue
+
     def get_error(self):
         """ Returns the Exception that caused the download to be moved to 
         DLSTATUS_STOPPED_ON_ERROR status.
@@ -192,7 +205,31 @@ class DownloadState(Serializable):
             return self.stats['stats'].upTotal
         else:
             return self.stats['stats'].downTotal
-        
+
+    def get_rate_class(self):
+        """
+        Returns the class of the Download for bandwidth shaping. VOD and live
+        Downloads (RATECLASS_STREAM) get bandwidth before the others
+        (RATECLASS_BULK).
+        @return RATECLASS_*, or None when the Download is not running.
+        """
+        if self.stats is None or 'shaping' not in self.stats:
+            return None
+        return self.stats['shaping']['rateclass']
+
+    def get_class_speed(self,direct,rateclass=None):
+        """
+        Returns the current up or download speed of all Downloads in the
+        Session of the given rate class together.
+        @param rateclass RATECLASS_*, default is the class of this Download.
+        @return The speed in KB/s, as float.
+        """
+        if self.stats is None or 'shaping' not in self.stats:
+            return 0.0
+        if rateclass is None:
+            rateclass = self.stats['shaping']['rateclass']
+        return self.stats['shaping']['classrates'][direct][rateclass]/1024.0
+
     def set_seeding_statistics(self, seedingstats):
         self.seedingstats = seedingstats
         
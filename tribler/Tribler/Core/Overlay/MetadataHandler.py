@@ -2,8 +2,6 @@
 # see LICENSE.txt for license information
 import sys
 import os
-import stat
-import random
 import itertools
 from Tribler.Core.Utilities.Crypto import sha
 from time import time, ctime
@@ -20,6 +18,7 @@ from Tribler.TrackerChecking.TorrentChecking import TorrentChecking
 from Tribler.Core.osutils import getfreespace,get_readable_torrent_name
 from Tribler.Core.CacheDB.CacheDBHandler import BarterCastDBHandler
 from Tribler.Core.CacheDB.SqliteCacheDBHandler import PopularityDBHandler
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 from Tribler.Core.TorrentDef import TorrentDef
 
 DEBUG = False
@@ -32,6 +31,11 @@ overlay_infohash = '\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00
 
 Max_Torrent_Size = 2*1024*1024    # 2MB torrent = 6GB ~ 250GB content
 
+# move .torrent files from the collecting dir into the torrent store in
+# batches of this size, one batch per interval of seconds
+MIGRATE_BATCH_SIZE = 200
+MIGRATE_INTERVAL = 2
+
 
 class MetadataHandler:
     
@@ -46,6 +50,7 @@ class MetadataHandler:
         self.initialized = False
         self.registered = False
         self.popularity_db = PopularityDBHandler.getInstance()
+        self.torrent_store = TorrentStore.getInstance()
 
 
     def getInstance(*args, **kw):
@@ -81,6 +86,7 @@ class MetadataHandler:
         self.initialized = True
         self.rquerytorrenthandler = None
         self.delayed_check_overflow(60)
+        self.overlay_bridge.add_task(self.migrate_collected_torrents, 30)
 
     def load_recently_collected_torrents(self, num_recent, num_random):
         """
@@ -95,44 +101,22 @@ class MetadataHandler:
         NUM_RANDOM is the number or random torrent files that will end
         up in the self.recently_collected_torrents list.
         """
-        # collect all torrents on disk
-        torrent_dir = self.torrent_db.getTorrentDir()
-        join = os.path.join
-        items = [join(torrent_dir, filename) for filename in os.listdir(torrent_dir) if filename.endswith(".torrent")]
-
-        # sort all torrents by creation/modification time
-        get_stat = os.stat
-        ST_MTIME = stat.ST_MTIME
-        items = [(get_stat(filename)[ST_MTIME], filename) for filename in items]
-        items.sort(reverse=True)
-
-        # get last NUM_RECENT and NUM_RANDOM randomly choses items
-        if len(items) >= num_recent:
-            recent_items = items[:num_recent]
-            random_items = random.sample(items[num_recent:], min(num_random, len(items) - num_recent))
-        else:
-            recent_items = items
-            random_items = []
-
-        # append the NUM_RECENT to the list
-        append = self.recently_collected_torrents.append
-        load = TorrentDef.load
-        for _, filename in recent_items:
-            try:
-                torrent_def = load(filename)
-            except:
-                print >> sys.stderr, "MetadataHandler.load_recently_collected_torrents() Invalid .torrent file", filename
-            else:
-                append(torrent_def.get_infohash())
+        recent = self.torrent_store.get_recent(num_recent)
+        self.recently_collected_torrents.extend(recent)
+        self.recently_collected_torrents.extend(self.torrent_store.get_random(num_random, exclude = recent))
 
-        # append the NUM_RANDOM to the list
-        for _, filename in random_items:
-            try:
-                torrent_def = load(filename)
-            except:
-                print >> sys.stderr, "MetadataHandler.load_recently_collected_torrents() Invalid .torrent file", filename
-            else:
-                append(torrent_def.get_infohash())
+    def migrate_collected_torrents(self):
+        """ Move the .torrent files collected before there was a torrent
+        store into it, a batch at a time """
+        try:
+            left = self.torrent_store.migrate(self.torrent_dir, MIGRATE_BATCH_SIZE)
+        except:
+            print_exc()
+            return
+        if left:
+            self.overlay_bridge.add_task(self.migrate_collected_torrents, MIGRATE_INTERVAL)
+        elif DEBUG:
+            print >> sys.stderr, "metadata: migrated collected torrents,", self.torrent_store.get_num_torrents(), "torrents in store"
 
     def register2(self,rquerytorrenthandler):
         self.rquerytorrenthandler = rquerytorrenthandler
@@ -197,10 +181,13 @@ class MetadataHandler:
         
         file_name = get_collected_torrent_filename(infohash)
         torrent_path = os.path.join(self.torrent_dir, file_name)
-        if not os.path.exists(torrent_path):
+        metadata = self.torrent_store.get(infohash)
+        if metadata is None and os.path.exists(torrent_path):
+            # not migrated into the store yet
+            metadata = self.read_torrent(torrent_path)
+        if metadata is None:
             return None,None
         else:
-            metadata = self.read_torrent(torrent_path)
             if not self.valid_metadata(infohash, metadata):
                 return None,None
             self.addTorrentToDB(torrent_path, infohash, metadata, source="BC", extra_info={})
@@ -257,7 +244,7 @@ class MetadataHandler:
                 print >> sys.stderr,"metadata: GET_METADATA: no torrent file name"
             return True
         torrent_path = os.path.join(self.torrent_dir, torrent_file_name)
-        if not os.path.isfile(torrent_path):
+        if not self.torrent_store.has(infohash) and not os.path.isfile(torrent_path):
             if DEBUG:
                 print >> sys.stderr,"metadata: GET_METADATA: not existing", res, torrent_path
             return True
@@ -270,7 +257,9 @@ class MetadataHandler:
         return True
 
     def read_and_send_metadata(self, permid, infohash, torrent_path, selversion):
-        torrent_data = self.read_torrent(torrent_path)
+        torrent_data = self.torrent_store.get(infohash)
+        if torrent_data is None:
+            torrent_data = self.read_torrent(torrent_path)
         if torrent_data:
             # Arno: Don't send private torrents
             try:
@@ -391,7 +380,7 @@ class MetadataHandler:
         # 03/02/10 Boudewijn: addExternalTorrent now requires a
         # torrentdef, consequently we provide the filename through the
         # extra_info dictionary
-        torrentdef = TorrentDef.load(filename)
+        torrentdef = TorrentDef.load_from_dict(bdecode(metadata))
         if not 'filename' in extra_info:
             extra_info['filename'] = filename
         torrent = self.torrent_db.addExternalTorrent(torrentdef, source, extra_info)
@@ -462,12 +451,18 @@ class MetadataHandler:
         if DEBUG:
             print >> sys.stderr,"metadata: Storing torrent", sha(infohash).hexdigest(),"in",file_name
         
-        save_path = self.write_torrent(metadata, self.torrent_dir, file_name)
-        if save_path:
-            self.num_collected_torrents += 1
-            self.free_space -= len(metadata)
-            self.addTorrentToDB(save_path, infohash, metadata, source=source, extra_info=extra_info)
-            # check if space is enough and remove old torrents
+        try:
+            self.torrent_store.put(infohash, metadata)
+        except:
+            print_exc()
+            print >> sys.stderr, "metadata: storing torrent failed"
+            return None
+        # the database keeps the name the torrent would have on disk, the
+        # store writes it there when a caller needs the file
+        save_path = os.path.join(self.torrent_dir, file_name)
+        self.num_collected_torrents += 1
+        self.free_space -= len(metadata)
+        self.addTorrentToDB(save_path, infohash, metadata, source=source, extra_info=extra_info)
             
         return file_name
         
@@ -17,8 +17,10 @@ from time import sleep
 
 from Tribler.Core.simpledefs import INFOHASH_LENGTH
 from Tribler.Core.CacheDB.sqlitecachedb import bin2str
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 from Tribler.Core.TorrentDef import TorrentDef
 from Tribler.Core.Swift.SwiftDef import SwiftDef
+from Tribler.Core.Swift.SwiftHasher import SwiftHasher
 import shutil
 from Tribler.Main.globals import DefaultDownloadStartupConfig
 from Tribler.Core.exceptions import DuplicateDownloadException
@@ -164,6 +166,9 @@ class RemoteTorrentHandler:
             if torrent.get('torrent_file_name', False) and os.path.isfile(torrent['torrent_file_name']):
                 result = torrent['torrent_file_name']
             
+            elif torrent.get('torrent_file_name', False) and TorrentStore.getInstance().extract(infohash, torrent['torrent_file_name']):
+                result = torrent['torrent_file_name']
+            
             elif torrent.get('swift_torrent_hash', False):
                 sdef = SwiftDef(torrent['swift_torrent_hash'])
                 torrent_filename = os.path.join(self.session.get_torrent_collecting_dir(), sdef.get_roothash_as_hex())
@@ -191,14 +196,7 @@ class RemoteTorrentHandler:
         tdef.save(tmp_filename)
         os.close(tmp_handle)
         
-        sdef, swiftpath = self._write_to_collected(tmp_filename)
-        
-        try:
-            os.remove(tmp_filename)
-        except:
-            atexit.register(lambda tmp_filename=tmp_filename: os.remove(tmp_filename))
-        
-        def do_db(callback):
+        def do_db(sdef, swiftpath, callback):
             #add this new torrent to db
             infohash = tdef.get_infohash()
             if self.torrent_db.hasTorrent(infohash):
@@ -210,15 +208,49 @@ class RemoteTorrentHandler:
             self.notify_possible_torrent_infohash(infohash, True)
             if callback:
                 callback()
+        
+        def do_collected(sdef, swiftpath):
+            try:
+                os.remove(tmp_filename)
+            except:
+                atexit.register(lambda tmp_filename=tmp_filename: os.remove(tmp_filename))
             
-        startWorker(None, do_db, wargs = (callback, ))
+            if sdef:
+                startWorker(None, do_db, wargs = (sdef, swiftpath, callback))
+            
+        self._write_to_collected(tmp_filename, do_collected)
     
-    def _write_to_collected(self, filename):
-        #calculate root-hash
-        sdef = SwiftDef()
-        sdef.add_content(filename)
-        sdef.finalize(self.session.get_swift_path(), destdir = self.session.get_torrent_collecting_dir())
+    def _write_to_collected(self, filename, callback):
+        """ Calculate the root-hash of the .torrent filename on the hashing
+        thread pool, and copy it to the collecting dir. Calls callback with
+        the SwiftDef and the path in the collecting dir, or with (None, None)
+        when filename could not be hashed, from a pool thread. """
+        def do_hashed(roothash):
+            if roothash is None:
+                print >>sys.stderr,'rtorrent: could not calculate root-hash of', filename
+                callback(None, None)
+            else:
+                sdef, swiftpath = self._move_to_collected(filename, roothash)
+                callback(sdef, swiftpath)
         
+        SwiftHasher.getInstance().hash_async([filename], do_hashed, destpath = filename)
+    
+    def _write_batch_to_collected(self, filenames):
+        """ As _write_to_collected for many .torrent files at once. Blocks
+        until all are hashed, and returns a list of (SwiftDef, path in the
+        collecting dir) in the order of filenames, (None, None) for files
+        that could not be hashed. """
+        result = []
+        roothashes = SwiftHasher.getInstance().hash_batch(filenames)
+        for filename, roothash in zip(filenames, roothashes):
+            if roothash is None:
+                result.append((None, None))
+            else:
+                result.append(self._move_to_collected(filename, roothash))
+        return result
+    
+    def _move_to_collected(self, filename, roothash):
+        sdef = SwiftDef(roothash)
         mfpath = os.path.join(self.session.get_torrent_collecting_dir(),sdef.get_roothash_as_hex())
         if not os.path.exists(mfpath):
             if os.path.exists(mfpath + ".mhash"): #indicating active swift download
@@ -236,6 +268,12 @@ class RemoteTorrentHandler:
                 
             except:
                 print_exc()
+        else:
+            for ext in ('.mhash', '.mbinmap'):
+                try:
+                    os.remove(filename+ext)
+                except:
+                    pass
         
         return sdef, mfpath
     
@@ -371,6 +371,36 @@ class Session(SessionRuntimeConfig):
         """
         self.lm.set_download_states_callback(usercallback,getpeerlist)
 
+    def set_download_states_changed_callback(self,usercallback,getpeerlist=False):
+        """
+        Like set_download_states_callback(), except that the list of
+        DownloadStates passed to usercallback only contains those of the
+        Downloads whose state changed since the previous call: their status
+        or number of peers changed, their progress changed by 0.1% or more,
+        or a speed changed by 10% and at least 1 KB/s. The first call
+        includes all Downloads. Removed Downloads are not reported.
+
+        This is much cheaper than set_download_states_callback() for many
+        Downloads, as for unchanged Downloads no DownloadState is created.
+
+        @param usercallback A function adhering to the above spec.
+        """
+        self.lm.set_download_states_changed_callback(usercallback,getpeerlist)
+
+    def get_download_states_poll_stats(self):
+        """
+        Returns the time spent on the network thread to create the
+        DownloadStates for set_download_states_callback() and 
+        set_download_states_changed_callback(). 
+        
+        @return A dict with keys 'all' and 'changed' for the polls made via 
+        either method. Each value is a dict with the number of 'polls', the
+        'total', 'max' and 'last' time spent in seconds, and the number of
+        Downloads 'checked' and 'reported' in the last poll. 
+        """
+        # locking by lm
+        return self.lm.get_download_states_poll_stats()
+
 
     #
     # Config parameters that only exist at runtime
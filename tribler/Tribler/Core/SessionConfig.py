@@ -184,6 +184,61 @@ class SessionConfigInterface:
         @return A number of seconds. """
         return self.sessconfig['timeout_check_interval']
 
+    #
+    # Hash checking of existing data when Downloads are started
+    #
+    def set_hashcheck_concurrency(self,value):
+        """ Maximum number of Downloads that check the integrity of their
+        data on disk at the same time (default = 4). Downloads that have
+        (almost) no data to check do not count.
+        @param value A number of Downloads.
+        """
+        self.sessconfig['hashcheck_concurrency'] = value
+
+    def get_hashcheck_concurrency(self):
+        """ Returns the maximum number of Downloads hashchecking at the same
+        time.
+        @return A number of Downloads. """
+        return self.sessconfig['hashcheck_concurrency']
+
+    def set_hashcheck_per_disk(self,value):
+        """ Maximum number of Downloads with data on the same disk that are
+        hashchecking at the same time (default = 1). More than one makes
+        spinning disks seek between the torrents.
+        @param value A number of Downloads.
+        """
+        self.sessconfig['hashcheck_per_disk'] = value
+
+    def get_hashcheck_per_disk(self):
+        """ Returns the maximum number of Downloads per disk hashchecking at
+        the same time.
+        @return A number of Downloads. """
+        return self.sessconfig['hashcheck_per_disk']
+
+    #
+    # Bandwidth shaping
+    #
+    def set_max_speed(self,direct,speed):
+        """ Sets the maximum upload or download speed of all Downloads
+        together. Within this limit VOD and live Downloads go before the 
+        others, and each Download is limited by its own maximum speeds 
+        (see DownloadConfig.set_max_speed() and set_max_speed_per_peer()).
+        @param direct The direction (UPLOAD/DOWNLOAD) 
+        @param speed The speed in KB/s, 0 for unlimited.
+        """
+        if direct == UPLOAD:
+            self.sessconfig['global_max_upload_rate'] = speed
+        else:
+            self.sessconfig['global_max_download_rate'] = speed
+
+    def get_max_speed(self,direct):
+        """ Returns the configured maximum speed of all Downloads together.
+        @return The speed in KB/s. """
+        if direct == UPLOAD:
+            return self.sessconfig['global_max_upload_rate']
+        else:
+            return self.sessconfig['global_max_download_rate']
+
     #
     # Enable/disable Tribler features 
     #
@@ -550,6 +605,18 @@ class SessionConfigInterface:
         @return URL. """
         return self.sessconfig['tracker_url']
 
+    def set_internal_tracker_udp_port(self,value):
+        """ Also serve the internal tracker over UDP (BEP 15) on this port
+        (default = 0, no UDP tracker).
+        @param value A port number.
+        """
+        self.sessconfig['tracker_udp_port'] = value
+
+    def get_internal_tracker_udp_port(self):
+        """ Returns the UDP port of the internal tracker, 0 if disabled.
+        @return Port number. """
+        return self.sessconfig['tracker_udp_port']
+
 
     def set_mainline_dht(self,value):
         """ Enable mainline DHT support (default = True)
@@ -1363,6 +1430,34 @@ class SessionConfigInterface:
         @return A number of downloads. """
         return self.sessconfig['swiftdlsperproc']
 
+    def set_swift_process_pool_size(self,value):
+        """ Number of swift processes that are kept running with room for
+        another download, such that starting a swift Download does not 
+        have to wait for a new swift process (default = 1).
+        @param value A number of processes.
+        """
+        self.sessconfig['swiftprocpoolsize'] = value
+
+    def get_swift_process_pool_size(self):
+        """ Returns the number of swift processes kept ready for new 
+        downloads.
+        @return A number of processes. """
+        return self.sessconfig['swiftprocpoolsize']
+
+    def set_swift_process_idle_timeout(self,value):
+        """ Number of seconds a swift process without downloads is kept
+        alive, in addition to the process pool (default = 300). 0 stops
+        such processes right away.
+        @param value A number of seconds.
+        """
+        self.sessconfig['swiftprocidletimeout'] = value
+
+    def get_swift_process_idle_timeout(self):
+        """ Returns the number of seconds a swift process without downloads 
+        is kept alive.
+        @return A number of seconds. """
+        return self.sessconfig['swiftprocidletimeout']
+
     
     #
     # Config for swift tunneling e.g. dispersy traffic
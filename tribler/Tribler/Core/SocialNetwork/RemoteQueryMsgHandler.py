@@ -23,6 +23,7 @@ from Tribler.Core.simpledefs import *
 from Tribler.Core.BitTornado.bencode import bencode,bdecode
 from Tribler.Core.CacheDB.sqlitecachedb import bin2str, str2bin
 from Tribler.Core.CacheDB.CacheDBHandler import ChannelCastDBHandler,PeerDBHandler
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 from Tribler.Core.BitTornado.BT1.MessageID import *
 from Tribler.Core.BuddyCast.moderationcast_util import *
 from Tribler.Core.TorrentDef import TorrentDef
@@ -357,6 +358,7 @@ class RemoteQueryMsgHandler:
         
     def create_remote_query_reply(self,id,hits,selversion):
         getsize = os.path.getsize
+        get_length = TorrentStore.getInstance().get_length
         join = os.path.join
         d = {}
         d['id'] = id
@@ -376,7 +378,10 @@ class RemoteQueryMsgHandler:
             if selversion >= OLPROTO_VER_NINETH:
                 if torrent['torrent_file_name']:
                     file = join(self.torrent_dir, torrent['torrent_file_name'])
-                    if isfile(file):
+                    torrent_size = get_length(torrent['infohash'])
+                    if torrent_size is not None:
+                        r['torrent_size'] = torrent_size
+                    elif isfile(file):
                         r['torrent_size'] = getsize(file)
                     else:
                         continue
@@ -540,10 +545,11 @@ class RemoteQueryMsgHandler:
         if sendtorrents:
             
             print >>sys.stderr,"rqmh: search_torrents: adding torrents"
+            torrent_store = TorrentStore.getInstance()
             for hit in hits:
                 filename = os.path.join(colltorrdir,hit['torrent_file_name'])
                 try:
-                    tdef = TorrentDef.load(filename)
+                    tdef = TorrentDef.load_from_dict(bdecode(torrent_store.read(hit['infohash'],filename)))
                     if tdef.get_url_compat():
                         metatype = URL_MIME_TYPE
                         metadata = tdef.get_url()
@@ -17,9 +17,10 @@ from binascii import hexlify
 from Tribler.Core.simpledefs import INFOHASH_LENGTH
 from Tribler.Core.CacheDB.CacheDBHandler import TorrentDBHandler
 from Tribler.Core.CacheDB.sqlitecachedb import bin2str
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 from Tribler.Core.Utilities.utilities import get_collected_torrent_filename
 from Tribler.Core.TorrentDef import TorrentDef
-from Tribler.Core.Swift.SwiftDef import SwiftDef
+from Tribler.Core.Swift.SwiftHasher import SwiftHasher
 
 DEBUG = False
 
@@ -264,7 +265,7 @@ class MagnetRequester():
                         torrent_filename = os.path.join(self.metadatahandler.torrent_dir, torrent['torrent_file_name'])
                     else:
                         torrent_filename = torrent_alt_filename
-                    if os.path.isfile(torrent_filename) or os.path.isfile(torrent_alt_filename):
+                    if TorrentStore.getInstance().has(infohash) or os.path.isfile(torrent_filename) or os.path.isfile(torrent_alt_filename):
                         if DEBUG:
                             print >> sys.stderr, 'magnetrequester: magnet already on disk', bin2str(infohash)
                     else:
@@ -303,16 +304,18 @@ class MagnetRequester():
                 torrent_filename = os.path.join(self.metadatahandler.torrent_dir, get_collected_torrent_filename(infohash))
             tdef.save(torrent_filename)
             
-            #calculate root-hash
-            sdef = SwiftDef()
-            sdef.add_content(torrent_filename)
-            sdef.finalize(self.session.get_swift_path())
-            
-            #add this new torrent to db
-            self.torrent_db.addExternalTorrent(tdef, extra_info = {'swift_torrent_hash':bin2str(sdef.get_roothash())})
+            def do_db(roothash):
+                #add this new torrent to db
+                if roothash is None:
+                    self.torrent_db.addExternalTorrent(tdef)
+                else:
+                    self.torrent_db.addExternalTorrent(tdef, extra_info = {'swift_torrent_hash':bin2str(roothash)})
+                
+                #notify all
+                self.remoteTorrentHandler.metadatahandler_got_torrent(infohash, tdef, torrent_filename)
             
-            #notify all
-            self.remoteTorrentHandler.metadatahandler_got_torrent(infohash, tdef, torrent_filename)
+            #calculate root-hash on the hashing thread pool
+            SwiftHasher.getInstance().hash_async([torrent_filename], lambda roothash: self.overlay_bridge.add_task(lambda: do_db(roothash), 0), destpath = torrent_filename)
             self.overlay_bridge.add_task(self.__requestMagnet, self.REQUEST_INTERVAL)
     
     def __torrentdef_failed(self, infohash):
@@ -5,14 +5,12 @@ import sys
 import urlparse
 import binascii
 from traceback import print_exc,print_stack
-import tempfile
-import subprocess
 import random
-import time
 
 from Tribler.Core.Base import *
 from Tribler.Core.simpledefs import *
 from Tribler.Core.Swift.util import *
+from Tribler.Core.Swift.SwiftHasher import hash_content, DEFAULT_CHUNKSIZE
 
 class SwiftDef(ContentDefinition):
     """ Definition of a swift swarm, that is, the root hash (video-on-demand) 
@@ -201,16 +199,19 @@ class SwiftDef(ContentDefinition):
             return None 
 
 
-    def finalize(self,binpath,userprogresscallback=None,destdir='.',removetemp=False):
+    def finalize(self,binpath=None,userprogresscallback=None,destdir='.',removetemp=False):
         """
-        Calculate root hash (time consuming).
+        Calculate root hash (time consuming). The hash tree is written to 
+        a .mhash and .mbinmap file next to the content (single-file) or the
+        multi-file spec, such that swift can seed without hashing again.
          
         The also userprogresscallback will be called by the calling thread 
         periodically, with a progress percentage as argument.
         
         The userprogresscallback function will be called by the calling thread. 
         
-        @param binpath  OS path of swift binary.
+        @param binpath  OS path of swift binary, unused as the root hash is
+        calculated in-process.
         @param userprogresscallback Function accepting a fraction as first
         argument.
         @param destdir OS path of where to store temporary files.
@@ -235,68 +236,36 @@ class SwiftDef(ContentDefinition):
             f.write(self.multifilespec)
             f.close()
         
+            # The content of a multi-file swarm is the spec followed by the
+            # files in the order of the spec
             filename = specpn
+            files = [(d['outpath'].encode("UTF-8"),d['length'],d['inpath']) for d in self.files]
+            files.sort()
+            filenames = [specpn] + [inpath for (specpath,length,inpath) in files]
+            progressfunc = None
+            if userprogresscallback is not None:
+                progressfunc = lambda fraction: userprogresscallback(0.2 + 0.7 * fraction)
         else:
             filename = self.files[0]['inpath']
-
-        urlfn = "swifturl-p"+str(os.getpid())+"-r"+str(random.random())+".txt"
-        urlpn = os.path.join(destdir,urlfn)
-
-        args=[]
-        args.append(str(binpath))
-        
-        # Arno, 2012-05-29: Hack. Win32 getopt code eats first arg when Windows app
-        # instead of CONSOLE app.
-        args.append("-j")
-        if self.tracker is not None:
-            args.append("-t")
-            args.append(self.tracker)
-        args.append("--printurl")
-        args.append("-r")
-        args.append(urlpn)
-        args.append("-f")
-        args.append(filename)
-        #args.append("-B") # DEBUG Hack
-        
-        if sys.platform == "win32":
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
-        else:
-            creationflags=0
-        pobj = subprocess.Popen(args,stdout=subprocess.PIPE,cwd='.',creationflags=creationflags)
-        
-        if userprogresscallback is not None:
-            userprogresscallback(0.6)
-
-        # Arno, 2012-05-25: When running in binary on windows, swift is a 
-        # windows app, so no console output. Hence, write swift URL to disk.
-        count = 0.0
-        while count < 600.0: # 10 minutes
-            pobj.poll()
-            if pobj.returncode is not None:
-                break
-            time.sleep(1)
-            count += 1.0
+            filenames = [filename]
+            progressfunc = None
             if userprogresscallback is not None:
-                userprogresscallback(0.6 + count/1000.0)
-            
-        f = open(urlpn,"rb")
-        url = f.read()
-        f.close()
-        
+                progressfunc = lambda fraction: userprogresscallback(0.9 * fraction)
+
+        chunksize = self.get_chunksize()
+        if chunksize is None:
+            chunksize = DEFAULT_CHUNKSIZE
         try:
-            os.remove(urlpn)
+            self.roothash = hash_content(filenames,chunksize,filename,progressfunc)
         except:
-            pass
-
-        if url is None or len(url) == 0:
-             self.roothash = '0' * 20
-             print >>sys.stderr,"swift: finalize: Error calculating roothash"
-             return None 
+            print_exc()
+            self.roothash = '0' * 20
+            print >>sys.stderr,"swift: finalize: Error calculating roothash"
+            return None 
 
         if userprogresscallback is not None:
             userprogresscallback(0.9)
 
-        (self.roothash,self.tracker,self.chunksize,self.duration) = parse_url(url)
         self.readonly = True
         
         if removetemp and specpn is not None:
@@ -382,6 +382,21 @@ class SwiftDownloadImpl(SwiftDownloadRuntimeConfig):
             self.dllock.release()
 
 
+    def network_get_summary(self):
+        """ Returns (status,progress,downrate,uprate,numpeers) without
+        building a DownloadState, to find out if the state changed.
+
+        Called by network thread """
+        self.dllock.acquire()
+        try:
+            if self.error is not None:
+                return (DLSTATUS_STOPPED_ON_ERROR,self.progressbeforestop,0.0,0.0,0)
+            elif self.sp is None:
+                return (DLSTATUS_STOPPED,self.progressbeforestop,0.0,0.0,0)
+            return (self.dlstatus,self.progress,self.curspeeds[DOWNLOAD],self.curspeeds[UPLOAD],self.numleech+self.numseeds)
+        finally:
+            self.dllock.release()
+
     def sesscb_get_state_returncallback(self,usercallback,when,newgetpeerlist):
         """ Called by SessionCallbackThread """
         self.dllock.acquire()
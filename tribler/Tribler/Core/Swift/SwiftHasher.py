@@ -0,0 +1,345 @@
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Calculates swift root hashes in-process, instead of running the swift
+# binary with --printurl for each file. The Merkle hash tree is built the same
+# way as MmapHashTree::Submit() in the swift engine does, and the hash tree
+# and the binmap of completed chunks can be written to the .mhash and
+# .mbinmap files the engine checkpoints to, such that it can seed the content
+# without hashing it again.
+#
+# SwiftHasher hashes on a pool of threads, and can hash a batch of many
+# small files, e.g. collected .torrents, at once.
+
+import sys
+import os
+import mmap
+from hashlib import sha1
+from threading import Condition
+from traceback import print_exc
+
+from Tribler.Core.APIImplementation.ThreadPool import ThreadPool
+
+DEBUG = False
+
+# as SWIFT_DEFAULT_CHUNK_SIZE in swift's hashtree.h
+DEFAULT_CHUNKSIZE = 1024
+HASHSIZE = 20
+ZEROHASH = '\x00' * HASHSIZE
+# read content in blocks of about this many bytes
+READSIZE = 2 ** 20
+# a binmap_t cell covers a bin of at least this layer, and its halves are
+# bitmaps of one bit per chunk below it
+BINMAP_CELL_LAYER = 6
+BINMAP_INITIAL_CELLS = 16
+BITMAP_FILLED = -1
+BITMAP_EMPTY = 0
+NUMTHREADS = 4
+
+
+def bin_number(layer, offset):
+    """ Returns the swift bin number of the offset-th bin in a layer """
+    return ((2 * offset + 1) << layer) - 1
+
+
+class SwiftHashTree:
+    """ Merkle hash tree of some content, fed to it with update(). The hashes
+    are stored per bin number in hashes, a writable buffer of at least
+    2 * 20 bytes per chunk, like in the .mhash file of swift, when given. """
+
+    def __init__(self, chunksize = DEFAULT_CHUNKSIZE, hashes = None):
+        self.chunksize = chunksize
+        self.hashes = hashes
+        self.size = 0L
+        self.numchunks = 0L
+        self.partial = ''
+        # hashes of the complete subtrees not yet combined with a right
+        # sibling, i.e. the peaks so far, largest first
+        self.stack = []
+
+    def update(self, data):
+        """ Hash the next data of the content """
+        chunksize = self.chunksize
+        self.size += len(data)
+        if self.partial:
+            need = chunksize - len(self.partial)
+            self.partial += str(data[:need])
+            data = data[need:]
+            if len(self.partial) < chunksize:
+                return
+            self.add_chunk(sha1(self.partial).digest())
+            self.partial = ''
+        view = memoryview(data)
+        full = len(view) - len(view) % chunksize
+        add_chunk = self.add_chunk
+        for pos in xrange(0, full, chunksize):
+            add_chunk(sha1(view[pos:pos + chunksize]).digest())
+        if full < len(view):
+            self.partial = view[full:].tobytes()
+
+    def add_chunk(self, hash):
+        chunk = self.numchunks
+        self.numchunks += 1
+        hashes = self.hashes
+        if hashes is not None:
+            pos = 2 * chunk * HASHSIZE
+            hashes[pos:pos + HASHSIZE] = hash
+        # a right child completes the subtree of its parent
+        layer = 0
+        offset = chunk
+        stack = self.stack
+        while offset & 1:
+            hash = sha1(stack.pop() + hash).digest()
+            layer += 1
+            offset >>= 1
+            if hashes is not None:
+                pos = bin_number(layer, offset) * HASHSIZE
+                hashes[pos:pos + HASHSIZE] = hash
+        stack.append(hash)
+
+    def get_peaks(self):
+        """ Returns the (layer, offset, hash) of each peak, largest first """
+        peaks = []
+        i = 0
+        for layer in xrange(self.numchunks.bit_length() - 1, -1, -1):
+            if self.numchunks & (1L << layer):
+                peaks.append((layer, (self.numchunks >> layer) - 1, self.stack[i]))
+                i += 1
+        return peaks
+
+    def finish(self):
+        """ Hash the last, partial chunk and return the root hash, which is
+        derived from the peaks like MmapHashTree::DeriveRoot() does. """
+        if self.partial:
+            self.add_chunk(sha1(self.partial).digest())
+            self.partial = ''
+        if self.numchunks == 0:
+            raise ValueError("swift cannot hash empty content")
+
+        peaks = self.get_peaks()
+        c = len(peaks) - 1
+        (layer, offset, hash) = peaks[c]
+        c -= 1
+        while c >= 0:
+            if offset & 1:
+                hash = sha1(peaks[c][2] + hash).digest()
+                c -= 1
+            else:
+                hash = sha1(hash + ZEROHASH).digest()
+            layer += 1
+            offset >>= 1
+        return hash
+
+
+def get_numchunks(size, chunksize):
+    return (size + chunksize - 1) / chunksize
+
+
+def binmap_cells(numchunks):
+    """ Returns the root bin and the [leftb, rightb, is_left_ref, is_right_ref]
+    cells of a swift binmap_t in which the first numchunks chunks are set.
+    Filled subtrees are packed, which leaves a single path of cells down to
+    the last chunk. """
+    layer = BINMAP_CELL_LAYER
+    while (1L << layer) < numchunks:
+        layer += 1
+    rootbin = bin_number(layer, 0)
+
+    cells = []
+    start = 0L
+    while True:
+        half = 1L << (layer - 1)
+        cell = []
+        refs = []
+        nextstart = None
+        for childstart in (start, start + half):
+            filled = min(max(numchunks - childstart, 0), half)
+            if layer - 1 < BINMAP_CELL_LAYER:
+                if filled == half:
+                    cell.append(BITMAP_FILLED)
+                else:
+                    cell.append(int((1L << filled) - 1))
+                refs.append(0)
+            elif filled == 0:
+                cell.append(BITMAP_EMPTY)
+                refs.append(0)
+            elif filled == half:
+                cell.append(BITMAP_FILLED)
+                refs.append(0)
+            else:
+                cell.append(len(cells) + 1)
+                refs.append(1)
+                nextstart = childstart
+        cells.append(cell + refs)
+        if nextstart is None:
+            return rootbin, cells
+        layer -= 1
+        start = nextstart
+
+
+def write_mbinmap(filename, roothash, chunksize, size):
+    """ Write the .mbinmap checkpoint of swift for complete content of size
+    bytes, as MmapHashTree::serialize() and binmap_t::serialize() do. """
+    numchunks = get_numchunks(size, chunksize)
+    rootbin, cells = binmap_cells(numchunks)
+    numcells = BINMAP_INITIAL_CELLS
+    while numcells < len(cells):
+        numcells *= 2
+
+    lines = ["version 1",
+             "root hash %s" % roothash.encode('hex'),
+             "chunk size %d" % chunksize,
+             "complete %d" % size,
+             "completec %d" % numchunks,
+             "root bin %d" % rootbin,
+             "free top %d" % (len(cells) % numcells),
+             "alloc cells %d" % len(cells),
+             "cells num %d" % numcells]
+    for (leftb, rightb, is_left_ref, is_right_ref) in cells:
+        lines.extend(["leftb %d" % leftb, "rightb %d" % rightb, "is_left %d" % is_left_ref, "is_right %d" % is_right_ref, "is_free 0"])
+    # free cells are linked through their first bitmap
+    for i in xrange(len(cells) + 1, numcells + 1):
+        lines.extend(["leftb %d" % (i % numcells), "rightb 0", "is_left 0", "is_right 0", "is_free 1"])
+
+    f = open(filename, "wb")
+    try:
+        f.write("\n".join(lines) + "\n")
+    finally:
+        f.close()
+
+
+def hash_content(filenames, chunksize = DEFAULT_CHUNKSIZE, destpath = None, progressfunc = None):
+    """ Returns the swift root hash of the concatenated contents of the files
+    in filenames, i.e. of a single file, or of the multi-file spec followed by
+    the files of a multi-file swarm.
+
+    @param filenames List of OS paths.
+    @param chunksize The chunk size of the swarm in bytes.
+    @param destpath When not None, the hash tree and the binmap are written
+    to destpath+'.mhash' and destpath+'.mbinmap' for the swift engine.
+    @param progressfunc Function accepting a fraction, called periodically.
+    @return A string of length 20.
+    """
+    size = 0L
+    for filename in filenames:
+        size += os.path.getsize(filename)
+    numchunks = get_numchunks(size, chunksize)
+
+    hashfile = None
+    hashes = None
+    if destpath is not None and numchunks > 0:
+        hashfile = open(destpath + '.mhash', 'w+b')
+        hashfile.truncate(2 * HASHSIZE * numchunks)
+        hashes = mmap.mmap(hashfile.fileno(), 2 * HASHSIZE * numchunks)
+    try:
+        tree = SwiftHashTree(chunksize, hashes)
+        readsize = max(1, READSIZE / chunksize) * chunksize
+        for filename in filenames:
+            f = open(filename, 'rb')
+            try:
+                while True:
+                    data = f.read(readsize)
+                    if not data:
+                        break
+                    tree.update(data)
+                    if progressfunc is not None:
+                        progressfunc(tree.size / float(size))
+            finally:
+                f.close()
+        roothash = tree.finish()
+        if tree.size != size:
+            raise IOError("content changed while hashing")
+    finally:
+        if hashes is not None:
+            hashes.close()
+        if hashfile is not None:
+            hashfile.close()
+
+    if destpath is not None:
+        write_mbinmap(destpath + '.mbinmap', roothash, chunksize, size)
+    return roothash
+
+
+class SwiftHasher:
+    """ Hashes content for swift on a pool of threads. Note that hashlib
+    only releases the GIL for data of at least 2 KB, so only larger chunk
+    sizes are hashed in parallel, while reading always is. """
+
+    __single = None
+
+    def __init__(self, numthreads = NUMTHREADS):
+        if SwiftHasher.__single:
+            raise RuntimeError, "SwiftHasher is singleton"
+        SwiftHasher.__single = self
+        self.pool = ThreadPool(numthreads)
+        self.numthreads = numthreads
+
+    def getInstance(*args, **kw):
+        if SwiftHasher.__single is None:
+            SwiftHasher(*args, **kw)
+        return SwiftHasher.__single
+    getInstance = staticmethod(getInstance)
+
+    def hash_async(self, filenames, callback, chunksize = DEFAULT_CHUNKSIZE, destpath = None):
+        """ Calculate the root hash of the content as hash_content() does
+        on a pool thread. Calls callback with the root hash, or with None
+        when the content could not be hashed, from that thread. """
+        def do_hash():
+            try:
+                roothash = hash_content(filenames, chunksize, destpath)
+            except:
+                print_exc()
+                roothash = None
+            callback(roothash)
+        self.pool.queueTask(do_hash)
+
+    def hash_batch(self, filenames, chunksize = DEFAULT_CHUNKSIZE, checkpoint = True):
+        """ Calculate the root hashes of many single-file swarms at once.
+        Blocks until all are done.
+
+        @param filenames List of OS paths.
+        @param checkpoint Whether to write a .mhash and .mbinmap file next to
+        each file.
+        @return List of the root hashes, in the order of filenames, None for
+        files that could not be hashed.
+        """
+        roothashes = [None] * len(filenames)
+        cond = Condition()
+        todo = [len(filenames)]
+
+        def do_hash(indices):
+            for i in indices:
+                try:
+                    if checkpoint:
+                        destpath = filenames[i]
+                    else:
+                        destpath = None
+                    roothashes[i] = hash_content([filenames[i]], chunksize, destpath)
+                except:
+                    print_exc()
+            cond.acquire()
+            try:
+                todo[0] -= len(indices)
+                cond.notify()
+            finally:
+                cond.release()
+
+        # one task per thread, as queueing a task per small file costs
+        # about as much as hashing it
+        for t in xrange(self.numthreads):
+            indices = range(t, len(filenames), self.numthreads)
+            if indices:
+                self.pool.queueTask(do_hash, (indices, ))
+
+        cond.acquire()
+        try:
+            while todo[0] > 0:
+                cond.wait()
+        finally:
+            cond.release()
+        if DEBUG:
+            print >>sys.stderr, "SwiftHasher: hashed", len(filenames), "files"
+        return roothashes
+
+    def shutdown(self):
+        self.pool.joinAll()
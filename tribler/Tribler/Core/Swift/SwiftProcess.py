@@ -80,8 +80,17 @@ class SwiftProcess(InstanceConnection):
         self.popen = subprocess.Popen(args,close_fds=True,cwd=workdir,creationflags=creationflags) 
 
         self.roothash2dl = {}
+        # roothash -> dlspeed+ulspeed of the last INFO, for load balancing
+        self.roothash2speed = {}
         self.donestate = DONE_STATE_WORKING  # shutting down
 
+        # Commands are queued until the cmd socket of the engine accepted
+        # our connection, see SwiftProcessMgr.check_cmd_connection()
+        self.ready = False
+        self.pending = []
+        # Time when the last download was removed, None when in use
+        self.idlesince = None
+
     #
     # Instance2Instance
     #   
@@ -89,9 +98,31 @@ class SwiftProcess(InstanceConnection):
         # Called by any thread, assume sessionlock is held
         
         if self.is_alive():
-            self.singsock = self.connhandler.start_connection(("127.0.0.1", self.cmdport),self)
+            self.splock.acquire()
+            try:
+                self.ready = False
+                self.singsock = self.connhandler.start_connection(("127.0.0.1", self.cmdport),self)
+            finally:
+                self.splock.release()
         else:
             print >>sys.stderr,"sp: start_cmd_connection: Process dead? returncode",self.popen.returncode,"pid",self.popen.pid
+
+    def cmd_connection_ready(self):
+        """ Called by SwiftProcessMgr when the engine accepted the cmd
+        connection. Sends the commands queued while it was starting. """
+        self.splock.acquire()
+        try:
+            self.ready = True
+            if DEBUG:
+                print >>sys.stderr,"sp: cmd_connection_ready: pid",self.get_pid(),"sending",len(self.pending),"queued commands"
+            for data in self.pending:
+                self.singsock.write(data)
+            self.pending = []
+        finally:
+            self.splock.release()
+
+    def is_ready(self):
+        return self.ready
           
             
     def i2ithread_readlinecallback(self,ic,cmd):
@@ -148,6 +179,7 @@ class SwiftProcess(InstanceConnection):
                 ulspeed = float(words[5])
                 numleech = int(words[6])
                 numseeds = int(words[7])
+                self.roothash2speed[roothash] = dlspeed+ulspeed
                 d.i2ithread_info_callback(dlstatus,progress,dynasize,dlspeed,ulspeed,numleech,numseeds)
             elif words[0] == "PLAY":
                 #print >>sys.stderr,"sp: i2ithread_readlinecallback: Got PLAY",cmd
@@ -218,6 +250,8 @@ class SwiftProcess(InstanceConnection):
             roothash = d.get_def().get_roothash()
 
             del self.roothash2dl[roothash] 
+            if roothash in self.roothash2speed:
+                del self.roothash2speed[roothash]
         finally:
             self.splock.release()
 
@@ -229,6 +263,16 @@ class SwiftProcess(InstanceConnection):
             self.splock.release()
 
 
+    def get_throughput(self):
+        """ Returns the sum of the up and download speeds of the downloads
+        as last reported by the engine. """
+        self.splock.acquire()
+        try:
+            return sum(self.roothash2speed.values())
+        finally:
+            self.splock.release()
+
+
     def get_pid(self):
         if self.popen is not None:
             return self.popen.pid
@@ -329,6 +373,13 @@ class SwiftProcess(InstanceConnection):
     #
     # Internal methods
     #
+    def write(self,data):
+        # assume splock is held to avoid concurrency on socket
+        if self.ready:
+            self.singsock.write(data)
+        else:
+            self.pending.append(data)
+
     def send_start(self,url,roothash_hex=None,maxdlspeed=None,maxulspeed=None,destdir=None):
         # assume splock is held to avoid concurrency on socket
         print >>sys.stderr,"sp: send_start:",url,"destdir",destdir
@@ -342,20 +393,20 @@ class SwiftProcess(InstanceConnection):
         if maxulspeed is not None:
             cmd += 'MAXSPEED '+roothash_hex+' UPLOAD '+str(float(maxulspeed))+'\r\n'
         
-        self.singsock.write(cmd)
+        self.write(cmd)
         
     def send_remove(self,roothash_hex,removestate,removecontent):
         # assume splock is held to avoid concurrency on socket
-        self.singsock.write('REMOVE '+roothash_hex+' '+str(int(removestate))+' '+str(int(removecontent))+'\r\n')
+        self.write('REMOVE '+roothash_hex+' '+str(int(removestate))+' '+str(int(removecontent))+'\r\n')
 
     def send_checkpoint(self,roothash_hex):
         # assume splock is held to avoid concurrency on socket
-        self.singsock.write('CHECKPOINT '+roothash_hex+'\r\n')
+        self.write('CHECKPOINT '+roothash_hex+'\r\n')
 
 
     def send_shutdown(self):
         # assume splock is held to avoid concurrency on socket
-        self.singsock.write('SHUTDOWN\r\n')
+        self.write('SHUTDOWN\r\n')
 
     def send_max_speed(self,roothash_hex,direct,speed):
         # assume splock is held to avoid concurrency on socket
@@ -366,26 +417,26 @@ class SwiftProcess(InstanceConnection):
             cmd += ' UPLOAD '
         cmd += str(float(speed))+'\r\n'
         
-        self.singsock.write(cmd)
+        self.write(cmd)
         
     def send_tunnel(self,session,address,data):
         # assume splock is held to avoid concurrency on socket
         if DEBUG:
             print >>sys.stderr,"sp: send_tunnel:",len(data),"bytes -> %s:%d" % address
 
-        self.singsock.write("TUNNELSEND %s:%d/%s %d\r\n" % (address[0], address[1], session.encode("HEX"), len(data)))
-        self.singsock.write(data)
+        self.write("TUNNELSEND %s:%d/%s %d\r\n" % (address[0], address[1], session.encode("HEX"), len(data)))
+        self.write(data)
 
     def send_setmoreinfo(self,roothash_hex,enable):
         # assume splock is held to avoid concurrency on socket
         onoff = "0"
         if enable:
             onoff = "1"
-        self.singsock.write('SETMOREINFO '+roothash_hex+' '+onoff+'\r\n')
+        self.write('SETMOREINFO '+roothash_hex+' '+onoff+'\r\n')
 
     def send_peer_addr(self,roothash_hex,addrstr):
         # assume splock is held to avoid concurrency on socket
-        self.singsock.write('PEERADDR '+roothash_hex+' '+addrstr+'\r\n')
+        self.write('PEERADDR '+roothash_hex+' '+addrstr+'\r\n')
 
     def is_alive(self):
         if self.popen:
@@ -4,10 +4,10 @@
 import sys
 import urlparse
 import binascii
-import random
 import time
 from traceback import print_exc,print_stack
 import threading
+import socket
 
 from Tribler.Core.Swift.SwiftProcess import *
 from Tribler.Utilities.Instance2Instance import *
@@ -15,16 +15,33 @@ from Tribler.Utilities.Instance2Instance import *
 
 DEBUG = False
 
+# Seconds between checks whether a starting swift engine accepted the
+# connection to its cmd socket
+CMD_CONNECT_POLL_INTERVAL = 0.02
+# Seconds before connecting again when the engine refused the connection,
+# i.e., it did not listen on its cmd socket yet
+CMD_CONNECT_RETRY_INTERVAL = 0.05
+
 class SwiftProcessMgr(InstanceConnectionHandler):
     """ Class that manages a number of SwiftProcesses """
 
-    def __init__(self,binpath,i2iport,dlsperproc,tunnellistenport,sesslock):
+    def __init__(self,binpath,i2iport,dlsperproc,tunnellistenport,sesslock,poolsize=0,idletimeout=0.0,workdir=None,zerostatedir=None):
+        """
+        poolsize: number of swift processes that are kept running with room
+        for another download, so new downloads need not wait for the engine
+        to start. They are created with workdir and zerostatedir.
+        idletimeout: seconds a process without downloads is kept alive 
+        (beyond the poolsize), 0 to stop it right away.
+        """
         self.binpath = binpath
         self.i2iport = i2iport
-        # ARNOSMPTODO: Implement such that a new proc is created when needed
         self.dlsperproc = dlsperproc
         self.tunnellistenport = tunnellistenport
         self.sesslock = sesslock
+        self.poolsize = poolsize
+        self.idletimeout = idletimeout
+        self.workdir = workdir
+        self.zerostatedir = zerostatedir
         self.done = False
         
         self.sps = []
@@ -35,6 +52,9 @@ class SwiftProcessMgr(InstanceConnectionHandler):
         self.i2is = Instance2InstanceServer(self.i2iport,self,timeout=(24.0*3600.0)) 
         self.i2is.start()
 
+        if self.poolsize > 0:
+            self.i2is.add_task(self.fill_pool,0)
+
     def get_or_create_sp(self,workdir,zerostatedir,listenport,httpgwport,cmdgwport):
         """ Download needs a process """
         self.sesslock.acquire()
@@ -50,39 +70,85 @@ class SwiftProcessMgr(InstanceConnectionHandler):
                         sp = sp2
                         #print >>sys.stderr,"spm: get_or_create_sp: Reusing",sp2.get_pid()
 
-            elif self.dlsperproc > 1:
-                # Find one with room, distribute equally
-                random.shuffle(self.sps)
-                for sp2 in self.sps:
-                    if len(sp2.get_downloads()) < self.dlsperproc:
-                        sp = sp2
-                        print >>sys.stderr,"spm: get_or_create_sp: Reusing",sp.get_pid() 
-                        break
+            else:
+                # Find one with room. Prefer engines that are up, then
+                # the ones moving the least data.
+                sps = self.get_sps_with_room()
+                if len(sps) > 0:
+                    sp = min(sps,key=lambda sp2:(not sp2.is_ready(),sp2.get_throughput(),len(sp2.get_downloads())))
+                    print >>sys.stderr,"spm: get_or_create_sp: Reusing",sp.get_pid() 
                     
             if sp is None:
                 # Create new process
-                sp = SwiftProcess(self.binpath,workdir,zerostatedir,listenport,httpgwport,cmdgwport,self)
+                sp = self.create_sp(workdir,zerostatedir,listenport,httpgwport,cmdgwport)
                 print >>sys.stderr,"spm: get_or_create_sp: Creating new",sp.get_pid()
-                self.sps.append(sp)
-            
-                # Arno, 2011-10-13: On Linux swift is slow to start and
-                # allocate the cmd listen socket?!
-                # 2012-05-23: connection_lost() will attempt another
-                # connect when the first fails, so not timing dependent,
-                # just ensures no send_()s get lost. Executed by NetworkThread.
-                if sys.platform == "linux2" or sys.platform=="darwin":
-                    print >>sys.stderr,"spm: Need to sleep 1 second for swift to start on Linux?! FIXME"
-                    time.sleep(1)
- 
-                sp.start_cmd_connection()
-                
+
+            sp.idlesince = None
+            if self.poolsize > 0:
+                self.i2is.add_task(self.fill_pool,0)
             return sp
         finally:
             self.sesslock.release()
+
+    def create_sp(self,workdir,zerostatedir,listenport,httpgwport,cmdgwport):
+        # lock held
+        sp = SwiftProcess(self.binpath,workdir,zerostatedir,listenport,httpgwport,cmdgwport,self)
+        self.sps.append(sp)
+
+        # Arno, 2011-10-13: On Linux swift is slow to start and allocate the
+        # cmd listen socket. Commands are queued by the SwiftProcess until 
+        # check_cmd_connection() finds the engine accepted the connection.
+        self.start_cmd_connection(sp)
+        return sp
+
+    def start_cmd_connection(self,sp):
+        # lock held
+        sp.start_cmd_connection()
+        singsock = sp.singsock
+        self.i2is.add_task(lambda:self.check_cmd_connection(sp,singsock),CMD_CONNECT_POLL_INTERVAL)
+
+    def check_cmd_connection(self,sp,singsock):
+        """ Called by Instance2Instance thread until the cmd connection to 
+        swift process sp is established, or failed. """
+        if self.done or singsock is None or sp.singsock is not singsock or singsock.socket is None:
+            # Connection failed, connection_lost() will retry
+            return
+        try:
+            singsock.socket.getpeername()
+        except socket.error:
+            # Not connected (yet)
+            if sp.is_alive():
+                self.i2is.add_task(lambda:self.check_cmd_connection(sp,singsock),CMD_CONNECT_POLL_INTERVAL)
+            return
+        if DEBUG:
+            print >>sys.stderr,"spm: check_cmd_connection: Ready",sp.get_pid()
+        sp.cmd_connection_ready()
+
+    def get_sps_with_room(self):
+        # lock held
+        return [sp for sp in self.sps if sp.is_alive() and sp.donestate == DONE_STATE_WORKING and len(sp.get_downloads()) < self.dlsperproc]
+
+    def fill_pool(self):
+        """ Start swift processes until poolsize of them have room for 
+        another download. Called by Instance2Instance thread. """
+        self.sesslock.acquire()
+        try:
+            if self.done:
+                return
+            self.clean_sps()
+            for i in range(self.poolsize-len(self.get_sps_with_room())):
+                try:
+                    sp = self.create_sp(self.workdir,self.zerostatedir,None,None,None)
+                except:
+                    print_exc()
+                    break
+                sp.idlesince = time.time()
+                print >>sys.stderr,"spm: fill_pool: Started",sp.get_pid()
+        finally:
+            self.sesslock.release()
     
     def release_sp(self,sp):
         """ Download no longer needs process. Apply process-cleanup policy """
-        # ARNOSMPTODO: MULTIPLE: Add policy param on whether to keep process around when no downloads. 
         self.sesslock.acquire()
         try:
             # Arno, 2012-05-23: Don't kill tunneling swift process
@@ -90,7 +156,30 @@ class SwiftProcessMgr(InstanceConnectionHandler):
                 return
                 
             if len(sp.get_downloads()) == 0:
-                self.destroy_sp(sp)
+                sp.idlesince = time.time()
+                if self.idletimeout > 0:
+                    self.i2is.add_task(self.stop_idle_sps,self.idletimeout)
+                else:
+                    self.stop_idle_sps()
+        finally:
+            self.sesslock.release()
+
+    def stop_idle_sps(self):
+        """ Destroy the processes that have had no downloads for idletimeout
+        seconds, keeping poolsize processes with room. """
+        self.sesslock.acquire()
+        try:
+            if self.done:
+                return
+            self.clean_sps()
+            spare = len(self.get_sps_with_room())
+            now = time.time()
+            for sp in self.sps[:]:
+                if spare <= self.poolsize:
+                    break
+                if sp.idlesince is not None and now-sp.idlesince >= self.idletimeout and len(sp.get_downloads()) == 0 and sp.get_listen_port() != self.tunnellistenport:
+                    spare -= 1
+                    self.destroy_sp(sp)
         finally:
             self.sesslock.release()
         
@@ -154,7 +243,19 @@ class SwiftProcessMgr(InstanceConnectionHandler):
         try:
             for sp in self.sps:
                 if sp.singsock == singsock:
-                    print >>sys.stderr,"spm: connection_lost: Restart",sp.get_pid()
-                    sp.start_cmd_connection()
+                    if sp.is_ready():
+                        print >>sys.stderr,"spm: connection_lost: Restart",sp.get_pid()
+                        self.start_cmd_connection(sp)
+                    else:
+                        # Engine not listening yet
+                        self.i2is.add_task(lambda sp=sp:self.retry_cmd_connection(sp),CMD_CONNECT_RETRY_INTERVAL)
+        finally:
+            self.sesslock.release()
+
+    def retry_cmd_connection(self,sp):
+        self.sesslock.acquire()
+        try:
+            if not self.done and sp in self.sps and sp.is_alive():
+                self.start_cmd_connection(sp)
         finally:
             self.sesslock.release()
@@ -76,6 +76,10 @@ class PiecePickerStreaming(PiecePicker):
     # relative size of mid-priority set
     MU = 4
 
+    # VOD: a chunk that is expected to arrive after its deadline is also
+    # requested from a faster peer when the deadline is this close (seconds)
+    DUPLICATE_DEADLINE = 5.0
+
     def __init__(self, numpieces,
                  rarest_first_cutoff = 1, rarest_first_priority_cutoff = 3,
                  priority_step = 20, piecesize = 0):
@@ -90,6 +94,7 @@ class PiecePickerStreaming(PiecePicker):
         self.stats["high"] = 0
         self.stats["mid"] = 0
         self.stats["low"] = 0
+        self.stats["duplicate"] = 0
 
         # playback module
         self.transporter = None
@@ -98,6 +103,11 @@ class PiecePickerStreaming(PiecePicker):
         # length):timestamp pairs for each outstanding request.
         self.outstanding_requests = {}
 
+        # (piece-id, begin, length):download for the chunks that were
+        # requested from a second peer because the first would miss their
+        # deadline
+        self.duplicate_requests = {}
+
         # The playing_delay and buffering_delay give three values
         # (min, max, offeset) in seconds.
         #
@@ -209,6 +219,13 @@ class PiecePickerStreaming(PiecePicker):
     def got_piece(self, *request):
         if request in self.outstanding_requests:
             del self.outstanding_requests[request]
+        if request in self.duplicate_requests:
+            # the other copy is no longer needed
+            del self.duplicate_requests[request]
+            for download in self.downloader.downloads:
+                if request in download.active_requests:
+                    download.active_requests.remove(request)
+                    download.connection.send_cancel(*request)
         if self.transporter:
             self.transporter.got_piece(*request)
 
@@ -223,6 +240,9 @@ class PiecePickerStreaming(PiecePicker):
         for request in self.outstanding_requests.keys():
             if request[0] == piece:
                 del self.outstanding_requests[request]
+        for request in self.duplicate_requests.keys():
+            if request[0] == piece:
+                del self.duplicate_requests[request]
 
         # don't consider this piece anymore
         for d in self.peer_connections.itervalues():
@@ -353,7 +373,10 @@ class PiecePickerStreaming(PiecePicker):
         cancel_requests = []
         in_high_range = self.videostatus.in_high_range
         playing_mode = self.videostatus.playing and not self.videostatus.paused
-        piece_due = self.transporter.piece_due
+        piece_deadline = self.transporter.piece_deadline
+        # live drops late pieces instead, and endgame mode already requests
+        # everything from every peer
+        duplicates = not self.videostatus.live_streaming and not self.downloader.endgamemode
         
         if playing_mode:
             # playing mode
@@ -366,10 +389,11 @@ class PiecePickerStreaming(PiecePicker):
 
             total_length = 0
             download_rate = download.get_short_term_rate()
-            for piece_id, begin, length in download.active_requests:
+            for request in download.active_requests:
+                piece_id, begin, length = request
                 # select policy for this piece
                 try:
-                    time_request = self.outstanding_requests[(piece_id, begin, length)]
+                    time_request = self.outstanding_requests[request]
                 except KeyError:
                     continue
                 
@@ -377,6 +401,23 @@ class PiecePickerStreaming(PiecePicker):
                 # that needs to be downloaded
                 total_length += length
 
+                if request in self.duplicate_requests:
+                    # already requested from a faster peer
+                    continue
+
+                # a chunk that will miss its deadline is also requested
+                # from a peer that is expected to deliver it in time
+                if duplicates and in_high_range(piece_id):
+                    time_until_deadline = piece_deadline(piece_id) - now
+                    if download_rate:
+                        time_until_download = total_length / download_rate
+                    else:
+                        time_until_download = float(2 ** 31)
+                    if ( time_until_deadline < self.DUPLICATE_DEADLINE
+                         and time_until_download > time_until_deadline
+                         and self.duplicate_request(request, download, time_until_download) ):
+                        continue
+
                 # each request must be allowed at least some
                 # minimal time to be handled
                 if now < time_request + min_delay:
@@ -394,7 +435,7 @@ class PiecePickerStreaming(PiecePicker):
 
                     else:
                         if playing_mode:
-                            time_until_deadline = min(piece_due(piece_id), time_request + max_delay - now)
+                            time_until_deadline = min(piece_deadline(piece_id) - now, time_request + max_delay - now)
                         else:
                             time_until_deadline = time_request + max_delay - now
                         time_until_download = total_length / download_rate
@@ -418,6 +459,54 @@ class PiecePickerStreaming(PiecePicker):
     def requested(self, *request):
         self.outstanding_requests[request] = time.time()
         return PiecePicker.requested(self, *request)
+
+    def expected_completion(self, download, length):
+        """ Returns the number of seconds in which download is expected to
+        deliver length bytes after its outstanding requests. """
+        rate = download.get_short_term_rate() or download.get_rate()
+        if rate <= 0:
+            return float(2 ** 31)
+        queued = 0
+        for request in download.active_requests:
+            queued += request[2]
+        return (queued + length) / rate
+
+    def faster_download(self, piece, download, seconds, length):
+        """ Returns the unchoked download other than download that has piece
+        and is expected to deliver length bytes of it first, if that takes
+        less than seconds. """
+        best = None
+        for d in self.downloader.downloads:
+            if d is download or d.choked or not d.have[piece]:
+                continue
+            t = self.expected_completion(d, length)
+            if t < seconds:
+                best = d
+                seconds = t
+        return best
+
+    def duplicate_request(self, request, download, seconds):
+        """ Requests the chunk that download is expected to deliver in
+        seconds from a faster peer as well. Returns whether it did. """
+        d = self.faster_download(request[0], download, seconds, request[2])
+        if d is None or request in d.active_requests:
+            return False
+        if DEBUG:
+            print >>sys.stderr,"PiecePickerStreaming: duplicate request for",request,"on",d.ip,"was on",download.ip
+        self.duplicate_requests[request] = d
+        self.stats["duplicate"] += 1
+        d.send_interested()
+        d.active_requests.append(request)
+        d.connection.send_request(*request)
+        return True
+
+    def duplicate_lost(self, download, request):
+        if self.duplicate_requests.pop(request, None) is None:
+            return False
+        for d in self.downloader.downloads:
+            if d is not download and request in d.active_requests:
+                return True
+        return False
         
     def next_new(self, haves, wantfunc, complete_first, willrequest=True, connection=None):
         """ Determine which piece to download next from a peer.
@@ -459,6 +548,32 @@ class PiecePickerStreaming(PiecePicker):
 
             return None
 
+        def pick_deadline( f, t ):
+            """ Like pick_first, but skips the pieces of which this peer
+            would miss the deadline while another peer is expected to deliver
+            them sooner. """
+            if connection is None:
+                return pick_first( f, t )
+            download = connection.download
+            now = time.time()
+            eta = None
+            for i in vs.generate_range((f,t)):
+                if not haves[i] or self.has[i]: 
+                    continue
+
+                if not wantfunc(i):
+                    continue
+
+                if eta is None:
+                    eta = self.expected_completion(download, vs.piecelen)
+                if now + eta <= self.transporter.piece_deadline(i):
+                    return i
+                if self.faster_download(i, download, eta, vs.piecelen) is None:
+                    # nobody does better
+                    return i
+
+            return None
+
         def pick_rarest_loop_over_small_range(f,t,shuffle=True):
             # Arno: pick_rarest is way expensive for the midrange thing,
             # therefore loop over the list of pieces we want and see
@@ -591,7 +706,7 @@ class PiecePickerStreaming(PiecePicker):
             if vs.live_streaming:
                 choice = pick_rarest_small_range( first, highprob_cutoff )
             else:
-                choice = pick_first( first, highprob_cutoff )
+                choice = pick_deadline( first, highprob_cutoff )
             type = "high"
 
         # it is possible that the performance of this peer prohibits
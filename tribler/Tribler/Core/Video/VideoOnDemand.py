@@ -228,6 +228,10 @@ class MovieOnDemandTransporter(MovieTransport):
         self.stat_latepieces = 0 # number of pieces that arrived too late
         self.stat_droppedpieces = 0 # number of pieces dropped
         self.stat_stalltime = 0.0 # total amount of time the video was stalled
+        self.stat_stalls = 0 # number of times playback paused for lack of data
+        self.stat_missed = 0 # number of high priority pieces completed after their deadline
+        self.stat_ttff = None # time from start of prebuffering to first data to the player
+        self.stat_seek_ttff = None # same, from the last start or seek
         self.stat_prebuffertime = 0.0 # amount of prebuffer time used
         self.stat_pieces = PieceStats() # information about each piece
 
@@ -237,6 +241,7 @@ class MovieOnDemandTransporter(MovieTransport):
         self.outbuf = []
         self.outbuflen = None
         self.last_pop = None # time of last pop
+        self.start_time = None # time of last start or seek, until the first pop after it
         self.rehookin = False
         self.reset_bitrate_prediction()
 
@@ -794,6 +799,8 @@ class MovieOnDemandTransporter(MovieTransport):
  
         if vs.in_high_range(piece):
             self._event_reporter.create_and_add_event("hipiece", [self.b64_infohash, piece])
+            if vs.playing and time.time() > self.piece_deadline(piece):
+                self.stat_missed += 1
         else:
             self._event_reporter.create_and_add_event("piece", [self.b64_infohash, piece])
 
@@ -1087,6 +1094,7 @@ class MovieOnDemandTransporter(MovieTransport):
             self.set_pos( piece )
             self.outbuf = []
             self.last_pop = time.time()
+            self.start_time = self.last_pop
             self.reset_bitrate_prediction()
             vs.playing = True
             self.playbackrate = Measure( 60 )
@@ -1418,6 +1426,24 @@ class MovieOnDemandTransporter(MovieTransport):
                 return s["local_ts"] + bytepos / vs.bitrate - self.PIECE_DUE_SKEW
             
 
+    def piece_deadline(self,i):
+        """ Return the time when piece i has to be pushed to the player. Until
+        playback (re)starts, e.g. after a seek, it is assumed to start right
+        away at the playback position, so the first pieces are due first. """
+
+        if self.start_playback is not None:
+            return self.piece_due(i)
+
+        vs = self.videostatus
+        if not vs.bitrate:
+            return float(2 ** 31) # end of time
+
+        if vs.wraparound:
+            piecedist = (i - vs.playback_pos) % vs.movie_numpieces
+        else:
+            piecedist = i - vs.playback_pos
+        return time.time() + max(0, piecedist) * vs.piecelen / vs.bitrate - self.PIECE_DUE_SKEW
+
     def max_buffer_size( self ):
         vs = self.videostatus
         if vs.dropping:
@@ -1540,6 +1566,7 @@ class MovieOnDemandTransporter(MovieTransport):
                 # TODO : Diego : The Http support level should be tuned according to the sustainability level
                 if self.http_support is not None:
                     self.http_support.start_video_support( 0 ) # TODO : Diego : still needed? here the buffer is 0 so already asking for support
+                self.stat_stalls += 1
                 self.pause( autoresume = True )
                 self.autoresume( sustainable )
 
@@ -1652,6 +1679,11 @@ class MovieOnDemandTransporter(MovieTransport):
             self.playbackrate.update_rate( len(piecetup[1]) )
 
         self.last_pop = time.time()
+        if piecetup and self.start_time is not None:
+            self.stat_seek_ttff = self.last_pop - self.start_time
+            if self.stat_ttff is None:
+                self.stat_ttff = self.last_pop - self.prebufstart
+            self.start_time = None
 
         lenoutbuf = len(self.outbuf)
 
@@ -1747,6 +1779,10 @@ class MovieOnDemandTransporter(MovieTransport):
               "late": self.stat_latepieces,
               "dropped": self.stat_droppedpieces,
               "stall": self.stat_stalltime,
+              "stalls": self.stat_stalls,
+              "missed": self.stat_missed,
+              "ttff": self.stat_ttff,
+              "seek_ttff": self.stat_seek_ttff,
               "pos": self.videostatus.playback_pos,
               "prebuf": self.stat_prebuffertime,
               "pp": self.piecepicker.stats,
@@ -43,6 +43,10 @@ sessdefaults['ipv6_binds_v4'] = None  # set if an IPv6 server socket won't also
 sessdefaults['upnp_nat_access'] = UPNPMODE_UNIVERSAL_DIRECT
 sessdefaults['timeout'] = 300.0
 sessdefaults['timeout_check_interval'] = 60.0
+sessdefaults['hashcheck_concurrency'] = 4  # max number of Downloads hashchecking at the same time
+sessdefaults['hashcheck_per_disk'] = 1     # of which at most this many on the same disk
+sessdefaults['global_max_upload_rate'] = 0    # KB/s for all Downloads together, 0 = unlimited
+sessdefaults['global_max_download_rate'] = 0
 sessdefaults['eckeypairfilename'] = None
 sessdefaults['megacache'] = True
 sessdefaults['overlay'] = False
@@ -120,6 +124,8 @@ sessdefaults['swiftpath'] = None
 sessdefaults['swiftworkingdir'] = '.'
 sessdefaults['swiftcmdlistenport'] = DEFAULTPORT+481 
 sessdefaults['swiftdlsperproc'] = 1000
+sessdefaults['swiftprocpoolsize'] = 1
+sessdefaults['swiftprocidletimeout'] = 300.0
 # config for tunneling via swift, e.g. dispersy
 sessdefaults['swifttunnellistenport'] = None
 sessdefaults['swifttunnelcmdgwlistenport'] = None
@@ -164,6 +170,7 @@ trackerdefaults['tracker_logfile'] = None
 trackerdefaults['tracker_allow_get'] = 1
 trackerdefaults['tracker_keep_dead'] = 0
 trackerdefaults['tracker_scrape_allowed'] = ITRACKSCRAPE_ALLOW_FULL
+trackerdefaults['tracker_udp_port'] = 0
 
 sessdefaults.update(trackerdefaults)
 
@@ -201,6 +208,8 @@ dldefaults['max_initiate'] = 40
 dldefaults['check_hashes'] = 1
 dldefaults['max_upload_rate'] = 0
 dldefaults['max_download_rate'] = 0
+dldefaults['max_upload_rate_per_peer'] = 0
+dldefaults['max_download_rate_per_peer'] = 0
 # Arno, 2009-12-11: Sparse as default reduces CPU usage. Previously this was
 # also set, but in DownloadConfig.__init__
 if sys.platform == 'win32':
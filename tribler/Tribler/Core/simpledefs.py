@@ -28,6 +28,10 @@ DLMODE_NORMAL = 0
 DLMODE_VOD = 1
 DLMODE_SVC = 2 # Ric: added download mode for Scalable Video Coding (SVC) 
 
+# Classes of Downloads for bandwidth shaping, served in this order
+RATECLASS_STREAM = 0 # VOD and live Downloads
+RATECLASS_BULK = 1
+
 PERSISTENTSTATE_CURRENTVERSION = 4
 """
 V1 = SwarmPlayer 1.0.0
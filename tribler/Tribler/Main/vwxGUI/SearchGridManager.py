@@ -12,6 +12,7 @@ from Tribler.Category.Category import Category
 from Tribler.Core.Search.SearchManager import SearchManager, split_into_keywords
 from Tribler.Core.Search.Reranking import getTorrentReranker, DefaultTorrentReranker
 from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, bin2str, str2bin, NULL
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 from Tribler.Core.simpledefs import *
 from Tribler.Core.TorrentDef import TorrentDef
 from Tribler.Main.Dialogs.GUITaskQueue import GUITaskQueue
@@ -106,6 +107,10 @@ class TorrentManager:
         if torrent_filename and os.path.isfile(torrent_filename):
             return torrent_filename
         
+        #collected torrents are kept in the torrent store, write it out
+        if torrent_filename and TorrentStore.getInstance().extract(torrent.infohash, torrent_filename):
+            return torrent_filename
+        
         #.torrent not found
         
         if torrent.swift_torrent_hash:
@@ -21,7 +21,7 @@ from wx.lib.agw.flatnotebook import FlatNotebook, PageContainer
 import wx.lib.agw.flatnotebook as fnb
 from wx._controls import StaticLine
 from Tribler.Main.vwxGUI.list_header import ChannelOnlyHeader
-from shutil import copyfile
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 
 DEBUG = False
 
@@ -1114,15 +1114,21 @@ class ManageChannelFilesManager():
         if os.path.isdir(target_dir):
             torrent_dir = self.channelsearch_manager.session.get_torrent_collecting_dir()
             _,_,torrents = self.channelsearch_manager.getTorrentsFromChannel(self.channel, filterTorrents = False)
+            torrent_store = TorrentStore.getInstance()
             
             nr_torrents_exported = 0
             for torrent in torrents:
                 collected_torrent_filename = get_collected_torrent_filename(torrent.infohash)
                 
                 torrent_filename = os.path.join(torrent_dir, collected_torrent_filename)
-                if os.path.isfile(torrent_filename):
+                metadata = torrent_store.read(torrent.infohash, torrent_filename)
+                if metadata is not None:
                     new_torrent_filename = os.path.join(target_dir, collected_torrent_filename)
-                    copyfile(torrent_filename, new_torrent_filename)
+                    f = open(new_torrent_filename, 'wb')
+                    try:
+                        f.write(metadata)
+                    finally:
+                        f.close()
                     
                     nr_torrents_exported += 1
             
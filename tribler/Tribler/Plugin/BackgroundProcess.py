@@ -520,6 +520,9 @@ class BackgroundApp(BaseApp):
             blocksize = d.get_def().get_piece_length()
             #Ric: add svc on streaminfo, added bitrate
             streaminfo = { 'mimetype': params['mimetype'], 'stream': stream, 'length': params['length'], 'blocksize':blocksize, 'svc': d.get_mode() == DLMODE_SVC, 'bitrate': params['bitrate'] }
+            if params['filename'] and not d.get_def().get_live():
+                # Complete on disk, let the HTTP server send it from the file
+                streaminfo['filename'] = params['filename']
 
             duser = self.dusers[d]
             duser['streaminfo'] = streaminfo
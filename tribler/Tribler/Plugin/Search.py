@@ -74,6 +74,7 @@ from threading import RLock
 from Tribler.Core.API import *
 from Tribler.Core.BitTornado.bencode import *
 from Tribler.Core.Utilities.utilities import get_collected_torrent_filename
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 from Tribler.Video.VideoServer import AbstractPathMapper
 
 
@@ -499,8 +500,11 @@ class Hits2AnyPathMapper(AbstractPathMapper):
                 colltorrdir = self.session.get_torrent_collecting_dir()
                 filepath = os.path.join(colltorrdir,dbhit['torrent_file_name'])
                 # Return stream that contains torrent file
-                stream = open(filepath,"rb")
-                length = os.path.getsize(filepath)
+                metadata = TorrentStore.getInstance().read(infohash,filepath)
+                if metadata is None:
+                    return streaminfo404()
+                stream = StringIO(metadata)
+                length = len(metadata)
                 torrentstreaminfo = {'statuscode':200,'mimetype':TSTREAM_MIME_TYPE,'stream':stream,'length':length}
                 return torrentstreaminfo
             else:
@@ -527,7 +531,7 @@ class Hits2AnyPathMapper(AbstractPathMapper):
                 
                 colltorrdir = self.session.get_torrent_collecting_dir()
                 filepath = os.path.join(colltorrdir,dbhit['torrent_file_name'])
-                tdef = TorrentDef.load(filepath)
+                tdef = load_collected_torrent(infohash,filepath)
                 (thumbtype,thumbdata) = tdef.get_thumbnail()
                 return self.create_thumbstreaminfo(thumbtype,thumbdata)
                     
@@ -570,6 +574,15 @@ class Hits2AnyPathMapper(AbstractPathMapper):
         return nsmetastreaminfo
 
 
+def load_collected_torrent(infohash,filepath):
+    """ Returns the TorrentDef of a collected torrent, which is kept in the
+    torrent store or, when not migrated yet, at filepath """
+    metadata = TorrentStore.getInstance().read(infohash,filepath)
+    if metadata is None:
+        raise IOError("collected torrent not found: "+filepath)
+    return TorrentDef.load_from_dict(bdecode(metadata))
+
+
 def infohash2urlpath(infohash):
     
     if len(infohash) != 20:
@@ -697,7 +710,7 @@ def hit2nsmetahit(hit,hiturlprefix,colltorrdir):
             torrenturlpath = '/'+infohash2urlpath(hit['infohash'])+URLPATH_TORRENT_POSTFIX
             torrenturl = hiturlprefix + torrenturlpath
             filepath = os.path.join(colltorrdir,hit['torrent_file_name'])
-            tdef = TorrentDef.load(filepath)
+            tdef = load_collected_torrent(hit['infohash'],filepath)
             (thumbtype,thumbdata) = tdef.get_thumbnail()
             if thumbtype is None:
                 titleimgurl = None
@@ -912,12 +925,15 @@ class Infohash2TorrentPathMapper(AbstractPathMapper):
                                                       
             if not wantthumb:
                 # Return stream that contains torrent file
-                stream = open(filepath,"rb")
-                length = os.path.getsize(filepath)
+                metadata = TorrentStore.getInstance().read(infohash,filepath)
+                if metadata is None:
+                    return None
+                stream = StringIO(metadata)
+                length = len(metadata)
                 streaminfo = {'statuscode':200,'mimetype':TSTREAM_MIME_TYPE,'stream':stream,'length':length}
             else:
                 # Return stream that contains thumbnail
-                tdef = TorrentDef.load(filepath)
+                tdef = load_collected_torrent(infohash,filepath)
                 (thumbtype,thumbdata) = tdef.get_thumbnail()
                 if thumbtype is None:
                     return None
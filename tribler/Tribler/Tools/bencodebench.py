@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Times bdecode and bencode on the given files, e.g. .torrent files, saved
+# tracker responses or download pstate pickles, and on a synthetic large
+# multi-file torrent and tracker responses when no files are given. For each
+# input it reports the time to decode with copies of all strings, with long
+# strings as buffers (zero-copy), incrementally from 16 KiB chunks, and the
+# time to encode the result again.
+#
+# Usage: python bencodebench.py [file ...]
+
+import sys
+import os
+import random
+from time import time
+
+from Tribler.Core.BitTornado.bencode import bdecode, bencode, BDecoder
+
+SEED = 42
+CHUNK_SIZE = 16384
+MIN_BUFFER = 1024
+# repeat each measurement for at least this many seconds, report the best
+MIN_TIME = 0.5
+
+
+def synthetic_torrent(numfiles, numpieces):
+    rnd = random.Random(SEED)
+    files = []
+    for i in xrange(numfiles):
+        files.append({'length': rnd.randrange(1, 10**9),
+                      'path': ['CD%d' % (i / 100), 'track %d of the collection.flac' % i]})
+    pieces = ''.join([chr(rnd.randrange(256)) for i in xrange(numpieces * 20)])
+    info = {'name': 'collection', 'piece length': 2 ** 20, 'pieces': pieces, 'files': files}
+    return bencode({'announce': 'http://tracker.example.org:6969/announce', 'creation date': 1234567890, 'info': info})
+
+
+def synthetic_tracker_response(numpeers, compact):
+    rnd = random.Random(SEED)
+    if compact:
+        peers = ''.join([chr(rnd.randrange(256)) for i in xrange(numpeers * 6)])
+    else:
+        peers = []
+        for i in xrange(numpeers):
+            peers.append({'ip': '10.%d.%d.%d' % (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)),
+                          'port': rnd.randrange(1024, 65536),
+                          'peer id': ''.join([chr(rnd.randrange(256)) for j in xrange(20)])})
+    return bencode({'interval': 1800, 'complete': numpeers / 2, 'incomplete': numpeers / 2, 'peers': peers})
+
+
+def timeit(func):
+    """ Returns the best time of func() in seconds """
+    best = None
+    begin = time()
+    while True:
+        t = time()
+        func()
+        t = time() - t
+        if best is None or t < best:
+            best = t
+        if time() - begin >= MIN_TIME:
+            return best
+
+
+def decode_incremental(data):
+    decoder = BDecoder(minbuffer = MIN_BUFFER)
+    for i in xrange(0, len(data), CHUNK_SIZE):
+        decoder.feed(buffer(data, i, CHUNK_SIZE))
+        value = decoder.get()
+    return value
+
+
+def main():
+    inputs = []
+    if len(sys.argv) > 1:
+        for filename in sys.argv[1:]:
+            f = open(filename, 'rb')
+            try:
+                inputs.append((os.path.basename(filename), f.read()))
+            finally:
+                f.close()
+    else:
+        inputs.append(('torrent, 10000 files', synthetic_torrent(10000, 50000)))
+        inputs.append(('torrent, 1 file', synthetic_torrent(1, 4000)))
+        inputs.append(('tracker, 200 peers', synthetic_tracker_response(200, False)))
+        inputs.append(('tracker, 200 peers compact', synthetic_tracker_response(200, True)))
+
+    print "%-30s %10s %10s %10s %10s %10s" % ("input", "bytes", "decode ms", "zerocopy", "chunked", "encode ms")
+    for name, data in inputs:
+        try:
+            value = bdecode(data)
+        except ValueError:
+            print >>sys.stderr, name, "is not bencoded, skipped"
+            continue
+        if bencode(bdecode(data, minbuffer = MIN_BUFFER)) != bencode(value) or bencode(decode_incremental(data)) != bencode(value):
+            print >>sys.stderr, name, "decodes differently"
+            sys.exit(1)
+        print "%-30s %10d %10.3f %10.3f %10.3f %10.3f" % (name[:30], len(data),
+            timeit(lambda: bdecode(data)) * 1e3,
+            timeit(lambda: bdecode(data, minbuffer = MIN_BUFFER)) * 1e3,
+            timeit(lambda: decode_incremental(data)) * 1e3,
+            timeit(lambda: bencode(value)) * 1e3)
+
+if __name__ == "__main__":
+    main()
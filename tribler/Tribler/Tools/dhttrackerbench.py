@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Drives the pymdht Tracker with announcements for many infohashes, on a
+# simulated clock, and reports the mean and worst case time per put and get
+# together with the number of keys and peers stored. The counters are checked
+# against the contents of the tracker at the end.
+#
+# Usage: python dhttrackerbench.py [puts] [infohashes] [puts per second]
+
+import sys
+import random
+from time import time
+
+import Tribler.Core.DecentralizedTracking.pymdht.core.ptime as ptime
+from Tribler.Core.DecentralizedTracking.pymdht.core.tracker import Tracker
+
+SEED = 42
+GETS_PER_PUT = 0.5
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    args = [int(x) for x in sys.argv[1:4]]
+    numputs, numkeys, rate = args + [1000000, 200000, 200][len(args):]
+
+    rnd = random.Random(SEED)
+    ptime.mock_mode()
+    tracker = Tracker()
+    # popular infohashes are announced more often
+    keys = [("%020d" % i) for i in xrange(numkeys)]
+    step = 1.0 / rate
+
+    put_times = []
+    get_times = []
+    begin = time()
+    for i in xrange(numputs):
+        k = keys[int(numkeys * rnd.random() ** 2)]
+        peer = ("10.%d.%d.%d" % (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)), 6881)
+        t = time()
+        tracker.put(k, peer)
+        put_times.append(time() - t)
+        if rnd.random() < GETS_PER_PUT:
+            k = keys[int(numkeys * rnd.random() ** 2)]
+            t = time()
+            tracker.get(k)
+            get_times.append(time() - t)
+        ptime.sleep(step)
+    total = time() - begin
+
+    put_times.sort()
+    get_times.sort()
+    print "%d puts, %d gets over %.0f simulated seconds in %.1f s" % (numputs, len(get_times), numputs * step, total)
+    for name, times in (("put", put_times), ("get", get_times)):
+        print "%s: mean %.1f us, 99%% %.1f us, 99.99%% %.1f us, max %.1f us" % (name, sum(times) * 1e6 / max(len(times), 1), percentile(times, 0.99) * 1e6, percentile(times, 0.9999) * 1e6, times[-1] * 1e6)
+    print "keys %d, peers %d" % (tracker.num_keys, tracker.num_peers)
+
+    num_peers = sum([len(peer_seq) for peer_seq, seq_peers in tracker._tracker_dict.itervalues()])
+    if tracker.num_keys != len(tracker._tracker_dict) or tracker.num_peers != num_peers:
+        print >>sys.stderr, "counters differ from contents: keys %d, peers %d" % (len(tracker._tracker_dict), num_peers)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
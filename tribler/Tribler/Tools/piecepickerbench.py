@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Replays a have/request trace against the indexed PiecePicker and against
+# the linear scan it replaced, checks that both pick the same pieces and
+# reports the time spent in PiecePicker.next.
+#
+# A trace is a text file with one event per line:
+#
+#   pieces <numpieces>
+#   bitfield <peer> <bitfield as hex>
+#   have <peer> <piece>
+#   next <peer>               (the picked piece is requested from the peer)
+#   complete                  (the lowest requested piece is completed)
+#   lost <peer>
+#
+# Usage: python piecepickerbench.py [trace]
+#        python piecepickerbench.py --generate trace [pieces] [peers] [requests]
+
+import sys
+import random
+from binascii import hexlify, unhexlify
+from time import time
+
+from Tribler.Core.BitTornado.bitfield import Bitfield
+from Tribler.Core.BitTornado.BT1.PiecePicker import PiecePicker
+
+SEED = 42
+
+
+class LinearPiecePicker(PiecePicker):
+    """ Scans the interest levels piece by piece, as PiecePicker did before
+    it kept the levels as bitsets. """
+    def _have_bits(self, haves):
+        return None
+
+
+def generate(numpieces, numpeers, numrequests):
+    """ Returns a list of trace lines for a swarm in which some pieces are
+    much rarer than others. """
+    rnd = random.Random(SEED)
+    trace = ["pieces %d" % numpieces]
+    # popularity of each piece, the chance that a peer has it
+    popularity = [rnd.random() ** 3 for i in xrange(numpieces)]
+    peers = {}
+
+    def connect(peer):
+        have = Bitfield(numpieces)
+        fraction = rnd.choice((0.0, 0.1, 0.5, 1.0))
+        for i in xrange(numpieces):
+            if rnd.random() < popularity[i] * fraction:
+                have[i] = True
+        peers[peer] = have
+        trace.append("bitfield %d %s" % (peer, hexlify(have.tostring())))
+
+    for peer in xrange(numpeers):
+        connect(peer)
+    nextpeer = numpeers
+    for i in xrange(numrequests):
+        peer = rnd.choice(peers.keys())
+        trace.append("next %d" % peer)
+        r = rnd.random()
+        if r < 0.5:
+            peer = rnd.choice(peers.keys())
+            have = peers[peer]
+            if not have.complete():
+                piece = rnd.randrange(numpieces)
+                while have[piece]:
+                    piece = rnd.randrange(numpieces)
+                have[piece] = True
+                trace.append("have %d %d" % (peer, piece))
+        elif r < 0.51:
+            peer = rnd.choice(peers.keys())
+            del peers[peer]
+            trace.append("lost %d" % peer)
+            connect(nextpeer)
+            nextpeer += 1
+        if i % 10 == 0:
+            trace.append("complete")
+    return trace
+
+
+class Replay:
+    def __init__(self, picker_class, numpieces):
+        random.seed(SEED)
+        self.numpieces = numpieces
+        self.picker = picker_class(numpieces)
+        self.picker.fast_initialize(False)
+        self.peers = {}
+        # piece:True for pieces that were requested but not completed
+        self.requested = {}
+        self.picks = []
+        self.next_time = 0.0
+
+    def want(self, piece):
+        return piece not in self.requested
+
+    def bitfield(self, peer, bitstring):
+        have = Bitfield(self.numpieces, bitstring)
+        self.peers[peer] = have
+        if have.complete():
+            self.picker.got_seed()
+        else:
+            for i in xrange(self.numpieces):
+                if have[i]:
+                    self.picker.got_have(i)
+
+    def have(self, peer, piece):
+        have = self.peers[peer]
+        if have[piece]:
+            return
+        have[piece] = True
+        self.picker.got_have(piece)
+        if have.complete():
+            self.picker.became_seed()
+
+    def lost(self, peer):
+        have = self.peers.pop(peer)
+        if have.complete():
+            self.picker.lost_seed()
+        else:
+            for i in xrange(self.numpieces):
+                if have[i]:
+                    self.picker.lost_have(i)
+
+    def next(self, peer):
+        begin = time()
+        piece = self.picker.next(self.peers[peer], self.want, None)
+        self.next_time += time() - begin
+        self.picks.append(piece)
+        if piece is not None:
+            self.picker.requested(piece)
+            self.requested[piece] = True
+
+    def complete(self):
+        if self.requested:
+            piece = min(self.requested)
+            del self.requested[piece]
+            self.picker.complete(piece)
+
+    def run(self, trace):
+        for line in trace:
+            words = line.split()
+            if words[0] == "bitfield":
+                self.bitfield(int(words[1]), unhexlify(words[2]))
+            elif words[0] == "have":
+                self.have(int(words[1]), int(words[2]))
+            elif words[0] == "next":
+                self.next(int(words[1]))
+            elif words[0] == "complete":
+                self.complete()
+            elif words[0] == "lost":
+                self.lost(int(words[1]))
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--generate":
+        args = [int(x) for x in sys.argv[3:6]]
+        f = open(sys.argv[2], "w")
+        f.write("\n".join(generate(*(args + [50000, 200, 5000][len(args):]))) + "\n")
+        f.close()
+        return
+
+    if len(sys.argv) > 1:
+        trace = [line for line in open(sys.argv[1]).read().splitlines() if line.strip()]
+    else:
+        print >>sys.stderr, "generating trace"
+        trace = generate(50000, 200, 5000)
+    numpieces = int(trace[0].split()[1])
+    numnext = len([line for line in trace if line.startswith("next")])
+
+    results = []
+    for name, picker_class in (("linear", LinearPiecePicker), ("indexed", PiecePicker)):
+        replay = Replay(picker_class, numpieces)
+        begin = time()
+        replay.run(trace[1:])
+        total = time() - begin
+        results.append(replay.picks)
+        print "%-8s %d pieces, %d next() calls: next %.3f s (%.1f us/call), replay %.3f s" % (name, numpieces, numnext, replay.next_time, replay.next_time * 1e6 / max(numnext, 1), total)
+
+    if results[0] != results[1]:
+        print >>sys.stderr, "picks differ!"
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
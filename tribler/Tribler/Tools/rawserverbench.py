@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Measures the RawServer event loop overhead with many idle sockets and many
+# pending tasks, for each available poll backend.
+#
+# Usage: python rawserverbench.py [sockets] [tasks]
+
+import sys
+import socket
+import resource
+from bisect import insort
+from random import random
+from threading import Event
+from time import time
+
+from Tribler.Core.BitTornado.RawServer import RawServer
+from Tribler.Core.BitTornado.SocketHandler import SocketHandler, epoll
+
+ROUNDS = 100
+
+def noop():
+    pass
+
+def raise_fd_limit(wanted):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        if hard != resource.RLIM_INFINITY:
+            wanted = min(wanted, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+        except (ValueError, resource.error):
+            return soft
+    return wanted
+
+def bench_poll(backend, nsockets):
+    sockethandler = SocketHandler(60, False, poll_backend = backend)
+    sockets = []
+    for i in xrange(nsockets):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(("127.0.0.1", 0))
+        s.setblocking(0)
+        sockethandler.poll.register(s, 1)
+        sockets.append(s)
+
+    begin = time()
+    for i in xrange(ROUNDS):
+        sockethandler.do_poll(0)
+    end = time()
+
+    for s in sockets:
+        sockethandler.poll.unregister(s)
+        s.close()
+    return (end - begin) / ROUNDS
+
+def bench_legacy_tasks(ntasks, nkill):
+    # the sorted list RawServer used before the heap
+    funcs = []
+    begin = time()
+    for i in xrange(ntasks):
+        insort(funcs, (1000.0 + random(), noop, i % nkill))
+    add = time() - begin
+
+    begin = time()
+    for i in xrange(ROUNDS):
+        insort(funcs, (0.0, noop, None))
+        funcs.pop(0)
+    loop = (time() - begin) / ROUNDS
+
+    begin = time()
+    kill = [0]
+    funcs = [(t, func, id) for (t, func, id) in funcs if id not in kill]
+    cancel = time() - begin
+    return add, loop, cancel
+
+def bench_tasks(ntasks, nkill):
+    rawserver = RawServer(Event(), 60, 60, noisy = False)
+    begin = time()
+    for i in xrange(ntasks):
+        rawserver._add_task(noop, 1000.0 + random(), i % nkill)
+    add = time() - begin
+
+    begin = time()
+    for i in xrange(ROUNDS):
+        rawserver._add_task(noop, 0)
+        rawserver._pop_task()
+        rawserver._next_task_time()
+    loop = (time() - begin) / ROUNDS
+
+    begin = time()
+    rawserver.kill_tasks(0)
+    rawserver._kill_tasks()
+    cancel = time() - begin
+    rawserver.shutdown()
+    return add, loop, cancel
+
+def main():
+    nsockets = 10000
+    ntasks = 100000
+    if len(sys.argv) > 1:
+        nsockets = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        ntasks = int(sys.argv[2])
+
+    limit = raise_fd_limit(nsockets + 64)
+    if limit < nsockets + 64:
+        print >>sys.stderr, "fd limit is", limit, "using", limit - 64, "sockets"
+        nsockets = limit - 64
+
+    backends = ['poll']
+    if epoll is not None:
+        backends.append('epoll')
+    for backend in backends:
+        print "%-6s do_poll with %d idle sockets: %.3f ms" % (backend, nsockets, bench_poll(backend, nsockets) * 1000)
+
+    for name, func in (("insort", bench_legacy_tasks), ("heap", bench_tasks)):
+        add, loop, cancel = func(ntasks, 100)
+        print "%-6s %d tasks: add %.3f s; schedule+run one task %.3f ms; kill_tasks(id) %.3f ms" % (name, ntasks, add, loop * 1000, cancel * 1000)
+
+if __name__ == "__main__":
+    main()
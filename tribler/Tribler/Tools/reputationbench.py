@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Times the BarterCast reputation engine on a synthetic graph of reported
+# transfers, in which a few peers take part in many transfers. It reports
+# the time to load the records, to apply incremental updates, to compute the
+# two-hop bounded maxflow between single pairs of peers, and to compute the
+# reputations of all peers as seen by one peer in a single pass. The maxflow
+# of a sample of pairs is checked against, and timed for, maxflow.Network.
+#
+# Usage: python reputationbench.py [numedges [numpeers]]
+
+import sys
+import random
+from time import time
+
+from Tribler.Core.CacheDB.maxflow import Network
+from Tribler.Core.CacheDB.reputation import ReputationEngine
+
+SEED = 42
+NUMEDGES = 50000
+NUMPEERS = 10000
+NUMUPDATES = 100000
+NUMQUERIES = 10000
+NUMCHECKS = 5
+ALPHA = float(1)/30000
+
+
+def synthetic_records(numedges, numpeers):
+    """ Returns a list of (peer_id_from, peer_id_to, uploaded, downloaded) """
+    rnd = random.Random(SEED)
+    records = {}
+    while len(records) < numedges:
+        # peers with a low id are more active
+        a = int(rnd.paretovariate(1.2)) % numpeers
+        b = rnd.randrange(numpeers)
+        if a != b:
+            records[(a, b)] = (rnd.randrange(0, 100000), rnd.randrange(0, 100000))
+    return [(a, b, up, down) for (a, b), (up, down) in records.iteritems()]
+
+
+def network_arcs(engine):
+    arcs = {}
+    for a, succ in enumerate(engine.succ):
+        arcs[engine.peer_ids[a]] = dict([(engine.peer_ids[b], {'cap': capacity, 'flow': 0}) for b, capacity in succ.iteritems()])
+    return arcs
+
+
+def main():
+    numedges = NUMEDGES
+    numpeers = NUMPEERS
+    if len(sys.argv) > 1:
+        numedges = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        numpeers = int(sys.argv[2])
+    rnd = random.Random(SEED)
+    records = synthetic_records(numedges, numpeers)
+
+    engine = ReputationEngine()
+    t = time()
+    for peer_id_from, peer_id_to, uploaded, downloaded in records:
+        engine.update(peer_id_from, peer_id_to, uploaded, downloaded)
+    t = time() - t
+    print "records %d, peers %d, edges %d" % (len(records), engine.get_num_peers(), engine.get_num_edges())
+    print "%-40s %10.3f s" % ("load", t)
+
+    t = time()
+    for i in xrange(NUMUPDATES):
+        peer_id_from, peer_id_to, uploaded, downloaded = records[rnd.randrange(len(records))]
+        engine.update(peer_id_from, peer_id_to, uploaded + rnd.randrange(100), None)
+    t = time() - t
+    print "%-40s %10.3f us" % ("incremental update", t / NUMUPDATES * 1e6)
+
+    peer_ids = engine.peer_ids
+    pairs = [tuple(rnd.sample(peer_ids, 2)) for i in xrange(NUMQUERIES)]
+    t = time()
+    for source, sink in pairs:
+        engine.maxflow(source, sink)
+    t = time() - t
+    print "%-40s %10.3f us" % ("maxflow of a pair", t / NUMQUERIES * 1e6)
+
+    # the busiest peer has the largest neighbourhood
+    for name, me in (("all reputations, busiest peer", 0), ("all reputations, random peer", rnd.choice(peer_ids))):
+        t = time()
+        engine.get_reputations(me, peer_ids, ALPHA)
+        t = time() - t
+        print "%-40s %10.3f ms" % (name, t * 1e3)
+
+    network = Network(network_arcs(engine))
+    t = time()
+    for source, sink in pairs[:NUMCHECKS]:
+        flow = network.maxflow(source, sink, max_distance = 2)
+        if flow != engine.maxflow(source, sink):
+            print >>sys.stderr, "maxflow", source, sink, "differs from maxflow.Network:", engine.maxflow(source, sink), flow
+            sys.exit(1)
+    t = time() - t
+    print "%-40s %10.3f ms" % ("maxflow of a pair, maxflow.Network", t / NUMCHECKS * 1e3)
+
+if __name__ == "__main__":
+    main()
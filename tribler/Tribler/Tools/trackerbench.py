@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Replays announce and scrape requests from a simulated swarm through the
+# BitTornado HTTP tracker, as the network thread would, and reports the
+# requests per second together with the worst case time of a request and of
+# the periodic tasks (expiring peers, saving the state) that run in between.
+#
+# Usage: python trackerbench.py [requests] [torrents] [peers] [expire after]
+
+import sys
+import os
+import random
+import tempfile
+from time import time
+from urllib import quote
+
+from Tribler.Core.defaults import trackerdefaults
+from Tribler.Core.BitTornado.BT1.track import Tracker
+
+SEED = 42
+SCRAPES_PER_ANNOUNCE = 0.1
+# requests between runs of the periodic tasks
+TASK_INTERVAL = 500
+
+
+class FakeRawServer:
+    def __init__(self):
+        self.tasks = []
+
+    def add_task(self, func, delay = 0, id = None):
+        self.tasks.append((time() + delay, func))
+
+    def run_due_tasks(self):
+        now = time()
+        due = [task for task in self.tasks if task[0] <= now]
+        self.tasks = [task for task in self.tasks if task[0] > now]
+        times = []
+        for when, func in due:
+            t = time()
+            func()
+            times.append(time() - t)
+        return times
+
+
+class FakeConnection:
+    def __init__(self, ip):
+        self.ip = ip
+
+    def get_ip(self):
+        return self.ip
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    args = [int(x) for x in sys.argv[1:5]]
+    numrequests, numtorrents, numpeers, expire = args + [200000, 1000, 100000, 5][len(args):]
+
+    rnd = random.Random(SEED)
+    dfile = os.path.join(tempfile.mkdtemp(), 'tracker.dfile')
+    config = dict(trackerdefaults)
+    config['tracker_dfile'] = dfile
+    config['tracker_nat_check'] = 0
+    config['tracker_save_dfile_interval'] = 10
+    config['tracker_timeout_downloaders_interval'] = expire
+    rawserver = FakeRawServer()
+    tracker = Tracker(config, rawserver)
+
+    infohashes = [("%020d" % i) for i in xrange(numtorrents)]
+    # popular torrents have most of the peers
+    peers = []
+    for i in xrange(numpeers):
+        peers.append((infohashes[int(numtorrents * rnd.random() ** 3)],
+                      "%020d" % i,
+                      "10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255),
+                      rnd.choice((0, 1000))))
+
+    request_times = []
+    task_times = []
+    begin = time()
+    for i in xrange(numrequests):
+        infohash, peerid, ip, left = peers[rnd.randrange(numpeers)]
+        if rnd.random() < SCRAPES_PER_ANNOUNCE:
+            path = "/scrape?info_hash=%s" % quote(infohash)
+        else:
+            path = "/announce?info_hash=%s&peer_id=%s&port=6881&uploaded=0&downloaded=0&left=%d&compact=1" % (quote(infohash), quote(peerid), left)
+        t = time()
+        response = tracker.get(FakeConnection(ip), path, {})
+        request_times.append(time() - t)
+        if response[0] != 200:
+            print >>sys.stderr, "request failed:", response
+            sys.exit(1)
+        if i % TASK_INTERVAL == 0:
+            task_times.extend(rawserver.run_due_tasks())
+    total = time() - begin
+
+    # as at shutdown
+    t = time()
+    tracker.save_state()
+    save_time = time() - t
+
+    request_times.sort()
+    task_times.sort()
+    print "%d requests in %.2f s: %.0f requests/s" % (numrequests, total, numrequests / total)
+    print "request: mean %.1f us, 99%% %.1f us, max %.1f ms" % (sum(request_times) * 1e6 / numrequests, percentile(request_times, 0.99) * 1e6, request_times[-1] * 1e3)
+    if task_times:
+        print "periodic tasks: %d runs, max %.1f ms" % (len(task_times), task_times[-1] * 1e3)
+    print "torrents %d, peers %d, state file %d bytes written in %.1f ms" % (len(tracker.downloads), sum([len(x) for x in tracker.downloads.values()]), os.path.getsize(dfile), save_time * 1e3)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+# Written by Tribler developers
+# see LICENSE.txt for license information
+#
+# Measures the throughput of the BitTorrent peer-wire receive path over a
+# loopback swarm: a number of sender processes handshake with a RawServer in
+# this process and stream PIECE messages to it, which are parsed by
+# Encrypter.Connection and copied into a piece-sized storage buffer. Reports
+# the received MB/s and the MB/s per core, i.e. per second of CPU time used by
+# the receiving process, for the current receive buffer and for the StringIO
+# based parser it replaced.
+#
+# Usage: python wirebench.py [peers] [megabytes per peer]
+
+import sys
+import os
+import socket
+import subprocess
+from cStringIO import StringIO
+from threading import Event
+from time import time
+
+from Tribler.Core.BitTornado.RawServer import RawServer
+from Tribler.Core.BitTornado.BT1.Encrypter import Connection
+from Tribler.Core.BitTornado.BT1.MessageID import protocol_name, option_pattern, PIECE
+from Tribler.Core.BitTornado.BT1.convert import toint, tobinary
+
+INFOHASH = 'i' * 20
+CHUNK_SIZE = 2 ** 14
+PIECE_SIZE = 2 ** 18
+MAX_LEN = 2 ** 17
+
+
+class LegacyConnection(Connection):
+    """ Encrypter.Connection with the StringIO based data_came_in """
+
+    def __init__(self, *args, **kwargs):
+        Connection.__init__(self, *args, **kwargs)
+        self.legacybuffer = StringIO()
+
+    def data_came_in(self, connection, s):
+        self.Encoder.measurefunc(len(s))
+        while 1:
+            if self.closed:
+                return
+            i = self.next_len - self.legacybuffer.tell()
+            if i > len(s):
+                self.legacybuffer.write(s)
+                return
+            self.legacybuffer.write(s[:i])
+            s = s[i:]
+            m = self.legacybuffer.getvalue()
+            self.legacybuffer.reset()
+            self.legacybuffer.truncate()
+            x = self.next_func(memoryview(m))
+            if x is None:
+                self.next_len, self.next_func = 1, self.read_dead
+                self.close()
+                return
+            self.next_len, self.next_func = x
+
+
+class SinkConnection:
+    """ The Connecter.Connection of a peer, does nothing """
+
+    def send_keepalive(self):
+        pass
+
+
+class SinkConnecter:
+    """ Stands in for Connecter, writes the payload of PIECE messages into a
+    storage buffer like StorageWrapper.piece_came_in does with its file. """
+
+    def __init__(self, numpeers, doneflag):
+        self.numpeers = numpeers
+        self.doneflag = doneflag
+        self.external_connection_made = 0
+        self.storage = bytearray(PIECE_SIZE)
+        self.received = 0
+        self.begin = None
+        self.lost = 0
+
+    def connection_made(self, connection):
+        if self.begin is None:
+            self.begin = (time(), os.times())
+        return SinkConnection()
+
+    def got_message(self, connection, message):
+        if message[0] == PIECE:
+            begin = toint(message[5:9]) % PIECE_SIZE
+            piece = message[9:]
+            self.storage[begin:begin + len(piece)] = piece
+            self.received += len(piece)
+
+    def connection_flushed(self, connection):
+        pass
+
+    def connection_lost(self, connection):
+        self.lost += 1
+        if self.lost == self.numpeers:
+            self.end = (time(), os.times())
+            self.doneflag.set()
+
+
+class SinkEncoder:
+    """ Stands in for Encoder, accepts all peers """
+
+    def __init__(self, rawserver, connecter, connectionclass):
+        self.raw_server = rawserver
+        self.connecter = connecter
+        self.connectionclass = connectionclass
+        self.download_id = INFOHASH
+        self.my_id = 'r' * 20
+        self.max_len = MAX_LEN
+        self.connections = {}
+        self.repexer = None
+
+    def measurefunc(self, amount):
+        pass
+
+    def got_id(self, connection):
+        return True
+
+    def admin_close(self, connection):
+        del self.connections[connection]
+
+    def external_connection_made(self, connection):
+        con = self.connectionclass(self, connection, None)
+        self.connections[connection] = con
+        connection.set_handler(con)
+
+
+def send(port, megabytes, peerno):
+    """ Runs in a sender process """
+    messages = []
+    for begin in xrange(0, PIECE_SIZE, CHUNK_SIZE):
+        messages.append(tobinary(9 + CHUNK_SIZE) + PIECE + tobinary(0) + tobinary(begin) + chr(peerno % 256) * CHUNK_SIZE)
+    # keepalives make sure the parser sees messages that straddle reads
+    stream = tobinary(0).join(messages)
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect(('127.0.0.1', port))
+    s.sendall(chr(len(protocol_name)) + protocol_name + option_pattern + INFOHASH + ('p%d' % peerno).ljust(20, '-'))
+    for i in xrange(megabytes * 2 ** 20 / PIECE_SIZE):
+        s.sendall(stream)
+    # closing with the handshake of the receiver unread would reset the
+    # connection and lose the data in flight
+    s.shutdown(socket.SHUT_WR)
+    while s.recv(4096):
+        pass
+    s.close()
+
+
+def receive(connectionclass, numpeers, megabytes):
+    doneflag = Event()
+    rawserver = RawServer(doneflag, 60, 60, noisy = False, ipv6_enable = False)
+    rawserver.bind(0, ['127.0.0.1'])
+    port = rawserver.sockethandler.servers.values()[0].getsockname()[1]
+    connecter = SinkConnecter(numpeers, doneflag)
+    encoder = SinkEncoder(rawserver, connecter, connectionclass)
+
+    senders = []
+    for i in xrange(numpeers):
+        senders.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), '--send', str(port), str(megabytes), str(i)]))
+    rawserver.listen_forever(encoder)
+    rawserver.shutdown()
+    for sender in senders:
+        sender.wait()
+
+    wall = connecter.end[0] - connecter.begin[0]
+    cpu = sum(connecter.end[1][:2]) - sum(connecter.begin[1][:2])
+    return connecter.received, wall, cpu
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--send':
+        send(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+        return
+
+    numpeers = 8
+    megabytes = 256
+    if len(sys.argv) > 1:
+        numpeers = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        megabytes = int(sys.argv[2])
+
+    print "%d peers sending %d MB each over loopback" % (numpeers, megabytes)
+    for name, connectionclass in (("StringIO", LegacyConnection), ("buffer", Connection)):
+        received, wall, cpu = receive(connectionclass, numpeers, megabytes)
+        mb = received / float(2 ** 20)
+        print "%-8s received %.0f MB in %.2f s: %.1f MB/s; %.2f s CPU: %.1f MB/s per core" % (name, mb, wall, mb / wall, cpu, mb / max(cpu, 1e-6))
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,7 @@ from Tribler.TrackerChecking.TrackerChecking import trackerChecking,\
     multiTrackerChecking
 
 from Tribler.Core.CacheDB.CacheDBHandler import TorrentDBHandler
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
 from Tribler.Core.DecentralizedTracking.mainlineDHTChecker import mainlineDHTChecker
 from Tribler.Core.DecentralizedTracking.MagnetLink.MagnetLink import MagnetLink
 from Tribler.Core.Session import Session
@@ -104,11 +105,13 @@ class TorrentChecking(Thread):
                 #torrent still not found, determine filename + current torrent collection directory
                 torrent_path = path.join(torrent_collection_dir, get_collected_torrent_filename(torrent['infohash']))
                 
-            if path.isfile(torrent_path):
+            _data = TorrentStore.getInstance().get(torrent['infohash'])
+            if _data is None and path.isfile(torrent_path):
                 f = open(torrent_path,'rb')
                 _data = f.read()
                 f.close()
             
+            if _data is not None:
                 data = bdecode(_data)
             
                 assert 'info' in data
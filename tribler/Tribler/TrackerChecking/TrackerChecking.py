@@ -149,7 +149,7 @@ def getUrl(announce, info_hashes):
             port = 80
         
         if host.find(':') > 0:
-            port = host[host.find(':')+1:]
+            port = int(host[host.find(':')+1:])
             host = host[:host.find(':')]
         
         return (host, port)
@@ -187,25 +187,35 @@ def getStatus(url, info_hash, info_hashes):
 
 def getStatusUDP(url, info_hash, info_hashes):
     #restrict to 74 max
-    info_hashes = [info_hash] + info_hashes[:73]
+    info_hashes = [info_hash] + [infohash for infohash in info_hashes if infohash != info_hash][:73]
     assert all(len(infohash) == 20 for infohash in info_hashes)
     
     udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udpSocket.settimeout(HTTP_TIMEOUT)
+    try:
+        try:
+            return _getStatusUDP(udpSocket, url, info_hash, info_hashes)
+        except socket.error:
+            return {info_hash: (-1, -1)}
+    finally:
+        udpSocket.close()
+
+def _getStatusUDP(udpSocket, url, info_hash, info_hashes):
     
     # step 1: Get a connection-id
     connection_id = 0x41727101980
     action = 0
-    transaction_id = randint(0, sys.maxint)
+    transaction_id = randint(0, 0x7fffffff)
     msg = pack('!qii', connection_id, action, transaction_id)
     udpSocket.sendto(msg, url)
     
     result = udpSocket.recv(1024)
     if len(result) >= 16:
-        raction, rtransaction_id, rconnection_id  = unpack('!iiq', result)
+        raction, rtransaction_id, rconnection_id  = unpack('!iiq', result[:16])
         if raction == action and rtransaction_id == transaction_id:
             # step 2: Send scrape
             action = 2
-            transaction_id = randint(0, sys.maxint)
+            transaction_id = randint(0, 0x7fffffff)
             
             format = "!qii" + "20s"*len(info_hashes)
             data = [rconnection_id, action, transaction_id]
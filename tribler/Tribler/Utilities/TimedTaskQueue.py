@@ -2,42 +2,71 @@
 # see LICENSE.txt for license information
 #
 # TimedTaskQueue is a server that executes tasks on behalf of e.g. the GUI that
-# are too time consuming to be run by the actual GUI Thread (MainThread). Note 
-# that you still need to delegate the actual updating of the GUI to the 
+# are too time consuming to be run by the actual GUI Thread (MainThread). Note
+# that you still need to delegate the actual updating of the GUI to the
 # MainThread via the wx.CallAfter mechanism.
 #
+# Tasks are kept in a heap on (due time, insertion count), and tasks that are
+# replaced through their id are only marked as removed, found through an
+# index of the queued task per id. When more than half of the heap consists
+# of removed tasks it is rebuilt.
+#
 import sys
 
 from threading import Thread,Condition, RLock
 from traceback import print_exc,print_stack,format_stack
 from time import time
+from heapq import heappush, heappop, heapify
 
 DEBUG = False
 
+# marks a task in the heap that was replaced
+REMOVED = 'removed'
+# don't bother rebuilding smaller heaps
+MIN_REBUILD_SIZE = 64
+
 class TimedTaskQueue:
-    
+
     __single = None
-    
-    def __init__(self,nameprefix="TimedTaskQueue",isDaemon=True, inDEBUG = DEBUG):
+
+    def __init__(self,nameprefix="TimedTaskQueue",isDaemon=True, inDEBUG = DEBUG, numthreads = 1):
+        """ With numthreads > 1 tasks that are due are executed concurrently,
+        so only use that for tasks that don't depend on their order. """
         self.inDEBUG = inDEBUG
-        
+
         self.cond = Condition(RLock())
-        self.queue = []
+        self.queue = [] # heap of [when,count,task,id]
+        self.ids = {} # id -> the entry of the task with that id
+        self.removed = 0 # number of removed entries in the heap
         self.count = 0.0 # serves to keep task that were scheduled at the same time in FIFO order
-        self.thread = Thread(target = self.run)
-        self.thread.setDaemon(isDaemon)
-        self.thread.setName( nameprefix+self.thread.getName() )
-        self.thread.start()
+
+        # statistics, see get_stats()
+        self.num_executed = 0
+        self.max_queued = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_runtime = 0.0
+        self.max_runtime = 0.0
 
         if __debug__:
             self.callstack = {} # callstack by self.count
-        
+
+        self.threads = []
+        for i in range(numthreads):
+            thread = Thread(target = self.run)
+            thread.setDaemon(isDaemon)
+            thread.setName( nameprefix+thread.getName() )
+            self.threads.append(thread)
+        self.thread = self.threads[0]
+        for thread in self.threads:
+            thread.start()
+
     def add_task(self,task,t=0,id=None):
-        """ t parameter is now usable, unlike before. 
+        """ t parameter is now usable, unlike before.
             If id is given, all the existing tasks with the same id will be removed
-            before inserting this task 
+            before inserting this task
         """
-        
+
         if task is None:
             print_stack()
 
@@ -49,36 +78,72 @@ class TimedTaskQueue:
 
         if __debug__:
             self.callstack[self.count] = format_stack()
-            
-        if id != None:  # remove all redundant tasks
-            self.queue = filter(lambda item:item[3]!=id, self.queue)
-        self.queue.append((when,self.count,task,id))
+
+        entry = [when,self.count,task,id]
+        if id != None:  # remove the redundant task
+            self.remove_entry(self.ids.get(id))
+            self.ids[id] = entry
+        heappush(self.queue, entry)
         self.count += 1.0
+        queued = len(self.queue) - self.removed
+        if queued > self.max_queued:
+            self.max_queued = queued
         self.cond.notify()
         self.cond.release()
-        
+
+    def remove_entry(self, entry):
+        """ Called with the lock held """
+        if entry is None:
+            return
+        if __debug__:
+            self.callstack.pop(entry[1], None)
+        entry[2] = REMOVED
+        self.removed += 1
+        if self.removed > MIN_REBUILD_SIZE and self.removed * 2 > len(self.queue):
+            self.queue = [item for item in self.queue if item[2] is not REMOVED]
+            heapify(self.queue)
+            self.removed = 0
+
     def does_task_exist(self, id):
-        return any(item[3]==id for item in self.queue)
-        
+        return id in self.ids
+
+    def get_num_tasks(self):
+        """ Returns the number of queued tasks """
+        return len(self.queue) - self.removed
+
+    def get_stats(self):
+        """ Returns a dict with the number of queued and executed tasks, the
+        largest number of queued tasks, and the average and largest latency
+        (time between being due and being started) and run time in seconds
+        of the executed tasks """
+        self.cond.acquire()
+        try:
+            n = max(self.num_executed, 1)
+            return {'queued': self.get_num_tasks(),
+                    'max_queued': self.max_queued,
+                    'executed': self.num_executed,
+                    'avg_latency': self.total_latency / n,
+                    'max_latency': self.max_latency,
+                    'avg_runtime': self.total_runtime / n,
+                    'max_runtime': self.max_runtime}
+        finally:
+            self.cond.release()
+
     def run(self):
         """ Run by server thread """
         while True:
             task = None
-            timeout = None
-            flag = False
             self.cond.acquire()
             while True:
-                while len(self.queue) == 0 or flag:
-                    flag = False
-                    if timeout is None:
-                        # Wait until something is queued
-                        self.cond.wait()
-                    else:
-                        # Wait till first event is due
-                        self.cond.wait(timeout)
+                # Skip tasks that were replaced
+                while self.queue and self.queue[0][2] is REMOVED:
+                    heappop(self.queue)
+                    self.removed -= 1
+                if len(self.queue) == 0:
+                    # Wait until something is queued
+                    self.cond.wait()
+                    continue
                 # A new event was added or an event is due
-                self.queue.sort()
-                
                 (when,count,task,id) = self.queue[0]
                 if DEBUG:
                     print >>sys.stderr,"ttqueue: EVENT IN QUEUE",when,task
@@ -87,39 +152,56 @@ class TimedTaskQueue:
                     # Event not due, wait some more
                     if DEBUG:
                         print >>sys.stderr,"ttqueue: EVENT NOT TILL",when-now
-                    timeout = when-now
-                    flag = True
+                    self.cond.wait(when-now)
                 else:
                     # Event due, execute
                     if DEBUG:
                         print >>sys.stderr,"ttqueue: EVENT DUE"
-                    self.queue.pop(0)
+                    entry = heappop(self.queue)
+                    if id is not None and self.ids.get(id) is entry:
+                        del self.ids[id]
+                    latency = now - when
+                    self.total_latency += latency
+                    if latency > self.max_latency:
+                        self.max_latency = latency
                     if __debug__:
                         assert count in self.callstack
                         stack = self.callstack.pop(count)
                     break
             self.cond.release()
-            
+
             # Execute task outside lock
             try:
-                # 'stop' and 'quit' are only used for unit test
-                if task == 'stop':  
+                # 'stop' and 'quit' are only used for unit test, and end
+                # a single thread
+                if task == 'stop':
                     break
                 elif task == 'quit':
-                    if len(self.queue) == 0:
+                    self.cond.acquire()
+                    try:
+                        last = [item[0] for item in self.queue if item[2] is not REMOVED]
+                    finally:
+                        self.cond.release()
+                    if len(last) == 0:
                         break
                     else:
-                        (when,count,task,id) = self.queue[-1]
-                        t = when-time()+0.001
+                        t = max(last)-time()+0.001
                         self.add_task('quit',t)
                 else:
-                    if self.inDEBUG:
-                        t1 = time()
-                    
-                    task()
-                    
-                    if self.inDEBUG:
+                    t1 = time()
+
+                    try:
+                        task()
+                    finally:
                         took = time() - t1
+                        self.cond.acquire()
+                        self.num_executed += 1
+                        self.total_runtime += took
+                        if took > self.max_runtime:
+                            self.max_runtime = took
+                        self.cond.release()
+
+                    if self.inDEBUG:
                         if took > 0.2:
                             debug_call_name = task.__name__ if hasattr(task, "__name__") else str(task)
                             print >> sys.stderr,"ttqueue: EVENT TOOK", took, debug_call_name
@@ -130,4 +212,3 @@ class TimedTaskQueue:
                     print >> sys.stderr, "TASK QUEUED FROM"
                     print >> sys.stderr, "".join(stack)
                     print >> sys.stderr, ">>>>>>>>>>>>>>>>"
-
@@ -7,10 +7,11 @@ import time
 import socket
 import BaseHTTPServer
 from SocketServer import ThreadingMixIn
-from threading import RLock,Thread,currentThread
+from threading import Lock,RLock,Thread,currentThread
 from traceback import print_exc,print_stack
 import string
 from cStringIO import StringIO
+from collections import OrderedDict
 
 import os
 import Tribler.Core.osutils
@@ -21,6 +22,17 @@ DEBUGCONTENT = False
 DEBUGWEBUI = False
 DEBUGLOCK = False
 DEBUGBASESERV = False
+
+# Streams with a known length are shared by all clients requesting them: one
+# client at a time reads a segment of blocksize bytes from the stream, and
+# puts it in a cache of at most this many bytes that all contents share.
+SEGMENT_CACHE_SIZE = 32*2**20
+DEFAULT_BLOCKSIZE = 65536
+# send completed files from disk in blocks of this size
+SENDFILE_BLOCKSIZE = 2**20
+# a client waiting longer than this for the stream to deliver a segment
+# counts as stalled
+STALL_TIME = 0.5
         
 def bytestr2int(b):
     if b == "":
@@ -29,6 +41,154 @@ def bytestr2int(b):
         return int(b)
 
 
+def sendfile(sock,f,offset,nbytes):
+    """ Send nbytes of file f from offset to the socket, without copying
+    the data through Python when the OS supports it. Returns the number of
+    bytes sent, which is less than nbytes when the file is shorter. """
+    sent = 0
+    if hasattr(os,'sendfile'):
+        while sent < nbytes:
+            n = os.sendfile(sock.fileno(),f.fileno(),offset+sent,min(nbytes-sent,SENDFILE_BLOCKSIZE))
+            if n == 0:
+                break
+            sent += n
+    else:
+        f.seek(offset)
+        while sent < nbytes:
+            data = f.read(min(nbytes-sent,SENDFILE_BLOCKSIZE))
+            if len(data) == 0:
+                break
+            sock.sendall(data)
+            sent += len(data)
+    return sent
+
+
+class SegmentCache:
+    """ LRU cache of segments of the shared contents, of at most maxsize
+    bytes """
+    
+    def __init__(self,maxsize):
+        self.maxsize = maxsize
+        self.size = 0
+        self.lock = Lock()
+        self.segments = OrderedDict() # (content,segment number) -> data
+
+    def get(self,key):
+        self.lock.acquire()
+        try:
+            data = self.segments.pop(key,None)
+            if data is not None:
+                self.segments[key] = data
+            return data
+        finally:
+            self.lock.release()
+
+    def put(self,key,data):
+        self.lock.acquire()
+        try:
+            old = self.segments.pop(key,None)
+            if old is not None:
+                self.size -= len(old)
+            self.segments[key] = data
+            self.size += len(data)
+            while self.size > self.maxsize and len(self.segments) > 1:
+                (oldkey,old) = self.segments.popitem(last=False)
+                self.size -= len(old)
+        finally:
+            self.lock.release()
+
+    def discard(self,content):
+        """ Remove all segments of content """
+        self.lock.acquire()
+        try:
+            for key in [key for key in self.segments if key[0] is content]:
+                self.size -= len(self.segments.pop(key))
+        finally:
+            self.lock.release()
+
+
+class SharedContent:
+    """ A stream with a known length that is served to several clients at
+    once. Only one client at a time reads from the stream, the others are
+    served the segments it read from the cache. When the content is complete
+    on disk as streaminfo['filename'], clients are served from the file. """
+    
+    def __init__(self,streaminfo,cache):
+        self.stream = streaminfo['stream']
+        self.length = streaminfo['length']
+        self.segmentsize = streaminfo.get('blocksize',DEFAULT_BLOCKSIZE)
+        self.filename = streaminfo.get('filename',None)
+        self.cache = cache
+        self.lock = RLock() # held while reading from the stream
+        self.position = None # of the stream, None when unknown
+
+    def get_segment(self,segno):
+        """ Returns the data of segment segno, which is shorter than a
+        segment only when the stream ended early, or None when the stream
+        could not seek to it """
+        key = (self,segno)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        
+        self.lock.acquire()
+        try:
+            # Another client may have read it while we waited
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+            
+            offset = segno*self.segmentsize
+            nbytes = min(self.segmentsize,self.length-offset)
+            if self.position != offset:
+                try:
+                    self.stream.seek(offset)
+                except:
+                    print_exc()
+                    # where the stream is now is anybody's guess
+                    self.position = None
+                    return None
+            
+            parts = []
+            need = nbytes
+            while need > 0:
+                data = self.stream.read(need)
+                if len(data) == 0:
+                    break
+                parts.append(data)
+                need -= len(data)
+            data = ''.join(parts)
+            
+            self.position = offset+len(data)
+            if len(data) == nbytes:
+                self.cache.put(key,data)
+            return data
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.cache.discard(self)
+
+
+class StreamClient:
+    """ Statistics of an HTTP client being sent a stream """
+    
+    def __init__(self,address,path,content=None):
+        self.address = address
+        self.path = path
+        self.content = content
+        self.starttime = time.time()
+        self.nbytes = 0
+        self.stalls = 0
+
+    def get_rate(self):
+        """ Returns the average number of bytes/sec sent """
+        return self.nbytes/max(time.time()-self.starttime,0.001)
+
+    def get_stats(self):
+        return {'address':self.address,'path':self.path,'bytes':self.nbytes,'rate':self.get_rate(),'stalls':self.stalls}
+
+
 class AbstractPathMapper:
     
     def __init__(self):
@@ -58,6 +218,10 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
     2009-12-05: I now made it Multi-threaded to also handle the NSSA search
     API requests. The concurrency issue on the p2p streams is handled by
     adding a lock per stream.
+    
+    Streams with a known length are now shared, see SharedContent, such that
+    several players can read the same content at once. Only live and SVC
+    streams still have a lock that serializes the requests for them.
     """
     __single = None
     
@@ -76,6 +240,8 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
         
         self.urlpath2streaminfo = {} # Maps URL to streaminfo
         self.mappers = [] # List of PathMappers
+        self.cache = SegmentCache(SEGMENT_CACHE_SIZE)
+        self.clients = [] # StreamClients being served
         
         self.errorcallback = None
         self.statuscallback = None
@@ -101,7 +267,13 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
         if DEBUGLOCK:
             print >>sys.stderr,"vs: set_input: lock",urlpath,currentThread().getName()
         self.lock.acquire()
-        streaminfo['lock'] = RLock()
+        if streaminfo.get('length',None) is not None and not streaminfo.get('svc',False):
+            streaminfo['content'] = SharedContent(streaminfo,self.cache)
+        else:
+            streaminfo['lock'] = RLock()
+        old = self.urlpath2streaminfo.get(urlpath,None)
+        if old is not None and 'content' in old:
+            old['content'].close()
         self.urlpath2streaminfo[urlpath] = streaminfo
         if DEBUGLOCK:
             print >>sys.stderr,"vs: set_input: unlock",urlpath,currentThread().getName()
@@ -162,6 +334,8 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
         self.lock.acquire()
         try:
             del self.urlpath2streaminfo[urlpath]
+            if streaminfo is not None and 'content' in streaminfo:
+                streaminfo['content'].close()
         finally:
             if DEBUGLOCK:
                 print >>sys.stderr,"vs: del_input: unlock",urlpath,currentThread().getName()
@@ -176,6 +350,33 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
     def get_port(self):
         return self.port
 
+    def add_client(self,client):
+        self.lock.acquire()
+        try:
+            self.clients.append(client)
+        finally:
+            self.lock.release()
+
+    def remove_client(self,client):
+        """ Returns the number of other clients of the same content """
+        self.lock.acquire()
+        try:
+            self.clients.remove(client)
+            if client.content is None:
+                return 0
+            return len([other for other in self.clients if other.content is client.content])
+        finally:
+            self.lock.release()
+
+    def get_client_stats(self):
+        """ Returns a list of dicts with the address, URL path, bytes sent,
+        bytes/sec and number of stalls of each client being sent a stream """
+        self.lock.acquire()
+        try:
+            return [client.get_stats() for client in self.clients]
+        finally:
+            self.lock.release()
+
     def add_path_mapper(self,mapper):
         """ WARNING: mappers cannot be added dynamically, must be registered before background_serve()
         """
@@ -366,8 +567,8 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                     print >>sys.stderr,"videoserv: do_GET: final range",firstbyte,lastbyte,nbytes2send,currentThread().getName()
             
             
-                # 4. Seek in stream to desired offset, unless svc
-                if not svc:
+                # 4. Seek in stream to desired offset, unless svc or shared
+                if not svc and 'content' not in streaminfo:
                     try:
                         stream.seek(firstbyte)
                     except:
@@ -401,60 +602,26 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                 self.end_headers()
     
     
-                if svc:
-                    # 6. Send body: For SVC we send all we currently have, not blocking.
-                    data = stream.read()
-                    
-                    if len(data) > 0: 
-                        self.wfile.write(data)
-                    elif len(data) == 0:
-                        if DEBUG:
-                            print >>sys.stderr,"videoserv: svc: stream.read() no data" 
-                else:
-                    # 6. Send body (completely, a Range: or an infinite stream in chunked encoding
-                    done = False
-                    while True:
-                        data = stream.read(blocksize)
-                        if len(data) == 0:
-                            done = True
-                        
-                        #print >>sys.stderr,"videoserv: HTTP: read",len(data),"bytes",currentThread().getName()
-                        
-                        if length is None:
-                            # If length unknown, use chunked encoding
-                            # http://www.ietf.org/rfc/rfc2616.txt, $3.6.1 
-                            self.wfile.write("%x\r\n" % (len(data)))
-                        if len(data) > 0:
-                            # Limit output to what was asked on range queries:
-                            if length is not None and nbyteswritten+len(data) > nbytes2send:
-                                endlen = nbytes2send-nbyteswritten
-                                if endlen != 0:
-                                    self.wfile.write(data[:endlen])
-                                done = True
-                                nbyteswritten += endlen
-                            else:
-                                self.wfile.write(data)
-                                nbyteswritten += len(data)
-                            
-                            #print >>sys.stderr,"videoserv: HTTP: wrote total",nbyteswritten
-                            
-                        if length is None:
-                            # If length unknown, use chunked encoding
-                            self.wfile.write("\r\n")
-        
-                        if done:
-                            if DEBUG:
-                                print >>sys.stderr,"videoserv: do_GET: stream reached EOF or range query's send limit",currentThread().getName() 
-                            break
-                        
-                    if nbyteswritten != nbytes2send:
-                        print >>sys.stderr,"videoserv: do_GET: Sent wrong amount, wanted",nbytes2send,"got",nbyteswritten,currentThread().getName()
-
-                    # Arno, 2010-01-08: No close on Range queries
-                    if not range:
-                        stream.close()
-                        if self.server.statuscallback is not None:
-                            self.server.statuscallback("Done")
+                content = streaminfo.get('content',None)
+                client = StreamClient(self.client_address,self.path,content)
+                self.server.add_client(client)
+                try:
+                    if content is not None:
+                        # 6. Send body from the shared content
+                        nbyteswritten = self.send_content(content,client,firstbyte,nbytes2send)
+                        if nbyteswritten != nbytes2send:
+                            print >>sys.stderr,"videoserv: do_GET: Sent wrong amount, wanted",nbytes2send,"got",nbyteswritten,currentThread().getName()
+                    else:
+                        self.send_stream(stream,client,svc,length,nbytes2send,blocksize,range)
+                finally:
+                    nclients = self.server.remove_client(client)
+                
+                # Arno, 2010-01-08: No close on Range queries. The last
+                # client of a shared stream closes it.
+                if content is not None and not range and nclients == 0:
+                    stream.close()
+                    if self.server.statuscallback is not None:
+                        self.server.statuscallback("Done")
                     
             finally:
                 self.server.release_inputstream(self.path)
@@ -469,6 +636,110 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
             print_exc()
             self.error(e,self.path)
 
+
+    def send_content(self,content,client,firstbyte,nbytes2send):
+        """ Send nbytes2send bytes of the shared content from firstbyte,
+        returns the number of bytes sent """
+        if content.filename is not None:
+            # Complete on disk
+            self.wfile.flush()
+            f = open(content.filename,"rb")
+            try:
+                nbyteswritten = sendfile(self.connection,f,firstbyte,nbytes2send)
+            finally:
+                f.close()
+            client.nbytes += nbyteswritten
+            return nbyteswritten
+        
+        segmentsize = content.segmentsize
+        pos = firstbyte
+        end = firstbyte+nbytes2send
+        while pos < end:
+            segno = pos/segmentsize
+            # includes waiting for another client reading from the stream
+            t = time.time()
+            data = content.get_segment(segno)
+            if time.time()-t > STALL_TIME:
+                client.stalls += 1
+            if data is None:
+                print >>sys.stderr,"videoserv: do_GET: cannot seek stream to segment",segno,currentThread().getName()
+                break
+            start = pos-segno*segmentsize
+            if start >= len(data):
+                if DEBUG:
+                    print >>sys.stderr,"videoserv: do_GET: stream reached EOF",currentThread().getName()
+                break
+            if start != 0 or len(data) > end-pos:
+                data = data[start:start+end-pos]
+            self.wfile.write(data)
+            pos += len(data)
+            client.nbytes += len(data)
+        return pos-firstbyte
+
+
+    def send_stream(self,stream,client,svc,length,nbytes2send,blocksize,range):
+        """ Send the body from a stream that is not shared """
+        nbyteswritten = 0
+        if svc:
+            # 6. Send body: For SVC we send all we currently have, not blocking.
+            data = stream.read()
+            
+            if len(data) > 0: 
+                self.wfile.write(data)
+            elif len(data) == 0:
+                if DEBUG:
+                    print >>sys.stderr,"videoserv: svc: stream.read() no data" 
+        else:
+            # 6. Send body (completely, a Range: or an infinite stream in chunked encoding
+            done = False
+            while True:
+                t = time.time()
+                data = stream.read(blocksize)
+                if time.time()-t > STALL_TIME:
+                    client.stalls += 1
+                if len(data) == 0:
+                    done = True
+                
+                #print >>sys.stderr,"videoserv: HTTP: read",len(data),"bytes",currentThread().getName()
+                
+                if length is None:
+                    # If length unknown, use chunked encoding
+                    # http://www.ietf.org/rfc/rfc2616.txt, $3.6.1 
+                    self.wfile.write("%x\r\n" % (len(data)))
+                if len(data) > 0:
+                    # Limit output to what was asked on range queries:
+                    if length is not None and nbyteswritten+len(data) > nbytes2send:
+                        endlen = nbytes2send-nbyteswritten
+                        if endlen != 0:
+                            self.wfile.write(data[:endlen])
+                        done = True
+                        nbyteswritten += endlen
+                        client.nbytes += endlen
+                    else:
+                        self.wfile.write(data)
+                        nbyteswritten += len(data)
+                        client.nbytes += len(data)
+                    
+                    #print >>sys.stderr,"videoserv: HTTP: wrote total",nbyteswritten
+                    
+                if length is None:
+                    # If length unknown, use chunked encoding
+                    self.wfile.write("\r\n")
+
+                if done:
+                    if DEBUG:
+                        print >>sys.stderr,"videoserv: do_GET: stream reached EOF or range query's send limit",currentThread().getName() 
+                    break
+                
+            if nbyteswritten != nbytes2send:
+                print >>sys.stderr,"videoserv: do_GET: Sent wrong amount, wanted",nbytes2send,"got",nbyteswritten,currentThread().getName()
+
+            # Arno, 2010-01-08: No close on Range queries
+            if not range:
+                stream.close()
+                if self.server.statuscallback is not None:
+                    self.server.statuscallback("Done")
+
         
 
 
@@ -600,6 +871,8 @@ class MultiHTTPServer(ThreadingMixIn,VideoHTTPServer):
         
         self.urlpath2streaminfo = {} # Maps URL to streaminfo
         self.mappers = [] # List of PathMappers
+        self.cache = SegmentCache(SEGMENT_CACHE_SIZE)
+        self.clients = [] # StreamClients being served
         
         self.errorcallback = None
         self.statuscallback = None
@@ -32,6 +32,8 @@ from Tribler.dispersy.candidate import CANDIDATE_WALK_LIFETIME,\
 from Tribler.dispersy.dispersy import IntroductionRequestCache
 from Tribler.Core.RemoteTorrentHandler import RemoteTorrentHandler
 from Tribler.Core.TorrentDef import TorrentDef
+from Tribler.Core.CacheDB.TorrentStore import TorrentStore
+from Tribler.Core.BitTornado.bencode import bdecode
 from os import path
 from Tribler.Core.CacheDB.sqlitecachedb import bin2str
 
@@ -520,12 +522,22 @@ class SearchCommunity(Community):
         if path.exists(filename):
             try:
                 torrentdef = TorrentDef.load(filename)
-                files = torrentdef.get_files_as_unicode_with_length()
-                
-                return self._disp_create_torrent(torrentdef.get_infohash(), long(time()), torrentdef.get_name_as_unicode(), tuple(files), torrentdef.get_trackers_as_single_tuple(), store, update, forward)
+                return self._create_torrent_from_def(torrentdef, store, update, forward)
             except:
                 print_exc()
         return False
+    
+    def create_torrent_from_metadata(self, metadata, store=True, update=True, forward=True):
+        try:
+            torrentdef = TorrentDef.load_from_dict(bdecode(metadata))
+            return self._create_torrent_from_def(torrentdef, store, update, forward)
+        except:
+            print_exc()
+        return False
+    
+    def _create_torrent_from_def(self, torrentdef, store=True, update=True, forward=True):
+        files = torrentdef.get_files_as_unicode_with_length()
+        return self._disp_create_torrent(torrentdef.get_infohash(), long(time()), torrentdef.get_name_as_unicode(), tuple(files), torrentdef.get_trackers_as_single_tuple(), store, update, forward)
 
     def _disp_create_torrent(self, infohash, timestamp, name, files, trackers, store=True, update=True, forward=True):
         meta = self.get_meta_message(u"torrent")
@@ -599,10 +611,12 @@ class SearchCommunity(Community):
                     dispersy_id = torrent['dispersy_id'] 
 
                     #2. if still not found, create a new torrentmessage and return this one
-                    if not dispersy_id and torrent['torrent_file_name'] and path.isfile(torrent['torrent_file_name']):
-                        message = self.create_torrent(torrent['torrent_file_name'], store = True, update = False, forward = False)
-                        if message:
-                            messages.append(message)
+                    if not dispersy_id and torrent['torrent_file_name']:
+                        metadata = TorrentStore.getInstance().read(infohash, torrent['torrent_file_name'])
+                        if metadata:
+                            message = self.create_torrent_from_metadata(metadata, store = True, update = False, forward = False)
+                            if message:
+                                messages.append(message)
             
             add_message(dispersy_id)
         return messages
@@ -15,6 +15,7 @@ Ippolito <bob@redivi.com>.  Simplified, and optimized to use just python code.
 @contact: dispersy@frayja.com
 """
 
+from binascii import hexlify
 from hashlib import sha1, sha256, sha384, sha512, md5
 from math import ceil, log
 from struct import Struct
@@ -27,6 +28,9 @@ if __debug__:
     from decorator import attach_profiler
 
 class BloomFilter(Constructor):
+    # the type used to store the bits, see _empty_filter and _filter_from_bytes
+    _filter_type = long
+
     def _init_(self, m_size, k_functions, prefix, filter_):
         assert isinstance(m_size, int)
         assert 0 < m_size
@@ -35,7 +39,7 @@ class BloomFilter(Constructor):
         assert 0 < k_functions <= m_size
         assert isinstance(prefix, str)
         assert 0 <= len(prefix) < 256
-        assert isinstance(filter_, long)
+        assert isinstance(filter_, self._filter_type)
 
         self._m_size = m_size
         self._k_functions = k_functions
@@ -82,7 +86,7 @@ class BloomFilter(Constructor):
         assert isinstance(bytes_, str)
         assert 0 < len(bytes_)
         if __debug__: dprint("constructing bloom filter based on ", len(bytes_), " bytes and k_functions ", k_functions)
-        self._init_(len(bytes_) * 8, k_functions, prefix, long(sum(ord(c) << (i*8) for i, c in enumerate(bytes_))))
+        self._init_(len(bytes_) * 8, k_functions, prefix, self._filter_from_bytes(bytes_))
 
     @constructor(int, float)
     def _init_m_f(self, m_size, f_error_rate, prefix=""):
@@ -95,7 +99,7 @@ class BloomFilter(Constructor):
         # self._n = int(m * ((log(2) ** 2) / abs(log(f))))
         # self._k = int(ceil(log(2) * (m / self._n)))
         if __debug__: dprint("constructing bloom filter based on m_size ", m_size, " bits and f_error_rate ", f_error_rate)
-        self._init_(m_size, self._get_k_functions(m_size, self._get_n_capacity(m_size, f_error_rate)), prefix, 0L)
+        self._init_(m_size, self._get_k_functions(m_size, self._get_n_capacity(m_size, f_error_rate)), prefix, self._empty_filter(m_size))
 
     @constructor(float, int)
     def _init_n_f(self, f_error_rate, n_capacity, prefix=""):
@@ -106,7 +110,15 @@ class BloomFilter(Constructor):
         m_size = abs((n_capacity * log(f_error_rate)) / (log(2) ** 2))
         m_size = int(ceil(m_size / 8.0) * 8)
         if __debug__: dprint("constructing bloom filter based on f_error_rate ", f_error_rate, " and ", n_capacity, " capacity")
-        self._init_(m_size, self._get_k_functions(m_size, n_capacity), prefix, 0L)
+        self._init_(m_size, self._get_k_functions(m_size, n_capacity), prefix, self._empty_filter(m_size))
+
+    @staticmethod
+    def _empty_filter(m_size):
+        return 0L
+
+    @staticmethod
+    def _filter_from_bytes(bytes_):
+        return long(sum(ord(c) << (i*8) for i, c in enumerate(bytes_)))
 
     def _hashes(self, key):
         h = self._salt.copy()
@@ -228,25 +240,134 @@ class BloomFilter(Constructor):
         """
         return self._prefix
 
+    @property
+    def bits_checked(self):
+        """
+        The number of bits that are set.
+        @rtype: int
+        """
+        return bin(self._filter).count("1")
+
     @property
     def bytes(self):
         filter_ = self._filter
         return "".join(chr((filter_ & (0xff << c)) >> c) for c in xrange(0, self._m_size, 8))
 
+class BytearrayBloomFilter(BloomFilter):
+    """
+    A BloomFilter that stores its bits in a bytearray instead of a long.
+
+    Setting or testing a bit in a long creates a new m_size bit long for every hash position, making
+    add_keys and not_filter O(m) per position.  The bytearray is changed in place and a bit test only
+    touches a single byte.
+
+    Bit POS is stored in byte POS / 8 at bit POS % 8, which is exactly the layout produced by
+    BloomFilter.bytes.  Hence both classes can decode each others bytes, given the same functions
+    and prefix.
+    """
+    _filter_type = bytearray
+
+    @staticmethod
+    def _empty_filter(m_size):
+        return bytearray(m_size / 8)
+
+    @staticmethod
+    def _filter_from_bytes(bytes_):
+        return bytearray(bytes_)
+
+    def add(self, key):
+        """
+        Add KEY to the BloomFilter.
+        """
+        filter_ = self._filter
+        for pos in self._hashes(key):
+            filter_[pos >> 3] |= 1 << (pos & 7)
+
+    def add_keys(self, keys):
+        """
+        Add a sequence of KEYS to the BloomFilter.
+        """
+        filter_ = self._filter
+        salt_copy = self._salt.copy
+        m_size = self._m_size
+        fmt_unpack = self._fmt_unpack
+
+        for key in keys:
+            assert isinstance(key, str)
+            h = salt_copy()
+            h.update(key)
+            for pos in fmt_unpack(h.digest()):
+                pos %= m_size
+                filter_[pos >> 3] |= 1 << (pos & 7)
+
+    def clear(self):
+        """
+        Set all bits in the filter to zero.
+        """
+        self._filter[:] = self._empty_filter(self._m_size)
+
+    def __contains__(self, key):
+        filter_ = self._filter
+        m_size_ = self._m_size
+
+        h = self._salt.copy()
+        h.update(key)
+
+        for pos in self._fmt_unpack(h.digest()):
+            pos %= m_size_
+            if not filter_[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def not_filter(self, iterator):
+        """
+        Yields all tuples in iterator where the first element in the tuple is NOT in the bloom
+        filter.
+        """
+        filter_ = self._filter
+        salt_copy = self._salt.copy
+        m_size = self._m_size
+        fmt_unpack = self._fmt_unpack
+
+        for tup in iterator:
+            assert isinstance(tup, tuple)
+            assert len(tup) > 0
+            assert isinstance(tup[0], str)
+            h = salt_copy()
+            h.update(tup[0])
+
+            for pos in fmt_unpack(h.digest()):
+                pos %= m_size
+                if not filter_[pos >> 3] & (1 << (pos & 7)):
+                    yield tup
+                    break
+
+    @property
+    def bits_checked(self):
+        """
+        The number of bits that are set.
+        @rtype: int
+        """
+        return bin(long(hexlify(self._filter), 16)).count("1")
+
+    @property
+    def bytes(self):
+        return str(self._filter)
+
 if __debug__:
-    def _test_behavior():
+    def _test_behavior(constructor = BloomFilter):
         length = 1024
         f_error_rate = 0.15
         m_size = length * 8
 
-        b = BloomFilter(m_size, f_error_rate)
+        b = constructor(m_size, f_error_rate)
         assert len(b.bytes) == length, b.bytes
 
         for i in xrange(1000):
             b.add(str(i))
         print b.size, b.get_capacity(f_error_rate), b.bytes.encode("HEX")
 
-        d = BloomFilter(b.bytes, b.functions)
+        d = constructor(b.bytes, b.functions)
         assert b.size == d.size
         assert b.functions == d.functions
         assert b.bytes == d.bytes
@@ -270,7 +391,7 @@ if __debug__:
                 if (h in bloom) == (i % 2 == 0):
                     ok += 1
             write_begin = time()
-            string = str(bloom)
+            string = bloom.bytes
             write_end = time()
 
             print "generate: {generate:.1f}; create: {create:.1f}; fill: {fill:.1f}; check: {check:.1f}; write: {write:.1f}".format(generate=create_begin-generate_begin, create=fill_begin-create_begin, fill=check_begin-fill_begin, check=write_begin-check_begin, write=write_end-write_begin)
@@ -289,7 +410,7 @@ if __debug__:
                 if (str(i) in bloom) == (i % 2 == 0):
                     ok += 1
             write_begin = time()
-            string = str(bloom)
+            string = bloom.bytes
             write_end = time()
 
             print "create: {create:.1f}; fill: {fill:.1f}; check: {check:.1f}; write: {write:.1f}".format(create=fill_begin-create_begin, fill=check_begin-fill_begin, check=write_begin-check_begin, write=write_end-write_begin)
@@ -303,25 +424,39 @@ if __debug__:
         #assert "Hello" in c
         #assert not "Bye" in c
 
-        test2(10, 10,FasterBloomFilter)
-        test2(10, 100,FasterBloomFilter)
-        test2(100, 100,FasterBloomFilter)
-        test2(100, 1000,FasterBloomFilter)
-        test2(1000, 1000,FasterBloomFilter)
-        test2(1000, 10000,FasterBloomFilter)
-        test2(10000, 10000,FasterBloomFilter)
-        test2(10000, 100000,FasterBloomFilter)
-
-        test(10, 10,FasterBloomFilter)
-        test(10, 100,FasterBloomFilter)
-        test(100, 100,FasterBloomFilter)
-        test(100, 1000,FasterBloomFilter)
-        test(1000, 1000,FasterBloomFilter)
-        test(1000, 10000,FasterBloomFilter)
-        test(10000, 10000,FasterBloomFilter)
-        test(10000, 100000,FasterBloomFilter)
-        test(100000, 100000,FasterBloomFilter)
-        test(100000, 1000000,FasterBloomFilter)
+        def test_bulk(bits, count):
+            # compare the backends on the operations used by the sync: add_keys, not_filter, and bytes
+            data = [sha1(str(i)).digest() for i in xrange(count)]
+            tuples = [(h,) for h in data]
+            results = []
+            for constructor in (BloomFilter, BytearrayBloomFilter):
+                fill_begin = time()
+                bloom = constructor(0.0001, bits, prefix="x")
+                bloom.add_keys(data[::2])
+                check_begin = time()
+                missing = sum(1 for _ in bloom.not_filter(tuples))
+                write_begin = time()
+                string = bloom.bytes
+                decode_begin = time()
+                decoded = constructor(string, bloom.functions, prefix=bloom.prefix)
+                decode_end = time()
+                assert decoded.bytes == string
+                results.append(string)
+
+                print "{name:20} add_keys: {fill:.3f}; not_filter: {check:.3f}; bytes: {write:.3f}; decode: {decode:.3f}; missing: {missing}/{total}".format(name=constructor.__name__, fill=check_begin-fill_begin, check=write_begin-check_begin, write=decode_begin-write_begin, decode=decode_end-decode_begin, missing=missing, total=count)
+
+            # both backends must produce the same bytes on the wire
+            assert results[0] == results[1]
+
+        for constructor in (BloomFilter, BytearrayBloomFilter):
+            print constructor.__name__
+            for bits, count in [(10, 10), (10, 100), (100, 100), (100, 1000), (1000, 1000), (1000, 10000), (10000, 10000), (10000, 100000)]:
+                test2(bits, count, constructor)
+            for bits, count in [(10, 10), (10, 100), (100, 100), (100, 1000), (1000, 1000), (1000, 10000), (10000, 10000), (10000, 100000)]:
+                test(bits, count, constructor)
+
+        for bits, count in [(1000, 1000), (1000, 10000), (10000, 10000), (10000, 100000)]:
+            test_bulk(bits, count)
 
 
         #test2(10, 10)
@@ -713,8 +848,8 @@ if __debug__:
         # _test_performance()
         # _test_false_positives()
         # _test_prefix_false_positives()
-        # _test_prefix_false_positives(FasterBloomFilter)
-        # _test_behavior(FasterBloomFilter)
+        # _test_prefix_false_positives(BytearrayBloomFilter)
+        # _test_behavior(BytearrayBloomFilter)
         # _test_size()
         _test_performance()
 
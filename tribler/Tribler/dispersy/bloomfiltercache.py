@@ -0,0 +1,185 @@
+"""
+This module provides a cache for sync bloom filters.
+
+Every dispersy-introduction-request contains a bloom filter describing the packets that we have in a
+certain global time range.  Building this filter requires a database query and hashing every
+packet in the range.  The BloomFilterCache keeps recently built filters and keeps them up to date
+while new packets are stored, allowing Dispersy to hand out the same filter (with the same prefix)
+several times before building a new one.
+
+Bloom filters do not support removal.  Hence, when a packet in the range of a cached filter is
+undone, deleted, or replaced, the filter is removed from the cache.
+"""
+
+from collections import OrderedDict, deque
+from math import log
+
+from bloomfilter import BloomFilter
+
+if __debug__:
+    from dprint import dprint
+
+class CachedBloomFilter(object):
+    def __init__(self, community_id, time_low, time_high, modulo, offset, bloom_filter, capacity, open_ended):
+        assert isinstance(community_id, (int, long))
+        assert isinstance(time_low, (int, long))
+        assert isinstance(time_high, (int, long))
+        assert isinstance(modulo, int)
+        assert isinstance(offset, int)
+        assert isinstance(bloom_filter, BloomFilter)
+        assert isinstance(capacity, int)
+        assert isinstance(open_ended, bool)
+        self.community_id = community_id
+        self.time_low = time_low
+        self.time_high = time_high
+        self.modulo = modulo
+        self.offset = offset
+        self.bloom_filter = bloom_filter
+        self.capacity = capacity
+        # when open_ended is True the filter contains all packets from time_low onwards.  time_high
+        # is moved forward every time the filter is claimed
+        self.open_ended = open_ended
+        self.key = (community_id, time_low, time_high, modulo, offset, bloom_filter.prefix)
+        self.count = self._estimate_count(bloom_filter)
+        # the filter has been handed out once by the time it is cached
+        self.claims = 1
+
+    @staticmethod
+    def _estimate_count(bloom_filter):
+        """
+        Estimate the number of keys in BLOOM_FILTER from the number of bits that are set.
+        """
+        m_size = bloom_filter.size
+        bits_checked = bloom_filter.bits_checked
+        if bits_checked >= m_size:
+            return m_size
+        return int(round(-1.0 * m_size / bloom_filter.functions * log(1.0 - 1.0 * bits_checked / m_size)))
+
+    @property
+    def size(self):
+        """
+        The approximate memory used by the filter in bytes.
+        """
+        return self.bloom_filter.size // 8
+
+    def covers(self, global_time):
+        return (self.time_low <= global_time and (self.open_ended or global_time <= self.time_high)
+                and (global_time + self.offset) % self.modulo == 0)
+
+class BloomFilterCache(object):
+    def __init__(self, memory_budget=1024*1024):
+        """
+        Create a cache that holds at most MEMORY_BUDGET bytes worth of bloom filters.  When the
+        budget is exceeded the least recently claimed filters are removed first.
+        """
+        assert isinstance(memory_budget, int)
+        assert memory_budget > 0
+        self._memory_budget = memory_budget
+        self._memory = 0
+        # key:CachedBloomFilter pairs, the least recently used filter first
+        self._entries = OrderedDict()
+        # community_id:deque pairs, where the deque contains the keys in claim order
+        self._communities = {}
+        self._evictions = 0
+        self._invalidations = 0
+        self._updates = 0
+
+    def claim(self, community, max_claims):
+        """
+        Returns a (time_low, time_high, modulo, offset, bloom_filter) tuple for COMMUNITY, or None
+        when there is no cached filter that has been claimed less than MAX_CLAIMS times.
+        """
+        assert isinstance(max_claims, int)
+        queue = self._communities.get(community.database_id)
+        while queue:
+            key = queue[0]
+            entry = self._entries[key]
+            if entry.claims >= max_claims:
+                # this filter has been handed out often enough
+                self._remove(key)
+                continue
+
+            entry.claims += 1
+            queue.rotate(-1)
+            # mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+
+            if entry.open_ended:
+                entry.time_high = max(entry.time_high, community.acceptable_global_time)
+            return (entry.time_low, entry.time_high, entry.modulo, entry.offset, entry.bloom_filter)
+
+        return None
+
+    def put(self, community, sync):
+        """
+        Add the (time_low, time_high, modulo, offset, bloom_filter) tuple SYNC, as returned by
+        community.dispersy_claim_sync_bloom_filter, to the cache.
+        """
+        time_low, time_high, modulo, offset, bloom_filter = sync
+        entry = CachedBloomFilter(community.database_id, time_low, time_high, modulo, offset, bloom_filter,
+                                  bloom_filter.get_capacity(community.dispersy_sync_bloom_filter_error_rate),
+                                  time_high >= community.acceptable_global_time)
+        if entry.count > entry.capacity:
+            if __debug__: dprint("not caching overfull bloom filter ", entry.key[:5])
+            return
+
+        key = entry.key
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._memory += entry.size
+        self._communities.setdefault(community.database_id, deque()).append(key)
+
+        while self._memory > self._memory_budget and self._entries:
+            self._evictions += 1
+            self._remove(next(iter(self._entries)))
+
+    def add_packets(self, community_id, packets):
+        """
+        Add the (global_time, packet) tuples in PACKETS, that were just stored in the sync table, to
+        the cached filters for COMMUNITY_ID.
+        """
+        queue = self._communities.get(community_id)
+        if queue:
+            for key in list(queue):
+                entry = self._entries[key]
+                keys = [packet for global_time, packet in packets if entry.covers(global_time)]
+                if keys:
+                    entry.count += len(keys)
+                    if entry.count > entry.capacity:
+                        # adding more packets would increase the false positive rate beyond what the
+                        # community allows
+                        self._remove(key)
+                    else:
+                        self._updates += 1
+                        entry.bloom_filter.add_keys(keys)
+
+    def invalidate(self, community_id, global_times=None):
+        """
+        Remove the cached filters for COMMUNITY_ID that cover one of GLOBAL_TIMES, or all cached
+        filters for COMMUNITY_ID when GLOBAL_TIMES is None.
+        """
+        queue = self._communities.get(community_id)
+        if queue:
+            for key in list(queue):
+                entry = self._entries[key]
+                if global_times is None or any(entry.covers(global_time) for global_time in global_times):
+                    self._invalidations += 1
+                    self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._memory -= entry.size
+        queue = self._communities[entry.community_id]
+        queue.remove(key)
+        if not queue:
+            del self._communities[entry.community_id]
+
+    def info(self):
+        return {"entries":len(self._entries),
+                "memory":self._memory,
+                "memory_budget":self._memory_budget,
+                "evictions":self._evictions,
+                "invalidations":self._invalidations,
+                "updates":self._updates}
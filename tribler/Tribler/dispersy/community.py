@@ -13,7 +13,7 @@ from itertools import islice
 from random import random, Random, randint
 from time import time
 
-from bloomfilter import BloomFilter
+from bloomfilter import BloomFilter, BytearrayBloomFilter
 from cache import CacheDict
 from candidate import LoopbackCandidate
 from conversion import BinaryConversion, DefaultConversion
@@ -569,6 +569,23 @@ class Community(object):
         """
         return (1500 - 60 - 8 - 51 - self._my_member.signature_length - 21 - 30) * 8
 
+    @property
+    def dispersy_sync_bloom_filter_reuse(self):
+        """
+        The number of dispersy-introduction-request messages that may contain the same sync bloom
+        filter.
+
+        Dispersy caches the sync bloom filters that it builds and keeps them up to date while new
+        packets are stored.  A cached filter is handed out up to this many times before
+        dispersy_claim_sync_bloom_filter is called to build a new one.  Handing out the same filter
+        (and hence the same prefix) to different candidates is harmless, however, building new
+        filters ensures that different time ranges are synced.
+
+        Return 1 to build a new filter for every introduction request.
+        @rtype: int
+        """
+        return 5
+
     def dispersy_claim_sync_bloom_filter(self, identifier):
         """
         Returns a (time_low, time_high, modulo, offset, bloom_filter) tuple or None.
@@ -580,7 +597,7 @@ class Community(object):
 
     @runtime_duration_warning(0.5)
     def dispersy_claim_sync_bloom_filter_simple(self):
-        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+        bloom = BytearrayBloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
         capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
         global_time = self.global_time
 
@@ -615,7 +632,7 @@ class Community(object):
     #choose a pivot, add all items capacity to the right. If too small, add items left of pivot
     @runtime_duration_warning(0.5)
     def dispersy_claim_sync_bloom_filter_right(self):
-        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+        bloom = BytearrayBloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
         capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
         desired_mean = self.global_time / 2.0
@@ -669,7 +686,7 @@ class Community(object):
     #instead of pivot + capacity, divide capacity to have 50/50 divivion around pivot
     @runtime_duration_warning(0.5)
     def dispersy_claim_sync_bloom_filter_50_50(self):
-        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+        bloom = BytearrayBloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
         capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
         desired_mean = self.global_time / 2.0
@@ -747,7 +764,7 @@ class Community(object):
                 t2 = time()
 
             acceptable_global_time = self.acceptable_global_time
-            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+            bloom = BytearrayBloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
             desired_mean = self.global_time / 2.0
@@ -823,7 +840,7 @@ class Community(object):
             if __debug__:
                 t2 = time()
 
-            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+            bloom = BytearrayBloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
             self._nrsyncpackets = list(self._dispersy.database.execute(u"SELECT count(*) FROM sync WHERE meta_message IN (%s) AND undone = 0 LIMIT 1" % (syncable_messages)))[0][0]
@@ -5,7 +5,7 @@ from struct import pack, unpack_from, Struct
 from random import choice
 
 from authentication import NoAuthentication, MemberAuthentication, MultiMemberAuthentication
-from bloomfilter import BloomFilter
+from bloomfilter import BloomFilter, BytearrayBloomFilter
 from crypto import ec_check_public_bin
 from destination import MemberDestination, CommunityDestination, CandidateDestination, SubjectiveDestination
 from dispersydatabase import DispersyDatabase
@@ -100,6 +100,20 @@ class Conversion(object):
         assert data[:22] == self._prefix
         raise NotImplementedError("The subclass must implement decode_message")
 
+    def get_signature_candidates(self, data):
+        """
+        Obtain the members that may have signed DATA, without decoding DATA.
+
+        Returns a list of (member, signature, length) tuples, where SIGNATURE should have been made
+        by MEMBER over the first LENGTH bytes of DATA.  An empty list is returned when the signature
+        can only be verified while decoding.
+        @rtype: [(Member, string, int)]
+        """
+        assert isinstance(data, str)
+        assert len(data) >= 22
+        assert data[:22] == self._prefix
+        return []
+
     def encode_message(self, message):
         """
         Encode a Message instance into a binary string where the first byte is the on-the-wire
@@ -934,7 +948,7 @@ class BinaryConversion(Conversion):
             if not length == len(data) - offset:
                 raise DropPacket("Invalid number of bytes available")
 
-            bloom_filter = BloomFilter(data[offset:offset + length], functions, prefix=prefix)
+            bloom_filter = BytearrayBloomFilter(data[offset:offset + length], functions, prefix=prefix)
             offset += length
 
             sync = (time_low, time_high, modulo, modulo_offset, bloom_filter)
@@ -1417,6 +1431,50 @@ class BinaryConversion(Conversion):
 
         return decode_functions.meta
 
+    def get_signature_candidates(self, data):
+        assert isinstance(data, str)
+        assert len(data) >= 22
+        assert data[:22] == self._prefix, (data[:22].encode("HEX"), self._prefix.encode("HEX"))
+
+        if len(data) < 23:
+            return []
+
+        decode_functions = self._decode_message_map.get(data[22])
+        if decode_functions is None:
+            return []
+
+        # only MemberAuthentication is supported, MultiMemberAuthentication signatures may be
+        # empty and are verified while decoding
+        authentication = decode_functions.meta.authentication
+        if not isinstance(authentication, MemberAuthentication):
+            return []
+
+        # same layout as _decode_member_authentication
+        offset = 23
+        if authentication.encoding == "sha1":
+            if len(data) < offset + 20:
+                return []
+            members = [member for member in self._community.dispersy.get_members_from_id(data[offset:offset+20]) if member.has_identity(self._community)]
+
+        elif authentication.encoding == "bin":
+            if len(data) < offset + 2:
+                return []
+            key_length, = self._struct_H.unpack_from(data, offset)
+            offset += 2
+            if len(data) < offset + key_length:
+                return []
+            key = data[offset:offset+key_length]
+            if not ec_check_public_bin(key):
+                return []
+            members = [self._community.dispersy.get_member(key)]
+
+        else:
+            return []
+
+        return [(member, data[len(data) - member.signature_length:], len(data) - member.signature_length)
+                for member in members
+                if offset < len(data) - member.signature_length]
+
     def decode_message(self, candidate, data, verify=True):
         """
         Decode a binary string into a Message.Implementation structure.
@@ -48,6 +48,7 @@ from time import time
 
 from authentication import NoAuthentication, MemberAuthentication, MultiMemberAuthentication
 from bloomfilter import BloomFilter
+from bloomfiltercache import BloomFilterCache
 from bootstrap import get_bootstrap_candidates
 from callback import Callback
 from candidate import BootstrapCandidate, LoopbackCandidate, WalkCandidate, Candidate
@@ -72,6 +73,7 @@ from payload import SubjectiveSetPayload, MissingSubjectiveSetPayload
 from requestcache import Cache, RequestCache
 from resolution import PublicResolution, LinearResolution
 from singleton import Singleton
+from verifier import SignatureVerifier
 
 from guessip import get_my_wan_ip
 
@@ -227,6 +229,8 @@ class Statistics(object):
         self._walk_attempt = 0
         self._walk_success = 0
         self._walk_reset = 0
+        self._bloom_filter_hit = 0
+        self._bloom_filter_miss = 0
         if __debug__:
             self._drop = {}
             self._delay = {}
@@ -251,6 +255,8 @@ class Statistics(object):
                     "walk_success":self._walk_success,
                     "walk_reset":self._walk_reset,
                     "walk_fail":self._walk_fail,
+                    "bloom_filter_hit":self._bloom_filter_hit,
+                    "bloom_filter_miss":self._bloom_filter_miss,
                     "attachment":self._attachment}
 
         else:
@@ -259,7 +265,9 @@ class Statistics(object):
                     "runtime":time() - self._start,
                     "walk_attempt":self._walk_attempt,
                     "walk_success":self._walk_success,
-                    "walk_reset":self._walk_reset}
+                    "walk_reset":self._walk_reset,
+                    "bloom_filter_hit":self._bloom_filter_hit,
+                    "bloom_filter_miss":self._bloom_filter_miss}
 
     def reset(self):
         """
@@ -273,6 +281,8 @@ class Statistics(object):
             self._walk_attempt = 0
             self._walk_success = 0
             self._walk_reset = 0
+            self._bloom_filter_hit = 0
+            self._bloom_filter_miss = 0
             if __debug__:
                 self._drop = {}
                 self._delay = {}
@@ -343,6 +353,12 @@ class Statistics(object):
     def increment_walk_reset(self):
         self._walk_reset += 1
 
+    def increment_bloom_filter_hit(self):
+        self._bloom_filter_hit += 1
+
+    def increment_bloom_filter_miss(self):
+        self._bloom_filter_miss += 1
+
 class Dispersy(Singleton):
     """
     The Dispersy class provides the interface to all Dispersy related commands, managing the in- and
@@ -431,6 +447,12 @@ class Dispersy(Singleton):
         # statistics...
         self._statistics = Statistics()
 
+        # sync bloom filters that can be reused in dispersy-introduction-request messages
+        self._bloom_filter_cache = BloomFilterCache()
+
+        # verifies the signatures of incoming batches in parallel
+        self._signature_verifier = SignatureVerifier()
+
         if __debug__:
             self._callback.register(self._stats_candidates)
             self._callback.register(self._stats_detailed_candidates)
@@ -815,6 +837,7 @@ class Dispersy(Singleton):
         assert self._communities[community.cid] == community
         assert not community.dispersy_enable_candidate_walker or community in self._walker_commmunities, [community.dispersy_enable_candidate_walker, community in self._walker_commmunities]
         del self._communities[community.cid]
+        self._bloom_filter_cache.invalidate(community.database_id)
 
         if community.dispersy_enable_candidate_walker:
             self._walker_commmunities.remove(community)
@@ -1145,6 +1168,7 @@ class Dispersy(Singleton):
                         # replace our current message with the other one
                         self._database.execute(u"UPDATE sync SET packet = ? WHERE community = ? AND member = ? AND global_time = ?",
                                                (buffer(message.packet), community.database_id, message.authentication.member.database_id, message.distribution.global_time))
+                        self._bloom_filter_cache.invalidate(community.database_id, [message.distribution.global_time])
 
                         # notify that global times have changed
                         # community.update_sync_range(message.meta, [message.distribution.global_time])
@@ -1824,8 +1848,11 @@ class Dispersy(Singleton):
 
         # BEGIN = time()
 
+        # verify all signatures in the batch at once, allowing them to be verified in parallel
+        verified = self._verify_batch(batch)
+
         # convert binary packets into Message.Implementation instances
-        messages = list(self._convert_batch_into_messages(batch))
+        messages = list(self._convert_batch_into_messages(batch, verified))
         assert all(isinstance(message, Message.Implementation) for message in messages), "_convert_batch_into_messages must return only Message.Implementation instances"
         assert all(message.meta == meta for message in messages), "All Message.Implementation instances must be in the same batch"
         if __debug__: dprint(len(messages), " ", meta.name, " messages after conversion")
@@ -2001,7 +2028,29 @@ class Dispersy(Singleton):
                     dprint("drop a ", len(packet), " byte packet (", exception,") from ", candidate, level="warning")
                     self._statistics.drop("_convert_packets_into_batch:decode_meta_message:%s" % exception, len(packet))
 
-    def _convert_batch_into_messages(self, batch):
+    def _verify_batch(self, batch):
+        """
+        Verify the signatures of the packets in BATCH using the signature verifier.
+
+        Returns the set of packets that have a valid signature.  The signatures of the remaining
+        packets are verified, when applicable, while they are decoded.
+        @rtype: set
+        """
+        jobs = []
+        for _, packet, conversion in batch:
+            for member, signature, length in conversion.get_signature_candidates(packet):
+                jobs.append((member, packet, signature, length))
+
+        if jobs:
+            return set(packet for (_, packet, _, _), valid in zip(jobs, self._signature_verifier.verify_batch(jobs)) if valid)
+        else:
+            return set()
+
+    def _convert_batch_into_messages(self, batch, verified=()):
+        """
+        Convert the (candidate, packet, conversion) tuples in BATCH into Message.Implementation
+        instances.  The signatures of the packets in VERIFIED are not verified again.
+        """
         if __debug__:
             # pylint: disable-msg=W0404
             from conversion import Conversion
@@ -2017,7 +2066,7 @@ class Dispersy(Singleton):
 
             try:
                 # convert binary data to internal Message
-                yield conversion.decode_message(candidate, packet)
+                yield conversion.decode_message(candidate, packet, not packet in verified)
 
             except DropPacket, exception:
                 if __debug__:
@@ -2061,6 +2110,7 @@ class Dispersy(Singleton):
         is_subjective_destination = isinstance(meta.destination, SubjectiveDestination)
         is_multi_member_authentication = isinstance(meta.authentication, MultiMemberAuthentication)
         highest_global_time = 0
+        stored_packets = []
 
         # update_sync_range = set()
         for message in messages:
@@ -2100,6 +2150,7 @@ class Dispersy(Singleton):
 
             # update global time
             highest_global_time = max(highest_global_time, message.distribution.global_time)
+            stored_packets.append((message.distribution.global_time, message.packet))
 
         if isinstance(meta.distribution, LastSyncDistribution):
             # delete packets that have become obsolete
@@ -2137,6 +2188,7 @@ class Dispersy(Singleton):
             if items:
                 self._database.executemany(u"DELETE FROM sync WHERE id = ?", [(id_,) for id_, _, _ in items])
                 assert len(items) == self._database.changes
+                self._bloom_filter_cache.invalidate(meta.community.database_id, [global_time for _, _, global_time in items])
                 if __debug__: dprint("deleted ", self._database.changes, " messages ", [id_ for id_, _, _ in items])
 
                 if is_multi_member_authentication:
@@ -2152,6 +2204,10 @@ class Dispersy(Singleton):
                         history_size, = self._database.execute(u"SELECT COUNT(1) FROM sync WHERE meta_message = ? AND member = ?", (message.database_id, message.authentication.member.database_id)).next()
                         assert history_size <= message.distribution.history_size, [count, message.distribution.history_size, message.authentication.member.database_id]
 
+        # only packets with a priority above 32 are included in the sync bloom filters
+        if stored_packets and meta.distribution.priority > 32:
+            self._bloom_filter_cache.add_packets(meta.community.database_id, stored_packets)
+
         # update the global time
         meta.community.update_global_time(highest_global_time)
 
@@ -2416,7 +2472,15 @@ class Dispersy(Singleton):
                 self._callback.unregister(task_identifier)
                 self._on_batch_cache_timeout(meta, timestamp, batch)
 
-            sync = community.dispersy_claim_sync_bloom_filter(identifier)
+            sync = self._bloom_filter_cache.claim(community, community.dispersy_sync_bloom_filter_reuse)
+            if sync:
+                self._statistics.increment_bloom_filter_hit()
+            else:
+                self._statistics.increment_bloom_filter_miss()
+                sync = community.dispersy_claim_sync_bloom_filter(identifier)
+                if sync and community.dispersy_sync_bloom_filter_reuse > 1:
+                    self._bloom_filter_cache.put(community, sync)
+
             if __debug__:
                 assert sync is None or isinstance(sync, tuple), sync
                 if not sync is None:
@@ -3114,6 +3178,7 @@ ORDER BY meta_message.priority DESC, sync.global_time * meta_message.direction""
         # remove all messages created by the malicious member
         self._database.execute(u"DELETE FROM sync WHERE community = ? AND member = ?",
                                (community.database_id, member.database_id))
+        self._bloom_filter_cache.invalidate(community.database_id)
 
         # TODO: if we have a address for the malicious member, we can also remove her from the
         # candidate table
@@ -4207,6 +4272,8 @@ ORDER BY meta_message.priority DESC, sync.global_time * meta_message.direction""
 
         self._database.executemany(u"UPDATE sync SET undone = ? WHERE community = ? AND member = ? AND global_time = ?",
                                    ((message.packet_id, message.community.database_id, message.payload.member.database_id, message.payload.global_time) for message in messages))
+        for community, iterator in groupby(messages, key=lambda x: x.community):
+            self._bloom_filter_cache.invalidate(community.database_id, [message.payload.global_time for message in iterator])
         for meta, iterator in groupby(messages, key=lambda x: x.payload.packet.meta):
             sub_messages = list(iterator)
             meta.undo_callback([(message.payload.member, message.payload.global_time, message.payload.packet) for message in sub_messages])
@@ -4287,6 +4354,7 @@ ORDER BY meta_message.priority DESC, sync.global_time * meta_message.direction""
                 # 1. remove all except the dispersy-authorize, dispersy-destroy-community, and
                 # dispersy-identity messages
                 self._database.execute(u"DELETE FROM sync WHERE community = ? AND NOT (meta_message = ? OR meta_message = ? OR meta_message = ?)", (community.database_id, authorize_message_id, destroy_message_id, identity_message_id))
+                self._bloom_filter_cache.invalidate(community.database_id)
 
                 # 2. cleanup the reference_member_sync table.  however, we should keep the ones
                 # that are still referenced
@@ -4356,6 +4424,7 @@ ORDER BY meta_message.priority DESC, sync.global_time * meta_message.direction""
                 if undo:
                     executemany(u"UPDATE sync SET undone = 1 WHERE id = ?", ((message.packet_id,) for message in undo))
                     assert self._database.changes == len(undo), (self._database.changes, len(undo))
+                    self._bloom_filter_cache.invalidate(community.database_id, [message.distribution.global_time for message in undo])
                     meta.undo_callback([(message.authentication.member, message.distribution.global_time, message) for message in undo])
 
                     # notify that global times have changed
@@ -4364,6 +4433,7 @@ ORDER BY meta_message.priority DESC, sync.global_time * meta_message.direction""
                 if redo:
                     executemany(u"UPDATE sync SET undone = 0 WHERE id = ?", ((message.packet_id,) for message in redo))
                     assert self._database.changes == len(redo), (self._database.changes, len(redo))
+                    self._bloom_filter_cache.invalidate(community.database_id, [message.distribution.global_time for message in redo])
                     meta.handle_callback(redo)
 
                     # notify that global times have changed
@@ -4816,9 +4886,14 @@ ORDER BY meta_message.priority DESC, sync.global_time * meta_message.direction""
         # 3.3: added info["walk_fail"] in __debug__ mode
         # 3.4: added info["walk_reset"]
         # 3.4: added info["attachment"] in __debug__ mode
+        # 3.5: added info["total_packets_up"], info["total_packets_down"], info["packets_per_second_up"],
+        #      info["packets_per_second_down"], info["syscalls_per_packet_up"], and
+        #      info["syscalls_per_packet_down"]
+        # 3.6: added info["bloom_filter_hit"], info["bloom_filter_miss"], and info["bloom_filter_cache"]
+        # 3.7: added info["signature_verifier"]
 
         now = time()
-        info = {"version":3.4,
+        info = {"version":3.7,
                 "class":"Dispersy",
                 "lan_address":self._lan_address,
                 "wan_address":self._wan_address,
@@ -4826,7 +4901,15 @@ ORDER BY meta_message.priority DESC, sync.global_time * meta_message.direction""
                 "database_version":self._database.database_version,
                 "connection_type":self._connection_type,
                 "total_up":self._endpoint.total_up,
-                "total_down":self._endpoint.total_down}
+                "total_down":self._endpoint.total_down,
+                "total_packets_up":self._endpoint.total_packets_up,
+                "total_packets_down":self._endpoint.total_packets_down,
+                "packets_per_second_up":self._endpoint.packets_per_second_up,
+                "packets_per_second_down":self._endpoint.packets_per_second_down,
+                "syscalls_per_packet_up":self._endpoint.syscalls_per_packet_up,
+                "syscalls_per_packet_down":self._endpoint.syscalls_per_packet_down,
+                "bloom_filter_cache":self._bloom_filter_cache.info(),
+                "signature_verifier":self._signature_verifier.info()}
 
         if statistics:
             info.update(self._statistics.info())
@@ -6,10 +6,10 @@ import select
 import socket
 import sys
 import threading
+from collections import deque
 from time import time
 
 from candidate import Candidate
-from traceback import print_exc
 
 if __debug__:
     from dprint import dprint
@@ -23,10 +23,33 @@ else:
 TUNNEL_PREFIX = "ffffffff".decode("HEX")
 DEBUG = False
 
+class PacketRate(object):
+    """
+    Packets per second over, roughly, the last WINDOW seconds.
+    """
+    def __init__(self, window=10):
+        self._samples = deque([(time(), 0)], maxlen=window + 1)
+
+    def update(self, total):
+        now = time()
+        if now - self._samples[-1][0] >= 1.0:
+            self._samples.append((now, total))
+
+    def get_rate(self, total):
+        timestamp, first = self._samples[0]
+        duration = time() - timestamp
+        return (total - first) / duration if duration > 0.0 else 0.0
+
 class Endpoint(object):
     def __init__(self):
         self._total_up = 0
         self._total_down = 0
+        self._total_packets_up = 0
+        self._total_packets_down = 0
+        self._total_syscalls_up = 0
+        self._total_syscalls_down = 0
+        self._rate_up = PacketRate()
+        self._rate_down = PacketRate()
 
     @property
     def total_up(self):
@@ -36,6 +59,38 @@ class Endpoint(object):
     def total_down(self):
         return self._total_down
 
+    @property
+    def total_packets_up(self):
+        return self._total_packets_up
+
+    @property
+    def total_packets_down(self):
+        return self._total_packets_down
+
+    @property
+    def total_syscalls_up(self):
+        return self._total_syscalls_up
+
+    @property
+    def total_syscalls_down(self):
+        return self._total_syscalls_down
+
+    @property
+    def packets_per_second_up(self):
+        return self._rate_up.get_rate(self._total_packets_up)
+
+    @property
+    def packets_per_second_down(self):
+        return self._rate_down.get_rate(self._total_packets_down)
+
+    @property
+    def syscalls_per_packet_up(self):
+        return 1.0 * self._total_syscalls_up / self._total_packets_up if self._total_packets_up else 0.0
+
+    @property
+    def syscalls_per_packet_down(self):
+        return 1.0 * self._total_syscalls_down / self._total_packets_down if self._total_packets_down else 0.0
+
     def get_address(self):
         raise NotImplementedError()
 
@@ -103,6 +158,7 @@ class StandaloneEndpoint(Endpoint):
                     packets = []
                     try:
                         while True:
+                            self._total_syscalls_down += 1
                             (data, sock_addr) = recvfrom(65535)
                             packets.append((sock_addr, data))
                     except socket.error:
@@ -120,6 +176,8 @@ class StandaloneEndpoint(Endpoint):
                                         print >> sys.stderr, "endpoint: %.1f %30s <- %15s:%-5d %4d bytes" % (time(), name, sock_addr[0], sock_addr[1], len(data))
 
                             self._total_down += sum(len(data) for _, data in packets)
+                            self._total_packets_down += len(packets)
+                            self._rate_down.update(self._total_packets_down)
                             register(dispersythread_data_came_in, (packets,))
 
     def dispersythread_data_came_in(self, packets):
@@ -150,11 +208,14 @@ class StandaloneEndpoint(Endpoint):
 
                 if candidate.tunnel:
                     data = TUNNEL_PREFIX + data
+                self._total_syscalls_up += 1
                 try:
                     self._socket.sendto(data, sock_addr)
                 except socket.error:
                     return False
+                self._total_packets_up += 1
 
+        self._rate_up.update(self._total_packets_up)
         # return True when something has been send
         return candidates and packets
 
@@ -174,8 +235,14 @@ class RawserverEndpoint(Endpoint):
         self._rawserver = rawserver
         self._rawserver.start_listening_udp(self._socket, self)
         self._dispersy = dispersy
+        from Tribler.Core.BitTornado.udpbatch import BatchWriter
+        self._writer = BatchWriter(self._socket)
         self._sendqueue_lock = threading.Lock()
-        self._sendqueue = []
+        # (data, sock_addr) tuples waiting for the socket to become writable.  _sendqueue_set
+        # contains the same tuples, a packet that is already queued for an address is not queued
+        # again
+        self._sendqueue = deque()
+        self._sendqueue_set = set()
 
     def get_address(self):
         return self._socket.getsockname()
@@ -187,6 +254,8 @@ class RawserverEndpoint(Endpoint):
         # sometimes called without any packets...
         if packets:
             self._total_down += sum(len(data) for _, data in packets)
+            self._total_packets_down, self._total_syscalls_down = self._rawserver.get_udp_stats(self._socket)
+            self._rate_down.update(self._total_packets_down)
 
             if __debug__:
                 if DEBUG:
@@ -222,54 +291,86 @@ class RawserverEndpoint(Endpoint):
         self._total_up += sum(len(data) for data in packets) * len(candidates)
         wan_address = self._dispersy.wan_address
 
-        with self._sendqueue_lock:
-            for candidate in candidates:
-                sock_addr = candidate.get_destination_address(wan_address)
-                assert self._dispersy.is_valid_remote_address(sock_addr)
+        batch = []
+        for candidate in candidates:
+            sock_addr = candidate.get_destination_address(wan_address)
+            assert self._dispersy.is_valid_remote_address(sock_addr)
 
-                for data in packets:
-                    if __debug__:
-                        if DEBUG:
-                            try:
-                                name = self._dispersy.convert_packet_to_meta_message(data, load=False, auto_load=False).name
-                            except:
-                                name = "???"
-                            print >> sys.stderr, "endpoint: %.1f %30s -> %15s:%-5d %4d bytes" % (time(), name, sock_addr[0], sock_addr[1], len(data))
+            for data in packets:
+                if __debug__:
+                    if DEBUG:
+                        try:
+                            name = self._dispersy.convert_packet_to_meta_message(data, load=False, auto_load=False).name
+                        except:
+                            name = "???"
+                        print >> sys.stderr, "endpoint: %.1f %30s -> %15s:%-5d %4d bytes" % (time(), name, sock_addr[0], sock_addr[1], len(data))
 
-                    if candidate.tunnel:
-                        data = TUNNEL_PREFIX + data
+                if candidate.tunnel:
+                    data = TUNNEL_PREFIX + data
+                batch.append((data, sock_addr))
 
-                    if self._sendqueue:
-                        self._sendqueue.append((data, sock_addr))
+        with self._sendqueue_lock:
+            if self._sendqueue:
+                self._enqueue(batch)
 
-                    else:
-                        try:
-                            self._socket.sendto(data, sock_addr)
-                        except socket.error, e:
-                            if e[0] == SOCKET_BLOCK_ERRORCODE:
-                                self._sendqueue.append((data, sock_addr))
-                                print >> sys.stderr, time(), "sendqueue overflowing", len(self._sendqueue), "(first schedule)"
-                                self._rawserver.add_task(self._process_sendqueue, 0.1)
+            else:
+                index = self._send_batch(batch)
+                if index < len(batch):
+                    self._enqueue(batch[index:])
+                    print >> sys.stderr, time(), "sendqueue overflowing", len(self._sendqueue), "(first schedule)"
+                    self._rawserver.add_task(self._process_sendqueue, 0.1)
 
             # return True when something has been send
             return candidates and packets
 
+    def _enqueue(self, batch):
+        # must be called with _sendqueue_lock held
+        for packet in batch:
+            if not packet in self._sendqueue_set:
+                self._sendqueue_set.add(packet)
+                self._sendqueue.append(packet)
+
+    def _send_batch(self, batch):
+        """
+        Sends BATCH, a list of (data, sock_addr) tuples, in as few system calls as possible.
+
+        Packets that fail for any reason other than a full socket buffer are dropped.  Returns the
+        index of the first packet that was not sent because the socket buffer is full, or
+        len(BATCH) when the entire batch was handled.
+        """
+        # must be called with _sendqueue_lock held
+        index = 0
+        while index < len(batch):
+            try:
+                sent, syscalls = self._writer.write(batch, index)
+
+            except socket.error, e:
+                self._total_syscalls_up += 1
+                if e[0] == SOCKET_BLOCK_ERRORCODE:
+                    break
+                if __debug__: dprint("dropping packet to ", batch[index][1], ": ", e, level="warning")
+                index += 1
+
+            else:
+                self._total_syscalls_up += syscalls
+                self._total_packets_up += sent
+                index += sent
+
+        self._rate_up.update(self._total_packets_up)
+        return index
+
     def _process_sendqueue(self):
         print >> sys.stderr, time(), "sendqueue overflowing", len(self._sendqueue)
 
         with self._sendqueue_lock:
-            while self._sendqueue:
-                data, sock_addr = self._sendqueue.pop(0)
-                try:
-                    self._socket.sendto(data, sock_addr)
+            batch = list(self._sendqueue)
+            self._sendqueue.clear()
+            self._sendqueue_set.clear()
 
-                except socket.error, e:
-                    if e[0] == SOCKET_BLOCK_ERRORCODE:
-                        self._sendqueue.insert(0, (data, sock_addr))
-                        self._rawserver.add_task(self._process_sendqueue, 0.1)
-                        break
-                    else:
-                        print_exc()
+            index = self._send_batch(batch)
+            if index < len(batch):
+                self._enqueue(batch[index:])
+                self._rawserver.add_task(self._process_sendqueue, 0.1)
 
 class TunnelEndpoint(Endpoint):
     def __init__(self, swift_process, dispersy):
@@ -314,6 +415,8 @@ class TunnelEndpoint(Endpoint):
                                 name = "???"
                             print >> sys.stderr, "endpoint: %.1f %30s -> %15s:%-5d %4d bytes" % (time(), name, sock_addr[0], sock_addr[1], len(data))
                     self._swift.send_tunnel(self._session, sock_addr, data)
+                    self._total_packets_up += 1
+            self._rate_up.update(self._total_packets_up)
 
             # return True when something has been send
             return candidates and packets
@@ -331,6 +434,8 @@ class TunnelEndpoint(Endpoint):
                     name = "???"
                 print >> sys.stderr, "endpoint: %.1f %30s <- %15s:%-5d %4d bytes" % (time(), name, sock_addr[0], sock_addr[1], len(data))
         self._total_down += len(data)
+        self._total_packets_down += 1
+        self._rate_down.update(self._total_packets_down)
         self._dispersy.callback.register(self.dispersythread_data_came_in, (sock_addr, data, time()))
 
     def dispersythread_data_came_in(self, sock_addr, data, timestamp):
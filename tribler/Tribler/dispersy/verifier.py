@@ -0,0 +1,127 @@
+"""
+This module provides parallel signature verification for incoming packets.
+
+Verifying an elliptic curve signature is by far the most expensive step when converting an incoming
+packet into a Message.Implementation.  The SignatureVerifier hands the signatures of an entire batch
+to a pool of worker threads (M2Crypto releases the GIL while verifying) and waits until all of them
+are verified.  The batch is converted afterwards, in its original order, on the callback thread.
+
+Packets are often received from many candidates at the same time.  Hence the (member, packet digest)
+pairs that were verified recently are remembered, allowing duplicate packets to be verified only
+once.
+"""
+
+from collections import OrderedDict
+from hashlib import sha1
+from Queue import Queue
+from threading import Thread
+
+if __debug__:
+    from dprint import dprint
+
+class SignatureVerifier(object):
+    def __init__(self, workers=2, cache_size=4096):
+        """
+        Create a verifier that uses WORKERS threads and remembers the last CACHE_SIZE verified
+        (member, packet digest) pairs.
+
+        When WORKERS is zero all signatures are verified on the calling thread.
+        """
+        assert isinstance(workers, int)
+        assert workers >= 0
+        assert isinstance(cache_size, int)
+        assert cache_size > 0
+        self._cache_size = cache_size
+        # (member, packet digest):None pairs, the least recently used pair first
+        self._verified = OrderedDict()
+        # (results, index, member, packet, signature, length) tuples
+        self._jobs = Queue()
+        self._workers = []
+        for index in xrange(workers):
+            thread = Thread(target=self._worker, name="Dispersy-Verifier-%d" % index)
+            thread.setDaemon(True)
+            thread.start()
+            self._workers.append(thread)
+
+        self._hits = 0
+        self._misses = 0
+        self._failures = 0
+
+    def _worker(self):
+        get = self._jobs.get
+        while True:
+            results, index, member, packet, signature, length = get()
+            try:
+                valid = bool(member.verify(packet, signature, length=length))
+            except Exception:
+                if __debug__: dprint("unable to verify signature", exception=True, level="error")
+                valid = False
+            results.put((index, valid))
+
+    def verify_batch(self, jobs):
+        """
+        Verify the signatures in JOBS, a list of (member, packet, signature, length) tuples, where
+        SIGNATURE must have been made by MEMBER over the first LENGTH bytes of PACKET.
+
+        Returns a list with a boolean for each tuple in JOBS, in the same order.
+        @rtype: [bool]
+        """
+        assert isinstance(jobs, list)
+        assert all(isinstance(job, tuple) and len(job) == 4 for job in jobs)
+        verified = self._verified
+        valid = [False] * len(jobs)
+        # key:index pairs for the jobs that must be verified
+        pending = {}
+        # (index, index of the identical pending job) pairs
+        duplicates = []
+
+        for index, (member, packet, signature, length) in enumerate(jobs):
+            key = (member, sha1(packet).digest())
+            if key in verified:
+                # mark as most recently used
+                del verified[key]
+                verified[key] = None
+                valid[index] = True
+                self._hits += 1
+            elif key in pending:
+                # the same packet occurs more than once in this batch, only verify the first
+                duplicates.append((index, pending[key]))
+                self._hits += 1
+            else:
+                pending[key] = index
+                self._misses += 1
+
+        if len(pending) > 1 and self._workers:
+            results = Queue()
+            put = self._jobs.put
+            for index in pending.itervalues():
+                put((results, index) + jobs[index])
+            get = results.get
+            for _ in xrange(len(pending)):
+                index, result = get()
+                valid[index] = result
+        else:
+            for index in pending.itervalues():
+                member, packet, signature, length = jobs[index]
+                valid[index] = bool(member.verify(packet, signature, length=length))
+
+        for key, index in pending.iteritems():
+            if valid[index]:
+                verified[key] = None
+            else:
+                self._failures += 1
+
+        for index, first in duplicates:
+            valid[index] = valid[first]
+
+        while len(verified) > self._cache_size:
+            verified.popitem(last=False)
+
+        return valid
+
+    def info(self):
+        return {"workers":len(self._workers),
+                "entries":len(self._verified),
+                "hits":self._hits,
+                "misses":self._misses,
+                "failures":self._failures}